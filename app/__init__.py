@@ -104,7 +104,7 @@ def create_app() -> Flask:
     @app.context_processor
     def inject_context_info():
         from flask import session, url_for
-        from .utils import get_db, _sql
+        from .utils.name_cache import get_tenant_name, get_store_info, get_app_manager_group_name
         
         context = {
             'current_tenant_name': None,
@@ -187,40 +187,22 @@ def create_app() -> Flask:
         except Exception:
             context['current_dashboard_url'] = '/'
         
-        # テナント情報を取得
+        # テナント/店舗名を取得（名称キャッシュ経由。ヒット時はクエリを発行しない）
         tenant_id = session.get('tenant_id')
         if tenant_id:
             try:
-                conn = get_db()
-                cur = conn.cursor()
-                sql = _sql(conn, 'SELECT "名称" FROM "T_テナント" WHERE id=%s')
-                cur.execute(sql, (tenant_id,))
-                row = cur.fetchone()
-                if row:
-                    context['current_tenant_name'] = row[0]
-                conn.close()
+                context['current_tenant_name'] = get_tenant_name(tenant_id)
             except Exception:
                 pass
         
-        # 店舗情報を取得
         store_id = session.get('store_id')
         if store_id:
             try:
-                conn = get_db()
-                cur = conn.cursor()
-                sql = _sql(conn, 'SELECT "名称", tenant_id FROM "T_店舗" WHERE id=%s')
-                cur.execute(sql, (store_id,))
-                row = cur.fetchone()
-                if row:
-                    context['current_store_name'] = row[0]
-                    if not context['current_tenant_name'] and row[1]:
-                        cur2 = conn.cursor()
-                        sql2 = _sql(conn, 'SELECT "名称" FROM "T_テナント" WHERE id=%s')
-                        cur2.execute(sql2, (row[1],))
-                        row2 = cur2.fetchone()
-                        if row2:
-                            context['current_tenant_name'] = row2[0]
-                conn.close()
+                store_info = get_store_info(store_id)
+                if store_info:
+                    context['current_store_name'] = store_info[0]
+                    if not context['current_tenant_name'] and store_info[1]:
+                        context['current_tenant_name'] = get_tenant_name(store_info[1])
             except Exception:
                 pass
 
@@ -229,13 +211,7 @@ def create_app() -> Flask:
             app_mgr_gid = session.get('app_manager_group_id')
             if app_mgr_gid:
                 try:
-                    from .models_login import TAppManagerGroup
-                    from .db import SessionLocal
-                    db = SessionLocal()
-                    grp = db.query(TAppManagerGroup).filter(TAppManagerGroup.id == app_mgr_gid).first()
-                    if grp:
-                        app_manager_group_name = grp.group_name
-                    db.close()
+                    app_manager_group_name = get_app_manager_group_name(app_mgr_gid)
                 except Exception:
                     pass
 
@@ -284,7 +260,8 @@ def create_app() -> Flask:
 
     # データベース初期化
     try:
-        from .utils.db import get_db
+        from .utils.db import get_db, init_app as init_db_pool
+        init_db_pool(app)
         conn = get_db()
         try:
             conn.close()
@@ -698,6 +675,14 @@ def create_app() -> Flask:
     except Exception as e:
         print(f"⚠️ アプリ内スケジューラ 起動エラー: {e}")
 
+    # 証憑OCRジョブのワーカー（再起動前に残ったジョブもここから再開する）
+    try:
+        from .services.ocr_queue import start_workers as start_ocr_workers
+        start_ocr_workers()
+        print("✅ OCRジョブワーカー 起動完了")
+    except Exception as e:
+        print(f"⚠️ OCRジョブワーカー 起動エラー: {e}")
+
     import json as _json
     @app.template_filter('from_json')
     def from_json_filter(value):
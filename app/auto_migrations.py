@@ -76,6 +76,22 @@ def table_exists(session, table_name):
         return False
 
 
+def backfill_internal_chat_read_cursor(session, db_type):
+    """社内チャットの既読カーソルを、旧方式の既読行から (ルーム, スタッフ) ごとの最大メッセージIDで埋める"""
+    q = '"' if db_type == 'postgresql' else '`'
+    session.execute(text(f"""
+        UPDATE {q}T_社内チャットメンバー{q} AS mb
+        SET last_read_message_id = (
+            SELECT MAX(r.message_id)
+            FROM {q}T_社内メッセージ既読{q} r
+            JOIN {q}T_社内メッセージ{q} msg ON msg.id = r.message_id
+            WHERE msg.room_id = mb.room_id
+              AND r.staff_id = mb.staff_id
+              AND r.staff_type = mb.staff_type
+        )
+    """))
+
+
 def run_auto_migrations():
     """
     自動マイグレーションを実行
@@ -907,6 +923,74 @@ def run_auto_migrations():
         else:
             logger.info("- T_テナント.app_manager_group_id カラムは既に存在します（スキップ）")
 
+        # T_ChatWork連携ルームに同期の高水位カラムを追加
+        for col, pg_type, my_type in (
+            ('synced_file_num', 'INTEGER NULL', "INT NULL COMMENT '前回同期時のファイル数'"),
+            ('last_file_id', 'BIGINT NULL', "BIGINT NULL COMMENT '同期済みの最大file_id'"),
+            ('synced_at', 'TIMESTAMP NULL', "DATETIME NULL COMMENT '前回同期完了日時'"),
+        ):
+            if not table_exists(session, 'T_ChatWork連携ルーム'):
+                break
+            if column_exists(session, 'T_ChatWork連携ルーム', col):
+                logger.info(f"- T_ChatWork連携ルーム.{col} カラムは既に存在します（スキップ）")
+                continue
+            if db_type == 'postgresql':
+                session.execute(text(f"""
+                    ALTER TABLE "T_ChatWork連携ルーム"
+                    ADD COLUMN {col} {pg_type}
+                """))
+            else:
+                session.execute(text(f"""
+                    ALTER TABLE `T_ChatWork連携ルーム`
+                    ADD COLUMN `{col}` {my_type}
+                """))
+            session.commit()
+            logger.info(f"✓ T_ChatWork連携ルーム.{col} カラムを追加しました")
+
+        # 社内チャット: 既読をメンバーごとのカーソル（最後に読んだメッセージID）で持つ
+        if table_exists(session, 'T_社内チャットメンバー') and \
+                not column_exists(session, 'T_社内チャットメンバー', 'last_read_message_id'):
+            logger.info("T_社内チャットメンバーに last_read_message_id カラムを追加中...")
+            if db_type == 'postgresql':
+                session.execute(text("""
+                    ALTER TABLE "T_社内チャットメンバー"
+                    ADD COLUMN last_read_message_id INTEGER NULL
+                """))
+            else:
+                session.execute(text("""
+                    ALTER TABLE `T_社内チャットメンバー`
+                    ADD COLUMN `last_read_message_id` INT NULL
+                    COMMENT '最後に読んだメッセージID（既読カーソル）'
+                """))
+            session.commit()
+            # 既存の既読行（T_社内メッセージ既読）から、ルームごとに読んだ最大のメッセージIDを移行する
+            if table_exists(session, 'T_社内メッセージ既読'):
+                backfill_internal_chat_read_cursor(session, db_type)
+                session.commit()
+            logger.info("✓ T_社内チャットメンバー.last_read_message_id カラムを追加し、既読を移行しました")
+
+        # 社内メッセージ: ルーム単位の未読数・最新メッセージ集計用の複合インデックス
+        if table_exists(session, 'T_社内メッセージ'):
+            if db_type == 'postgresql':
+                session.execute(text("""
+                    CREATE INDEX IF NOT EXISTS ix_internal_message_room_id
+                    ON "T_社内メッセージ" (room_id, id)
+                """))
+                session.commit()
+            else:
+                exists = session.execute(text("""
+                    SELECT COUNT(*) FROM information_schema.STATISTICS
+                    WHERE TABLE_SCHEMA = DATABASE()
+                    AND TABLE_NAME = 'T_社内メッセージ'
+                    AND INDEX_NAME = 'ix_internal_message_room_id'
+                """)).scalar()
+                if not exists:
+                    session.execute(text("""
+                        CREATE INDEX ix_internal_message_room_id
+                        ON `T_社内メッセージ` (room_id, id)
+                    """))
+                    session.commit()
+
         logger.info("✓ 自動マイグレーションが正常に完了しました")
         
     except Exception as e:
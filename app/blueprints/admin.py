@@ -11,6 +11,7 @@ from app.models_login import TKanrisha, TJugyoin, TTenant, TTenpo, TKanrishaTenp
 from sqlalchemy import func, and_, or_
 from ..utils.decorators import ROLES
 from ..utils.decorators import require_roles
+from ..utils.name_cache import invalidate_store
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -1072,6 +1073,7 @@ def store_edit(store_id):
             store_obj.anthropic_api_key = anthropic_api_key if anthropic_api_key else None
             store_obj.有効 = active
             db.commit()
+            invalidate_store(store_obj.id)
             
             flash('店舗情報を更新しました', 'success')
             return redirect(url_for('admin.store_info'))
@@ -1129,6 +1131,7 @@ def store_delete(store_id):
         # 店舗を削除
         db.delete(store_obj)
         db.commit()
+        invalidate_store(store_id)
         
         # セッションから店舗IDを削除
         session.pop('store_id', None)
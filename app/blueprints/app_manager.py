@@ -8,6 +8,7 @@ from werkzeug.security import check_password_hash, generate_password_hash
 from app.db import SessionLocal
 from app.models_login import TKanrisha, TAppManagerGroup
 from ..utils.decorators import require_roles
+from ..utils.name_cache import invalidate_tenant
 
 bp = Blueprint('app_manager', __name__, url_prefix='/app_manager')
 
@@ -1276,6 +1277,7 @@ def tenant_edit(tenant_id):
             tenant.azure_document_intelligence_endpoint = azure_endpoint or None
             tenant.azure_document_intelligence_key = azure_key or None
             db.commit()
+            invalidate_tenant(tenant.id)
             flash(f'テナント "{name}" を更新しました', 'success')
             return redirect(url_for('app_manager.tenants'))
 
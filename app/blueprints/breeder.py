@@ -2094,7 +2094,8 @@ def simulation():
                 from app.services.breeding_logic import evaluate_mating_compatibility
                 from app.models_breeder import MatingEvaluation
                 result = evaluate_mating_compatibility(
-                    sire_id, dam_id, max_depth=max_depth, db=db, use_ai_comment=True
+                    sire_id, dam_id, max_depth=max_depth, db=db, use_ai_comment=True,
+                    use_cache=True,
                 )
                 # 評価結果を DB に保存
                 try:
@@ -2146,13 +2147,18 @@ def mating_bulk():
     females = _tf(db.query(Dog).filter(Dog.status == 'active', Dog.gender == 'female')).all()
 
     # 全ペアのCOIを breeding_logic で計算（数式ロジック）
-    from app.services.breeding_logic import calculate_coi, get_coi_rank
+    from app.services.breeding_logic import PedigreeGraph, PedigreeMetricsCache, get_coi_rank
+    # 全ペアで血統グラフを共有し、祖先の読み込み・F_A 計算を 1 回で済ませる。
+    # 血統が変わっていないペアは保存済みの COI を使う
+    graph = PedigreeGraph(db, [d.id for d in males + females])
+    metrics_cache = PedigreeMetricsCache(db, graph)
+    metrics_cache.prefetch([(m.id, f.id) for f in females for m in males], 5)
     matrix = []
     for dam in females:
         row = {'dam': dam, 'pairs': []}
         for sire in males:
             try:
-                coi_result = calculate_coi(sire.id, dam.id, max_depth=5, db=db)
+                coi_result = metrics_cache.get(sire.id, dam.id, 5)['coi']
                 coi_pct = coi_result['coi_percent']
                 rank_info = get_coi_rank(coi_pct)
                 row['pairs'].append({
@@ -2165,6 +2171,7 @@ def mating_bulk():
             except Exception:
                 row['pairs'].append({'sire': sire, 'coi': None, 'rank': '-', 'risk_level': '-', 'level': 'unknown'})
         matrix.append(row)
+    metrics_cache.save()
 
     return render_template('breeder/mating_bulk.html',
                            males=males, females=females, matrix=matrix)
@@ -3048,6 +3055,7 @@ def mating_compare():
                     max_depth=max_depth,
                     db=db,
                     use_ai_comment=False,
+                    use_cache=True,
                 )
         except Exception as e:
             error = f'比較中にエラーが発生しました: {e}'
@@ -3337,6 +3345,7 @@ def api_mating_evaluate():
         use_ai_comment=use_ai,
         sire_breed=sire.breed if sire else None,
         dam_breed=dam.breed if dam else None,
+        use_cache=True,
     )
 
     ev = MatingEvaluation(
@@ -3378,10 +3387,60 @@ def api_mating_compare():
         candidate_ids=candidate_ids,
         max_depth=max_depth,
         db=db,
+        use_cache=True,
     )
     return jsonify({'candidate_rankings': results})
 
 
+@bp.route('/api/mating/compare-candidates/stream', methods=['POST'])
+def api_mating_compare_stream():
+    """
+    POST /api/mating/compare-candidates/stream - 候補比較API（逐次返却）
+
+    評価が終わった候補から 1 行ずつ NDJSON で返す。
+      {"type": "candidate", "done": n, "total": N, "candidate": {...}}  ※ detail は含まない
+      {"type": "ranking", "candidate_rankings": [...]}                 ※ 最終行（/compare-candidates と同じ形式）
+    """
+    from flask import Response, stream_with_context
+    from app.services.breeding_logic import iter_mating_candidates, rank_mating_candidates
+    db = _get_db()
+    data = request.get_json() or {}
+
+    fixed_dog_id   = data.get('fixed_dog_id')
+    fixed_role     = data.get('fixed_role', 'dam')
+    candidate_ids  = data.get('candidate_ids', [])
+    max_depth      = data.get('max_depth', 5)
+    use_ai_comment = bool(data.get('use_ai_comment', False))
+
+    if not fixed_dog_id or not candidate_ids:
+        return jsonify({'error': 'fixed_dog_id と candidate_ids は必須です'}), 400
+
+    def generate():
+        results = []
+        for r in iter_mating_candidates(
+            fixed_dog_id=fixed_dog_id,
+            fixed_role=fixed_role,
+            candidate_ids=candidate_ids,
+            max_depth=max_depth,
+            db=db,
+            use_ai_comment=use_ai_comment,
+            use_cache=True,
+        ):
+            results.append(r)
+            line = {
+                'type': 'candidate',
+                'done': len(results),
+                'total': len(candidate_ids),
+                'candidate': {k: v for k, v in r.items() if k != 'detail'},
+            }
+            yield json.dumps(line, ensure_ascii=False, default=str) + '\n'
+
+        final = {'type': 'ranking', 'candidate_rankings': rank_mating_candidates(results, candidate_ids)}
+        yield json.dumps(final, ensure_ascii=False, default=str) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @bp.route('/api/mating/evaluations/<int:evaluation_id>', methods=['GET'])
 def api_mating_evaluation_get(evaluation_id):
     """GET /api/mating/evaluations/{evaluation_id} - 評価取得API"""
@@ -3836,7 +3895,7 @@ def api_analytics_line_performance():
     from app.services.survival_analysis import (
         make_survival_record, analyze_line_performance
     )
-    from app.services.breeding_logic import get_ancestors
+    from app.services.breeding_logic import PedigreeGraph
     db = _get_db()
 
     ancestor_id = request.args.get('ancestor_id', type=int)
@@ -3850,9 +3909,10 @@ def api_analytics_line_performance():
     # 祖先の子孫を取得（breeding_logicのget_ancestorsを逆引き）
     # 全犬の祖先を調べて ancestor_id が含まれるものを子孫とする
     all_dogs = db.query(Dog).filter(Dog.id != ancestor_id).all()
+    graph = PedigreeGraph(db, [d.id for d in all_dogs])
     descendant_ids = []
     for dog in all_dogs:
-        ancestors = get_ancestors(db, dog.id, max_depth=5)
+        ancestors = graph.ancestors(dog.id, 5)
         if ancestor_id in ancestors:
             descendant_ids.append(dog.id)
 
@@ -1,20 +1,69 @@
 """
 チャット機能ブループリント
 """
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, Response
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, Response, jsonify, stream_with_context, current_app
 from datetime import datetime
 import urllib.parse
 import requests as http_requests
 from app.db import get_conn, SessionLocal
 from app.utils.decorators import require_roles, ROLES
 from app.models_clients import TClient, TMessage, TMessageRead
-from sqlalchemy import and_
+from app.services import chat_push
+from sqlalchemy import and_, func as sqlfunc
 
 bp = Blueprint('chat', __name__, url_prefix='/chat')
 
+STAFF_ROLES = (ROLES["SYSTEM_ADMIN"], ROLES["TENANT_ADMIN"], ROLES["ADMIN"], ROLES["EMPLOYEE"])
+
+
+def _message_dict(m):
+    return {
+        'id'          : m.id,
+        'sender'      : m.sender,
+        'sender_type' : m.sender_type,
+        'message'     : m.message or '',
+        'message_type': m.message_type or 'text',
+        'file_url'    : m.file_url or '',
+        'file_name'   : m.file_name or '',
+        'download_url': url_for('chat.download_message_file', message_id=m.id) if m.file_url else '',
+        'timestamp'   : m.timestamp.strftime('%Y/%m/%d %H:%M') if m.timestamp else '',
+    }
+
+
+def _mark_client_messages_read(db, messages, reader_id):
+    """顧問先から届いたメッセージを staff として既読に登録する（登録済みは除く）"""
+    ids = [m.id for m in messages if m.sender_type == 'client']
+    if not ids:
+        return
+    done = {r[0] for r in db.query(TMessageRead.message_id).filter(
+        TMessageRead.message_id.in_(ids),
+        TMessageRead.reader_type == 'staff',
+        TMessageRead.reader_id == reader_id,
+    ).all()}
+    for mid in ids:
+        if mid not in done:
+            db.add(TMessageRead(message_id=mid, reader_type='staff', reader_id=reader_id))
+
+
+def _client_read_upto(db, client_id):
+    """顧問先側が既読にした最大のメッセージID（スタッフ送信分の「既読」表示用）"""
+    value = db.query(sqlfunc.max(TMessageRead.message_id)).join(
+        TMessage, TMessage.id == TMessageRead.message_id
+    ).filter(
+        TMessage.client_id == client_id,
+        TMessageRead.reader_type == 'client',
+    ).scalar()
+    return value or 0
+
+
+def _get_client(db, client_id, tenant_id):
+    return db.query(TClient).filter(
+        and_(TClient.id == client_id, TClient.tenant_id == tenant_id)
+    ).first()
+
 
 @bp.route('/client/<int:client_id>', methods=['GET', 'POST'])
-@require_roles(ROLES["SYSTEM_ADMIN"], ROLES["TENANT_ADMIN"], ROLES["ADMIN"], ROLES["EMPLOYEE"])
+@require_roles(*STAFF_ROLES)
 def client_chat(client_id):
     """顧問先ごとのチャットルーム"""
     tenant_id = session.get('tenant_id')
@@ -75,6 +124,7 @@ def client_chat(client_id):
                     )
                     db.add(new_message)
                     db.commit()
+                    chat_push.notify(chat_push.client_channel(client_id))
                     flash(f'ファイル「{uploaded_file.filename}」を送信しました', 'success')
                 except Exception as e:
                     db.rollback()
@@ -91,6 +141,7 @@ def client_chat(client_id):
                 )
                 db.add(new_message)
                 db.commit()
+                chat_push.notify(chat_push.client_channel(client_id))
             return redirect(url_for('chat.client_chat', client_id=client_id))
 
         # メッセージ一覧を取得
@@ -129,8 +180,82 @@ def client_chat(client_id):
         db.close()
 
 
+@bp.route('/client/<int:client_id>/messages')
+@require_roles(*STAFF_ROLES)
+def client_messages_api(client_id):
+    """顧問先チャットの新着メッセージ JSON API（SSE が使えない場合のポーリング用）"""
+    tenant_id = session.get('tenant_id')
+    reader_id = session.get('user_name', '匿名')
+    db = SessionLocal()
+    try:
+        if not _get_client(db, client_id, tenant_id):
+            return jsonify({'error': 'not found'}), 404
+        since_id = request.args.get('since_id', 0, type=int)
+        messages = db.query(TMessage).filter(
+            TMessage.client_id == client_id, TMessage.id > since_id
+        ).order_by(TMessage.id.asc()).all()
+        _mark_client_messages_read(db, messages, reader_id)
+        db.commit()
+        return jsonify({
+            'messages' : [_message_dict(m) for m in messages],
+            'read_upto': _client_read_upto(db, client_id),
+        })
+    finally:
+        db.close()
+
+
+@bp.route('/client/<int:client_id>/stream')
+@require_roles(*STAFF_ROLES)
+def client_stream(client_id):
+    """顧問先チャットの新着メッセージ・既読の SSE 配信
+
+    event: message … メッセージ1件（id はメッセージID。再接続時は Last-Event-ID から続きを送る）
+    event: read    … {'read_upto': 顧問先が既読にした最大メッセージID}
+    通知が来たときだけDBを読み、待機中はハートビートのみ送る。
+    """
+    tenant_id = session.get('tenant_id')
+    reader_id = session.get('user_name', '匿名')
+    db = SessionLocal()
+    try:
+        if not _get_client(db, client_id, tenant_id):
+            return jsonify({'error': 'not found'}), 404
+    finally:
+        db.close()
+
+    state = {'last_id': chat_push.last_event_id(request), 'read_upto': None}
+
+    def fetch():
+        events = []
+        db = SessionLocal()
+        try:
+            messages = db.query(TMessage).filter(
+                TMessage.client_id == client_id, TMessage.id > state['last_id']
+            ).order_by(TMessage.id.asc()).all()
+            for m in messages:
+                events.append(('message', _message_dict(m), m.id))
+                state['last_id'] = m.id
+            _mark_client_messages_read(db, messages, reader_id)
+            db.commit()
+            read_upto = _client_read_upto(db, client_id)
+            if read_upto != state['read_upto']:
+                state['read_upto'] = read_upto
+                events.append(('read', {'read_upto': read_upto}, None))
+        except Exception:
+            db.rollback()
+            current_app.logger.exception('[chat] stream fetch failed (client=%s)', client_id)
+        finally:
+            db.close()
+        return events
+
+    return Response(
+        stream_with_context(chat_push.stream(chat_push.client_channel(client_id), fetch)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
 @bp.route('/download/message/<int:message_id>')
-@require_roles(ROLES["SYSTEM_ADMIN"], ROLES["TENANT_ADMIN"], ROLES["ADMIN"], ROLES["EMPLOYEE"])
+@require_roles(*STAFF_ROLES)
 def download_message_file(message_id):
     """チャットメッセージのファイルをプロキシ経由でダウンロードする"""
     tenant_id = session.get('tenant_id')
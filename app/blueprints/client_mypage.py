@@ -19,6 +19,7 @@ from app.models_client_users import TClientUser, TClientInvitation
 from app.models_clients import TClient, TMessage, TFile, TMessageRead
 from sqlalchemy import func
 from app.utils.tenant_storage_adapter import get_storage_adapter
+from app.services import chat_push
 
 bp = Blueprint('client_mypage', __name__, url_prefix='/mypage')
 
@@ -140,6 +141,7 @@ def chat():
                     )
                     db.add(new_msg)
                     db.commit()
+                    chat_push.notify(chat_push.client_channel(client_id))
                     flash(f'ファイル「{uploaded_file.filename}」を送信しました', 'success')
                 except Exception as e:
                     db.rollback()
@@ -154,6 +156,7 @@ def chat():
                 )
                 db.add(new_msg)
                 db.commit()
+                chat_push.notify(chat_push.client_channel(client_id))
             return redirect(url_for('client_mypage.chat'))
 
         messages = db.query(TMessage).filter(
@@ -178,6 +181,9 @@ def chat():
                     reader_id=reader_id
                 ))
         db.commit()
+        if first_unread_id is not None:
+            # スタッフ側のチャット画面へ既読を通知
+            chat_push.notify(chat_push.client_channel(client_id))
 
         return render_template(
             'client_mypage_chat.html',
@@ -272,6 +278,7 @@ def files():
                     )
                     db.add(notify_msg)
                     db.commit()
+                    chat_push.notify(chat_push.client_channel(client_id))
                     flash(f'ファイル「{f.filename}」をアップロードしました。', 'success')
                 except Exception as e:
                     db.rollback()
@@ -1986,117 +1986,30 @@ def branches_for_filing(client_id):
 @bp.route('/<int:client_id>/get_tax_office_by_zipcode')
 @require_roles(ROLES["SYSTEM_ADMIN"], ROLES["TENANT_ADMIN"], ROLES["ADMIN"])
 def get_tax_office_by_zipcode(client_id):
-    """郵便番号から国税庁サービスで税務署名・都道府県税事務所名・市区町村役所名を取得"""
-    import requests as http_requests
-    from bs4 import BeautifulSoup
-    import re
-    from app.prefecture_tax_office_map import get_pref_tax_office_name
+    """郵便番号から税務署名・都道府県税事務所名・市区町村役所名を取得
+
+    郵便番号インデックス → 照会結果キャッシュ → 国税庁サービスの順に引く（tax_office_lookup）
+    """
+    from app.tax_office_lookup import lookup_zipcode, normalize_zipcode
     tenant_id = session.get('tenant_id')
     if not tenant_id:
         return jsonify({'error': '未認証'}), 401
     zipcode = request.args.get('zipcode', '').strip()
     if not zipcode:
         return jsonify({'error': '郵便番号が指定されていません'})
-    zipcode_clean = zipcode.replace('-', '').replace('ー', '').replace('－', '').replace(' ', '').replace('　', '')
-    if len(zipcode_clean) != 7 or not zipcode_clean.isdigit():
+    if normalize_zipcode(zipcode) is None:
         return jsonify({'error': '郵便番号の形式が正しくありません（7桁の数字）'})
     try:
-        # ── Step1: 国税庁サービスで税務署名を取得 ──
-        nta_data = {
-            'KSTYPE': 'ksz',
-            'TODOFUKEN_TO_ASCII': '',
-            'ADDR_TO_ASCII': '',
-            'kszc1': zipcode_clean[:3],
-            'kszc2': zipcode_clean[3:],
-            'ksaTodofuken': '',
-            'ksaddr': '',
-        }
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Referer': 'https://www.nta.go.jp/about/organization/access/map.htm',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        resp = http_requests.post(
-            'https://www.nta.go.jp/cgi-bin/zeimusho/kensaku/kensakuprocess.php',
-            data=nta_data, headers=headers, timeout=10
-        )
-        text = resp.content.decode('utf-8', errors='replace')
-        soup = BeautifulSoup(text, 'html.parser')
-        full_text = soup.get_text()
-        matches = re.findall(r'を管轄する税務署[\s\n]*([^\s電話\n]+)', full_text)
-        tax_office_name = matches[0] if matches else None
-
-        # ── Step2: 郵便番号から都道府県・市区町村を取得（zipcloud API） ──
-        prefecture = None
-        city = None
-        pref_tax_office_name = None
-        municipality_office_name = None
-        is_tokyo_23ku = False
-        try:
-            zip_resp = http_requests.get(
-                f'https://zipcloud.ibsnet.co.jp/api/search?zipcode={zipcode_clean}',
-                timeout=5
-            )
-            zip_data = zip_resp.json()
-            if zip_data.get('results'):
-                r0 = zip_data['results'][0]
-                prefecture = r0.get('address1', '')
-                city = r0.get('address2', '')
-                town = r0.get('address3', '')
-
-                # 都道府県税事務所名を対応表から取得
-                pref_tax_office_name = get_pref_tax_office_name(prefecture, city)
-
-                # 東京23区の判定
-                tokyo_23ku = [
-                    '千代田区','中央区','港区','新宿区','文京区','台東区','墨田区','江東区',
-                    '品川区','目黒区','大田区','世田谷区','渋谷区','中野区','杉並区','豊島区',
-                    '北区','荒川区','板橋区','練馬区','足立区','葛飾区','江戸川区'
-                ]
-                if prefecture == '東京都' and city in tokyo_23ku:
-                    is_tokyo_23ku = True
-                    municipality_office_name = None  # 東京23区は市区町村への申告不要
-                else:
-                    # 市区町村役所名を生成（市区町村名 + 役所/役場）
-                    if city:
-                        if city.endswith('市'):
-                            municipality_office_name = city + '役所'
-                        elif city.endswith('区'):
-                            municipality_office_name = city + '役所'
-                        elif city.endswith('町'):
-                            municipality_office_name = city + '役場'
-                        elif city.endswith('村'):
-                            municipality_office_name = city + '役場'
-                        else:
-                            municipality_office_name = city + '役所'
-        except Exception:
-            pass  # 住所取得失敗時は None のまま
-
-        result = {}
-        if tax_office_name:
-            result['tax_office_name'] = tax_office_name
-        else:
-            result['tax_office_error'] = '税務署が見つかりませんでした。郵便番号を確認してください。'
-        if prefecture:
-            result['prefecture'] = prefecture
-        if city:
-            result['city'] = city
-        if pref_tax_office_name:
-            result['pref_tax_office_name'] = pref_tax_office_name
-        if municipality_office_name:
-            result['municipality_office_name'] = municipality_office_name
-        if is_tokyo_23ku:
-            result['is_tokyo_23ku'] = True
-            result['tokyo_23ku_note'] = '東京23区は都税事務所への申告のみとなります（市区町村への申告は不要です）'
-
-        # 後方互換: tax_office_name がない場合はエラーを返す
-        if not tax_office_name and not prefecture:
-            return jsonify({'error': '税務署が見つかりませんでした。郵便番号を確認してください。'})
-
-        return jsonify(result)
+        result = lookup_zipcode(zipcode)
     except Exception as e:
         return jsonify({'error': f'国税庁サービスへの接続に失敗しました: {str(e)}'})
 
+    # 後方互換: 税務署も住所も取れない場合はエラーを返す
+    if not result or (not result.get('tax_office_name') and not result.get('prefecture')):
+        return jsonify({'error': '税務署が見つかりませんでした。郵便番号を確認してください。'})
+    result.pop('source', None)
+    return jsonify(result)
+
 
 @bp.route('/<int:client_id>/get_pref_tax_office_by_address')
 @require_roles(ROLES["SYSTEM_ADMIN"], ROLES["TENANT_ADMIN"], ROLES["ADMIN"])
@@ -2125,7 +2038,8 @@ def get_pref_tax_office_by_address(client_id):
 @require_roles(ROLES["SYSTEM_ADMIN"], ROLES["TENANT_ADMIN"], ROLES["ADMIN"], ROLES["EMPLOYEE"])
 def tax_calendar():
     """全顧問先の税務年間カレンダー"""
-    from app.tax_calendar import get_all_deadlines_for_client, group_by_month
+    from app.tax_calendar import group_by_month
+    from app.services.tax_deadline_index import deadlines_for_year
     db = SessionLocal()
     try:
         tenant_id = session['tenant_id']
@@ -2137,17 +2051,13 @@ def tax_calendar():
 
         clients_q = db.query(TClient).filter(TClient.tenant_id == tenant_id).all()
 
-        all_deadlines = []
-        for client in clients_q:
-            if client.type == '法人' and not show_corporate:
-                continue
-            if client.type == '個人' and not show_individual:
-                continue
-            deadlines = get_all_deadlines_for_client(client, year)
-            all_deadlines.extend(deadlines)
-
-        all_deadlines = [d for d in all_deadlines if d['date'].year == year]
-        all_deadlines.sort(key=lambda x: x['date'])
+        targets = [
+            c for c in clients_q
+            if not (c.type == '法人' and not show_corporate)
+            and not (c.type == '個人' and not show_individual)
+        ]
+        # 生成済みの期限（T_税務期限）から年内分を日付順に取得
+        all_deadlines = deadlines_for_year(db, targets, year)
         grouped = group_by_month(all_deadlines)
 
         today = date.today()
@@ -6,6 +6,7 @@ from datetime import datetime
 from app.db import SessionLocal
 from app.utils.tenant_storage_adapter import get_storage_adapter
 from app.utils.decorators import require_roles, ROLES
+from app.services import chat_push
 from app.models_clients import TClient, TFile
 from sqlalchemy import and_
 
@@ -67,6 +68,7 @@ def client_files(client_id):
                     )
                     db.add(notify_msg)
                     db.commit()
+                    chat_push.notify(chat_push.client_channel(client_id))
                     flash(f'ファイル「{f.filename}」をアップロードしました', 'success')
                 except RuntimeError as e:
                     flash(f'エラー: {str(e)}', 'error')
@@ -61,7 +61,7 @@ def settings():
                                gmail_port=extra.get('imap_port', 993),
                                mappings=mappings, clients=clients,
                                recent=recent, client_names=client_names,
-                               sched=get_state())
+                               sched=get_state(tenant_id))
     finally:
         db.close()
 
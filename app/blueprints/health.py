@@ -1,5 +1,8 @@
 from flask import Blueprint, jsonify, current_app
 
+from ..utils.db import get_pool_stats
+from ..utils.name_cache import get_name_cache_stats
+
 bp = Blueprint("health", __name__)
 
 @bp.get("/healthz")
@@ -12,4 +15,6 @@ def healthz():
         ok=True,
         env=current_app.config.get("ENVIRONMENT"),
         version=current_app.config.get("VERSION"),
+        db_pool=get_pool_stats(),
+        name_cache=get_name_cache_stats(),
     )
@@ -136,7 +136,7 @@ def chatwork_settings():
                                setting=setting, mappings=mappings,
                                clients=clients, recent=recent,
                                client_names=client_names,
-                               sched=get_state())
+                               sched=get_state(tenant_id))
     finally:
         db.close()
 
@@ -1,15 +1,17 @@
 """
 社内チャット（スタッフ間メッセージ）ブループリント
 """
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context, current_app
 from app.db import SessionLocal
 from app.models_login import (
     TKanrisha, TJugyoin, TInternalChatRoom,
-    TInternalChatMember, TInternalMessage, TInternalMessageRead
+    TInternalChatMember, TInternalMessage
 )
 from app.utils.decorators import require_roles, ROLES
+from app.services import chat_push
 from app.utils.tenant_storage_adapter import get_storage_adapter, get_tenant_storage_config
-from sqlalchemy import and_, or_, func as sqlfunc
+from sqlalchemy import and_, or_, select, func as sqlfunc
+from sqlalchemy.orm import aliased
 from datetime import datetime
 import os
 
@@ -36,22 +38,138 @@ def _get_current_staff(db):
     return staff, staff_type
 
 
-def _get_unread_count_for_room(db, room_id, staff_id, staff_type):
-    """指定ルームの未読数を取得する"""
-    all_msgs = db.query(TInternalMessage.id).filter(
-        TInternalMessage.room_id == room_id
-    ).all()
-    all_ids = [m.id for m in all_msgs]
-    if not all_ids:
-        return 0
-    read_ids = [r.message_id for r in db.query(TInternalMessageRead).filter(
+def _mark_read(db, room_id, staff_id, staff_type, message_id):
+    """既読カーソルを message_id まで進める（後退はさせない）。UPDATE 1文で済ませる。
+
+    カーソルが進んだら True（コミット後に chat_push.notify で既読を通知する）
+    """
+    if not message_id:
+        return False
+    updated = db.query(TInternalChatMember).filter(
+        and_(
+            TInternalChatMember.room_id    == room_id,
+            TInternalChatMember.staff_id   == staff_id,
+            TInternalChatMember.staff_type == staff_type,
+            or_(
+                TInternalChatMember.last_read_message_id.is_(None),
+                TInternalChatMember.last_read_message_id < message_id,
+            ),
+        )
+    ).update({TInternalChatMember.last_read_message_id: message_id}, synchronize_session=False)
+    return updated == 1
+
+
+def _others_read_upto(db, room_id, staff_id, staff_type):
+    """自分以外のメンバーが既読にした最大のメッセージID（自分の送信分の「既読」表示用）"""
+    value = db.query(sqlfunc.max(TInternalChatMember.last_read_message_id)).filter(
+        TInternalChatMember.room_id == room_id,
+        ~and_(TInternalChatMember.staff_id == staff_id, TInternalChatMember.staff_type == staff_type),
+    ).scalar()
+    return value or 0
+
+
+def _message_dict(m):
+    return {
+        'id'          : m.id,
+        'sender_name' : m.sender_name,
+        'sender_id'   : m.sender_id,
+        'sender_type' : m.sender_type,
+        'message'     : m.message,
+        'message_type': m.message_type or 'text',
+        'file_url'    : m.file_url or '',
+        'file_name'   : m.file_name or '',
+        'created_at'  : m.created_at.strftime('%H:%M') if m.created_at else '',
+    }
+
+
+def _is_member(db, room_id, tenant_id, staff_id, staff_type):
+    return db.query(TInternalChatMember.id).join(
+        TInternalChatRoom, TInternalChatRoom.id == TInternalChatMember.room_id
+    ).filter(
+        TInternalChatRoom.id        == room_id,
+        TInternalChatRoom.tenant_id == tenant_id,
+        TInternalChatMember.staff_id   == staff_id,
+        TInternalChatMember.staff_type == staff_type,
+    ).first() is not None
+
+
+def _room_summaries(db, tenant_id, staff_id, staff_type):
+    """自分が参加しているルームを、最新メッセージ・未読数・メンバー名付きで返す。
+
+    ルームごとにクエリを発行せず、最新メッセージID・未読数をそれぞれ GROUP BY の
+    サブクエリで集計して1クエリで取得し、メンバー名は全ルーム分を1クエリで取得する。
+    未読 = 既読カーソル（last_read_message_id）より新しい、自分以外が送ったメッセージ。
+    """
+    me = aliased(TInternalChatMember)
+    my_room_ids = select(TInternalChatMember.room_id).where(
         and_(
-            TInternalMessageRead.message_id.in_(all_ids),
-            TInternalMessageRead.staff_id == staff_id,
-            TInternalMessageRead.staff_type == staff_type,
+            TInternalChatMember.staff_id   == staff_id,
+            TInternalChatMember.staff_type == staff_type,
         )
-    ).all()]
-    return len(all_ids) - len(read_ids)
+    )
+
+    last_ids = db.query(
+        TInternalMessage.room_id.label('room_id'),
+        sqlfunc.max(TInternalMessage.id).label('last_id'),
+    ).filter(TInternalMessage.room_id.in_(my_room_ids)).group_by(TInternalMessage.room_id).subquery()
+
+    reader = aliased(TInternalChatMember)
+    unread = db.query(
+        TInternalMessage.room_id.label('room_id'),
+        sqlfunc.count(TInternalMessage.id).label('unread'),
+    ).join(
+        reader,
+        and_(
+            reader.room_id    == TInternalMessage.room_id,
+            reader.staff_id   == staff_id,
+            reader.staff_type == staff_type,
+        ),
+    ).filter(
+        TInternalMessage.id > sqlfunc.coalesce(reader.last_read_message_id, 0),
+        ~and_(TInternalMessage.sender_id == staff_id, TInternalMessage.sender_type == staff_type),
+    ).group_by(TInternalMessage.room_id).subquery()
+
+    last_msg = aliased(TInternalMessage)
+    rows = db.query(TInternalChatRoom, last_msg, unread.c.unread).join(
+        me,
+        and_(
+            me.room_id    == TInternalChatRoom.id,
+            me.staff_id   == staff_id,
+            me.staff_type == staff_type,
+        ),
+    ).outerjoin(
+        last_ids, last_ids.c.room_id == TInternalChatRoom.id
+    ).outerjoin(
+        last_msg, last_msg.id == last_ids.c.last_id
+    ).outerjoin(
+        unread, unread.c.room_id == TInternalChatRoom.id
+    ).filter(
+        TInternalChatRoom.tenant_id == tenant_id
+    ).order_by(TInternalChatRoom.updated_at.desc()).all()
+
+    room_ids = [room.id for room, _, _ in rows]
+    names = {}
+    if room_ids:
+        for m in db.query(
+            TInternalChatMember.room_id, TInternalChatMember.staff_id,
+            TInternalChatMember.staff_type, TInternalChatMember.staff_name,
+        ).filter(TInternalChatMember.room_id.in_(room_ids)).order_by(TInternalChatMember.id).all():
+            if m.staff_id == staff_id and m.staff_type == staff_type:
+                continue
+            names.setdefault(m.room_id, []).append(m.staff_name)
+
+    rooms = []
+    for room, msg, unread_count in rows:
+        room.last_message = msg
+        room.unread_count = unread_count or 0
+        # メンバー名（1対1の場合は相手の名前）
+        room.member_names = names.get(room.id, [])
+        if room.room_type == 'direct' and room.member_names:
+            room.display_name = room.member_names[0]
+        else:
+            room.display_name = room.name or '名称未設定グループ'
+        rooms.append(room)
+    return rooms
 
 
 @bp.route('/')
@@ -70,42 +188,8 @@ def room_list():
             flash('スタッフ情報が見つかりません', 'error')
             return redirect(url_for('staff_mypage.dashboard'))
 
-        # 自分が参加しているルーム
-        my_memberships = db.query(TInternalChatMember).filter(
-            and_(
-                TInternalChatMember.staff_id   == staff.id,
-                TInternalChatMember.staff_type == staff_type,
-            )
-        ).all()
-        room_ids = [m.room_id for m in my_memberships]
-
-        rooms = db.query(TInternalChatRoom).filter(
-            and_(
-                TInternalChatRoom.id.in_(room_ids),
-                TInternalChatRoom.tenant_id == tenant_id,
-            )
-        ).order_by(TInternalChatRoom.updated_at.desc()).all() if room_ids else []
-
-        # 各ルームのメタ情報を付加
-        for room in rooms:
-            # 最新メッセージ
-            last_msg = db.query(TInternalMessage).filter(
-                TInternalMessage.room_id == room.id
-            ).order_by(TInternalMessage.created_at.desc()).first()
-            room.last_message = last_msg
-
-            # 未読数
-            room.unread_count = _get_unread_count_for_room(db, room.id, staff.id, staff_type)
-
-            # メンバー名（1対1の場合は相手の名前）
-            members = db.query(TInternalChatMember).filter(
-                TInternalChatMember.room_id == room.id
-            ).all()
-            room.member_names = [m.staff_name for m in members if not (m.staff_id == staff.id and m.staff_type == staff_type)]
-            if room.room_type == 'direct' and room.member_names:
-                room.display_name = room.member_names[0]
-            else:
-                room.display_name = room.name or '名称未設定グループ'
+        # 自分が参加しているルーム（最新メッセージ・未読数・メンバー名付き）
+        rooms = _room_summaries(db, tenant_id, staff.id, staff_type)
 
         # 全スタッフ（新規DM作成用）
         all_admins    = db.query(TKanrisha).filter(
@@ -286,7 +370,11 @@ def room_view(room_id):
                 db.add(msg)
                 # ルームのupdated_atを更新
                 room.updated_at = datetime.utcnow()
+                db.flush()
+                # 自分の送信メッセージまでは既読
+                _mark_read(db, room_id, staff.id, staff_type, msg.id)
                 db.commit()
+                chat_push.notify(chat_push.room_channel(room_id))
             return redirect(url_for('internal_chat.room_view', room_id=room_id) + '#bottom')
 
         # メッセージ取得
@@ -294,24 +382,10 @@ def room_view(room_id):
             TInternalMessage.room_id == room_id
         ).order_by(TInternalMessage.created_at.asc()).all()
 
-        # 既読マーク
-        msg_ids = [m.id for m in messages]
-        if msg_ids:
-            already_read = {r.message_id for r in db.query(TInternalMessageRead).filter(
-                and_(
-                    TInternalMessageRead.message_id.in_(msg_ids),
-                    TInternalMessageRead.staff_id   == staff.id,
-                    TInternalMessageRead.staff_type == staff_type,
-                )
-            ).all()}
-            for mid in msg_ids:
-                if mid not in already_read:
-                    db.add(TInternalMessageRead(
-                        message_id = mid,
-                        staff_id   = staff.id,
-                        staff_type = staff_type,
-                    ))
+        # 既読マーク（カーソルを最新メッセージまで進める）
+        if messages and _mark_read(db, room_id, staff.id, staff_type, max(m.id for m in messages)):
             db.commit()
+            chat_push.notify(chat_push.room_channel(room_id))
 
         # メンバー一覧
         members = db.query(TInternalChatMember).filter(
@@ -332,6 +406,7 @@ def room_view(room_id):
             members    = members,
             staff      = staff,
             staff_type = staff_type,
+            others_read_upto = _others_read_upto(db, room_id, staff.id, staff_type),
         )
     finally:
         db.close()
@@ -340,7 +415,7 @@ def room_view(room_id):
 @bp.route('/room/<int:room_id>/messages')
 @require_roles(*STAFF_ROLES)
 def room_messages_api(room_id):
-    """チャットメッセージのJSON API（ポーリング用）"""
+    """チャットメッセージのJSON API（SSE が使えない場合のポーリング用）"""
     tenant_id = session.get('tenant_id')
     db = SessionLocal()
     try:
@@ -348,6 +423,9 @@ def room_messages_api(room_id):
         if not staff:
             return jsonify({'error': 'unauthorized'}), 401
 
+        if not _is_member(db, room_id, tenant_id, staff.id, staff_type):
+            return jsonify({'error': 'forbidden'}), 403
+
         since_id = int(request.args.get('since_id', 0))
         messages = db.query(TInternalMessage).filter(
             and_(
@@ -356,38 +434,76 @@ def room_messages_api(room_id):
             )
         ).order_by(TInternalMessage.created_at.asc()).all()
 
-        # 既読マーク
-        for msg in messages:
-            exists = db.query(TInternalMessageRead).filter(
-                and_(
-                    TInternalMessageRead.message_id == msg.id,
-                    TInternalMessageRead.staff_id   == staff.id,
-                    TInternalMessageRead.staff_type == staff_type,
-                )
-            ).first()
-            if not exists:
-                db.add(TInternalMessageRead(
-                    message_id = msg.id,
-                    staff_id   = staff.id,
-                    staff_type = staff_type,
-                ))
-        if messages:
+        # 既読マーク（カーソルを最新メッセージまで進める）
+        if messages and _mark_read(db, room_id, staff.id, staff_type, max(m.id for m in messages)):
             db.commit()
+            chat_push.notify(chat_push.room_channel(room_id))
+
+        return jsonify([_message_dict(m) for m in messages])
+    finally:
+        db.close()
+
 
-        return jsonify([{
-            'id'          : m.id,
-            'sender_name' : m.sender_name,
-            'sender_id'   : m.sender_id,
-            'sender_type' : m.sender_type,
-            'message'     : m.message,
-            'message_type': m.message_type or 'text',
-            'file_url'    : m.file_url or '',
-            'file_name'   : m.file_name or '',
-            'created_at'  : m.created_at.strftime('%H:%M') if m.created_at else '',
-        } for m in messages])
+@bp.route('/room/<int:room_id>/stream')
+@require_roles(*STAFF_ROLES)
+def room_stream(room_id):
+    """新着メッセージ・既読の SSE 配信
+
+    event: message … メッセージ1件（id はメッセージID。再接続時は Last-Event-ID から続きを送る）
+    event: read    … {'read_upto': 自分以外が既読にした最大メッセージID}
+    通知が来たときだけDBを読み、待機中はハートビートのみ送る。
+    """
+    tenant_id = session.get('tenant_id')
+    db = SessionLocal()
+    try:
+        staff, staff_type = _get_current_staff(db)
+        if not staff:
+            return jsonify({'error': 'unauthorized'}), 401
+        if not _is_member(db, room_id, tenant_id, staff.id, staff_type):
+            return jsonify({'error': 'forbidden'}), 403
+        staff_id = staff.id
     finally:
         db.close()
 
+    state = {'last_id': chat_push.last_event_id(request), 'read_upto': None}
+    channel = chat_push.room_channel(room_id)
+
+    def fetch():
+        events = []
+        advanced = False
+        db = SessionLocal()
+        try:
+            messages = db.query(TInternalMessage).filter(
+                and_(
+                    TInternalMessage.room_id == room_id,
+                    TInternalMessage.id > state['last_id'],
+                )
+            ).order_by(TInternalMessage.id.asc()).all()
+            for m in messages:
+                events.append(('message', _message_dict(m), m.id))
+                state['last_id'] = m.id
+            if messages:
+                advanced = _mark_read(db, room_id, staff_id, staff_type, state['last_id'])
+                db.commit()
+            read_upto = _others_read_upto(db, room_id, staff_id, staff_type)
+            if read_upto != state['read_upto']:
+                state['read_upto'] = read_upto
+                events.append(('read', {'read_upto': read_upto}, None))
+        except Exception:
+            db.rollback()
+            current_app.logger.exception('[internal_chat] stream fetch failed (room=%s)', room_id)
+        finally:
+            db.close()
+        if advanced:
+            chat_push.notify(channel)
+        return events
+
+    return Response(
+        stream_with_context(chat_push.stream(channel, fetch)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
 
 @bp.route('/room/<int:room_id>/upload', methods=['POST'])
 @require_roles(*STAFF_ROLES)
@@ -461,7 +577,10 @@ def room_upload(room_id):
         )
         db.add(msg)
         room.updated_at = datetime.utcnow()
+        db.flush()
+        _mark_read(db, room_id, staff.id, staff_type, msg.id)
         db.commit()
+        chat_push.notify(chat_push.room_channel(room_id))
 
         return jsonify({
             'success'     : True,
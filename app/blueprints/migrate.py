@@ -3,7 +3,7 @@
 """
 
 from flask import Blueprint, jsonify
-from ..utils.db import get_db_connection
+from ..utils.db import get_db_connection, _is_pg
 
 bp = Blueprint('migrate', __name__, url_prefix='/migrate')
 
@@ -16,7 +16,7 @@ def add_openai_key():
         cur = conn.cursor()
         
         # PostgreSQLかどうか確認
-        is_pg = conn.__class__.__module__.startswith("psycopg2")
+        is_pg = _is_pg(conn)
         
         if not is_pg:
             return jsonify({
@@ -67,7 +67,7 @@ def init_all_tables():
         cur = conn.cursor()
         
         # PostgreSQLかどうか確認
-        is_pg = conn.__class__.__module__.startswith("psycopg2")
+        is_pg = _is_pg(conn)
         
         if not is_pg:
             return jsonify({
@@ -125,7 +125,7 @@ def add_admin_columns():
         cur = conn.cursor()
         
         # PostgreSQLかどうか確認
-        is_pg = conn.__class__.__module__.startswith("psycopg2")
+        is_pg = _is_pg(conn)
         
         if not is_pg:
             return jsonify({
@@ -27,9 +27,11 @@ import traceback
 import uuid
 from collections import defaultdict
 import random
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 from functools import wraps
+from types import SimpleNamespace
 from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
@@ -84,6 +86,7 @@ from sqlalchemy.orm import (
     declared_attr,
     with_loader_criteria,
     joinedload,
+    Mapper,
 )
 
 try:
@@ -258,23 +261,23 @@ def inject_policy_flags():
 
 
 # -----------------------------------------------------------------------------------------------
-#  変更検知のグローバル（フロア版数）＋ユーティリティ
+#  変更検知（フロア版数）＋ユーティリティ
+#  版数は店舗ごとに change_bus（PostgreSQL LISTEN/NOTIFY / ローカルはファイル）で管理し、
+#  どのワーカーで注文を受けても全ワーカーの SSE 待機へ通知が届く。
 # -----------------------------------------------------------------------------------------------
-_floor_version = int(time.time() * 1000)
-_floor_lock = threading.Lock()
-_floor_waiters = []
+def _floor_channel(store_id) -> str:
+    return f"floor:{store_id or 0}"
 
 # --- [ヘルパ] フロア更新通知（版数更新 & SSE 待機へ通知） --------------------------------
-def mark_floor_changed():
-    """フロア状態が変わったら呼ぶ（版数を前に進め、SSE 待機中の接続に通知）"""
-    global _floor_version
-    with _floor_lock:
-        _floor_version = int(time.time() * 1000)
-        for q in list(_floor_waiters):
-            try:
-                q.put_nowait(_floor_version)
-            except Exception:
-                pass
+def mark_floor_changed(store_id=None):
+    """フロア状態が変わったら呼ぶ（店舗の版数を前に進め、全ワーカーの SSE 待機中の接続に通知）"""
+    from app.services.change_bus import get_change_bus
+    if store_id is None:
+        store_id = current_store_id()
+    try:
+        get_change_bus().publish(_floor_channel(store_id))
+    except Exception as e:
+        logging.getLogger(__name__).warning("[floor] change notification failed: %s", e)
 
 # ---------------------------------------------------------------------
 # Jinja フィルタ登録（価格表示：¥12,345 形式）
@@ -858,6 +861,55 @@ def is_store_admin_or_higher() -> bool:
         SessionLocal.remove()
 
 
+# --- TenantScoped モデルのレジストリ（マッパー構成時に再構築） -------------------
+_tenant_scoped_mappers = None  # frozenset[Mapper] | None（None = 未構築）
+_tenant_criteria_cache = {}    # tenant_id -> with_loader_criteria オプション
+_TENANT_CRITERIA_CACHE_MAX = 1024
+
+
+def tenant_scoped_mappers():
+    """Base に登録された TenantScoped 継承モデルの Mapper 集合を返す（キャッシュ）"""
+    global _tenant_scoped_mappers
+    cached = _tenant_scoped_mappers
+    if cached is not None:
+        return cached
+    found = set()
+    for mapper in list(Base.registry.mappers):
+        try:
+            if issubclass(mapper.class_, TenantScoped):
+                found.add(mapper)
+        except TypeError:
+            pass
+    _tenant_scoped_mappers = frozenset(found)
+    return _tenant_scoped_mappers
+
+
+@event.listens_for(Mapper, "after_configured")
+def _reset_tenant_scoped_mappers():
+    """マッパーが（再）構成されたらレジストリを作り直す"""
+    global _tenant_scoped_mappers
+    _tenant_scoped_mappers = None
+
+
+def _tenant_criteria_option(tenant_id):
+    """
+    テナントごとに 1 つだけ生成する loader criteria オプション。
+    Mixin（TenantScoped）を対象にすることで全サブクラスへ一括適用され、
+    lambda の tenant_id はバインドパラメータとして扱われるため文キャッシュも効く。
+    """
+    opt = _tenant_criteria_cache.get(tenant_id)
+    if opt is None:
+        if len(_tenant_criteria_cache) >= _TENANT_CRITERIA_CACHE_MAX:
+            _tenant_criteria_cache.clear()
+        opt = with_loader_criteria(
+            TenantScoped,
+            lambda cls: cls.tenant_id == tenant_id,
+            include_aliases=True,
+        )
+        _tenant_criteria_cache[tenant_id] = opt
+    return opt
+
+
 # --- SELECT時のテナント自動フィルタ（sysadmin は免除） ---------------------------
 @event.listens_for(Session, "do_orm_execute")
 def _apply_tenant_filter(execute_state):
@@ -877,19 +929,13 @@ def _apply_tenant_filter(execute_state):
     tenant_id = _current_tenant_id()
     if tenant_id is None:
         return
-    for mapper in list(Base.registry.mappers):
-        cls = mapper.class_
-        try:
-            if issubclass(cls, TenantScoped):
-                execute_state.statement = execute_state.statement.options(
-                    with_loader_criteria(
-                        cls,
-                        lambda ent: ent.tenant_id == tenant_id,
-                        include_aliases=True
-                    )
-                )
-        except TypeError:
-            pass
+    if not tenant_scoped_mappers():
+        return
+    # Query.count() や select(func.count()).select_from(...) は all_mappers が空になるため、
+    # 文の種類で絞り込まず常に付ける（TenantScoped を含まない文では何もしない）
+    execute_state.statement = execute_state.statement.options(
+        _tenant_criteria_option(tenant_id)
+    )
 
 
 # --- INSERT時の tenant_id 自動スタンプ ------------------------------------------
@@ -2598,42 +2644,12 @@ def build_ticket_with_totals(header, items, table, new_item_ids):
     return "\n".join(lines) + "\n"
 
 
-# --- ヘルパー関数：カテゴリ階層チェック --------------------------------------------
-def _is_descendant_category(session_db, child_id, parent_id):
-    """
-    カテゴリが別のカテゴリの子孫かどうかをチェック
-    
-    Args:
-        session_db: データベースセッション
-        child_id: 子カテゴリ ID
-        parent_id: 親カテゴリ ID
-    
-    Returns:
-        bool: child_idがparent_idの子孫である場合True
-    """
-    # 直接の親をチェック
-    current_id = child_id
-    visited = set()  # 循環参照対策
-    
-    while current_id and current_id not in visited:
-        visited.add(current_id)
-        
-        category = session_db.get(Category, current_id)
-        if not category:
-            return False
-        
-        if category.parent_id == parent_id:
-            return True
-        
-        current_id = category.parent_id
-    
-    return False
-
-
 # --- KDS印刷処理（印刷ルールに基づく） --------------------------------------------
 def _trigger_kds_print(session_db, order_id, new_items):
     """
-    印刷ルールに基づいてKDS印刷を実行
+    印刷ルールに基づいてKDS印刷を登録する（コミット後に呼ぶ）。
+    伝票の作成・送信・再試行は印刷キューのワーカーが行い、ここでは待たない。
+    送信先が無い（ルール不一致・Printer Server EXE が取りに来るプリンタのみ）注文は登録しない。
     
     Args:
         session_db: データベースセッション
@@ -2643,96 +2659,26 @@ def _trigger_kds_print(session_db, order_id, new_items):
     if not new_items:
         return
     
-    # 印刷ルールを取得
-    rules = session_db.query(PrintRule).all()
-    if not rules:
-        current_app.logger.debug("[_trigger_kds_print] no print rules found")
-        return
-    
-    # プリンターごとに印刷するアイテムをグループ化
-    printer_items = {}  # printer_id -> [items]
-    
-    for item in new_items:
-        menu_id = item.menu_id
-        
-        # このアイテムに適用される印刷ルールを検索
-        for rule in rules:
-            # メニュー指定のルール
-            if rule.menu_id and rule.menu_id == menu_id:
-                if rule.printer_id not in printer_items:
-                    printer_items[rule.printer_id] = []
-                printer_items[rule.printer_id].append(item)
-                break  # 最初にマッチしたルールを適用
-            
-            # カテゴリ指定のルール
-            elif rule.category_id:
-                # メニューが直接このカテゴリに属しているかチェック
-                cat_link = session_db.query(ProductCategoryLink).filter(
-                    ProductCategoryLink.product_id == menu_id,
-                    ProductCategoryLink.category_id == rule.category_id
-                ).first()
-                
-                if cat_link:
-                    if rule.printer_id not in printer_items:
-                        printer_items[rule.printer_id] = []
-                    printer_items[rule.printer_id].append(item)
-                    break  # 最初にマッチしたルールを適用
-                
-                # 直接マッチしない場合、子カテゴリもチェック（階層対応）
-                # メニューが属するカテゴリを取得
-                menu_categories = session_db.query(ProductCategoryLink.category_id).filter(
-                    ProductCategoryLink.product_id == menu_id
-                ).all()
-                menu_category_ids = [c[0] for c in menu_categories]
-                
-                # 各カテゴリが指定されたカテゴリの子孫かチェック
-                for cat_id in menu_category_ids:
-                    if _is_descendant_category(session_db, cat_id, rule.category_id):
-                        if rule.printer_id not in printer_items:
-                            printer_items[rule.printer_id] = []
-                        printer_items[rule.printer_id].append(item)
-                        break  # 最初にマッチしたルールを適用
-    
-    if not printer_items:
-        current_app.logger.debug("[_trigger_kds_print] no items matched print rules")
-        return
-    
-    # 注文情報を取得
     order = session_db.get(OrderHeader, order_id)
     if not order:
         current_app.logger.warning("[_trigger_kds_print] order not found: %s", order_id)
         return
     
-    # テーブル情報を取得
-    table = None
-    if order.table_id:
-        table = session_db.get(TableSeat, order.table_id)
+    routes = get_print_routes(session_db, order.store_id)
+    if not routes.rules:
+        current_app.logger.debug("[_trigger_kds_print] no print rules found")
+        return
+    
+    item_ids = []
+    for item in new_items:
+        printer = routes.printers.get(routes.kds_printer_id(item.menu_id))
+        if printer is not None and printer.kind != "printer_server":
+            item_ids.append(item.id)
+    if not item_ids:
+        current_app.logger.debug("[_trigger_kds_print] no items to push for order %s", order_id)
+        return
     
-    # プリンターごとに印刷
-    for printer_id, items in printer_items.items():
-        printer = session_db.get(Printer, printer_id)
-        if not printer or printer.enabled != 1:
-            current_app.logger.warning("[_trigger_kds_print] printer not found or disabled: %s", printer_id)
-            continue
-        
-        try:
-            # 印刷データを生成
-            ticket = build_ticket_with_totals(order, items, table, [i.id for i in items])
-            
-            # プリンターに印刷
-            if printer.kind == "escpos_tcp":
-                print_escpos_tcp(ticket, printer.connection)
-                current_app.logger.info("[_trigger_kds_print] printed to %s (%s): %d items",
-                               printer.name, printer.connection, len(items))
-            elif printer.kind == "printer_server":
-                # printer_serverタイプの場合、Printer Server EXEが自動的にOrderHeaderをポーリングして印刷する
-                # ここでは何もする必要がない
-                current_app.logger.info("[_trigger_kds_print] printer_server type: %s will be handled by Printer Server EXE (order_id=%s)",
-                               printer.name, order_id)
-            else:
-                current_app.logger.warning("[_trigger_kds_print] unsupported printer type: %s", printer.kind)
-        except Exception as e:
-            current_app.logger.exception("[_trigger_kds_print] failed to print to %s: %s", printer.name, e)
+    trigger_print_async(order_id, item_ids)
 
 
 # --- ESC/POS（TCP）プリンタへの印刷 --------------------------------------------
@@ -2806,10 +2752,11 @@ def write_print_fallback(text: str, name_prefix="ticket"):
 
 
 # --- プリンタ種別に応じた印刷ディスパッチ（常に内容をファイル保存も実施） -------
-def dispatch_print(printer_row: 'Printer' | None, text: str):
+def dispatch_print(printer_row: 'Printer' | None, text: str, raise_errors: bool = False):
     """
     指定されたプリンタ情報に基づいて、適切な印刷処理を呼び出す。
     印刷が失敗した場合は、フォールバックとして内容をファイルに保存する。
+    raise_errors=True の場合はフォールバック保存後に例外を再送出する（印刷キューの再試行用）。
     """
     # 💡 常にプリンタへ送信されるデータをファイルに保存する
     write_print_fallback(text, "sent_to_printer")
@@ -2841,6 +2788,8 @@ def dispatch_print(printer_row: 'Printer' | None, text: str):
         logging.error(traceback.format_exc())
         # ここで正しいtextを渡す
         write_print_fallback(text, error_prefix)
+        if raise_errors:
+            raise
 
 
 # --- 明細ごとのプリンタ解決（メニュー→カテゴリ→デフォルトの優先順） -----------
@@ -2860,88 +2809,575 @@ def resolve_printers_for_item(session_db, menu_id: int) -> list['Printer']:
     return pr
 
 
-# --- 印刷ジョブの生成とディスパッチ（明細のバケツ分け→チケット生成→出力） ------
-def trigger_print_job(order_id: int, items_to_print: list = None):
-    s = SessionLocal()
+# -----------------------------------------------------------------------------
+# 印刷ルーティング表（店舗ごと：メニューID → 送信先プリンタ）
+#   店舗の印刷ルール・プリンタ・カテゴリ・カテゴリ付与を 4 クエリで読み込み、
+#   kds_printer_id で _trigger_kds_print と同じ「ルールID順で最初に一致したルール（子孫カテゴリ含む）」を解決する。
+#   印刷ルール / プリンタ / カテゴリ / カテゴリ付与の変更で change_bus の版数を進め、全ワーカーの表を作り直す。
+#   一括 DELETE など ORM の flush を経由しない変更に備えて PRINT_ROUTES_TTL_SEC でも作り直す。
+# -----------------------------------------------------------------------------
+PRINT_ROUTES_TTL_SEC = float(os.getenv("PRINT_ROUTES_TTL_SEC", "300"))
+
+_print_routes_cache = {}  # store_id -> (版数, 作成時刻, _PrintRoutes)
+_print_routes_lock = threading.Lock()
+
+
+def _print_routes_channel(store_id) -> str:
+    return f"print_routes:{store_id or 0}"
+
+
+class _PrintRoutes:
+    """1 店舗分のルーティング表（プリンタは ORM から切り離したスナップショットで保持）"""
+
+    def __init__(self, rules=(), printers=None, menu_rule_categories=None):
+        self.rules = rules                            # [(menu_id, category_id, printer_id)]（ルールID順）
+        self.printers = printers or {}                # printer_id -> printer（有効なもののみ）
+        self.menu_rule_categories = menu_rule_categories or {}  # menu_id -> {ルールのカテゴリID（祖先含む）}
+        self._kds_resolved = {}
+
+    def kds_printer_id(self, menu_id):
+        """
+        KDS 印刷の送信先（_trigger_kds_print の判定）。
+        ルールID順に見て最初に一致したルールのプリンタID（メニュー指定、またはメニューが
+        そのカテゴリか子孫カテゴリに属するカテゴリ指定）。一致しなければ None。
+        """
+        if menu_id in self._kds_resolved:
+            return self._kds_resolved[menu_id]
+        categories = self.menu_rule_categories.get(menu_id, ())
+        printer_id = None
+        for rule_menu_id, rule_category_id, rule_printer_id in self.rules:
+            if rule_menu_id:
+                if rule_menu_id == menu_id:
+                    printer_id = rule_printer_id
+                    break
+            elif rule_category_id and rule_category_id in categories:
+                printer_id = rule_printer_id
+                break
+        self._kds_resolved[menu_id] = printer_id
+        return printer_id
+
+
+def _load_print_routes(s, store_id) -> _PrintRoutes:
+    rules = s.query(PrintRule.id, PrintRule.menu_id, PrintRule.category_id, PrintRule.printer_id)\
+        .filter(PrintRule.store_id == store_id).order_by(PrintRule.id).all()
+    printer_ids = {r.printer_id for r in rules}
+    printers = {}
+    if printer_ids:
+        for p in s.query(Printer).filter(Printer.id.in_(printer_ids), Printer.enabled == 1)\
+                .order_by(Printer.id).all():
+            printers[p.id] = SimpleNamespace(id=p.id, name=p.name, kind=p.kind,
+                                             connection=p.connection, width=p.width, enabled=p.enabled)
+
+    # カテゴリ指定ルールは子孫カテゴリにも効くので、カテゴリごとに「一致するルールのカテゴリ」を求める
+    rule_categories = {r.category_id for r in rules if r.category_id is not None}
+    matching = {}  # category_id -> {ルールのカテゴリID}
+    if rule_categories:
+        parents = dict(s.query(Category.id, Category.parent_id).filter(Category.store_id == store_id).all())
+        for cid in set(parents) | rule_categories:
+            hits = set()
+            cur, seen = cid, set()
+            while cur and cur not in seen:  # 循環参照対策
+                seen.add(cur)
+                if cur in rule_categories:
+                    hits.add(cur)
+                cur = parents.get(cur)
+            if hits:
+                matching[cid] = hits
+
+    menu_rule_categories = defaultdict(set)
+    if matching:
+        links = s.query(ProductCategoryLink.product_id, ProductCategoryLink.category_id)\
+            .filter(ProductCategoryLink.category_id.in_(list(matching))).all()
+        for link in links:
+            menu_rule_categories[link.product_id] |= matching[link.category_id]
+
+    return _PrintRoutes(rules=[(r.menu_id, r.category_id, r.printer_id) for r in rules],
+                        printers=printers, menu_rule_categories=dict(menu_rule_categories))
+
+
+def get_print_routes(s, store_id) -> _PrintRoutes:
+    """店舗のルーティング表を返す（版数が変わっていなければプロセス内のキャッシュを使う）"""
+    from app.services.change_bus import get_change_bus
     try:
-        header = s.get(OrderHeader, order_id)
-        if not header:
-            current_app.logger.warning(f"注文ヘッダーが見つかりませんでした: {order_id}")
-            return
-        
-        # 💡 TableSeatオブジェクトをデータベースから取得
-        table = s.get(TableSeat, getattr(header, 'table_id', None))
-        
-        # --- 詳細なデバッグログを追加 ---
-        current_app.logger.info(f"DEBUG: 注文ID {order_id} に紐づくテーブルID: {getattr(header, 'table_id', 'N/A')}")
-        if table:
-            current_app.logger.info(f"DEBUG: データベースからTableSeatオブジェクトを正常に取得しました。")
-            current_app.logger.info(f"DEBUG: 取得されたテーブルID: {getattr(table, 'id', 'N/A')}")
-            current_app.logger.info(f"DEBUG: 取得されたテーブル番号: {getattr(table, 'table_no', 'N/A')}")
-            if not getattr(table, 'table_no', None):
-                current_app.logger.warning("WARNING: Table object found, but 'table_no' attribute is missing or empty.")
-        else:
-            current_app.logger.warning(f"テーブルが見つかりませんでした。header.table_id: {getattr(header, 'table_id', 'N/A')}")
-            
-        current_app.logger.info(f"注文ID {order_id} の印刷ジョブを開始します。")
+        version = get_change_bus().version(_print_routes_channel(store_id))
+    except Exception as e:
+        logging.getLogger(__name__).warning("[print-routes] version lookup failed: %s", e)
+        return _load_print_routes(s, store_id)
+
+    now = time.monotonic()
+    with _print_routes_lock:
+        entry = _print_routes_cache.get(store_id)
+    if entry is not None and entry[0] == version and now - entry[1] < PRINT_ROUTES_TTL_SEC:
+        return entry[2]
+
+    routes = _load_print_routes(s, store_id)
+    with _print_routes_lock:
+        _print_routes_cache[store_id] = (version, now, routes)
+    return routes
+
+
+def invalidate_print_routes(store_id=None):
+    """印刷ルール・プリンタの変更後に呼ぶ（全ワーカーのルーティング表を破棄）"""
+    from app.services.change_bus import get_change_bus
+    if store_id is None:
+        store_id = current_store_id()
+    with _print_routes_lock:
+        _print_routes_cache.pop(store_id, None)
+    try:
+        get_change_bus().publish(_print_routes_channel(store_id))
+    except Exception as e:
+        logging.getLogger(__name__).warning("[print-routes] change notification failed: %s", e)
+
+
+@event.listens_for(Session, "after_flush")
+def _print_routes_collect_changes(session_obj, flush_context):
+    stores = None
+    for obj in list(session_obj.new) + list(session_obj.dirty) + list(session_obj.deleted):
+        if isinstance(obj, (PrintRule, Printer, ProductCategoryLink, Category)):
+            sid = getattr(obj, "store_id", None)
+            if sid:
+                if stores is None:
+                    stores = session_obj.info.setdefault("_print_routes_stores", set())
+                stores.add(int(sid))
+
+
+@event.listens_for(Session, "after_commit")
+def _print_routes_publish_changes(session_obj):
+    for sid in session_obj.info.pop("_print_routes_stores", ()):
+        invalidate_print_routes(sid)
+
+
+@event.listens_for(Session, "after_rollback")
+def _print_routes_discard_changes(session_obj):
+    session_obj.info.pop("_print_routes_stores", None)
+
+
+# --- 印刷チケットの生成（明細のバケツ分け→プリンタごとのチケット本文） ------------
+def _build_print_tickets(s, order_id: int, items_to_print: list = None) -> list[tuple]:
+    """
+    注文明細を印刷ルール（kds_printer_id）でプリンタごとに振り分け、伝票本文を生成する。
+    Printer Server EXE が自分で取りに来るプリンタ・未対応の種別・無効なプリンタは除く。
+    戻り値: [(プリンタ, 明細リスト, 伝票本文), ...]
+    """
+    header = s.get(OrderHeader, order_id)
+    if not header:
+        current_app.logger.warning(f"注文ヘッダーが見つかりませんでした: {order_id}")
+        return []
 
-        # items_to_print引数が渡された場合は、そのリストを使用
-        if items_to_print is not None:
-            details = items_to_print
+    # items_to_print引数が渡された場合は、そのリストを使用
+    if items_to_print is not None:
+        details = items_to_print
+    else:
+        # 引数が渡されない場合は、データベースから明細をすべて取得（再印刷）
+        details = s.query(OrderItem).filter(
+            OrderItem.order_id == order_id,
+            OrderItem.status != "取消"
+        ).order_by(OrderItem.id).all()
+
+    # 店舗のルーティング表で全明細を一括振り分け（明細ごとのクエリは発行しない）
+    routes = get_print_routes(s, header.store_id)
+    printer_items = {}  # printer_id -> [items]
+    for item in details:
+        printer_id = routes.kds_printer_id(item.menu_id)
+        if printer_id is not None:
+            printer_items.setdefault(printer_id, []).append(item)
+    if not printer_items:
+        return []
+
+    table = s.get(TableSeat, header.table_id) if header.table_id else None
+
+    tickets = []
+    for printer_id, items in printer_items.items():
+        printer = routes.printers.get(printer_id)
+        if not printer:
+            current_app.logger.warning("[print] printer not found or disabled: %s", printer_id)
+        elif printer.kind == "printer_server":
+            # Printer Server EXE が注文をポーリングして印刷する
+            current_app.logger.info("[print] printer_server type: %s will be handled by Printer Server EXE (order_id=%s)",
+                                    printer.name, order_id)
+        elif printer.kind != "escpos_tcp":
+            current_app.logger.warning("[print] unsupported printer type: %s", printer.kind)
         else:
-            # 引数が渡されない場合は、データベースから明細をすべて取得（従来の動作）
-            details = s.query(OrderItem).filter(
-                OrderItem.order_id == order_id, 
-                OrderItem.status != "取消"
-            ).order_by(OrderItem.id).all()
-        
-        current_app.logger.info(f"注文ID {order_id} に紐づく明細が {len(details)} 件見つかりました。")
-
-        # プリンタIDまたはNoneをキーとして、明細のリストを保持する辞書
-        # 値は (プリンタオブジェクト or None, 明細リスト) のタプル
-        printer_buckets = {}
-        
-        for item in details:
-            current_app.logger.info(f"明細ID {item.id} (メニューID: {item.menu_id}) のプリンタを解決します。")
-            printers = resolve_printers_for_item(s, item.menu_id)
-            current_app.logger.info(f"明細ID {item.id} には {len(printers) if printers else 0} 件のプリンタが割り当てられました。")
-            
-            if not printers:
-                if None not in printer_buckets:
-                    printer_buckets[None] = (None, [])
-                printer_buckets[None][1].append(item)
-            else:
-                for p in printers:
-                    if p.id not in printer_buckets:
-                        printer_buckets[p.id] = (p, [])
-                    printer_buckets[p.id][1].append(item)
+            ticket = build_ticket_with_totals(header, items, table, [i.id for i in items])
+            tickets.append((printer, items, ticket))
+    return tickets
 
-        current_app.logger.info(f"合計 {len(printer_buckets)} 件のプリンタバケットが作成されました。")
 
-        for key, vals in printer_buckets.items():
-            printer_obj, items_to_print_in_bucket = vals
-            
-            if items_to_print_in_bucket:
-                title = (getattr(printer_obj, 'name', "DEFAULT")).upper()
-                width = getattr(printer_obj, 'width', 42)
-                
-                current_app.logger.info(f"プリンタID {key if key else 'DEFAULT'} に {len(items_to_print_in_bucket)} 件の明細を印刷します。")
-                
-                # 💡 build_ticket関数にテーブルオブジェクトを渡す
-                ticket = build_ticket(header, items_to_print_in_bucket, table=table, width=width, title=title)
-                dispatch_print(printer_obj, ticket)
-            else:
-                current_app.logger.warning(f"プリンタID {key if key else 'DEFAULT'} に印刷する明細がありません。")
+def _load_print_items(s, item_ids) -> list:
+    """印刷対象の明細（取消を除く・ID順）"""
+    if not item_ids:
+        return []
+    return (
+        s.query(OrderItem)
+         .filter(OrderItem.id.in_([int(i) for i in item_ids]), OrderItem.status != "取消")
+         .order_by(OrderItem.id)
+         .all()
+    )
+
 
+# --- 印刷ジョブの生成とディスパッチ（同期版：チケット生成→その場で出力） ----------
+def trigger_print_job(order_id: int, items_to_print: list = None, item_ids: list = None):
+    s = SessionLocal()
+    try:
+        if items_to_print is None and item_ids is not None:
+            items_to_print = _load_print_items(s, item_ids)
+        for printer_obj, _items, ticket in _build_print_tickets(s, order_id, items_to_print):
+            dispatch_print(printer_obj, ticket)
     finally:
         s.close()
         SessionLocal.remove()
 
 
-# --- 非同期印刷トリガ（コンテキスト継承して軽量スレッドで実行） -----------------
-def trigger_print_async(order_id: int) -> None:
+# -----------------------------------------------------------------------------
+# 印刷キュー（T_印刷ジョブ）
+#   /api/order の KDS 印刷（_trigger_kds_print）を DB に永続化し、プロセスごとの有限ワーカーで処理する。
+#   - kind='order'  : 注文単位の振り分けジョブ。プリンタごとの伝票を作り kind='ticket' を登録する
+#   - kind='ticket' : プリンタ単位の伝票ジョブ。伝票本文は登録時に確定し、再試行でも同じ内容を出す
+#   - 重複排除: dedupe_key（種別・注文ID・プリンタID・明細ID集合）の UNIQUE 制約。
+#               完了・中止したジョブはキーを解放するので、同じ明細の再印刷は新しいジョブになる
+#   - 順序: (店舗ID, プリンタID) ごとに最も古い未完了ジョブだけを処理する
+#   - 再試行: 失敗時は指数バックオフ。PRINT_JOB_MAX_ATTEMPTS 回で failed（後続ジョブへ進む）
+#   - 待機: 登録・完了時に起こされ、それ以外は次の再試行時刻まで（最長 PRINT_JOB_POLL_SEC）眠る
+#   - 再起動: running のまま残ったジョブはロック期限切れ後に再取得する
+#   - 掃除: 完了ジョブは PRINT_JOB_KEEP_DONE_SEC、中止ジョブは PRINT_JOB_KEEP_FAILED_SEC 経過後に削除する
+#   共有DBモード専用。db-per-tenant モードでは従来のスレッド印刷を使う。
+# -----------------------------------------------------------------------------
+PRINT_JOB_WORKERS = max(1, int(os.getenv("PRINT_JOB_WORKERS", "4")))
+PRINT_JOB_MAX_ATTEMPTS = int(os.getenv("PRINT_JOB_MAX_ATTEMPTS", "8"))
+PRINT_JOB_POLL_SEC = float(os.getenv("PRINT_JOB_POLL_SEC", "60"))  # 他プロセスが残したジョブの確認間隔
+PRINT_JOB_KEEP_DONE_SEC = int(os.getenv("PRINT_JOB_KEEP_DONE_SEC", str(24 * 3600)))
+PRINT_JOB_KEEP_FAILED_SEC = int(os.getenv("PRINT_JOB_KEEP_FAILED_SEC", str(7 * 24 * 3600)))
+PRINT_JOB_PRUNE_INTERVAL_SEC = 3600
+PRINT_JOB_BACKOFF_BASE_SEC = 5
+PRINT_JOB_BACKOFF_MAX_SEC = 300
+PRINT_JOB_LOCK_SEC = 120  # 処理中ジョブのロック期限（停止したワーカーのジョブを引き継ぐまでの時間）
+
+_print_job_table_ready = set()  # テーブル作成済みのバインド URL
+_print_worker = None
+_print_worker_lock = threading.Lock()
+
+
+def _ensure_print_job_table(eng):
+    key = str(eng.url)
+    if key in _print_job_table_ready:
+        return
+    id_col = "id INTEGER PRIMARY KEY AUTOINCREMENT" if eng.dialect.name == "sqlite" else "id BIGSERIAL PRIMARY KEY"
+    with eng.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS "T_印刷ジョブ" (
+                {id_col},
+                tenant_id INTEGER,
+                "店舗ID" INTEGER,
+                "注文ID" INTEGER NOT NULL,
+                "プリンタID" INTEGER NOT NULL DEFAULT 0,
+                kind TEXT NOT NULL,
+                item_ids TEXT NOT NULL DEFAULT '',
+                dedupe_key TEXT NOT NULL UNIQUE,
+                ticket TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_at DOUBLE PRECISION NOT NULL DEFAULT 0,
+                locked_until DOUBLE PRECISION NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )"""))
+        conn.execute(text(
+            'CREATE INDEX IF NOT EXISTS idx_print_job_queue '
+            'ON "T_印刷ジョブ"(status, kind, "店舗ID", "プリンタID", id)'
+        ))
+    _print_job_table_ready.add(key)
+
+
+def _print_item_key(item_ids) -> str:
+    """明細ID集合の正規化キー（昇順・カンマ区切り）"""
+    return ",".join(str(i) for i in sorted({int(i) for i in item_ids}))
+
+
+def _insert_print_job(conn, *, tenant_id, store_id, order_id, printer_id, kind, item_key, ticket=None) -> bool:
+    """ジョブを登録する。同じ dedupe_key の未完了ジョブがあれば何もしない（登録できたら True）"""
+    ts = now_str()
+    res = conn.execute(text("""
+        INSERT INTO "T_印刷ジョブ"
+            (tenant_id, "店舗ID", "注文ID", "プリンタID", kind, item_ids, dedupe_key, ticket,
+             status, attempts, next_at, locked_until, created_at, updated_at)
+        VALUES (:tid, :sid, :oid, :pid, :kind, :items, :dedupe, :ticket,
+                'pending', 0, 0, 0, :ts, :ts)
+        ON CONFLICT (dedupe_key) DO NOTHING"""), {
+        "tid": tenant_id, "sid": store_id, "oid": order_id, "pid": printer_id or 0,
+        "kind": kind, "items": item_key, "ticket": ticket,
+        "dedupe": f"{kind}:{order_id}:{printer_id or 0}:{item_key}", "ts": ts,
+    })
+    return res.rowcount == 1
+
+
+def _load_printer_row(eng, printer_id):
+    """伝票ジョブの送信先プリンタ（削除済み・未指定なら None → フォールバック保存）"""
+    if not printer_id:
+        return None
+    with eng.connect() as conn:
+        row = conn.execute(text(
+            'SELECT id, "名称" AS name, "種別" AS kind, "接続情報" AS connection '
+            'FROM "M_プリンタ" WHERE id = :id'), {"id": printer_id}).mappings().first()
+    return SimpleNamespace(**row) if row else None
+
+
+class _PrintWorker:
+    """印刷キューの取り出しと実行（プロセスごとに 1 つ）"""
+
+    def __init__(self, app, eng, size: int):
+        self.app = app
+        self.engine = eng
+        self.pid = os.getpid()
+        self._wake = threading.Event()
+        self._slots = threading.Semaphore(size)
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="print-job")
+        threading.Thread(target=self._loop, name="print-job-dispatcher", daemon=True).start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        timeout = 0
+        next_prune = 0.0
+        while True:
+            self._wake.wait(timeout)
+            self._wake.clear()
+            try:
+                timeout = self._dispatch_ready()
+            except Exception:
+                timeout = PRINT_JOB_POLL_SEC
+                logging.exception("[print-queue] ジョブの取り出しに失敗しました")
+            if time.time() >= next_prune:
+                next_prune = time.time() + PRINT_JOB_PRUNE_INTERVAL_SEC
+                try:
+                    self._prune()
+                except Exception:
+                    logging.exception("[print-queue] 完了ジョブの削除に失敗しました")
+
+    def _dispatch_ready(self) -> float:
+        """空きワーカー分だけジョブを取得して投入し、次に確認するまでの秒数を返す"""
+        ready, next_due = self._candidates()
+        for job_id in ready:
+            if not self._slots.acquire(blocking=False):
+                break  # 実行中のジョブが終わると wake される
+            if not self._claim(job_id):
+                self._slots.release()
+                continue
+            self._executor.submit(self._run, job_id)
+        if next_due is None:
+            return PRINT_JOB_POLL_SEC
+        return max(0.0, min(PRINT_JOB_POLL_SEC, next_due - time.time()))
+
+    def _candidates(self) -> tuple[list[int], float | None]:
+        """(種別, 店舗, プリンタ) ごとの先頭ジョブのうち、今実行できるものと、次に実行できる時刻"""
+        now = time.time()
+        with self.engine.connect() as conn:
+            heads = conn.execute(text("""
+                SELECT j.id, j.status, j.next_at, j.locked_until
+                  FROM "T_印刷ジョブ" j
+                  JOIN (SELECT MIN(id) AS head_id
+                          FROM "T_印刷ジョブ"
+                         WHERE status IN ('pending', 'running')
+                         GROUP BY kind, "店舗ID", "プリンタID") h ON h.head_id = j.id
+                 ORDER BY j.id""")).all()
+        ready, next_due = [], None
+        for r in heads:
+            due = r.next_at if r.status == "pending" else r.locked_until
+            if due <= now:
+                ready.append(r.id)
+            elif next_due is None or due < next_due:
+                next_due = due
+        return ready, next_due
+
+    def _prune(self):
+        """保存期間を過ぎた完了・中止ジョブを削除する"""
+        now = datetime.now()
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                DELETE FROM "T_印刷ジョブ"
+                 WHERE (status = 'done' AND updated_at < :done_before)
+                    OR (status = 'failed' AND updated_at < :failed_before)"""), {
+                "done_before": (now - timedelta(seconds=PRINT_JOB_KEEP_DONE_SEC)).strftime('%Y-%m-%d %H:%M:%S'),
+                "failed_before": (now - timedelta(seconds=PRINT_JOB_KEEP_FAILED_SEC)).strftime('%Y-%m-%d %H:%M:%S'),
+            })
+
+    def _claim(self, job_id) -> bool:
+        """条件付き UPDATE で実行権を取る（他ワーカー・他プロセスとの取り合いは 1 件だけ成功）"""
+        now = time.time()
+        with self.engine.begin() as conn:
+            res = conn.execute(text("""
+                UPDATE "T_印刷ジョブ"
+                   SET status = 'running', attempts = attempts + 1,
+                       locked_until = :lock, updated_at = :ts
+                 WHERE id = :id
+                   AND ((status = 'pending' AND next_at <= :now)
+                        OR (status = 'running' AND locked_until < :now))"""),
+                {"id": job_id, "now": now, "lock": now + PRINT_JOB_LOCK_SEC, "ts": now_str()})
+        return res.rowcount == 1
+
+    def _run(self, job_id):
+        try:
+            with self.engine.connect() as conn:
+                job = conn.execute(text('SELECT * FROM "T_印刷ジョブ" WHERE id = :id'),
+                                   {"id": job_id}).mappings().first()
+            if job is None:
+                return
+            try:
+                if job["kind"] == "order":
+                    self._route(job)
+                else:
+                    printer = _load_printer_row(self.engine, job["プリンタID"])
+                    dispatch_print(printer, job["ticket"] or "", raise_errors=True)
+                    self._finish(job_id)
+            except Exception as e:
+                self._fail(job, e)
+        except Exception:
+            logging.exception("[print-queue] ジョブ %s の処理に失敗しました", job_id)
+        finally:
+            self._slots.release()
+            self.wake()
+
+    def _route(self, job):
+        """振り分けジョブ：プリンタごとの伝票を作って伝票ジョブを登録する"""
+        item_ids = [int(x) for x in (job["item_ids"] or "").split(",") if x]
+        with self.app.app_context(), self.app.test_request_context("/__print_queue__"):
+            # マルチテナントのフィルタが g / session を見る想定に合わせて注入
+            if job["tenant_id"] is not None:
+                g.tenant_id = job["tenant_id"]
+                session["tenant_id"] = job["tenant_id"]
+            if job["店舗ID"] is not None:
+                session["store_id"] = job["店舗ID"]
+            s = SessionLocal()
+            try:
+                items = _load_print_items(s, item_ids)
+                tickets = [
+                    (getattr(p, "id", None), [it.id for it in bucket], ticket)
+                    for p, bucket, ticket in _build_print_tickets(s, job["注文ID"], items)
+                ]
+            finally:
+                s.close()
+                SessionLocal.remove()
+
+        with self.engine.begin() as conn:
+            for printer_id, bucket_ids, ticket in tickets:
+                _insert_print_job(conn, tenant_id=job["tenant_id"], store_id=job["店舗ID"],
+                                  order_id=job["注文ID"], printer_id=printer_id, kind="ticket",
+                                  item_key=_print_item_key(bucket_ids), ticket=ticket)
+            self._finish(job["id"], conn)
+
+    def _finish(self, job_id, conn=None):
+        if conn is None:
+            with self.engine.begin() as conn:
+                return self._finish(job_id, conn)
+        conn.execute(text("""
+            UPDATE "T_印刷ジョブ"
+               SET status = 'done', locked_until = 0, last_error = NULL, updated_at = :ts,
+                   dedupe_key = dedupe_key || '#' || CAST(id AS TEXT)
+             WHERE id = :id"""), {"id": job_id, "ts": now_str()})
+
+    def _fail(self, job, exc):
+        attempts = int(job["attempts"] or 0)
+        final = attempts >= PRINT_JOB_MAX_ATTEMPTS
+        delay = min(PRINT_JOB_BACKOFF_MAX_SEC, PRINT_JOB_BACKOFF_BASE_SEC * 2 ** max(0, attempts - 1))
+        # 中止したジョブは重複排除キーを解放し、同じ明細を再印刷できるようにする
+        release_key = " || '#' || CAST(id AS TEXT)" if final else ""
+        with self.engine.begin() as conn:
+            conn.execute(text(f"""
+                UPDATE "T_印刷ジョブ"
+                   SET status = :status, next_at = :next_at, locked_until = 0,
+                       last_error = :err, updated_at = :ts,
+                       dedupe_key = dedupe_key{release_key}
+                 WHERE id = :id"""), {
+                "id": job["id"], "status": "failed" if final else "pending",
+                "next_at": time.time() + delay, "err": str(exc)[:1000], "ts": now_str(),
+            })
+        if final:
+            logging.error("[print-queue] ジョブ %s（注文ID %s, プリンタID %s）を %s 回失敗したため中止しました: %s",
+                          job["id"], job["注文ID"], job["プリンタID"], attempts, exc)
+        else:
+            logging.warning("[print-queue] ジョブ %s（注文ID %s, プリンタID %s）失敗 %s 回目、%s 秒後に再試行: %s",
+                            job["id"], job["注文ID"], job["プリンタID"], attempts, delay, exc)
+
+
+def _get_print_worker():
+    """プロセス内の印刷ワーカーを返す（共有DBモード以外は None、fork 後は作り直す）"""
+    global _print_worker
+    eng = _shared_engine_or_none()
+    if eng is None:
+        return None
+    worker = _print_worker
+    if worker is not None and worker.pid == os.getpid():
+        return worker
+    with _print_worker_lock:
+        if _print_worker is None or _print_worker.pid != os.getpid():
+            _ensure_print_job_table(eng)
+            _print_worker = _PrintWorker(current_app._get_current_object(), eng, PRINT_JOB_WORKERS)
+        return _print_worker
+
+
+def _start_print_worker_on_startup(state):
+    """
+    再起動後も未処理の印刷ジョブを再開できるよう、アプリ登録時に一度だけワーカーを起動する。
+    失敗してもアプリの起動は止めない（次の enqueue_print_job で改めて起動を試みる）。
+    """
+    try:
+        with state.app.app_context():
+            _get_print_worker()
+    except Exception:
+        state.app.logger.exception("[print-queue] ワーカーの起動に失敗しました")
+
+
+bp.record_once(_start_print_worker_on_startup)
+
+
+def enqueue_print_job(order_id: int, item_ids: list = None) -> bool:
+    """
+    注文の印刷を印刷キューへ登録する（item_ids 省略時は取消以外の全明細）。
+    同じ注文・明細の組み合わせが処理待ち・処理中なら何もしない（完了後の再登録は再印刷になる）。
+    新規登録できたら True。
+    """
+    worker = _get_print_worker()
+    if worker is None:
+        raise RuntimeError("print queue requires MULTI_TENANT_MODE=shared")
+    with worker.engine.begin() as conn:
+        head = conn.execute(text('SELECT tenant_id, "店舗ID" FROM "T_注文" WHERE id = :id'),
+                            {"id": order_id}).first()
+        if head is None:
+            current_app.logger.warning(f"注文ヘッダーが見つかりませんでした: {order_id}")
+            return False
+        if item_ids is None:
+            item_ids = conn.execute(text(
+                'SELECT id FROM "T_注文明細" WHERE "注文ID" = :id AND "状態" <> :cancel'),
+                {"id": order_id, "cancel": "取消"}).scalars().all()
+        if not item_ids:
+            return False
+        created = _insert_print_job(conn, tenant_id=head[0], store_id=head[1], order_id=order_id,
+                                    printer_id=0, kind="order", item_key=_print_item_key(item_ids))
+    if created:
+        worker.wake()
+    return created
+
+
+# --- 非同期印刷トリガ（印刷キューへ登録して即座に戻る） ---------------------------
+def trigger_print_async(order_id: int, item_ids: list = None) -> None:
+    """
+    コミット完了後に呼び出す印刷トリガ。
+    共有DBモードでは印刷キューへ登録して即座に戻る（印刷・再試行はワーカーが行う）。
+    db-per-tenant モード、またはキュー登録に失敗した場合は従来どおりスレッドで印刷する。
+    """
+    if _shared_engine_or_none() is not None:
+        try:
+            enqueue_print_job(order_id, item_ids)
+            return
+        except Exception as e:
+            current_app.logger.error("[print] enqueue failed (order_id=%s): %s", order_id, e, exc_info=True)
+    _trigger_print_thread(order_id, item_ids)
+
+
+def _trigger_print_thread(order_id: int, item_ids: list = None) -> None:
     """
-    コミット完了後に、軽量スレッドで印刷処理を走らせるヘルパ。
+    軽量スレッドで印刷処理を走らせる（印刷キューを使えない場合の経路）。
     スレッド内で app_context / request_context を明示的に張る。
     """
 
@@ -2958,8 +3394,8 @@ def trigger_print_async(order_id: int) -> None:
     def _run(oid: int) -> None:
         try:
             # アプリコンテキスト → ダミーのリクエストコンテキストを張る
-            with current_app.app_context():
-                with current_app.test_request_context("/__print_async__"):
+            with app.app_context():
+                with app.test_request_context("/__print_async__"):
                     # マルチテナントのフィルタが g / session を見る想定に合わせて注入
                     if tenant_id is not None:
                         g.tenant_id = tenant_id
@@ -2968,10 +3404,10 @@ def trigger_print_async(order_id: int) -> None:
                         session["store_id"] = store_id
 
                     # 既存の同期版をそのまま呼ぶ（内部で SessionLocal を開閉する実装）
-                    trigger_print_job(oid)
+                    trigger_print_job(oid, item_ids=item_ids)
 
         except Exception as e:
-            current_app.logger.error("[print] async failed: %s", e, exc_info=True)
+            app.logger.error("[print] async failed: %s", e, exc_info=True)
 
     threading.Thread(target=_run, args=(order_id,), daemon=True).start()
 
@@ -4190,16 +4626,11 @@ def sys_tenant_purge(tid):
             return redirect(url_for("pos_app.sys_tenants"))
 
         # TenantScoped を継承しているモデルを列挙して DELETE
-        from sqlalchemy.orm import with_loader_criteria
         deleted_total = 0
-        for mapper in list(Base.registry.mappers):
+        for mapper in tenant_scoped_mappers():
             cls = mapper.class_
-            try:
-                if issubclass(cls, TenantScoped):
-                    deleted = s.query(cls).filter(cls.tenant_id == tid).delete(synchronize_session=False)
-                    deleted_total += int(deleted or 0)
-            except TypeError:
-                pass
+            deleted = s.query(cls).filter(cls.tenant_id == tid).delete(synchronize_session=False)
+            deleted_total += int(deleted or 0)
 
         # 最後に M_テナント 自体を削除
         s.delete(t)
@@ -7274,24 +7705,26 @@ def floor():
 def floor_changed():
     """
     クライアントから ?since=（前回受け取った version, int）を受け取り、
-    サーバ側の _floor_version が新しければ changed=True を返す。
+    現店舗の版数が新しければ changed=True を返す。
+    版数は全ワーカー共通のため、どのワーカーが応答しても同じ値になる。
     """
-    global _floor_version
+    from app.services.change_bus import get_change_bus
     try:
         since = int(request.args.get("since", "0"))
     except Exception:
         since = 0
-    changed = (_floor_version > since)
-    return jsonify(changed=changed, version=_floor_version)
+    version = get_change_bus().version(_floor_channel(current_store_id()))
+    return jsonify(changed=(version > since), version=version)
 
 
 # --- フロアイベント（SSE: Server-Sent Events 配信） ---------------------------
 @bp.get("/events/floor")
 def events_floor():
-    q = queue.Queue(maxsize=8)
-    with _floor_lock:
-        _floor_waiters.append(q)
-        ver = _floor_version  # 接続直後に一度流す
+    from app.services.change_bus import get_change_bus
+    bus = get_change_bus()
+    channel = _floor_channel(current_store_id())
+    q = bus.subscribe(channel)
+    ver = bus.version(channel)  # 接続直後に一度流す
 
     def gen():
         try:
@@ -7307,9 +7740,7 @@ def events_floor():
                     # タイムアウト時はハートビート（コメント）を送信
                     yield ": heartbeat\n\n"
         finally:
-            with _floor_lock:
-                if q in _floor_waiters:
-                    _floor_waiters.remove(q)
+            bus.unsubscribe(channel, q)
 
     # 重要: text/event-stream を返す
     return Response(stream_with_context(gen()), mimetype="text/event-stream")
@@ -7727,6 +8158,149 @@ def kds():
         SessionLocal.remove()
 
 
+# -----------------------------------------------------------------------------
+# KDS 変更ログ（差分ポーリング用）
+#   注文/明細/進捗が変わった「注文ID」を店舗ごとに T_KDS変更ログ へ記録する。
+#   - ORM 経由の OrderItem / OrderHeader 変更 … after_flush で収集
+#   - text() による T_明細進捗 の INSERT/UPDATE … do_orm_execute で item_id を収集
+#   収集分はコミット直前に同じトランザクションで書き込む（ロールバック時は残らない）。
+# -----------------------------------------------------------------------------
+KDS_CHANGELOG_RETENTION_HOURS = int(os.getenv("KDS_CHANGELOG_RETENTION_HOURS", "12"))
+KDS_DELTA_MAX_ORDERS = 200  # これを超える差分はフル応答に切り替える
+KDS_DELTA_OVERLAP_SEC = 10  # コミット順とID順のずれを吸収するため、直近分は毎回含め直す
+
+_kds_changelog_ready = set()  # テーブル作成済みのバインド URL
+
+
+def _ensure_kds_changelog(s):
+    key = str(s.get_bind().url)
+    if key in _kds_changelog_ready:
+        return
+    dialect = s.get_bind().dialect.name
+    id_col = "id INTEGER PRIMARY KEY AUTOINCREMENT" if dialect == "sqlite" else "id BIGSERIAL PRIMARY KEY"
+    s.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS "T_KDS変更ログ" (
+            {id_col},
+            "店舗ID" INTEGER NOT NULL,
+            "注文ID" INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )"""))
+    s.execute(text(
+        'CREATE INDEX IF NOT EXISTS idx_kds_changelog_store ON "T_KDS変更ログ"("店舗ID", id)'
+    ))
+    _kds_changelog_ready.add(key)
+
+
+@event.listens_for(Session, "after_flush")
+def _kds_collect_orm_changes(session_obj, flush_context):
+    pairs = None
+    for obj in list(session_obj.new) + list(session_obj.dirty) + list(session_obj.deleted):
+        if isinstance(obj, OrderItem):
+            sid, oid = getattr(obj, "store_id", None), getattr(obj, "order_id", None)
+        elif isinstance(obj, OrderHeader):
+            sid, oid = getattr(obj, "store_id", None), getattr(obj, "id", None)
+        else:
+            continue
+        if sid and oid:
+            if pairs is None:
+                pairs = session_obj.info.setdefault("_kds_changed_orders", set())
+            pairs.add((int(sid), int(oid)))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _kds_collect_progress_writes(execute_state):
+    if execute_state.is_select:
+        return
+    stmt = execute_state.statement
+    sql = getattr(stmt, "text", None)
+    if not isinstance(sql, str) or '"T_明細進捗"' not in sql:
+        return
+    if not sql.lstrip().upper().startswith(("INSERT", "UPDATE")):
+        return
+    params = execute_state.parameters
+    for p in (params if isinstance(params, (list, tuple)) else [params]):
+        if not isinstance(p, dict):
+            continue
+        item_id = p.get("id", p.get("item_id"))
+        if item_id is not None:
+            execute_state.session.info.setdefault("_kds_changed_items", set()).add(int(item_id))
+
+
+@event.listens_for(Session, "before_commit")
+def _kds_write_changelog(session_obj):
+    if session_obj.new or session_obj.dirty or session_obj.deleted:
+        session_obj.flush()  # コミット時フラッシュ分の変更もここで収集しておく
+    info = session_obj.info
+    orders = info.pop("_kds_changed_orders", set())
+    items = info.pop("_kds_changed_items", set())
+    if not (orders or items):
+        return
+    try:
+        # セーブポイント内で書く。失敗してもロールバックはここまでで、本来の更新は生きたまま
+        with session_obj.begin_nested():
+            _ensure_kds_changelog(session_obj)
+            ts = _now_iso()
+            if orders:
+                session_obj.execute(
+                    text('INSERT INTO "T_KDS変更ログ"("店舗ID", "注文ID", created_at) VALUES (:sid, :oid, :ts)'),
+                    [{"sid": sid, "oid": oid, "ts": ts} for sid, oid in sorted(orders)],
+                )
+            if items:
+                in_ids = ",".join(str(int(i)) for i in sorted(items))
+                session_obj.execute(text(f"""
+                    INSERT INTO "T_KDS変更ログ"("店舗ID", "注文ID", created_at)
+                    SELECT DISTINCT "店舗ID", "注文ID", :ts FROM "T_注文明細"
+                     WHERE id IN ({in_ids}) AND "店舗ID" IS NOT NULL
+                """), {"ts": ts})
+    except Exception as e:
+        # 変更ログは補助情報。書けなくても本来の更新は通す（KDS はフル取得で整合する）
+        logging.getLogger(__name__).warning("[KDS] changelog write failed: %s", e)
+
+
+def _kds_changed_orders_since(s, sid: int, since: int):
+    """
+    since より後に変わった注文IDの集合と新しいカーソルを返す。
+    差分で追えない（ログが削除済み・件数過多）ときは (None, cursor)。
+    """
+    _ensure_kds_changelog(s)
+    oldest = s.execute(text('SELECT MIN(id) FROM "T_KDS変更ログ"')).scalar()
+    # 空（全件削除済み）なら since 以降のログが消えたかどうか判断できないのでフル応答にする
+    if oldest is None or since + 1 < int(oldest):
+        return None, _kds_cursor(s)
+    recent = (datetime.utcnow() - timedelta(seconds=KDS_DELTA_OVERLAP_SEC)).strftime("%Y-%m-%d %H:%M:%S")
+    rows = s.execute(text("""
+        SELECT id, "注文ID" FROM "T_KDS変更ログ"
+         WHERE "店舗ID" = :sid AND (id > :since OR created_at >= :recent)
+         ORDER BY id LIMIT :lim
+    """), {"sid": sid, "since": since, "recent": recent, "lim": KDS_DELTA_MAX_ORDERS * 4 + 1}).all()
+    if not rows:
+        return set(), since
+    if len(rows) > KDS_DELTA_MAX_ORDERS * 4:
+        return None, _kds_cursor(s)
+    orders = {int(r[1]) for r in rows}
+    if len(orders) > KDS_DELTA_MAX_ORDERS:
+        return None, _kds_cursor(s)
+    return orders, max(since, max(int(r[0]) for r in rows))
+
+
+def _kds_cursor(s) -> int:
+    """現在のログ末尾 ID（フル応答時のカーソル）"""
+    _ensure_kds_changelog(s)
+    return int(s.execute(text('SELECT COALESCE(MAX(id), 0) FROM "T_KDS変更ログ"')).scalar() or 0)
+
+
+def _kds_prune_changelog(s):
+    """
+    保持期間を過ぎたログを削除（フル応答時にときどき実行）。
+    専用のセッションでコミットし、呼び出し元のセッションには触れない。
+    """
+    cutoff = (datetime.utcnow() - timedelta(hours=KDS_CHANGELOG_RETENTION_HOURS)).strftime("%Y-%m-%d %H:%M:%S")
+    with Session(bind=s.get_bind()) as w:
+        _ensure_kds_changelog(w)
+        w.execute(text('DELETE FROM "T_KDS変更ログ" WHERE created_at < :c'), {"c": cutoff})
+        w.commit()
+
+
 # --- KDS API：アイテム一覧（カテゴリ絞り込み対応） -----------------------------
 @bp.route("/api/kds/items")
 @require_any
@@ -7735,6 +8309,14 @@ def kds_api_get_items():
     KDS 表示用 API（進捗4カラム方式）
     - ?cat_ids=1,2,3 でカテゴリ絞り込み
     - ?debug=1        で詳細デバッグ情報を JSON + サーバーログに出力
+    - ?since=0        でフル応答 + cursor を返す
+    - ?since=<cursor> で差分応答（前回以降に変わった注文のテーブル分だけ）
+        mode="delta", cursor=次回用カーソル,
+        items=対象テーブルの現在の表示アイテム（id で上書き）,
+        orders=変化した注文ID（この注文のアイテムで items に無いものは削除）,
+        removed=orders のうち非表示になったアイテムID（墓標）
+      変化が無ければ items/orders/removed は空で、明細への JOIN は行わない。
+      差分で追えないときは mode="full" で全件を返す（クライアントは置き換える）。
     """
     s = SessionLocal()
     try:
@@ -7749,6 +8331,38 @@ def kds_api_get_items():
         if DEBUG:
             current_current_app.logger.debug("[KDS] sid=%s raw_cat_ids=%r -> cat_ids=%r", sid, raw, cat_ids)
 
+        # ★ 差分モード（T_KDS変更ログのカーソル）
+        cursor = None
+        delta_orders = None
+        since_raw = request.args.get("since")
+        if since_raw not in (None, ""):
+            try:
+                since = max(0, int(since_raw))
+            except ValueError:
+                since = 0
+            if since > 0:
+                delta_orders, cursor = _kds_changed_orders_since(s, sid, since)
+                if delta_orders is not None and not delta_orders:
+                    return jsonify(ok=True, mode="delta", cursor=cursor, items=[], orders=[], removed=[])
+            else:
+                if random.random() < 0.02:
+                    _kds_prune_changelog(s)
+                cursor = _kds_cursor(s)
+
+        def _respond(items, **extra):
+            if delta_orders:
+                order_list = sorted(delta_orders)
+                visible = {it["id"] for it in items}
+                removed = [
+                    r[0] for r in s.query(OrderItem.id).filter(OrderItem.order_id.in_(order_list)).all()
+                    if r[0] not in visible
+                ]
+                return jsonify(ok=True, mode="delta", cursor=cursor, items=items,
+                               orders=order_list, removed=removed, **extra)
+            if cursor is not None:
+                return jsonify(ok=True, mode="full", cursor=cursor, items=items, **extra)
+            return jsonify(ok=True, items=items, **extra)
+
         # ベース抽出（元行のみ：qty>0。明細.statusは見ない）
         # ★ KDS判定グループを取得するためにカテゴリ情報をJOIN
         q = (
@@ -7771,6 +8385,16 @@ def kds_api_get_items():
             .filter(OrderItem.qty > 0)
         )
 
+        # 差分モード：変化した注文のテーブルだけを対象にする
+        # （「新規/追加」の判定がテーブル単位のため、テーブル内は全件作り直す）
+        if delta_orders:
+            delta_tables = [
+                r[0] for r in s.query(OrderHeader.table_id)
+                               .filter(OrderHeader.id.in_(sorted(delta_orders)))
+                               .distinct().all()
+            ]
+            q = q.filter(OrderHeader.table_id.in_(delta_tables))
+
         # カテゴリ絞り込み
         menu_ids = None
         if cat_ids:
@@ -7786,10 +8410,10 @@ def kds_api_get_items():
                                          len(menu_ids or []), (menu_ids[:10] if menu_ids else []))
             if not menu_ids:
                 if DEBUG:
-                    return jsonify(ok=True, items=[], debug={
+                    return _respond([], debug={
                         "sid": sid, "cat_ids": cat_ids, "menu_ids": [], "reason": "no menus for selected categories"
                     })
-                return jsonify(ok=True, items=[])
+                return _respond([])
 
             q = q.filter(OrderItem.menu_id.in_(menu_ids))
 
@@ -7800,11 +8424,11 @@ def kds_api_get_items():
 
         if not rows:
             if DEBUG:
-                return jsonify(ok=True, items=[], debug={
+                return _respond([], debug={
                     "sid": sid, "cat_ids": cat_ids, "menu_ids": menu_ids,
                     "rows": 0, "reason": "no base rows"
                 })
-            return jsonify(ok=True, items=[])
+            return _respond([])
 
         # 進捗取得（分割しつつ）
         def fetch_progress_for_ids(id_list):
@@ -8105,9 +8729,9 @@ def kds_api_get_items():
                 "returned": len(items),
             }
             current_current_app.logger.debug("[KDS] debug=%r", dbg)
-            return jsonify(ok=True, items=items, debug=dbg)
+            return _respond(items, debug=dbg)
 
-        return jsonify(ok=True, items=items)
+        return _respond(items)
 
     except Exception as e:
         current_current_app.logger.exception("KDS API error: %s", e)
@@ -12511,6 +13135,7 @@ def admin_printers_generate_api_key():
         api_key = secrets.token_urlsafe(32)
         store.printer_server_api_key = api_key
         s.commit()
+        invalidate_printer_api_key(sid)
         
         flash(f"APIキーを生成しました", "success")
         return redirect(url_for("pos_app.admin_printers"))
@@ -12544,6 +13169,7 @@ def admin_printers_regenerate_api_key():
         api_key = secrets.token_urlsafe(32)
         store.printer_server_api_key = api_key
         s.commit()
+        invalidate_printer_api_key(sid)
         
         flash(f"APIキーを再生成しました", "success")
         return redirect(url_for("pos_app.admin_printers"))
@@ -14032,7 +14658,8 @@ def api_order():
                          order.id, order.subtotal, order.tax, order.total)
 
         s.commit()
-        mark_floor_changed()
+        # QR 注文のセッションには store_id が無いため、テーブルの店舗へ通知する
+        mark_floor_changed(store_id)
 
         # 印刷処理（印刷ルールに基づいてKDS印刷を実行）
         try:
@@ -16096,249 +16723,532 @@ def sales_report():
 
 
 
-# ---------------------------------------------------------------------
-# API: 日別売上
-# ---------------------------------------------------------------------
-# --- API：日別売上（/api/sales/daily） -------------------------------------------
-@bp.route("/api/sales/daily")
-@require_store_admin
-def api_sales_daily():
-    from collections import defaultdict
-    from datetime import datetime
-    s = SessionLocal()
-    try:
-        sid = current_store_id()
-        start, end = _range_from_params("start_date", "end_date", default_days=30)
-        end_dt = _end_of_day(end)
+# =============================================================================
+# 売上集計テーブル（T_売上集計）
+#   /api/sales/* と CSV エクスポートは、伝票・明細を毎回読み込む代わりに
+#   店舗×日（×時 / メニュー / 支払方法）単位の集計行を読む。
+#   - 伝票・明細・支払記録・人数が変わったコミットでは、同じトランザクションで
+#     T_売上集計_再計算 に (店舗, 日) を記録するだけにする（会計処理側の負荷は最小）
+#   - 読み出し時に、対象期間のうち「再計算待ち」と「未集計」の日だけを作り直す
+#   - 全期間の作り直し（バックフィル）は batch_sales_rollup.py
+#   種別（kind）:
+#     'sales'   … 売上日（過去日付モードの売上計上日を優先、なければ会計日）ごと。日別 API 用。
+#                  未集計の判定に使うため、伝票が無い日も 1 行作る
+#     'order'   … 会計日×時（hour）ごと。会計済の件数・伝票金額・明細から再計算した金額
+#     'menu'    … 会計日×メニューごと。商品別 API（取消除外）と商品別 CSV（素の数量×単価）
+#     'payment' … 支払日×支払方法ごと
+# =============================================================================
+_SALES_ROLLUP_MEASURES = (
+    "cnt", "guests", "subtotal", "tax", "total",
+    "hdr_subtotal", "hdr_tax", "hdr_total",
+    "qty", "unit_sum", "unit_incl_sum", "unit_cnt",
+    "raw_qty", "raw_sales", "raw_unit_sum", "raw_unit_cnt",
+)
+_SALES_CANCEL_WORDS_JA = ("取消", "ｷｬﾝｾﾙ", "キャンセル", "削除")
+_SALES_CANCEL_WORDS_EN = ("cancel", "void", "voided")
+_SALES_SETTLED_STATUSES = ("会計済", "closed", "paid")
 
-        # 除外ステータス（統合済は売上・件数に載せない）
-        EXCLUDED_STATUSES = {"統合済", "integrated", "merged"}
+_sales_rollup_ready = set()  # テーブル作成済みのバインド URL
 
-        # ---- 期間内の会計済み伝票を取得（closed_atベース）
-        q = (
-            s.query(OrderHeader)
-             .filter(
-                 OrderHeader.closed_at.isnot(None),
-                 OrderHeader.closed_at >= start,
-                 OrderHeader.closed_at <= end_dt
-             )
-        )
-        if hasattr(OrderHeader, "store_id") and sid is not None:
-            q = q.filter(OrderHeader.store_id == sid)
-        if hasattr(OrderHeader, "status"):
-            q = q.filter(OrderHeader.status == "会計済")
-            q = q.filter(~OrderHeader.status.in_(list(EXCLUDED_STATUSES)))
 
-        orders = q.all()
+def _ensure_sales_rollup_tables(s):
+    key = str(s.get_bind().url)
+    if key in _sales_rollup_ready:
+        return
+    dialect = s.get_bind().dialect.name
+    id_col = "id INTEGER PRIMARY KEY AUTOINCREMENT" if dialect == "sqlite" else "id BIGSERIAL PRIMARY KEY"
+    measures = ",\n            ".join(f"{m} BIGINT NOT NULL DEFAULT 0" for m in _SALES_ROLLUP_MEASURES)
+    s.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS "T_売上集計" (
+            {id_col},
+            tenant_id INTEGER,
+            "店舗ID" INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            hour INTEGER NOT NULL DEFAULT -1,
+            kind TEXT NOT NULL,
+            key_id INTEGER NOT NULL DEFAULT 0,
+            {measures},
+            UNIQUE ("店舗ID", day, hour, kind, key_id)
+        )"""))
+    s.execute(text(
+        'CREATE INDEX IF NOT EXISTS idx_sales_rollup_kind ON "T_売上集計"(kind, "店舗ID", day)'
+    ))
+    s.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS "T_売上集計_再計算" (
+            {id_col},
+            "店舗ID" INTEGER NOT NULL,
+            day TEXT NOT NULL
+        )"""))
+    s.execute(text(
+        'CREATE INDEX IF NOT EXISTS idx_sales_rollup_dirty ON "T_売上集計_再計算"("店舗ID", day)'
+    ))
+    _sales_rollup_ready.add(key)
+
+
+def _sales_day(value) -> str:
+    """日時（文字列 / datetime）の先頭 10 文字（YYYY-MM-DD）"""
+    return str(value)[:10] if value else ""
+
+
+def _sales_id_list(ids) -> str:
+    return ",".join(str(int(i)) for i in sorted(ids))
+
 
-        def _ival(x):
+def _sales_chunks(seq, size=1000):
+    seq = list(seq)
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+# --- 変更の検知：コミット時に再計算待ちの (店舗, 日) を記録 --------------------------
+def _sales_guest_models() -> tuple:
+    return tuple(m for m in (globals().get("T_お客様詳細"), globals().get("T_お客様詳細履歴")) if m is not None)
+
+
+def _sales_attr_values(obj, attr: str) -> list:
+    """属性の現在値と、このフラッシュで置き換えられた旧値"""
+    values = [getattr(obj, attr, None)]
+    try:
+        values.extend(inspect(obj).attrs[attr].history.deleted or ())
+    except Exception:
+        pass
+    return [v for v in values if v]
+
+
+@event.listens_for(Session, "after_flush")
+def _sales_collect_changes(session_obj, flush_context):
+    orders = days = None
+    guest_models = _sales_guest_models()
+    for obj in list(session_obj.new) + list(session_obj.dirty) + list(session_obj.deleted):
+        oid = None
+        sid = getattr(obj, "store_id", None)
+        dated = ()
+        if isinstance(obj, OrderHeader):
+            oid = getattr(obj, "id", None)
+            dated = _sales_attr_values(obj, "closed_at")
+        elif isinstance(obj, OrderItem):
+            oid = getattr(obj, "order_id", None)
+            dated = _sales_attr_values(obj, "scheduled_date")
+        elif isinstance(obj, PaymentRecord):
+            dated = _sales_attr_values(obj, "paid_at")
+        elif guest_models and isinstance(obj, guest_models):
+            oid = getattr(obj, "order_id", None)
+        else:
+            continue
+        if oid:
+            if orders is None:
+                orders = session_obj.info.setdefault("_sales_dirty_orders", set())
+            orders.add(int(oid))
+        if sid and dated:
+            if days is None:
+                days = session_obj.info.setdefault("_sales_dirty_days", set())
+            for v in dated:
+                days.add((int(sid), _sales_day(v)))
+
+
+@event.listens_for(Session, "before_commit")
+def _sales_write_dirty_marks(session_obj):
+    if session_obj.new or session_obj.dirty or session_obj.deleted:
+        session_obj.flush()  # コミット時フラッシュ分の変更もここで収集しておく
+    info = session_obj.info
+    if not (info.get("_sales_dirty_orders") or info.get("_sales_dirty_days")):
+        return
+    orders = info.pop("_sales_dirty_orders", set())
+    days = info.pop("_sales_dirty_days", set())
+    try:
+        # セーブポイント内で書く。失敗してもロールバックはここまでで、会計のトランザクションは生きたまま
+        with session_obj.begin_nested():
+            _ensure_sales_rollup_tables(session_obj)
+            for chunk in _sales_chunks(orders):
+                in_ids = _sales_id_list(chunk)
+                for sid, closed_at in session_obj.execute(text(
+                        f'SELECT "店舗ID", "会計日時" FROM "T_注文" WHERE id IN ({in_ids}) AND "会計日時" IS NOT NULL')):
+                    days.add((int(sid), _sales_day(closed_at)))
+                for sid, scheduled in session_obj.execute(text(f"""
+                        SELECT DISTINCT "店舗ID", "売上計上日" FROM "T_注文明細"
+                         WHERE "注文ID" IN ({in_ids}) AND "売上計上日" IS NOT NULL""")):
+                    days.add((int(sid), _sales_day(scheduled)))
+            days = {(sid, d) for sid, d in days if sid and d}
+            if days:
+                session_obj.execute(
+                    text('INSERT INTO "T_売上集計_再計算"("店舗ID", day) VALUES (:sid, :day)'),
+                    [{"sid": sid, "day": d} for sid, d in sorted(days)],
+                )
+    except Exception as e:
+        # 記録できなくても会計処理は通す（集計は次回のバックフィルで整合する）
+        logging.getLogger(__name__).warning("[sales-rollup] dirty mark write failed: %s", e)
+
+
+# --- 集計行の作成 -------------------------------------------------------------
+def _sales_guest_counts(s, order_ids) -> dict:
+    """
+    伝票ごとの来客者数（1 伝票 1 レコード）。
+    履歴の最新 → 現在値の最新 → 1 人 の順に決める（/api/sales/daily の従来ロジックと同じ）。
+    """
+    GHist = globals().get("T_お客様詳細履歴")
+    GCur = globals().get("T_お客様詳細")
+
+    def _ival(x):
+        try:
+            return int(x or 0)
+        except Exception:
             try:
-                return int(x or 0)
+                return int(float(x or 0))
             except Exception:
+                return 0
+
+    def _best_key(r):
+        for nm in ("created_at", "updated_at"):
+            if hasattr(r, nm) and getattr(r, nm, None):
+                return str(getattr(r, nm))
+        return f"{getattr(r, 'id', 0):020d}"
+
+    def _total(r):
+        for nm in ("合計人数", "total", "人数"):
+            if hasattr(r, nm):
+                total = _ival(getattr(r, nm))
+                break
+        else:
+            total = 0
+        if total <= 0:
+            for nm in ("大人男性", "大人女性", "子ども男", "子ども女"):
+                if hasattr(r, nm):
+                    total += _ival(getattr(r, nm))
+        return total if total > 0 else 1
+
+    counts = {}
+    for model in (GHist, GCur):
+        remaining = [oid for oid in order_ids if oid not in counts]
+        if model is None or not remaining:
+            continue
+        latest = {}
+        for chunk in _sales_chunks(remaining):
+            for r in s.query(model).filter(model.order_id.in_(chunk)).all():
+                if r.order_id not in latest or _best_key(r) > _best_key(latest[r.order_id]):
+                    latest[r.order_id] = r
+        for oid, r in latest.items():
+            counts[oid] = _total(r)
+    return {oid: counts.get(oid, 1) for oid in order_ids}
+
+
+def _sales_rollup_compute(s, store_id: int, day_from: str, day_to: str) -> dict:
+    """店舗の [day_from, day_to] の集計行を伝票・明細・支払記録から作る。キー: (日, 時, 種別, キーID)"""
+    rows = defaultdict(lambda: dict.fromkeys(_SALES_ROLLUP_MEASURES, 0))
+
+    def in_range(day):
+        return bool(day) and day_from <= day <= day_to
+
+    # 会計日が期間内の伝票 + 売上計上日（過去日付モード）が期間内の明細を持つ伝票
+    orders = {o.id: o for o in s.query(OrderHeader).filter(
+        OrderHeader.store_id == store_id,
+        OrderHeader.closed_at.isnot(None),
+        OrderHeader.closed_at >= day_from,
+        OrderHeader.closed_at <= _end_of_day(day_to),
+    ).all()}
+    d_from = datetime.strptime(day_from, "%Y-%m-%d") - timedelta(days=1)
+    d_to = datetime.strptime(day_to, "%Y-%m-%d") + timedelta(days=2)
+    scheduled_ids = [oid for (oid,) in s.query(OrderItem.order_id).filter(
+        OrderItem.store_id == store_id,
+        OrderItem.scheduled_date.isnot(None),
+        OrderItem.scheduled_date >= d_from,
+        OrderItem.scheduled_date < d_to,
+    ).distinct().all() if oid not in orders]
+    for chunk in _sales_chunks(scheduled_ids):
+        for o in s.query(OrderHeader).filter(OrderHeader.id.in_(chunk), OrderHeader.closed_at.isnot(None)).all():
+            orders[o.id] = o
+
+    items_by_order = defaultdict(list)
+    for chunk in _sales_chunks(orders):
+        q = (
+            s.query(OrderItem, Menu.tax_rate)
+             .outerjoin(Menu, Menu.id == OrderItem.menu_id)
+             .filter(OrderItem.order_id.in_(chunk))
+             .order_by(OrderItem.id)
+        )
+        for it, menu_rate in q.all():
+            items_by_order[it.order_id].append((it, menu_rate))
+
+    sales_orders = {}  # order_id -> 売上日
+    for oid, o in orders.items():
+        pairs = items_by_order.get(oid, [])
+        items = [it for it, _ in pairs]
+        status = getattr(o, "status", None)
+        closed_day = _sales_day(o.closed_at)
+
+        if status == "会計済":
+            totals = _calculate_order_totals(items)
+            if in_range(closed_day):
                 try:
-                    return int(float(x or 0))
+                    hh = int(str(o.closed_at)[11:13])
                 except Exception:
-                    return 0
+                    hh = 0
+                r = rows[(closed_day, hh, "order", 0)]
+                r["cnt"] += 1
+                r["hdr_subtotal"] += int(o.subtotal or 0)
+                r["hdr_tax"] += int(o.tax or 0)
+                r["hdr_total"] += int(o.total or 0)
+                r["subtotal"] += totals["subtotal"]
+                r["tax"] += totals["tax"]
+                r["total"] += totals["total"]
+
+            scheduled = next((it.scheduled_date for it in items if it.scheduled_date), None)
+            sales_day = _sales_day(scheduled) or closed_day or _sales_day(getattr(o, "opened_at", None))
+            if in_range(sales_day):
+                r = rows[(sales_day, -1, "sales", 0)]
+                r["cnt"] += 1
+                r["subtotal"] += totals["subtotal"]
+                r["tax"] += totals["tax"]
+                r["total"] += totals["total"]
+                sales_orders[oid] = sales_day
+
+        if not in_range(closed_day) or status not in _SALES_SETTLED_STATUSES:
+            continue
+        for it, menu_rate in pairs:
+            qty = int(it.qty or 0)
+            unit_excl = int(it.unit_price or 0)
+            r = rows[(closed_day, -1, "menu", int(it.menu_id or 0))]
+
+            # 商品別 CSV（会計済の素の数量×単価）
+            if status == "会計済":
+                r["raw_qty"] += qty
+                r["raw_sales"] += qty * unit_excl
+                r["raw_unit_sum"] += unit_excl
+                r["raw_unit_cnt"] += 1
+
+            # 商品別 API（数量0と「正数量かつ取消ラベル」は除外、負数量は相殺として集計）
+            if qty == 0:
+                continue
+            s_all = f"{it.status or ''} {it.memo or ''}"
+            is_cancel = (any(w in s_all for w in _SALES_CANCEL_WORDS_JA)
+                         or any(w in s_all.lower() for w in _SALES_CANCEL_WORDS_EN))
+            if qty > 0 and is_cancel:
+                continue
+            rate = float(it.tax_rate or menu_rate or 0.10)
+            unit_tax = math.floor(unit_excl * rate)
+            r["qty"] += qty
+            r["subtotal"] += unit_excl * qty
+            r["tax"] += unit_tax * qty
+            r["total"] += (unit_excl + unit_tax) * qty
+            r["unit_sum"] += unit_excl
+            r["unit_incl_sum"] += unit_excl + unit_tax
+            r["unit_cnt"] += 1
+
+    for oid, n in _sales_guest_counts(s, list(sales_orders)).items():
+        rows[(sales_orders[oid], -1, "sales", 0)]["guests"] += n
+
+    payments = s.query(PaymentRecord.method_id, PaymentRecord.amount, PaymentRecord.paid_at).filter(
+        PaymentRecord.store_id == store_id,
+        PaymentRecord.paid_at >= day_from,
+        PaymentRecord.paid_at <= _end_of_day(day_to),
+    ).all()
+    for method_id, amount, paid_at in payments:
+        r = rows[(_sales_day(paid_at), -1, "payment", int(method_id or 0))]
+        r["cnt"] += 1
+        r["total"] += int(amount or 0)
+
+    # 未集計判定用に、伝票が無い日にも 'sales' 行を置く
+    day = datetime.strptime(day_from, "%Y-%m-%d")
+    last = datetime.strptime(day_to, "%Y-%m-%d")
+    while day <= last:
+        rows[(day.strftime("%Y-%m-%d"), -1, "sales", 0)]
+        day += timedelta(days=1)
+    return rows
+
+
+def _sales_rollup_rebuild(s, tenant_id, store_id: int, days) -> int:
+    """店舗の指定日の集計行を作り直す（連続する日はまとめて 1 回で読む）。作成した行数を返す"""
+    _ensure_sales_rollup_tables(s)
+    ordered = sorted(set(days))
+    runs = []
+    for d in ordered:
+        if runs and (datetime.strptime(d, "%Y-%m-%d") - datetime.strptime(runs[-1][1], "%Y-%m-%d")).days == 1:
+            runs[-1][1] = d
+        else:
+            runs.append([d, d])
+
+    cols = ", ".join(_SALES_ROLLUP_MEASURES)
+    binds = ", ".join(f":{m}" for m in _SALES_ROLLUP_MEASURES)
+    insert = text(f"""
+        INSERT INTO "T_売上集計"(tenant_id, "店舗ID", day, hour, kind, key_id, {cols})
+        VALUES (:tid, :sid, :day, :hour, :kind, :key_id, {binds})""")
+    written = 0
+    for day_from, day_to in runs:
+        rows = _sales_rollup_compute(s, store_id, day_from, day_to)
+        s.execute(text('DELETE FROM "T_売上集計" WHERE "店舗ID" = :sid AND day BETWEEN :f AND :t'),
+                  {"sid": store_id, "f": day_from, "t": day_to})
+        params = [
+            {"tid": tenant_id, "sid": store_id, "day": day, "hour": hour, "kind": kind, "key_id": key_id, **m}
+            for (day, hour, kind, key_id), m in rows.items()
+            if day_from <= day <= day_to
+        ]
+        if params:
+            s.execute(insert, params)
+        written += len(params)
+    return written
+
+
+def _sales_rollup_store_ids(s, sid=None) -> list[int]:
+    """集計対象の店舗ID（店舗指定がなければ現在のテナントの全店舗）"""
+    if sid is not None:
+        return [int(sid)]
+    tid = _current_tenant_id()
+    if tid:
+        rows = s.execute(text('SELECT id FROM "M_店舗" WHERE tenant_id = :tid'), {"tid": tid}).all()
+    else:
+        rows = s.execute(text('SELECT id FROM "M_店舗"')).all()
+    return [int(r[0]) for r in rows]
+
+
+def _sales_rollup_refresh(s, store_ids, start: str, end: str):
+    """
+    期間内の再計算待ち・未集計の日を作り直す（読み出し前に呼ぶ）。
+    作り直しは専用のセッションでコミットし、呼び出し元のセッションの未コミットの変更には触れない。
+    """
+    with Session(bind=s.get_bind(), autoflush=False) as w:
+        _ensure_sales_rollup_tables(w)
+        w.commit()
+        if not store_ids:
+            return
+        in_sids = _sales_id_list(store_ids)
+        marks = w.execute(text(f"""
+            SELECT id, "店舗ID", day FROM "T_売上集計_再計算"
+             WHERE "店舗ID" IN ({in_sids}) AND day BETWEEN :f AND :t"""), {"f": start, "t": end}).all()
+        covered = set(w.execute(text(f"""
+            SELECT "店舗ID", day FROM "T_売上集計"
+             WHERE kind = 'sales' AND "店舗ID" IN ({in_sids}) AND day BETWEEN :f AND :t"""),
+            {"f": start, "t": end}).all())
+
+        all_days = []
+        day = datetime.strptime(start, "%Y-%m-%d")
+        last = datetime.strptime(min(end, _today_str()), "%Y-%m-%d")
+        while day <= last:
+            all_days.append(day.strftime("%Y-%m-%d"))
+            day += timedelta(days=1)
+
+        todo = defaultdict(set)
+        for sid in store_ids:
+            todo[sid].update(d for d in all_days if (sid, d) not in covered)
+        for _mid, sid, d in marks:
+            todo[int(sid)].add(d)
+        todo = {sid: days for sid, days in todo.items() if days}
+        if not todo and not marks:
+            return
+
+        tenants = dict(w.execute(text(f'SELECT id, tenant_id FROM "M_店舗" WHERE id IN ({in_sids})')).all())
+        try:
+            for sid, days in todo.items():
+                _sales_rollup_rebuild(w, tenants.get(sid), sid, days)
+            if marks:
+                w.execute(text(f'DELETE FROM "T_売上集計_再計算" WHERE id IN ({_sales_id_list(m[0] for m in marks)})'))
+            w.commit()
+        except IntegrityError:
+            # 同じ日を別リクエストが同時に作り直した場合。そちらの結果を使う
+            w.rollback()
+
+
+def _sales_rollup_rows(s, store_ids, start: str, end: str, kind: str) -> list:
+    """期間内の集計行（最新化してから読む）"""
+    _sales_rollup_refresh(s, store_ids, start, end)
+    if not store_ids:
+        return []
+    cols = ", ".join(_SALES_ROLLUP_MEASURES)
+    return s.execute(text(f"""
+        SELECT "店舗ID" AS store_id, day, hour, key_id, {cols}
+          FROM "T_売上集計"
+         WHERE kind = :kind AND "店舗ID" IN ({_sales_id_list(store_ids)}) AND day BETWEEN :f AND :t
+         ORDER BY day, hour, key_id"""), {"kind": kind, "f": start, "t": end}).mappings().all()
+
+
+def _sales_names(s, table: str, ids) -> dict:
+    """M_メニュー / M_支払方法 の id → 名称"""
+    ids = {int(i) for i in ids if i}
+    names = {}
+    for chunk in _sales_chunks(ids):
+        for rid, name in s.execute(text(f'SELECT id, "名称" FROM "{table}" WHERE id IN ({_sales_id_list(chunk)})')):
+            names[int(rid)] = name
+    return names
+
+
+def rebuild_sales_rollups(store_ids=None, start: str | None = None, end: str | None = None) -> dict:
+    """
+    売上集計のバックフィル（batch_sales_rollup.py から呼ぶ）。
+    store_ids 省略時は全店舗、start 省略時は各店舗の最初の伝票日から、end 省略時は今日まで。
+    """
+    s = SessionLocal()
+    try:
+        _ensure_sales_rollup_tables(s)
+        if store_ids is None:
+            rows = s.execute(text('SELECT id, tenant_id FROM "M_店舗" ORDER BY id')).all()
+        else:
+            rows = s.execute(text(
+                f'SELECT id, tenant_id FROM "M_店舗" WHERE id IN ({_sales_id_list(store_ids)}) ORDER BY id')).all()
+        end = end or _today_str()
+        summary = {"stores": 0, "days": 0, "rows": 0}
+        for sid, tid in rows:
+            first = start or _sales_day(s.execute(text(
+                'SELECT MIN("開始日時") FROM "T_注文" WHERE "店舗ID" = :sid'), {"sid": sid}).scalar())
+            if not first or first > end:
+                continue
+            # 1 か月ずつ作り直してコミット（長期間でもトランザクションを小さく保つ）
+            day = datetime.strptime(first, "%Y-%m-%d")
+            last = datetime.strptime(end, "%Y-%m-%d")
+            while day <= last:
+                chunk_end = min(day + timedelta(days=30), last)
+                days = []
+                d = day
+                while d <= chunk_end:
+                    days.append(d.strftime("%Y-%m-%d"))
+                    d += timedelta(days=1)
+                mark_ids = [r[0] for r in s.execute(text(
+                    'SELECT id FROM "T_売上集計_再計算" WHERE "店舗ID" = :sid AND day BETWEEN :f AND :t'),
+                    {"sid": sid, "f": days[0], "t": days[-1]})]
+                summary["rows"] += _sales_rollup_rebuild(s, tid, int(sid), days)
+                if mark_ids:
+                    s.execute(text(f'DELETE FROM "T_売上集計_再計算" WHERE id IN ({_sales_id_list(mark_ids)})'))
+                s.commit()
+                summary["days"] += len(days)
+                day = chunk_end + timedelta(days=1)
+            summary["stores"] += 1
+        return summary
+    except Exception:
+        s.rollback()
+        raise
+    finally:
+        s.close()
+        SessionLocal.remove()
+
+
+# ---------------------------------------------------------------------
+# API: 日別売上
+# ---------------------------------------------------------------------
+# --- API：日別売上（/api/sales/daily） -------------------------------------------
+@bp.route("/api/sales/daily")
+@require_store_admin
+def api_sales_daily():
+    s = SessionLocal()
+    try:
+        sid = current_store_id()
+        start, end = _range_from_params("start_date", "end_date", default_days=30)
+
+        # 売上日（売上計上日優先、なければ会計日）ごとの集計行（会計済・統合済除外）
+        rows = _sales_rollup_rows(s, _sales_rollup_store_ids(s, sid), start, end, "sales")
 
-        # 日別集計の土台（売上・件数）
         daily = defaultdict(lambda: {
             "order_count": 0,
             "total_sales": 0,
             "subtotal":    0,
             "tax_amount":  0,
-            "guests":      0,   # ← あとで埋める
+            "guests":      0,
         })
-
-        order_day = {}   # order_id -> 'YYYY-MM-DD'
-        order_ids = []
-        for o in orders:
-            oid = getattr(o, "id", None)
-            if oid is None:
+        for r in rows:
+            if not r["cnt"]:
                 continue
-            order_ids.append(oid)
-        
-        # 全注文の明細を取得してscheduled_dateをチェック
-        if order_ids:
-            qi_all_temp = s.query(OrderItem).filter(OrderItem.order_id.in_(order_ids)).all()
-            items_by_order_temp = defaultdict(list)
-            for it in qi_all_temp:
-                oid_temp = getattr(it, "order_id", None)
-                if oid_temp:
-                    items_by_order_temp[oid_temp].append(it)
-            
-            # 各注文の日付を決定（scheduled_date優先、なければclosed_at）
-            for o in orders:
-                oid = getattr(o, "id", None)
-                if oid is None:
-                    continue
-                    
-                # scheduled_dateをチェック
-                items_temp = items_by_order_temp.get(oid, [])
-                scheduled_date = None
-                for it in items_temp:
-                    sd = getattr(it, "scheduled_date", None)
-                    if sd:
-                        scheduled_date = sd
-                        break
-                
-                if scheduled_date:
-                    # scheduled_dateがある場合はそれを使用
-                    day = str(scheduled_date)[:10] if isinstance(scheduled_date, datetime) else str(scheduled_date)[:10]
-                else:
-                    # scheduled_dateがない場合は従来通りclosed_atを使用
-                    closed_at = getattr(o, "closed_at", None)
-                    if closed_at:
-                        day = str(closed_at)[:10] if isinstance(closed_at, datetime) else str(closed_at)[:10]
-                    else:
-                        day = ""
-                    if not day:
-                        # closed_atが無い/壊れている場合は opened_at にフォールバック
-                        opened_at = getattr(o, "opened_at", None)
-                        if opened_at:
-                            day = str(opened_at)[:10] if isinstance(opened_at, datetime) else str(opened_at)[:10]
-                        else:
-                            day = ""
-                        if not day:
-                            continue
-                
-                order_day[oid] = day
-        
-        # 全注文の明細を取得してOrderItemから再計算（取り消しを除外）
-        if order_ids:
-            qi_all = s.query(OrderItem).filter(OrderItem.order_id.in_(order_ids)).all()
-            items_by_order = defaultdict(list)
-            for it in qi_all:
-                oid = getattr(it, "order_id", None)
-                if oid:
-                    items_by_order[oid].append(it)
-            
-            # 各注文の実売上を計算して日別に集計
-            for oid in order_ids:
-                day = order_day.get(oid)
-                if not day:
-                    continue
-                items = items_by_order.get(oid, [])
-                totals = _calculate_order_totals(items)
-                
-                d = daily[day]
-                d["order_count"] += 1
-                d["total_sales"] += totals["total"]
-                d["subtotal"]    += totals["subtotal"]
-                d["tax_amount"]  += totals["tax"]
-
-        # ---- 来客者数集計（重複防止：各伝票につき1レコードのみ採用）
-        # 1) 履歴テーブルがあれば「最新」を採用
-        GHist = (globals().get("GuestDetailHistory")
-                 or globals().get("TCustomerDetailHistory")
-                 or globals().get("CustomerInfoHistory")
-                 or globals().get("VisitHistory")
-                 or globals().get("T_お客様詳細履歴"))
-
-        def _best_key(r):
-            """最新判定キー（created_at > updated_at > id）"""
-            for nm in ("created_at", "updated_at"):
-                if hasattr(r, nm) and getattr(r, nm, None):
-                    try:
-                        # 文字列/Datetime どちらでも文字列比較で安定するように
-                        return str(getattr(r, nm))
-                    except Exception:
-                        pass
-            return f"{getattr(r, 'id', 0):020d}"
-
-        used_orders = set()
-        if GHist is not None and order_ids:
-            qg = s.query(GHist).filter(getattr(GHist, "order_id").in_(order_ids))
-            if hasattr(GHist, "store_id") and sid is not None:
-                qg = qg.filter(getattr(GHist, "store_id") == sid)
-            # 期間で緩く絞る（created_at があれば）
-            if hasattr(GHist, "created_at"):
-                qg = qg.filter(getattr(GHist, "created_at") >= start,
-                               getattr(GHist, "created_at") <= end_dt)
-
-            latest = {}  # order_id -> record
-            for r in qg.all():
-                oid = getattr(r, "order_id", None)
-                if oid not in order_day:
-                    continue
-                key = _best_key(r)
-                if (oid not in latest) or (key > _best_key(latest[oid])):
-                    latest[oid] = r
-
-            for oid, r in latest.items():
-                day = order_day.get(oid)
-                if not day:
-                    continue
-                # 合計人数を優先
-                total = 0
-                for nm in ("合計人数", "total", "人数"):
-                    if hasattr(r, nm):
-                        try:
-                            total = int(getattr(r, nm) or 0)
-                            break
-                        except Exception:
-                            pass
-                # 無ければ内訳合算
-                if total <= 0:
-                    for nm in ("大人男性","adult_male","men",
-                               "大人女性","adult_female","women",
-                               "子ども男","boys","子供男",
-                               "子ども女","girls","子供女"):
-                        if hasattr(r, nm):
-                            total += _ival(getattr(r, nm))
-                # 未記録は安全側で 1 人扱い
-                if total <= 0:
-                    total = 1
-                daily[day]["guests"] += total
-                used_orders.add(oid)
-
-        # 2) 履歴が無い or 拾えなかった伝票は「現在値」から補完（同様に1件/伝票）
-        remaining = [oid for oid in order_ids if oid not in used_orders]
-        if remaining:
-            GCur = globals().get("GuestDetail") or globals().get("T_お客様詳細")
-            if GCur is not None:
-                qg2 = s.query(GCur).filter(getattr(GCur, "order_id").in_(remaining))
-                if hasattr(GCur, "store_id") and sid is not None:
-                    qg2 = qg2.filter(getattr(GCur, "store_id") == sid)
-
-                # 最新（updated_at or id）で1件/伝票を選ぶ
-                chosen = {}
-                for r in qg2.all():
-                    oid = getattr(r, "order_id", None)
-                    if oid not in order_day:
-                        continue
-                    key = _best_key(r)
-                    if (oid not in chosen) or (key > _best_key(chosen[oid])):
-                        chosen[oid] = r
-
-                for oid, r in chosen.items():
-                    day = order_day.get(oid)
-                    if not day:
-                        continue
-                    total = 0
-                    for nm in ("合計人数", "total", "人数"):
-                        if hasattr(r, nm):
-                            try:
-                                total = int(getattr(r, nm) or 0); break
-                            except Exception:
-                                pass
-                    if total <= 0:
-                        for nm in ("大人男性","adult_male","men",
-                                   "大人女性","adult_female","women",
-                                   "子ども男","boys","子供男",
-                                   "子ども女","girls","子供女"):
-                            if hasattr(r, nm):
-                                total += _ival(getattr(r, nm))
-                    if total <= 0:
-                        total = 1
-                    daily[day]["guests"] += total
-                    used_orders.add(oid)
-
-        # 3) それでも人数が入らなかった伝票は 1 人で埋める
-        for oid in order_ids:
-            if oid not in used_orders:
-                day = order_day.get(oid)
-                if day:
-                    daily[day]["guests"] += 1
+            d = daily[r["day"]]
+            d["order_count"] += int(r["cnt"])
+            d["total_sales"] += int(r["total"])
+            d["subtotal"]    += int(r["subtotal"])
+            d["tax_amount"]  += int(r["tax"])
+            d["guests"]      += int(r["guests"])
 
         # ---- 出力成形（客単価: total_sales / guests の整数割）
         out = []
@@ -16427,45 +17337,16 @@ def api_sales_monthly():
     try:
         year = str(request.args.get("year", datetime.now().year))
 
-        rows = (s.query(OrderHeader)
-                  .filter(OrderHeader.closed_at.isnot(None),
-                          (OrderHeader.closed_at >= f"{year}-01-01"),
-                          (OrderHeader.closed_at <= f"{year}-12-31 23:59:59"),
-                          OrderHeader.status == "会計済")
-                  .all())
+        # 会計日×時の集計行を月ごとに合算（金額は明細から再計算した値＝取り消し除外）
+        rows = _sales_rollup_rows(s, _sales_rollup_store_ids(s), f"{year}-01-01", f"{year}-12-31", "order")
 
-        # 注文IDを収集
-        order_ids = [getattr(o, "id", None) for o in rows if getattr(o, "id", None) is not None]
-        order_month = {}  # order_id -> 'YYYY-MM'
-        for o in rows:
-            oid = getattr(o, "id", None)
-            if oid:
-                month = (str(o.closed_at or ""))[:7]  # YYYY-MM
-                order_month[oid] = month
-        
-        # 全注文の明細を取得してOrderItemから再計算（取り消しを除外）
         monthly = defaultdict(lambda: {"order_count":0, "total_sales":0, "subtotal":0, "tax_amount":0})
-        if order_ids:
-            qi_all = s.query(OrderItem).filter(OrderItem.order_id.in_(order_ids)).all()
-            items_by_order = defaultdict(list)
-            for it in qi_all:
-                oid = getattr(it, "order_id", None)
-                if oid:
-                    items_by_order[oid].append(it)
-            
-            # 各注文の実売上を計算して月別に集計
-            for oid in order_ids:
-                month = order_month.get(oid)
-                if not month:
-                    continue
-                items = items_by_order.get(oid, [])
-                totals = _calculate_order_totals(items)
-                
-                m = monthly[month]
-                m["order_count"] += 1
-                m["total_sales"] += totals["total"]
-                m["subtotal"]    += totals["subtotal"]
-                m["tax_amount"]  += totals["tax"]
+        for r in rows:
+            m = monthly[r["day"][:7]]
+            m["order_count"] += int(r["cnt"])
+            m["total_sales"] += int(r["total"])
+            m["subtotal"]    += int(r["subtotal"])
+            m["tax_amount"]  += int(r["tax"])
 
         out = []
         for k in sorted(monthly.keys()):
@@ -16496,19 +17377,10 @@ def api_sales_products():
     - 正数量かつ取消系ラベルを含む明細は除外（会計前の取り消し）
     - 負数量（監査の相殺行）は取消ラベルでもそのままネットに反映
     - 税は「単価×税率」を floor して数量分積み上げ（内税想定）
+    集計は T_売上集計（kind='menu'）から読む。
 
-    /api/sales/products?debug=1 で詳細ログ＋レスポンスにデバッグを含める
+    /api/sales/products?debug=1 でレスポンスに集計行の件数を含める
     """
-    from collections import defaultdict
-    import math
-
-    # 入口ログ
-    try:
-        qs = request.query_string.decode("utf-8", errors="ignore")
-    except Exception:
-        qs = ""
-    current_current_app.logger.info("[/api/sales/products] ENTER q=%s", qs)
-
     # periodを安全に文字列化
     def _to_iso_safe(x):
         try:
@@ -16520,35 +17392,12 @@ def api_sales_products():
     try:
         debug_mode = str(request.args.get("debug", "0")).lower() in ("1", "true", "yes", "on")
 
-        # 期間
+        # 期間・店舗
         start, end = _range_from_params("start_date", "end_date", default_days=30)
-        end_dt = _end_of_day(end)
-
-        # 店舗
         sid = current_store_id()
 
-        # クエリ（Menu JOINでN+1回避）
-        q = (
-            s.query(OrderItem, OrderHeader, Menu)
-             .join(OrderHeader, OrderItem.order_id == OrderHeader.id)
-             .join(Menu, Menu.id == OrderItem.menu_id)
-             .filter(
-                 OrderHeader.closed_at.isnot(None),
-                 OrderHeader.closed_at >= start,
-                 OrderHeader.closed_at <= end_dt,
-             )
-        )
-        if hasattr(OrderHeader, "status"):
-            q = q.filter(OrderHeader.status.in_(["会計済", "closed", "paid"])) \
-                 .filter(~OrderHeader.status.in_(["統合済", "integrated", "merged"]))
-        if hasattr(OrderHeader, "store_id") and sid is not None:
-            q = q.filter(OrderHeader.store_id == sid)
-
-        rows = q.all()
-
-        if debug_mode:
-            current_current_app.logger.info("[/api/sales/products] rows=%s sid=%s period=%s..%s",
-                                    len(rows), sid, start, end_dt)
+        rows = _sales_rollup_rows(s, _sales_rollup_store_ids(s, sid), start, end, "menu")
+        names = _sales_names(s, "M_メニュー", (r["key_id"] for r in rows))
 
         agg = defaultdict(lambda: {
             "total_qty": 0,
@@ -16559,112 +17408,18 @@ def api_sales_products():
             "sum_unit_price_incl": 0,
             "count_unit_price": 0,
         })
-
-        cancel_words_ja = ("取消", "ｷｬﾝｾﾙ", "キャンセル", "削除")
-        cancel_words_en = ("cancel", "void", "voided")
-
-        dbg = {
-            "seen": 0,
-            "included": 0,
-            "excluded_cancel_posqty": 0,
-            "skipped_zero_qty": 0,
-            "neg_qty_kept": 0,
-            "no_cancel_but_posqty_kept": 0,
-            "examples": []
-        }
-        EXAMPLE_LIMIT = 20
-
-        for it, oh, m in rows:
-            dbg["seen"] += 1
-
-            qty = int(getattr(it, "qty", 0) or getattr(it, "数量", 0) or 0)
-            if qty == 0:
-                dbg["skipped_zero_qty"] += 1
-                if debug_mode and len(dbg["examples"]) < EXAMPLE_LIMIT:
-                    dbg["examples"].append({
-                        "decision": "skip_zero_qty",
-                        "order_id": getattr(it, "order_id", None),
-                        "item_id": getattr(it, "id", None),
-                        "menu_id": getattr(it, "menu_id", None),
-                        "menu_name": getattr(m, "name", None),
-                        "qty": qty,
-                        "status": getattr(it, "status", None) or getattr(it, "状態", None),
-                        "memo": getattr(it, "memo", None) or getattr(it, "メモ", None),
-                    })
-                continue
-
-            st  = (getattr(it, "status", None) or getattr(it, "状態", None) or "")
-            mm  = (getattr(it, "memo",   None) or getattr(it, "メモ",   None) or "")
-            s_all = f"{st} {mm}"
-            is_cancel = (any(w in s_all for w in cancel_words_ja)
-                         or any(w in s_all.lower() for w in cancel_words_en))
-
-            if qty > 0 and is_cancel:
-                dbg["excluded_cancel_posqty"] += 1
-                if debug_mode and len(dbg["examples"]) < EXAMPLE_LIMIT:
-                    dbg["examples"].append({
-                        "decision": "excluded_cancel_posqty",
-                        "order_id": getattr(it, "order_id", None),
-                        "item_id": getattr(it, "id", None),
-                        "menu_id": getattr(it, "menu_id", None),
-                        "menu_name": getattr(m, "name", None),
-                        "qty": qty,
-                        "status": st, "memo": mm,
-                    })
-                if debug_mode:
-                    current_current_app.logger.info(
-                        "[sales-products] EXCLUDE (cancel&pos) oid=%s iid=%s menu=%s qty=%s status='%s' memo='%s'",
-                        getattr(it, "order_id", None), getattr(it, "id", None),
-                        getattr(m, "name", None), qty, st, mm
-                    )
-                continue
-
-            unit_excl = int(
-                getattr(it, "unit_price", None)
-                or getattr(it, "税抜単価", None)
-                or getattr(it, "price_excl", None)
-                or getattr(it, "price", None)
-                or 0
-            )
-            rate = float(
-                getattr(it, "tax_rate", None)
-                or getattr(getattr(it, "menu", None), "tax_rate", None)
-                or getattr(m, "tax_rate", None)
-                or 0.10
-            )
-            unit_tax  = math.floor(unit_excl * rate)
-            unit_incl = unit_excl + unit_tax
-
-            name = (getattr(m, "name", None)
-                    or getattr(getattr(it, "menu", None), "name", None)
-                    or f"#{getattr(it, 'menu_id', None)}")
-
-            a = agg[name]
-            a["total_qty"]           += qty
-            a["total_sales"]         += unit_excl * qty
-            a["tax_total"]           += unit_tax  * qty
-            a["total_sales_incl"]    += unit_incl * qty
-            a["sum_unit_price"]      += unit_excl
-            a["sum_unit_price_incl"] += unit_incl
-            a["count_unit_price"]    += 1
-
-            dbg["included"] += 1
-            if qty < 0:
-                dbg["neg_qty_kept"] += 1
-            else:
-                dbg["no_cancel_but_posqty_kept"] += 1
-
-            if debug_mode and len(dbg["examples"]) < EXAMPLE_LIMIT:
-                dbg["examples"].append({
-                    "decision": "included",
-                    "order_id": getattr(it, "order_id", None),
-                    "item_id": getattr(it, "id", None),
-                    "menu_id": getattr(it, "menu_id", None),
-                    "menu_name": getattr(m, "name", None),
-                    "qty": qty,
-                    "status": st, "memo": mm,
-                    "unit_excl": unit_excl, "rate": rate,
-                })
+        for r in rows:
+            menu_id = r["key_id"]
+            if not r["unit_cnt"] or menu_id not in names:
+                continue  # 集計対象の明細なし / メニュー削除済み
+            a = agg[names[menu_id] or f"#{menu_id}"]
+            a["total_qty"]           += int(r["qty"])
+            a["total_sales"]         += int(r["subtotal"])
+            a["tax_total"]           += int(r["tax"])
+            a["total_sales_incl"]    += int(r["total"])
+            a["sum_unit_price"]      += int(r["unit_sum"])
+            a["sum_unit_price_incl"] += int(r["unit_incl_sum"])
+            a["count_unit_price"]    += int(r["unit_cnt"])
 
         out = []
         for name, v in sorted(agg.items(), key=lambda x: x[1]["total_sales_incl"], reverse=True):
@@ -16688,14 +17443,15 @@ def api_sales_products():
         }
         if debug_mode:
             resp["debug"] = {
-                "summary": dbg | {"examples_count": len(dbg["examples"])},
-                "examples": dbg["examples"],
-                "cancel_words": {"ja": cancel_words_ja, "en": cancel_words_en},
+                "source": "T_売上集計",
+                "rollup_rows": len(rows),
+                "items_included": sum(int(r["unit_cnt"]) for r in rows),
+                "cancel_words": {"ja": _SALES_CANCEL_WORDS_JA, "en": _SALES_CANCEL_WORDS_EN},
             }
         return jsonify(resp)
 
     except Exception as e:
-        current_current_app.logger.exception("[/api/sales/products] ERROR: %s", e)
+        current_app.logger.exception("[/api/sales/products] ERROR: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
     finally:
         s.close()
@@ -16713,21 +17469,17 @@ def api_sales_payment_methods():
     s = SessionLocal()
     try:
         start, end = _range_from_params("start_date", "end_date", default_days=30)
-        end_dt = _end_of_day(end)
 
-        rows = (
-            s.query(PaymentMethod.name, PaymentRecord.amount, PaymentRecord.paid_at)
-             .join(PaymentRecord, PaymentRecord.method_id == PaymentMethod.id)
-             .filter(PaymentRecord.paid_at >= start,
-                     PaymentRecord.paid_at <= end_dt)
-             .all()
-        )
+        rows = _sales_rollup_rows(s, _sales_rollup_store_ids(s), start, end, "payment")
+        names = _sales_names(s, "M_支払方法", (r["key_id"] for r in rows))
 
         agg = defaultdict(lambda: {"transaction_count":0, "total_amount":0})
-        for name, amount, _paid in rows:
-            key = name or "-"
-            agg[key]["transaction_count"] += 1
-            agg[key]["total_amount"]      += int(amount or 0)
+        for r in rows:
+            if r["key_id"] not in names:
+                continue  # 支払方法が削除済み
+            key = names[r["key_id"]] or "-"
+            agg[key]["transaction_count"] += int(r["cnt"])
+            agg[key]["total_amount"]      += int(r["total"])
 
         out = []
         for k, v in sorted(agg.items(), key=lambda x: x[1]["total_amount"], reverse=True):
@@ -16752,25 +17504,19 @@ def api_sales_summary():
     s = SessionLocal()
     try:
         start, end = _range_from_params("start_date", "end_date", default_days=30)
-        end_dt = _end_of_day(end)
 
-        rows = (s.query(OrderHeader)
-                  .filter(OrderHeader.closed_at.isnot(None),
-                          OrderHeader.closed_at >= start,
-                          OrderHeader.closed_at <= end_dt,
-                          OrderHeader.status == "会計済")
-                  .all())
+        rows = _sales_rollup_rows(s, _sales_rollup_store_ids(s), start, end, "order")
 
-        total_orders = len(rows)
-        total_sales  = sum(int(o.total or 0)    for o in rows)
-        total_sub    = sum(int(o.subtotal or 0) for o in rows)
-        total_tax    = sum(int(o.tax or 0)      for o in rows)
+        total_orders = sum(int(r["cnt"])          for r in rows)
+        total_sales  = sum(int(r["hdr_total"])    for r in rows)
+        total_sub    = sum(int(r["hdr_subtotal"]) for r in rows)
+        total_tax    = sum(int(r["hdr_tax"])      for r in rows)
         avg_order    = (total_sales/total_orders) if total_orders else 0
 
         today = _today_str()
-        today_rows = [o for o in rows if (o.closed_at or "")[:10] == today]
-        today_orders = len(today_rows)
-        today_sales  = sum(int(o.total or 0) for o in today_rows)
+        today_rows = [r for r in rows if r["day"] == today]
+        today_orders = sum(int(r["cnt"]) for r in today_rows)
+        today_sales  = sum(int(r["hdr_total"]) for r in today_rows)
 
         return jsonify({
             "status":"success",
@@ -16803,23 +17549,16 @@ def export_daily_sales():
     s = SessionLocal()
     try:
         start, end = _range_from_params("start_date", "end_date", default_days=30)
-        end_dt = _end_of_day(end)
 
-        rows = (s.query(OrderHeader)
-                  .filter(OrderHeader.closed_at.isnot(None),
-                          OrderHeader.closed_at >= start,
-                          OrderHeader.closed_at <= end_dt,
-                          OrderHeader.status == "会計済")
-                  .all())
+        rows = _sales_rollup_rows(s, _sales_rollup_store_ids(s), start, end, "order")
 
         daily = defaultdict(lambda: {"order_count":0, "total_sales":0, "subtotal":0, "tax_amount":0})
-        for o in rows:
-            day = (o.closed_at or "")[:10]
-            d = daily[day]
-            d["order_count"] += 1
-            d["total_sales"] += int(o.total or 0)
-            d["subtotal"]    += int(o.subtotal or 0)
-            d["tax_amount"]  += int(o.tax or 0)
+        for r in rows:
+            d = daily[r["day"]]
+            d["order_count"] += int(r["cnt"])
+            d["total_sales"] += int(r["hdr_total"])
+            d["subtotal"]    += int(r["hdr_subtotal"])
+            d["tax_amount"]  += int(r["hdr_tax"])
 
         import csv, io
         output = io.StringIO()
@@ -16851,27 +17590,20 @@ def export_products_sales():
     s = SessionLocal()
     try:
         start, end = _range_from_params("start_date", "end_date", default_days=30)
-        end_dt = _end_of_day(end)
 
-        item_rows = (
-            s.query(OrderItem, OrderHeader)
-             .join(OrderHeader, OrderItem.order_id == OrderHeader.id)
-             .filter(OrderHeader.closed_at.isnot(None),
-                     OrderHeader.closed_at >= start,
-                     OrderHeader.closed_at <= end_dt,
-                     OrderHeader.status == "会計済")
-             .all()
-        )
+        rows = _sales_rollup_rows(s, _sales_rollup_store_ids(s), start, end, "menu")
+        names = _sales_names(s, "M_メニュー", (r["key_id"] for r in rows))
 
         agg = defaultdict(lambda: {"total_qty":0, "total_sales":0, "sum_unit_price":0, "count_unit_price":0})
-        for it, _oh in item_rows:
-            name = it.menu.name if it.menu else f"#{it.menu_id}"
-            qty  = int(it.qty or 0)
-            unit = int(it.unit_price or 0)
-            agg[name]["total_qty"]       += qty
-            agg[name]["total_sales"]     += qty * unit
-            agg[name]["sum_unit_price"]  += unit
-            agg[name]["count_unit_price"]+= 1
+        for r in rows:
+            if not r["raw_unit_cnt"]:
+                continue
+            menu_id = r["key_id"]
+            name = names[menu_id] if menu_id in names else f"#{menu_id}"
+            agg[name]["total_qty"]       += int(r["raw_qty"])
+            agg[name]["total_sales"]     += int(r["raw_sales"])
+            agg[name]["sum_unit_price"]  += int(r["raw_unit_sum"])
+            agg[name]["count_unit_price"]+= int(r["raw_unit_cnt"])
 
         import csv, io
         output = io.StringIO()
@@ -16902,26 +17634,14 @@ def api_sales_hourly():
     s = SessionLocal()
     try:
         date = (request.args.get("date") or _today_str()).strip()
-        start = date
-        end   = date
-        end_dt = _end_of_day(end)
 
-        rows = (s.query(OrderHeader)
-                  .filter(OrderHeader.closed_at.isnot(None),
-                          OrderHeader.closed_at >= start,
-                          OrderHeader.closed_at <= end_dt,
-                          OrderHeader.status == "会計済")
-                  .all())
+        rows = _sales_rollup_rows(s, _sales_rollup_store_ids(s), date, date, "order")
 
         buckets = {h: {"hour": f"{h:02d}:00", "order_count":0, "total_sales":0} for h in range(24)}
-        for o in rows:
-            ts = (o.closed_at or "00:00:00")[11:13]  # "YYYY-MM-DD HH"
-            try:
-                hh = int(ts)
-            except Exception:
-                hh = 0
-            buckets[hh]["order_count"] += 1
-            buckets[hh]["total_sales"] += int(o.total or 0)
+        for r in rows:
+            hh = r["hour"] if 0 <= r["hour"] < 24 else 0
+            buckets[hh]["order_count"] += int(r["cnt"])
+            buckets[hh]["total_sales"] += int(r["hdr_total"])
 
         out = [buckets[h] for h in range(24)]
         return jsonify({"status":"success","data":out,"date":date})
@@ -19307,7 +20027,165 @@ if __name__ == "__main__":
 
 # ========================================
 # printer-server 用 API
+#   - API キーは店舗ごとにプロセス内で TTL 付きキャッシュ。発行・再発行時は change_bus の
+#     printer_api_key:<店舗ID> の版数を進め、全ワーカーのキャッシュを無効にする
+#   - wait=<秒> 指定時はロングポーリング：新しい明細が無ければ change_bus の
+#     print_items:<店舗ID> の版数が進むか timeout まで応答を保留する。
+#     待機中はワーカー（スレッド）を占有するため、PRINTER_SERVER_LONGPOLL_MAX_SEC を
+#     設定した場合のみ有効（既定 0 = 無効、上限 _PRINTER_SERVER_LONGPOLL_CAP_SEC）
 # ========================================
+_PRINTER_SERVER_LONGPOLL_CAP_SEC = 10.0
+PRINTER_SERVER_LONGPOLL_MAX_SEC = min(float(os.getenv("PRINTER_SERVER_LONGPOLL_MAX_SEC", "0")),
+                                      _PRINTER_SERVER_LONGPOLL_CAP_SEC)
+PRINTER_API_KEY_CACHE_TTL_SEC = float(os.getenv("PRINTER_API_KEY_CACHE_TTL_SEC", "60"))
+
+_printer_api_keys = {}  # store_id -> (有効期限, 版数, 期待する API キー or None)
+_printer_api_keys_lock = threading.Lock()
+
+
+def _printer_items_channel(store_id) -> str:
+    return f"print_items:{store_id or 0}"
+
+
+def _printer_api_key_channel(store_id) -> str:
+    return f"printer_api_key:{store_id or 0}"
+
+
+def _get_printer_api_key(store_id) -> tuple[bool, str | None]:
+    """(店舗が存在するか, 設定済みの API キー) を返す。存在する店舗の値のみキャッシュする"""
+    from app.services.change_bus import get_change_bus
+    try:
+        version = get_change_bus().version(_printer_api_key_channel(store_id))
+    except Exception as e:
+        logging.getLogger(__name__).warning("[printer-server] api key version lookup failed: %s", e)
+        version = None  # 版数が分からない間はキャッシュを使わない
+
+    now = time.monotonic()
+    with _printer_api_keys_lock:
+        entry = _printer_api_keys.get(store_id)
+    if entry is not None and version is not None and entry[0] > now and entry[1] == version:
+        return True, entry[2]
+
+    # テナントフィルタを完全にバイパスするため、生SQLを使用
+    s = SessionLocal()
+    try:
+        row = s.execute(
+            text('SELECT id, "プリンターサーバーAPIキー" FROM "M_店舗" WHERE id = :store_id'),
+            {"store_id": store_id}
+        ).fetchone()
+    finally:
+        s.close()
+    if not row:
+        return False, None
+    if version is not None:
+        with _printer_api_keys_lock:
+            _printer_api_keys[store_id] = (now + PRINTER_API_KEY_CACHE_TTL_SEC, version, row[1])
+    return True, row[1]
+
+
+def _printer_api_key_matches(provided: str, expected: str | None) -> bool:
+    if not expected or not provided:
+        return False
+    return hmac.compare_digest(provided.encode("utf-8"), expected.encode("utf-8"))
+
+
+def invalidate_printer_api_key(store_id):
+    """API キーの発行・再発行後に呼ぶ（全ワーカーのキャッシュを破棄し、旧キーを即座に無効にする）"""
+    from app.services.change_bus import get_change_bus
+    with _printer_api_keys_lock:
+        _printer_api_keys.pop(store_id, None)
+    try:
+        get_change_bus().publish(_printer_api_key_channel(store_id))
+    except Exception as e:
+        logging.getLogger(__name__).warning("[printer-server] api key change notification failed: %s", e)
+
+
+@event.listens_for(Session, "after_flush")
+def _printer_collect_new_items(session_obj, flush_context):
+    for obj in session_obj.new:
+        if isinstance(obj, OrderItem) and getattr(obj, "store_id", None):
+            session_obj.info.setdefault("_printer_new_item_stores", set()).add(int(obj.store_id))
+
+
+@event.listens_for(Session, "after_commit")
+def _printer_publish_new_items(session_obj):
+    stores = session_obj.info.pop("_printer_new_item_stores", None)
+    if not stores:
+        return
+    from app.services.change_bus import get_change_bus
+    for sid in stores:
+        try:
+            get_change_bus().publish(_printer_items_channel(sid))
+        except Exception as e:
+            logging.getLogger(__name__).warning("[printer-server] change notification failed: %s", e)
+
+
+@event.listens_for(Session, "after_rollback")
+def _printer_discard_new_items(session_obj):
+    session_obj.info.pop("_printer_new_item_stores", None)
+
+
+def _printer_server_fetch_items(store_id: int, print_type: str, since_item_id: int) -> list[dict]:
+    """未印刷の明細を 1 クエリで取得する（テーブル番号・メニュー名も JOIN で取得）"""
+    if print_type == 'kitchen':
+        # 厨房印刷済み=falseのアイテムのみ取得
+        cond = '(i."厨房印刷済み" IS NULL OR i."厨房印刷済み" = false)'
+    elif print_type == 'receipt':
+        # 明細印刷済み=falseのアイテムのみ取得
+        cond = '(i."明細印刷済み" IS NULL OR i."明細印刷済み" = false)'
+    else:
+        # 従来方式（since_item_idベース）
+        cond = 'i.id > :since_item_id'
+
+    s = SessionLocal()
+    try:
+        # テナントフィルタを完全にバイパスするため、生 SQL を使用
+        result = s.execute(
+            text(f'''
+                SELECT
+                    i.id,
+                    i."注文ID",
+                    i."メニューID",
+                    i."数量",
+                    i."追加日時",
+                    o."テーブルID",
+                    t.id AS t_id,
+                    t."テーブル番号",
+                    m.id AS m_id,
+                    m."名称"
+                FROM "T_注文明細" i
+                JOIN "T_注文" o ON i."注文ID" = o.id
+                LEFT JOIN "M_テーブル" t ON t.id = o."テーブルID"
+                LEFT JOIN "M_メニュー" m ON m.id = i."メニューID"
+                WHERE i."店舗ID" = :store_id
+                  AND {cond}
+                  AND (o."状態" IS NULL OR o."状態" NOT IN ('会計済', 'closed', 'paid'))
+                ORDER BY i.id ASC
+            '''),
+            {"store_id": store_id, "since_item_id": since_item_id}
+        ).fetchall()
+    finally:
+        s.close()
+        SessionLocal.remove()
+
+    items = []
+    for item_id, order_id, menu_id, qty, added_at, table_id, t_id, table_no, m_id, menu_name in result:
+        table_name = "不明"
+        if table_id and t_id is not None:
+            table_name = table_no or f"Table {table_id}"
+        menu_name = (menu_name or f"Menu {menu_id}") if m_id is not None else "不明"
+        items.append({
+            "item_id": item_id,
+            "order_id": order_id,
+            "menu_id": menu_id,
+            "menu_name": menu_name,
+            "qty": qty,
+            "table_name": table_name,
+            "added_at": str(added_at) if added_at else None
+        })
+    return items
+
+
 @bp.route("/api/printer-server/new-orders", methods=["GET"])
 def api_printer_server_new_orders():
     """
@@ -19315,72 +20193,36 @@ def api_printer_server_new_orders():
     クエリパラメータ:
       - store_id: 店舗ID
       - api_key: 認証用APIキー
-      - since_id: このID以降の注文を取得（オプション）
+      - since_item_id: このID以降の明細を取得（オプション、旧 since_id も可）
+      - print_type: 'kitchen' / 'receipt'（印刷済みフラグで絞り込み。未指定は since_item_id 方式）
+      - wait: ロングポーリングの最大待機秒数（オプション、上限 PRINTER_SERVER_LONGPOLL_MAX_SEC。
+              未設定のサーバーでは無視して即座に返す）
+      - init: true なら最新の明細IDのみ返す
     レスポンス:
-      { "ok": true, "orders": [{"id": 123, "table_name": "テーブル1", "created_at": "..."}] }
+      { "ok": true, "items": [...], "cursor": <返した明細の最大ID（無ければ since_item_id）> }
     """
-    from flask import request
-    import os
-    
-    # 詳細なログ出力
-    print("[PRINTER-SERVER-API] === 新規リクエスト ===")
-    print(f"[PRINTER-SERVER-API] Full URL: {request.url}")
-    print(f"[PRINTER-SERVER-API] Query String: {request.query_string.decode('utf-8')}")
-    print(f"[PRINTER-SERVER-API] All Args: {dict(request.args)}")
-    
     store_id = request.args.get("store_id", type=int)
-    print(f"[PRINTER-SERVER-API] store_id: {store_id}")
     if not store_id:
         return jsonify({"ok": False, "error": "store_id is required"}), 400
-    
+
     provided_api_key = request.args.get("api_key", "")
-    print(f"[PRINTER-SERVER-API] provided_api_key: '{provided_api_key}'")
-    print(f"[PRINTER-SERVER-API] provided_api_key length: {len(provided_api_key)}")
-    print(f"[PRINTER-SERVER-API] provided_api_key type: {type(provided_api_key)}")
-    print(f"[PRINTER-SERVER-API] provided_api_key repr: {repr(provided_api_key)}")
-    
-    # APIキー認証（データベースから取得）
-    # テナントフィルタを完全にバイパスするため、生SQLを使用
-    s_auth = SessionLocal()
-    try:
-        # 生SQLでStoreを取得（テナントフィルタを回避）
-        result = s_auth.execute(
-            text('SELECT id, "プリンターサーバーAPIキー" FROM "M_店舗" WHERE id = :store_id'),
-            {"store_id": store_id}
-        ).fetchone()
-        
-        if not result:
-            return jsonify({"ok": False, "error": "Store not found"}), 404
-        
-        store_id_db, expected_api_key = result
-        
-        print(f"[PRINTER-SERVER-API] expected_api_key: '{expected_api_key}'")
-        print(f"[PRINTER-SERVER-API] expected_api_key length: {len(expected_api_key) if expected_api_key else 0}")
-        print(f"[PRINTER-SERVER-API] expected_api_key type: {type(expected_api_key)}")
-        print(f"[PRINTER-SERVER-API] expected_api_key repr: {repr(expected_api_key)}")
-        
-        if not expected_api_key:
-            print("[PRINTER-SERVER-API] ERROR: API key not configured")
-            return jsonify({"ok": False, "error": "API key not configured for this store"}), 401
-        
-        print(f"[PRINTER-SERVER-API] Comparing: '{provided_api_key}' == '{expected_api_key}'")
-        print(f"[PRINTER-SERVER-API] Match result: {provided_api_key == expected_api_key}")
-        
-        if provided_api_key != expected_api_key:
-            print("[PRINTER-SERVER-API] ERROR: API key mismatch")
-            return jsonify({"ok": False, "error": "Invalid API key"}), 401
-        
-        print("[PRINTER-SERVER-API] SUCCESS: API key matched")
-    finally:
-        s_auth.close()
-    
+
+    # APIキー認証（店舗ごとのキャッシュ）
+    exists, expected_api_key = _get_printer_api_key(store_id)
+    if not exists:
+        return jsonify({"ok": False, "error": "Store not found"}), 404
+    if not expected_api_key:
+        return jsonify({"ok": False, "error": "API key not configured for this store"}), 401
+    if not _printer_api_key_matches(provided_api_key, expected_api_key):
+        current_app.logger.warning("[printer-server] API key mismatch: store_id=%s", store_id)
+        return jsonify({"ok": False, "error": "Invalid API key"}), 401
+
     # since_item_id をサポート（OrderItem 単位で管理）
     since_item_id = request.args.get("since_item_id", type=int, default=0)
     # 後方互換性のため、古い since_id もサポート
     if since_item_id == 0:
         since_item_id = request.args.get("since_id", type=int, default=0)
-    print(f"[PRINTER-SERVER-API] since_item_id (final): {since_item_id}")
-    
+
     # init=true の場合は最新のitem_idのみ返す（初回起動時の初期化用）
     init_mode = request.args.get("init", "").lower() == "true"
     if init_mode:
@@ -19391,130 +20233,38 @@ def api_printer_server_new_orders():
                 {"store_id": store_id}
             ).scalar()
             latest_item_id = latest or 0
-            print(f"[PRINTER-SERVER-API] init mode: latest_item_id={latest_item_id}")
             return jsonify({"ok": True, "items": [], "latest_item_id": latest_item_id})
         finally:
             s_init.close()
-    
+
     # print_type: 'kitchen'=厨房印刷済みフィルター, 'receipt'=明細印刷済みフィルター, 未指定=従来のsince_item_id方式
     print_type = request.args.get("print_type", "").lower()  # 'kitchen' or 'receipt'
-    
-    s = SessionLocal()
+
+    wait_sec = min(max(request.args.get("wait", type=float, default=0) or 0, 0), PRINTER_SERVER_LONGPOLL_MAX_SEC)
+    bus = None
+    if wait_sec > 0:
+        from app.services.change_bus import get_change_bus
+        bus = get_change_bus()
+    channel = _printer_items_channel(store_id)
+    deadline = time.monotonic() + wait_sec
+
     try:
-        # テナントフィルタを完全にバイパスするため、生 SQL を使用
-        # 印刷済みフラグがあればそれでフィルター、なければ従来のsince_item_id方式
-        if print_type == 'kitchen':
-            # 厨房印刷済み=falseのアイテムのみ取得（印刷済みカラムが存在する場合）
-            filter_sql = '''
-                SELECT 
-                    i.id,
-                    i."\u6ce8\u6587ID",
-                    i."\u30e1\u30cb\u30e5\u30fcID",
-                    i."\u6570\u91cf",
-                    i."\u8ffd\u52a0\u65e5\u6642",
-                    o."\u30c6\u30fc\u30d6\u30ebID",
-                    o."\u72b6\u614b" as order_status
-                FROM "T_\u6ce8\u6587\u660e\u7d30" i
-                JOIN "T_\u6ce8\u6587" o ON i."\u6ce8\u6587ID" = o.id
-                WHERE i."\u5e97\u8217ID" = :store_id
-                  AND (i."厨房印刷済み" IS NULL OR i."厨房印刷済み" = false)
-                  AND (o."\u72b6\u614b" IS NULL OR o."\u72b6\u614b" NOT IN ('\u4f1a\u8a08\u6e08', 'closed', 'paid'))
-                ORDER BY i.id ASC
-            '''
-            result = s.execute(text(filter_sql), {"store_id": store_id}).fetchall()
-        elif print_type == 'receipt':
-            # 明細印刷済み=falseのアイテムのみ取得
-            filter_sql = '''
-                SELECT 
-                    i.id,
-                    i."\u6ce8\u6587ID",
-                    i."\u30e1\u30cb\u30e5\u30fcID",
-                    i."\u6570\u91cf",
-                    i."\u8ffd\u52a0\u65e5\u6642",
-                    o."\u30c6\u30fc\u30d6\u30ebID",
-                    o."\u72b6\u614b" as order_status
-                FROM "T_\u6ce8\u6587\u660e\u7d30" i
-                JOIN "T_\u6ce8\u6587" o ON i."\u6ce8\u6587ID" = o.id
-                WHERE i."\u5e97\u8217ID" = :store_id
-                  AND (i."\u660e\u7d30\u5370\u5237\u6e08\u307f" IS NULL OR i."\u660e\u7d30\u5370\u5237\u6e08\u307f" = false)
-                  AND (o."\u72b6\u614b" IS NULL OR o."\u72b6\u614b" NOT IN ('\u4f1a\u8a08\u6e08', 'closed', 'paid'))
-                ORDER BY i.id ASC
-            '''
-            result = s.execute(text(filter_sql), {"store_id": store_id}).fetchall()
-        else:
-            # 従来方式（since_item_idベース）
-            result = s.execute(
-                text('''
-                    SELECT 
-                        i.id,
-                        i."注文ID",
-                        i."メニューID",
-                        i."数量",
-                        i."追加日時",
-                        o."テーブルID",
-                        o."状態" as order_status
-                    FROM "T_注文明細" i
-                    JOIN "T_注文" o ON i."注文ID" = o.id
-                    WHERE i."店舗ID" = :store_id
-                      AND i.id > :since_item_id
-                      AND (o."状態" IS NULL OR o."状態" NOT IN ('会計済', 'closed', 'paid'))
-                    ORDER BY i.id ASC
-                '''),
-                {"store_id": store_id, "since_item_id": since_item_id}
-            ).fetchall()
-        
-        print(f"[PRINTER-SERVER-API] Query returned {len(result)} items")
-        
-        # デバッグ: 最近の OrderItem を確認
-        all_recent = s.execute(
-            text('SELECT id, "注文ID" FROM "T_注文明細" WHERE "店舗ID" = :store_id ORDER BY id DESC LIMIT 5'),
-            {"store_id": store_id}
-        ).fetchall()
-        print(f"[PRINTER-SERVER-API] Recent 5 items: {[(r[0], r[1]) for r in all_recent]}")
-        
-        print(f"[PRINTER-SERVER-API] Filtered items: {[r[0] for r in result]}")
-        
-        items = []
-        for row in result:
-            item_id, order_id, menu_id, qty, added_at, table_id, order_status = row
-            
-            table_name = "不明"
-            if table_id:
-                # テーブル番号を取得（生 SQL）
-                table_result = s.execute(
-                    text('SELECT "テーブル番号" FROM "M_テーブル" WHERE id = :table_id'),
-                    {"table_id": table_id}
-                ).fetchone()
-                if table_result:
-                    table_name = table_result[0] or f"Table {table_id}"
-            
-            # メニュー名を取得
-            menu_name = "不明"
-            menu_result = s.execute(
-                text('SELECT "名称" FROM "M_メニュー" WHERE id = :menu_id'),
-                {"menu_id": menu_id}
-            ).fetchone()
-            if menu_result:
-                menu_name = menu_result[0] or f"Menu {menu_id}"
-            
-            items.append({
-                "item_id": item_id,
-                "order_id": order_id,
-                "menu_id": menu_id,
-                "menu_name": menu_name,
-                "qty": qty,
-                "table_name": table_name,
-                "added_at": str(added_at) if added_at else None
-            })
-        
-        return jsonify({"ok": True, "items": items})
-    
+        while True:
+            # 検索前の版数を控えておき、検索〜待機の間に入った注文も取りこぼさない
+            version = bus.version(channel) if bus is not None else 0
+            items = _printer_server_fetch_items(store_id, print_type, since_item_id)
+            remaining = deadline - time.monotonic()
+            if items or bus is None or remaining <= 0:
+                break
+            if bus.wait(channel, version, remaining) <= version:
+                break  # タイムアウト
+
+        cursor = max((it["item_id"] for it in items), default=since_item_id)
+        return jsonify({"ok": True, "items": items, "cursor": cursor})
+
     except Exception as e:
         current_app.logger.error(f"[api_printer_server_new_orders] error: {e}", exc_info=True)
         return jsonify({"ok": False, "error": str(e)}), 500
-    finally:
-        s.close()
-        SessionLocal.remove()
 
 
 # ========================================
@@ -19541,18 +20291,18 @@ def api_printer_server_mark_printed():
         return jsonify({"ok": False, "error": "print_type must be 'kitchen' or 'receipt'"}), 400
     
     # APIキー認証（店舗の存在確認）
+    try:
+        store_id = int(store_id)
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "invalid store_id"}), 400
+    exists, expected_api_key = _get_printer_api_key(store_id)
+    if not exists:
+        return jsonify({"ok": False, "error": "Store not found"}), 404
+    if not _printer_api_key_matches(api_key, expected_api_key):
+        return jsonify({"ok": False, "error": "invalid api_key"}), 403
+
     s = SessionLocal()
     try:
-        store_row = s.execute(
-            text('SELECT id, "プリンターサーバーAPIキー" FROM "M_店舗" WHERE id = :store_id'),
-            {"store_id": store_id}
-        ).fetchone()
-        if not store_row:
-            return jsonify({"ok": False, "error": "Store not found"}), 404
-        _, expected_api_key = store_row
-        if expected_api_key != api_key:
-            return jsonify({"ok": False, "error": "invalid api_key"}), 403
-        
         # 印刷済みカラムを死殺防止のため存在確認
         col_name = "厨房印刷済み" if print_type == 'kitchen' else "明細印刷済み"
         col_check = s.execute(
@@ -128,18 +128,11 @@ def dashboard():
         # 直近の税務期限（担当顧問先）
         upcoming_deadlines = []
         if assigned_client_ids:
-            from app.tax_calendar import get_all_deadlines_for_client  # noqa
-            year = today.year
+            from app.services.tax_deadline_index import upcoming_deadlines as _upcoming  # noqa
             clients_q = db.query(TClient).filter(
                 TClient.id.in_(assigned_client_ids)
             ).all()
-            for client in clients_q:
-                deadlines = get_all_deadlines_for_client(client, year)
-                for d in deadlines:
-                    if d['date'] >= today:
-                        upcoming_deadlines.append(d)
-            upcoming_deadlines.sort(key=lambda x: x['date'])
-            upcoming_deadlines = upcoming_deadlines[:5]
+            upcoming_deadlines = _upcoming(db, clients_q, today, limit=5)
 
         android_apk_url = getattr(tenant, 'android_apk_url', None) if tenant else None
         android_apk_version = getattr(tenant, 'android_apk_version', None) if tenant else None
@@ -805,7 +798,8 @@ def my_calendar():
     role = session.get('role', '')
     db = SessionLocal()
     try:
-        from app.tax_calendar import get_all_deadlines_for_client, group_by_month  # noqa
+        from app.tax_calendar import group_by_month  # noqa
+        from app.services.tax_deadline_index import deadlines_for_year  # noqa
 
         year = int(request.args.get('year', today_jst().year))
         unread_count = _get_unread_count(tenant_id, user_name)
@@ -823,13 +817,7 @@ def my_calendar():
                 TClient.id.in_(assigned_client_ids)
             ).all() if assigned_client_ids else []
 
-        all_deadlines = []
-        for client in clients_q:
-            deadlines = get_all_deadlines_for_client(client, year)
-            all_deadlines.extend(deadlines)
-
-        all_deadlines = [d for d in all_deadlines if d['date'].year == year]
-        all_deadlines.sort(key=lambda x: x['date'])
+        all_deadlines = deadlines_for_year(db, clients_q, year)
         grouped = group_by_month(all_deadlines)
         today = today_jst()
 
@@ -1483,7 +1471,7 @@ def storage_dropbox_callback():
     """担当者個人のDropbox OAuth コールバック"""
     from dropbox import DropboxOAuth2Flow
     from dropbox.oauth import BadStateException, CsrfException, NotApprovedException
-    from app.utils.tenant_storage_adapter import get_dropbox_app_credentials
+    from app.utils.tenant_storage_adapter import get_dropbox_app_credentials, invalidate_storage_cache
     user, staff_type, role = _get_current_user()
     tenant_id = session.get('tenant_id')
     if not user:
@@ -1504,6 +1492,7 @@ def storage_dropbox_callback():
                 res.access_token, res.refresh_token,
                 name=f'Dropbox（{getattr(user, "name", None) or "担当"}）')
             db.commit()
+            invalidate_storage_cache(tenant_id)
             flash('個人Dropboxの連携を更新しました' if updated else '個人Dropboxとの連携が完了しました！', 'success')
         except Exception as e:
             db.rollback()
@@ -1526,6 +1515,7 @@ def storage_dropbox_callback():
 def storage_disconnect():
     """自分の個人ストレージ連携を解除する（このアプリ内の割当を無効化）。"""
     from app.models_integrations import TStorageConnection, TStoreStorageAssignment
+    from app.utils.tenant_storage_adapter import invalidate_storage_cache
     user, staff_type, role = _get_current_user()
     tenant_id = session.get('tenant_id')
     if not user:
@@ -1548,6 +1538,7 @@ def storage_disconnect():
                             TStorageConnection.status == 'active').all()):
             c.status = 'inactive'
         db.commit()
+        invalidate_storage_cache(tenant_id)
         flash('個人ストレージ連携を解除しました', 'success')
     except Exception as e:
         db.rollback()
@@ -10,6 +10,7 @@ from app.models_login import TKanrisha, TJugyoin, TTenant, TTenpo, TKanrishaTenp
 from sqlalchemy import func, and_, or_
 from ..utils.decorators import ROLES
 from ..utils.decorators import require_roles
+from ..utils.name_cache import invalidate_tenant, invalidate_app_manager_group, clear_name_cache
 from ..blueprints.tenant_admin import AVAILABLE_APPS
 import os
 import markdown
@@ -814,6 +815,7 @@ def tenant_edit(tid):
                         tenant_obj.openai_api_key = openai_api_key or None
                         tenant_obj.有効 = active
                         db.commit()
+                        invalidate_tenant(tid)
                         flash('テナント情報を更新しました', 'success')
                         return redirect(url_for('system_admin.tenants'))
         
@@ -903,6 +905,8 @@ def tenant_delete(tid):
             
             # コミット
             db.commit()
+            # 配下の店舗名も参照されなくなるためキャッシュを全破棄
+            clear_name_cache()
             flash('テナントと関連データを削除しました', 'success')
         except Exception as e:
             db.rollback()
@@ -2783,6 +2787,7 @@ def app_manager_group_edit(group_id):
         group.description = description if description else None
         group.active = active
         db.commit()
+        invalidate_app_manager_group(group_id)
         
         flash(f'アプリ管理者グループ「{group_name}」を更新しました', 'success')
         return redirect(url_for('system_admin.app_manager_groups'))
@@ -2824,6 +2829,7 @@ def app_manager_group_delete(group_id):
         group_name = group.group_name
         db.delete(group)
         db.commit()
+        invalidate_app_manager_group(group_id)
         
         flash(f'アプリ管理者グループ「{group_name}」を削除しました', 'success')
         return redirect(url_for('system_admin.app_manager_groups'))
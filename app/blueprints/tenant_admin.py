@@ -11,6 +11,7 @@ from app.models_clients import TClient, TTaxAccountant
 from sqlalchemy import func, and_, or_
 from ..utils.decorators import ROLES
 from ..utils.decorators import require_roles
+from ..utils.name_cache import invalidate_tenant, invalidate_store
 
 bp = Blueprint('tenant_admin', __name__, url_prefix='/tenant_admin')
 
@@ -576,6 +577,7 @@ def me_edit():
                         tenant_obj.profession = profession
                         tenant_obj.有効 = active
                         db.commit()
+                        invalidate_tenant(tenant_id)
                         flash('テナント情報を更新しました', 'success')
                         return redirect(url_for('tenant_admin.tenant_info'))
         
@@ -838,6 +840,7 @@ def store_edit(store_id):
                         store_obj.anthropic_api_key = anthropic_api_key or None
                         store_obj.有効 = active
                         db.commit()
+                        invalidate_store(store_id)
                         flash('店舗情報を更新しました', 'success')
                         return redirect(url_for('tenant_admin.stores'))
         
@@ -920,6 +923,7 @@ def store_delete(store_id):
             
             # コミット
             db.commit()
+            invalidate_store(store_id)
             flash('店舗と関連データを削除しました', 'success')
         except Exception as e:
             db.rollback()
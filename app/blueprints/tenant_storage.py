@@ -8,11 +8,23 @@ from sqlalchemy import text
 from app.utils.decorators import require_roles, ROLES
 from app.utils.tenant_storage_adapter import (
     get_dropbox_app_credentials, DROPBOX_APP_KEY, DROPBOX_APP_SECRET,
+    invalidate_storage_cache,
 )
 
 bp = Blueprint('tenant_storage', __name__, url_prefix='/tenant/storage')
 
 
+@bp.after_request
+def _invalidate_storage_cache(response):
+    """設定を変更しうるリクエストの後、保存先キャッシュ（全ワーカー）を破棄する。
+    変更系は POST と OAuth コールバック（GET）。"""
+    if request.method == 'POST' or request.endpoint == 'tenant_storage.dropbox_oauth_callback':
+        tenant_id = session.get('tenant_id')
+        if tenant_id:
+            invalidate_storage_cache(tenant_id)
+    return response
+
+
 def _deactivate_scope(db, tenant_id, store_id):
     """指定スコープ（店舗 or テナント全体）の既存設定のみを無効化する。
     他スコープの設定は温存する。
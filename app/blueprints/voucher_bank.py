@@ -7,13 +7,13 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 import os
 import io
 import csv
-import threading
 from datetime import datetime
 from app.db import SessionLocal
 from app.models_voucher import TBankStatement, TBankTransaction, TBankColumnTemplate, TBankDescriptionLearning
 from app.models_login import TTenpo, TTenant, TKanrisha, TAppManagerGroup
 from app.utils.decorators import require_roles, ROLES
 from app.utils.voucher.ocr import process_bank_statement_image, save_uploaded_file
+from app.services import ocr_queue
 
 bp = Blueprint('voucher_bank', __name__, url_prefix='/voucher/bank')
 
@@ -235,20 +235,47 @@ def get_api_keys(tenant_id, tenpo_id):
     return result
 
 
-def _run_ocr_background(stmt_id, filepath, api_key, tenant_id, google_vision_api_key=None, column_def=None, tenpo_id=None, template_id=None, azure_document_intelligence_endpoint=None, azure_document_intelligence_key=None):
-    """バックグラウンドスレッドでOCR処理を実行してDBを更新する"""
+def _run_ocr_job(job, progress):
+    """OCRジョブ（app.services.ocr_queue）の処理本体。APIキーは実行時に取得する"""
+    options = job.get('options') or {}
+    api_keys = get_api_keys(job['tenant_id'], job['tenpo_id'])
+    ocr_result = process_bank_statement_image(
+        job['file_path'],
+        api_key=api_keys.get('openai_api_key'),
+        google_vision_api_key=api_keys.get('google_vision_api_key'),
+        column_def=options.get('column_def'),
+        azure_document_intelligence_endpoint=api_keys.get('azure_document_intelligence_endpoint'),
+        azure_document_intelligence_key=api_keys.get('azure_document_intelligence_key'),
+        progress=progress,
+        refresh_cache=bool(options.get('refresh_cache')),
+    )
+    if ocr_result.get('_error'):
+        # プロバイダ側のエラーはキューの再試行（バックオフ）に任せる
+        raise RuntimeError(ocr_result['_error'])
+    _save_ocr_result(job['target_id'], ocr_result, job['tenant_id'],
+                     tenpo_id=job['tenpo_id'], template_id=options.get('template_id'))
+
+
+def _mark_ocr_error(job, message):
+    """再試行しきったOCRジョブの明細をエラーにする"""
     db = SessionLocal()
     try:
-        stmt = db.query(TBankStatement).filter(TBankStatement.id == stmt_id).first()
-        if not stmt:
-            return
-        stmt.ステータス = 'processing'
-        db.commit()
+        stmt = db.query(TBankStatement).filter(TBankStatement.id == job['target_id']).first()
+        if stmt:
+            stmt.ステータス = 'error'
+            stmt.OCR結果_生データ = f'OCRエラー: {message}'
+            db.commit()
+    finally:
+        db.close()
+
+
+ocr_queue.register_handler('bank', _run_ocr_job, _mark_ocr_error)
 
-        ocr_result = process_bank_statement_image(filepath, api_key=api_key, google_vision_api_key=google_vision_api_key, column_def=column_def,
-                                                    azure_document_intelligence_endpoint=azure_document_intelligence_endpoint,
-                                                    azure_document_intelligence_key=azure_document_intelligence_key)
 
+def _save_ocr_result(stmt_id, ocr_result, tenant_id, tenpo_id=None, template_id=None):
+    """OCR結果を明細・明細行に保存する（学習データの摘要を自動適用）"""
+    db = SessionLocal()
+    try:
         stmt = db.query(TBankStatement).filter(TBankStatement.id == stmt_id).first()
         if not stmt:
             return
@@ -529,16 +556,9 @@ def upload():
         if not has_any_key:
             flash('APIキーが未設定のため、OCR処理をスキップしました。設定画面からOpenAIまたはGoogle Cloud Vision APIキーを設定してください。', 'warning')
         else:
-            t = threading.Thread(
-                target=_run_ocr_background,
-                args=(stmt_id, filepath, openai_api_key, tenant_id),
-                kwargs={'google_vision_api_key': google_vision_api_key, 'column_def': column_def,
-                        'tenpo_id': tenpo_id, 'template_id': used_template_id,
-                        'azure_document_intelligence_endpoint': azure_adi_endpoint,
-                        'azure_document_intelligence_key': azure_adi_key},
-                daemon=True
-            )
-            t.start()
+            # OCRはジョブキューのワーカーが実行する（APIキーはジョブ実行時に取得し、DBには保存しない）
+            ocr_queue.enqueue('bank', stmt_id, tenant_id, filepath, tenpo_id=tenpo_id,
+                              options={'column_def': column_def, 'template_id': used_template_id})
             if azure_adi_endpoint and azure_adi_key:
                 key_info = 'Azure Document Intelligence + GPT-4o'
             elif google_vision_api_key and openai_api_key:
@@ -572,7 +592,8 @@ def status(stmt_id):
         ).first()
         if not stmt:
             return jsonify({'status': 'error'})
-        return jsonify({'status': stmt.ステータス or 'pending'})
+        return jsonify({'status': stmt.ステータス or 'pending',
+                        'job': ocr_queue.get_job_status('bank', stmt_id)})
     finally:
         db.close()
 
@@ -16,6 +16,7 @@ from app.utils.decorators import require_roles, ROLES
 from app.utils.voucher.ocr import process_receipt_image, save_uploaded_file
 from app.utils.voucher.nta_api import NTAInvoiceAPI
 from app.utils.voucher.nta_api_enhanced import search_corporate_number_by_contact
+from app.services import ocr_queue
 
 bp = Blueprint('voucher_store', __name__, url_prefix='/voucher')
 
@@ -38,6 +39,145 @@ def get_session_info():
     }
 
 
+def _get_openai_api_key(tenant_id, tenpo_id):
+    """OpenAI APIキーを継承順に取得：店舗 → テナント → システム管理者"""
+    db = SessionLocal()
+    try:
+        # 1. 店舗のAPIキー
+        if tenpo_id:
+            tenpo = db.query(TTenpo).filter(TTenpo.id == tenpo_id).first()
+            if tenpo and getattr(tenpo, 'openai_api_key', None):
+                return tenpo.openai_api_key
+
+        # 2. テナントのAPIキー（店舗にない場合）
+        if tenant_id:
+            tenant = db.query(TTenant).filter(TTenant.id == tenant_id).first()
+            if tenant and getattr(tenant, 'openai_api_key', None):
+                return tenant.openai_api_key
+
+        # 3. システム管理者のAPIキー（店舗・テナントにない場合）
+        sys_admin = db.query(TKanrisha).filter(
+            TKanrisha.role == 'system_admin',
+            TKanrisha.openai_api_key != None,
+            TKanrisha.openai_api_key != ''
+        ).first()
+        if sys_admin and getattr(sys_admin, 'openai_api_key', None):
+            return sys_admin.openai_api_key
+    except Exception:
+        pass
+    finally:
+        db.close()
+    return None
+
+
+def _save_ocr_result(voucher_id, tenant_id, ocr_result):
+    """OCR結果（と法人番号検索・取引先登録の結果）を証憑に反映し、確認待ち（pending）にする"""
+    # 電話番号・住所から法人番号検索（NTA API）
+    company_id = None
+    corporate_number = ocr_result.get('corporate_number')
+    phone = None
+    address = None
+
+    if ocr_result.get('phone_numbers'):
+        phone = ocr_result['phone_numbers'][0]
+    if ocr_result.get('addresses'):
+        address = ocr_result['addresses'][0]
+
+    # 法人番号が取れていない場合は電話番号・住所から検索
+    if not corporate_number and (phone or address or ocr_result.get('company_name')):
+        try:
+            result = search_corporate_number_by_contact(
+                phone_number=phone,
+                address=address,
+                company_name=ocr_result.get('company_name')
+            )
+            if result and result.get('corporate_number'):
+                corporate_number = result['corporate_number']
+        except Exception:
+            pass
+
+    db = SessionLocal()
+    try:
+        # 取引先会社の登録・取得
+        if ocr_result.get('company_name') or corporate_number:
+            try:
+                company = None
+                if corporate_number:
+                    company = db.query(TCompany).filter(
+                        TCompany.法人番号 == corporate_number,
+                        TCompany.tenant_id == tenant_id
+                    ).first()
+                if not company and ocr_result.get('company_name'):
+                    company = db.query(TCompany).filter(
+                        TCompany.会社名 == ocr_result['company_name'],
+                        TCompany.tenant_id == tenant_id
+                    ).first()
+                if not company:
+                    company = TCompany(
+                        tenant_id=tenant_id,
+                        会社名=ocr_result.get('company_name', ''),
+                        法人番号=corporate_number,
+                        電話番号=phone,
+                        住所=address,
+                    )
+                    db.add(company)
+                    db.flush()
+                company_id = company.id
+                db.commit()
+            except Exception:
+                db.rollback()
+
+        voucher = db.query(TVoucher).filter(TVoucher.id == voucher_id).first()
+        if not voucher:
+            return
+        voucher.company_id = company_id
+        voucher.OCR結果_生データ = ocr_result.get('raw_text', '')
+        voucher.電話番号 = phone
+        voucher.住所 = address
+        voucher.郵便番号 = ocr_result.get('postal_code')
+        voucher.会社名 = ocr_result.get('company_name')
+        voucher.金額 = ocr_result.get('amount')
+        voucher.日付 = ocr_result.get('date')
+        voucher.インボイス番号 = ocr_result.get('invoice_number')
+        voucher.法人番号 = corporate_number
+        voucher.摘要 = ocr_result.get('summary')
+        voucher.ステータス = 'pending'
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _run_ocr_job(job, progress):
+    """OCRジョブ（app.services.ocr_queue）の処理本体。APIキーは実行時に取得する"""
+    options = job.get('options') or {}
+    api_key = _get_openai_api_key(job['tenant_id'], job['tenpo_id'])
+    ocr_result = process_receipt_image(job['file_path'], api_key=api_key,
+                                       refresh_cache=bool(options.get('refresh_cache')))
+    if ocr_result.get('_error'):
+        # プロバイダ側のエラーはキューの再試行（バックオフ）に任せる
+        raise RuntimeError(ocr_result['_error'])
+    _save_ocr_result(job['target_id'], job['tenant_id'], ocr_result)
+
+
+def _mark_ocr_error(job, message):
+    """再試行しきった証憑は手入力できるよう確認待ち（pending）に戻す"""
+    db = SessionLocal()
+    try:
+        voucher = db.query(TVoucher).filter(TVoucher.id == job['target_id']).first()
+        if voucher:
+            voucher.ステータス = 'pending'
+            voucher.OCR結果_生データ = f'OCRエラー: {message}'
+            db.commit()
+    finally:
+        db.close()
+
+
+ocr_queue.register_handler('receipt', _run_ocr_job, _mark_ocr_error)
+
+
 # ============================================================
 # 証憑モード選択トップ（/ と /top の両方で表示）
 # ============================================================
@@ -112,121 +252,17 @@ def upload():
         upload_dir = os.path.join('uploads', 'vouchers', str(tenant_id))
         filepath = save_uploaded_file(file, upload_dir)
 
-        # OpenAI APIキーを継承順に取得：店舗 → テナント → システム管理者
-        openai_api_key = None
-        api_key_source = None
-        db_tmp = SessionLocal()
-        try:
-            # 1. 店舗のAPIキー
-            if tenpo_id:
-                tenpo = db_tmp.query(TTenpo).filter(TTenpo.id == tenpo_id).first()
-                if tenpo and getattr(tenpo, 'openai_api_key', None):
-                    openai_api_key = tenpo.openai_api_key
-                    api_key_source = '店舗'
-
-            # 2. テナントのAPIキー（店舗にない場合）
-            if not openai_api_key and tenant_id:
-                tenant = db_tmp.query(TTenant).filter(TTenant.id == tenant_id).first()
-                if tenant and getattr(tenant, 'openai_api_key', None):
-                    openai_api_key = tenant.openai_api_key
-                    api_key_source = 'テナント'
-
-            # 3. システム管理者のAPIキー（店舗・テナントにない場合）
-            if not openai_api_key:
-                sys_admin = db_tmp.query(TKanrisha).filter(
-                    TKanrisha.role == 'system_admin',
-                    TKanrisha.openai_api_key != None,
-                    TKanrisha.openai_api_key != ''
-                ).first()
-                if sys_admin and getattr(sys_admin, 'openai_api_key', None):
-                    openai_api_key = sys_admin.openai_api_key
-                    api_key_source = 'システム管理者'
-        except Exception:
-            pass
-        finally:
-            db_tmp.close()
-
-        # OCR処理（OpenAI Vision API使用）
-        if not openai_api_key:
-            flash('OpenAI APIキーが未設定のため、OCR処理をスキップしました。店舗・テナントまたはシステム管理者のOpenAI APIキーを登録してください。', 'warning')
-        ocr_result = process_receipt_image(filepath, api_key=openai_api_key)
-
-        # 電話番号・住所から法人番号検索（NTA API）
-        company_id = None
-        corporate_number = ocr_result.get('corporate_number')
-        phone = None
-        address = None
-
-        if ocr_result.get('phone_numbers'):
-            phone = ocr_result['phone_numbers'][0]
-        if ocr_result.get('addresses'):
-            address = ocr_result['addresses'][0]
-
-        # 法人番号が取れていない場合は電話番号・住所から検索
-        if not corporate_number and (phone or address or ocr_result.get('company_name')):
-            try:
-                result = search_corporate_number_by_contact(
-                    phone_number=phone,
-                    address=address,
-                    company_name=ocr_result.get('company_name')
-                )
-                if result and result.get('corporate_number'):
-                    corporate_number = result['corporate_number']
-            except Exception:
-                pass
-
-        # 取引先会社の登録・取得
-        if ocr_result.get('company_name') or corporate_number:
-            db = SessionLocal()
-            try:
-                company = None
-                if corporate_number:
-                    company = db.query(TCompany).filter(
-                        TCompany.法人番号 == corporate_number,
-                        TCompany.tenant_id == tenant_id
-                    ).first()
-                if not company and ocr_result.get('company_name'):
-                    company = db.query(TCompany).filter(
-                        TCompany.会社名 == ocr_result['company_name'],
-                        TCompany.tenant_id == tenant_id
-                    ).first()
-                if not company:
-                    company = TCompany(
-                        tenant_id=tenant_id,
-                        会社名=ocr_result.get('company_name', ''),
-                        法人番号=corporate_number,
-                        電話番号=phone,
-                        住所=address,
-                    )
-                    db.add(company)
-                    db.flush()
-                company_id = company.id
-                db.commit()
-            except Exception:
-                db.rollback()
-            finally:
-                db.close()
+        openai_api_key = _get_openai_api_key(tenant_id, tenpo_id)
 
-        # 証憑レコード保存
+        # 証憑レコードを先に保存し、OCRはジョブキューのワーカーが実行する
         db = SessionLocal()
         try:
             voucher = TVoucher(
                 tenant_id=tenant_id,
                 tenpo_id=tenpo_id,
                 uploaded_by=user_id,
-                company_id=company_id,
                 画像パス=filepath,
-                OCR結果_生データ=ocr_result.get('raw_text', ''),
-                電話番号=phone,
-                住所=address,
-                郵便番号=ocr_result.get('postal_code'),
-                会社名=ocr_result.get('company_name'),
-                金額=ocr_result.get('amount'),
-                日付=ocr_result.get('date'),
-                インボイス番号=ocr_result.get('invoice_number'),
-                法人番号=corporate_number,
-                摘要=ocr_result.get('summary'),
-                ステータス='pending',
+                ステータス='processing' if openai_api_key else 'pending',
             )
             db.add(voucher)
             db.commit()
@@ -237,7 +273,11 @@ def upload():
         finally:
             db.close()
 
-        flash('証憑をアップロードしました。OCR結果を確認してください。', 'success')
+        if not openai_api_key:
+            flash('OpenAI APIキーが未設定のため、OCR処理をスキップしました。店舗・テナントまたはシステム管理者のOpenAI APIキーを登録してください。', 'warning')
+        else:
+            ocr_queue.enqueue('receipt', voucher_id, tenant_id, filepath, tenpo_id=tenpo_id)
+            flash('証憑をアップロードしました。OCR処理をバックグラウンドで実行中です...', 'success')
         return redirect(url_for('voucher_store.detail', voucher_id=voucher_id))
 
     except Exception as e:
@@ -245,6 +285,28 @@ def upload():
         return redirect(request.url)
 
 
+# ============================================================
+# OCRステータス確認API（詳細画面の自動リロード用）
+# ============================================================
+@bp.route('/<int:voucher_id>/status')
+@require_roles(ROLES['SYSTEM_ADMIN'], ROLES['TENANT_ADMIN'], ROLES['ADMIN'], ROLES['EMPLOYEE'], ROLES['APP_MANAGER'])
+def status(voucher_id):
+    info = get_session_info()
+    tenant_id = info['tenant_id']
+    db = SessionLocal()
+    try:
+        voucher = db.query(TVoucher).filter(
+            TVoucher.id == voucher_id,
+            TVoucher.tenant_id == tenant_id
+        ).first()
+        if not voucher:
+            return jsonify({'status': 'error'})
+        return jsonify({'status': voucher.ステータス or 'pending',
+                        'job': ocr_queue.get_job_status('receipt', voucher_id)})
+    finally:
+        db.close()
+
+
 # ============================================================
 # 証憑詳細
 # ============================================================
@@ -320,6 +320,8 @@ def _h_send_message(ctx, args):
         timestamp=datetime.utcnow())
     ctx.db.add(m)
     ctx.db.commit()
+    from app.services import chat_push
+    chat_push.notify(chat_push.client_channel(m.client_id))
     return {'sent': True, 'message': _msg_dict(m)}
 
 
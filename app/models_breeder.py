@@ -6,7 +6,7 @@ from __future__ import annotations
 from datetime import datetime, date
 from sqlalchemy import (
     Column, Integer, String, Text, DateTime, Date,
-    ForeignKey, Numeric, Enum as SAEnum, JSON, Float, Boolean
+    ForeignKey, Numeric, Enum as SAEnum, JSON, Float, Boolean, UniqueConstraint
 )
 from sqlalchemy.sql import func
 from app.db import Base
@@ -605,6 +605,30 @@ class MatingEvaluation(Base):
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
+# ─────────────────────────────────────────────
+# 交配評価：血統由来指標キャッシュ
+# ─────────────────────────────────────────────
+class MatingPedigreeCache(Base):
+    """交配評価の血統由来指標キャッシュテーブル
+    COI・AVK・祖先集中度・ライン依存度を (父犬, 母犬, 探索世代数) ごとに保存する。
+    pedigree_hash は両親の全祖先の父母・犬名と血統書祖先情報から作る指紋で、
+    現在の血統から計算した指紋と一致する場合のみ result_json を再利用する。
+    """
+    __tablename__ = 'mating_pedigree_cache'
+
+    __table_args__ = (
+        UniqueConstraint('sire_id', 'dam_id', 'max_depth', name='uq_mating_pedigree_cache_pair'),
+        {'extend_existing': True},
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sire_id = Column(Integer, ForeignKey('dogs.id', ondelete='CASCADE'), nullable=False, index=True, comment='父犬ID')
+    dam_id = Column(Integer, ForeignKey('dogs.id', ondelete='CASCADE'), nullable=False, index=True, comment='母犬ID')
+    max_depth = Column(Integer, nullable=False, comment='探索世代数')
+    pedigree_hash = Column(String(64), nullable=False, comment='血統指紋（SHA-256）')
+    result_json = Column(Text, nullable=False, comment='COI・AVK・祖先集中度・ライン依存度の JSON')
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
 # ─────────────────────────────────────────────
 # 犬種別リスクマスタ
 # ─────────────────────────────────────────────
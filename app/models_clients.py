@@ -1,7 +1,7 @@
 """
 顧問先管理用モデル
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Numeric
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, ForeignKey, Boolean, Numeric, Index, UniqueConstraint
 from datetime import datetime
 from app.db import Base
 from app.utils.crypto import EncryptedString
@@ -187,6 +187,46 @@ class TTaxRecordMunicipality(Base):
     corporate_tax_levy = Column(Integer, nullable=True)      # 法人税割
 
 
+class TTaxDeadline(Base):
+    """T_税務期限テーブル（顧問先×年ごとに生成済みの税務期限。税務カレンダーの検索用）
+
+    tax_calendar.get_all_deadlines_for_client(client, cal_year) の結果をそのまま保存する。
+    cal_year の生成結果には前後の年の期限も含まれるため、表示時は deadline_date で絞り込む。
+    """
+    __tablename__ = 'T_税務期限'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tenant_id = Column(Integer, ForeignKey('T_テナント.id'), nullable=False)
+    client_id = Column(Integer, ForeignKey('T_顧問先.id'), nullable=False)
+    cal_year = Column(Integer, nullable=False)              # 生成対象年（get_all_deadlines_for_client の year）
+    deadline_date = Column(Date, nullable=False)            # 期限日（翌営業日調整後）
+    original_date = Column(Date, nullable=True)             # 調整前の期限日
+    deadline_type = Column(String(255), nullable=False)     # 期限名（例: 法人税確定申告）
+    category = Column(String(50), nullable=True)
+    color = Column(String(20), nullable=True)
+    note = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index('ix_tax_deadline_client_year_date', 'client_id', 'cal_year', 'deadline_date'),
+        Index('ix_tax_deadline_tenant_year_date', 'tenant_id', 'cal_year', 'deadline_date'),
+    )
+
+
+class TTaxDeadlineState(Base):
+    """T_税務期限生成状態テーブル（顧問先×年ごとの生成時の税務設定フィンガープリント）"""
+    __tablename__ = 'T_税務期限生成状態'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    client_id = Column(Integer, ForeignKey('T_顧問先.id'), nullable=False)
+    cal_year = Column(Integer, nullable=False)
+    fingerprint = Column(String(64), nullable=False)        # 税務設定＋生成ロジック版数のハッシュ
+    generated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('client_id', 'cal_year', name='uq_tax_deadline_state_client_year'),
+    )
+
+
 class TFilingOfficeTaxOffice(Base):
     """T_申告先_税務署テーブル"""
     __tablename__ = 'T_申告先_税務署'
@@ -4,7 +4,7 @@
 顧客からもらった資料を、選択したストレージ（Dropbox/GCS/Cloudinary 等）へ
 自動保存するための連携設定・ルーティング・受信ログを管理する。
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, UniqueConstraint
 from datetime import datetime
 from app.db import Base
 
@@ -41,6 +41,11 @@ class TChatworkRoomMapping(Base):
     client_id = Column(Integer, ForeignKey('T_顧問先.id'), nullable=False)
     subfolder = Column(String(255), nullable=True, default='ChatWork受信')  # 保存先サブフォルダ
     status = Column(String(20), nullable=False, default='active')
+    # 同期の高水位（前回同期完了時点のルーム内ファイル数・最大file_id・日時）
+    # ファイル数が変わっていないルームは次回ファイル一覧の取得自体を省略する
+    synced_file_num = Column(Integer, nullable=True)
+    last_file_id = Column(BigInteger, nullable=True)
+    synced_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -86,10 +91,10 @@ class TSchedulerConfig(Base):
 
 
 class TSchedulerState(Base):
-    """T_スケジューラ状態テーブル（アプリ内定期実行の管理・多重起動ロック用）
+    """T_スケジューラ状態テーブル（アプリ内定期実行の管理用）
 
-    複数のgunicornワーカーが同時に走っても、last_run_at への条件付きUPDATEで
-    実行権を1つに絞り、重複実行を防ぐ（ai-app-studio の db_backup と同方式）。
+    定期実行はテナント×連携ごとのジョブ（T_スケジューラジョブ）へ移行したため、
+    現在は手動の一括同期（run_sync_once）の直近結果の記録に使う。
     """
     __tablename__ = 'T_スケジューラ状態'
 
@@ -102,6 +107,35 @@ class TSchedulerState(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class TSchedulerJob(Base):
+    """T_スケジューラジョブテーブル（テナント×連携ごとの同期ジョブとリース）
+
+    1行＝1つの独立して取得できる作業単位（例: 'chatwork:12' = テナント12のChatWork同期）。
+    どのワーカー（gunicorn / batch_*.py）も lease_until への条件付きUPDATEで1行ずつ
+    リースを取り、期限内に終われば next_run_at を進めてリースを返す。
+    ワーカーが落ちてもリース期限切れで他のワーカーが拾い直す。
+    """
+    __tablename__ = 'T_スケジューラジョブ'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_key = Column(String(100), nullable=False, unique=True)  # '<kind>:<tenant_id>'
+    kind = Column(String(30), nullable=False)                   # 'chatwork' / 'gmail' / 'mail'
+    tenant_id = Column(Integer, nullable=False)
+    next_run_at = Column(DateTime, nullable=True)       # この時刻以降に実行対象（NULL=即時）
+    lease_owner = Column(String(100), nullable=True)    # リース保持者（host:pid:thread）
+    lease_until = Column(DateTime, nullable=True)       # リース期限（NULL=未取得）
+    last_started_at = Column(DateTime, nullable=True)
+    last_finished_at = Column(DateTime, nullable=True)
+    last_status = Column(String(20), nullable=True)     # 'ok' / 'error'
+    last_duration_ms = Column(Integer, nullable=True)
+    last_detail = Column(Text, nullable=True)           # 直近の結果サマリ（JSON文字列）
+    run_count = Column(Integer, nullable=False, default=0)
+    error_count = Column(Integer, nullable=False, default=0)
+    total_duration_ms = Column(BigInteger, nullable=False, default=0)  # 平均算出用の累計
+    max_duration_ms = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class TStaffMailAccount(Base):
     """T_担当メール連携テーブル（担当スタッフごとのメール受信アカウント）
 
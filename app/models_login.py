@@ -1,7 +1,7 @@
 """
 login-system-app用のSQLAlchemyモデル
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Date, Float
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Date, Float, Index
 from sqlalchemy.sql import func
 from app.db import Base
 
@@ -301,6 +301,7 @@ class TInternalChatMember(Base):
     staff_id = Column(Integer, nullable=False)
     staff_type = Column(String(20), default='admin', comment='admin/employee')
     staff_name = Column(String(255), nullable=True)
+    last_read_message_id = Column(Integer, nullable=True, comment='最後に読んだメッセージID（既読カーソル）。これより大きいIDが未読')
     joined_at = Column(DateTime, server_default=func.now())
 
 
@@ -318,9 +319,13 @@ class TInternalMessage(Base):
     file_name = Column(String(255), nullable=True)
     created_at = Column(DateTime, server_default=func.now())
 
+    __table_args__ = (
+        Index('ix_internal_message_room_id', 'room_id', 'id'),
+    )
+
 
 class TInternalMessageRead(Base):
-    """T_社内メッセージ既読テーブル"""
+    """T_社内メッセージ既読テーブル（旧方式。既読は T_社内チャットメンバー.last_read_message_id に移行済み）"""
     __tablename__ = 'T_社内メッセージ既読'
     id = Column(Integer, primary_key=True, autoincrement=True)
     message_id = Column(Integer, ForeignKey('T_社内メッセージ.id'), nullable=False)
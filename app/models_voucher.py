@@ -225,3 +225,36 @@ class TCreditTransaction(Base):
 
     def __repr__(self):
         return f"<TCreditTransaction(id={self.id}, 利用日={self.利用日}, 利用店名={self.利用店名})>"
+
+
+class TOcrJob(Base):
+    """OCRジョブキュー（通帳・クレジット明細・レシートのアップロード後のOCR処理）
+
+    アップロード時に1件登録し、ワーカー（app.services.ocr_queue）がリースを取って実行する。
+    プロセスが再起動しても queued / リース切れの running は再実行される。
+    """
+    __tablename__ = 'T_OCRジョブ'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(20), nullable=False, index=True, comment='bank / credit / receipt')
+    target_id = Column(Integer, nullable=False, index=True, comment='対象レコードID（T_通帳明細 / T_クレジット明細 / T_証憑）')
+    tenant_id = Column(Integer, ForeignKey('T_テナント.id'), nullable=False, index=True)
+    tenpo_id = Column(Integer, ForeignKey('T_店舗.id'), nullable=True)
+    file_path = Column(String(500), nullable=False, comment='OCR対象ファイルのパス')
+    options = Column(Text, nullable=True, comment='種別ごとの追加パラメータ（JSON）')
+
+    status = Column(String(20), nullable=False, default='queued', index=True, comment='queued / running / done / error')
+    attempts = Column(Integer, nullable=False, default=0, comment='実行回数（リース取得ごとに+1）')
+    next_run_at = Column(DateTime, nullable=True, index=True, comment='次に実行してよい時刻（再試行のバックオフ）')
+    lease_owner = Column(String(100), nullable=True)
+    lease_until = Column(DateTime, nullable=True)
+    progress_done = Column(Integer, nullable=False, default=0, comment='処理済みページ（チャンク）数')
+    progress_total = Column(Integer, nullable=False, default=0, comment='全ページ（チャンク）数')
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, server_default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<TOcrJob(id={self.id}, kind={self.kind}, target_id={self.target_id}, status={self.status})>"
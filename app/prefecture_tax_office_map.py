@@ -1596,6 +1596,61 @@ PREF_TAX_OFFICE_MAP = {
 }
 
 
+# ── 検索用インデックス ──
+# 都道府県ごとに初回利用時に作る。
+#   exact : 市区町村名 → 最初に現れる税事務所の番号
+#   trie  : 市区町村名の文字トライ。各ノードに「そこで終わる市区町村の最小順位」と
+#           「配下の市区町村の最小順位」を持ち、前方一致を市区町村名の長さ分の走査で求める
+#   flat  : (順位, 市区町村名, 税事務所番号) を対応表の順に並べたもの（部分一致の走査用）
+# 順位は対応表の並び順（税事務所順→市区町村順）で、従来の線形走査と同じものが最初に見つかる。
+_INDEX = {}
+_END = '\0end'     # ノードで終わる市区町村の最小順位
+_SUB = '\0sub'     # ノード配下（自身を含む）の市区町村の最小順位
+
+
+def _build_index(prefecture):
+    offices = PREF_TAX_OFFICE_MAP.get(prefecture, [])
+    exact = {}
+    trie = {}
+    flat = []
+    rank = 0
+    for oi, office in enumerate(offices):
+        for muni in office["municipalities"]:
+            exact.setdefault(muni, oi)
+            flat.append((rank, muni, oi))
+            node = trie
+            node.setdefault(_SUB, rank)
+            for ch in muni:
+                node = node.setdefault(ch, {})
+                node.setdefault(_SUB, rank)
+            node.setdefault(_END, rank)
+            rank += 1
+    index = (exact, trie, flat)
+    _INDEX[prefecture] = index
+    return index
+
+
+def _get_index(prefecture):
+    return _INDEX.get(prefecture) or _build_index(prefecture)
+
+
+def _prefix_match_rank(trie, city):
+    """city.startswith(muni) または muni.startswith(city) を満たす市区町村の最小順位"""
+    best = None
+    node = trie
+    for ch in city:
+        # ここまでの文字列と一致する市区町村（city がその市区町村で始まる）
+        if _END in node and (best is None or node[_END] < best):
+            best = node[_END]
+        node = node.get(ch)
+        if node is None:
+            return best
+    # city を最後までたどれた: 配下はすべて city で始まる市区町村
+    if _SUB in node and (best is None or node[_SUB] < best):
+        best = node[_SUB]
+    return best
+
+
 def get_pref_tax_office_name(prefecture: str, city: str) -> str | None:
     """
     都道府県名と市区町村名から都道府県税事務所の正式名称を返す。
@@ -1611,21 +1666,19 @@ def get_pref_tax_office_name(prefecture: str, city: str) -> str | None:
     offices = PREF_TAX_OFFICE_MAP.get(prefecture, [])
     if not offices:
         return None
+    exact, trie, flat = _get_index(prefecture)
     # 完全一致で検索
-    for office in offices:
-        for muni in office["municipalities"]:
-            if muni == city:
-                return office["name"]
+    oi = exact.get(city)
+    if oi is not None:
+        return offices[oi]["name"]
     # 前方一致で検索（市区町村名が郡名を含む場合など）
-    for office in offices:
-        for muni in office["municipalities"]:
-            if city.startswith(muni) or muni.startswith(city):
-                return office["name"]
+    rank = _prefix_match_rank(trie, city)
+    if rank is not None:
+        return offices[flat[rank][2]]["name"]
     # 部分一致で検索
-    for office in offices:
-        for muni in office["municipalities"]:
-            if city in muni or muni in city:
-                return office["name"]
+    for _, muni, oi in flat:
+        if city in muni or muni in city:
+            return offices[oi]["name"]
     return None
 
 
@@ -1640,15 +1693,16 @@ def get_pref_tax_office_candidates(prefecture: str, city: str) -> list[dict]:
     offices = PREF_TAX_OFFICE_MAP.get(prefecture, [])
     if not offices:
         return []
+    exact, _, flat = _get_index(prefecture)
     # 完全一致
-    for office in offices:
-        if city in office["municipalities"]:
-            return [office]
+    oi = exact.get(city)
+    if oi is not None:
+        return [offices[oi]]
     # 部分一致
+    seen = set()
     candidates = []
-    for office in offices:
-        for muni in office["municipalities"]:
-            if city in muni or muni in city:
-                if office not in candidates:
-                    candidates.append(office)
+    for _, muni, oi in flat:
+        if oi not in seen and (city in muni or muni in city):
+            seen.add(oi)
+            candidates.append(offices[oi])
     return candidates
@@ -21,7 +21,9 @@ breeding_logic.py
 """
 
 from __future__ import annotations
-from collections import defaultdict
+import hashlib
+import json
+from collections import defaultdict, namedtuple
 from typing import Any
 
 # ---------------------------------------------------------------------------
@@ -38,6 +40,19 @@ def _get_dog_name(dog_id: int, db) -> str:
         return f'ID:{dog_id}'
 
 
+def _fetch_pedigree_rows(dog_ids: list[int], db) -> list[tuple]:
+    """
+    dog_ids の (id, name, father_id, mother_id) を IN 句で一括取得する。
+    テスト時にモンキーパッチ可能。
+    """
+    from app.models_breeder import Dog
+    return [
+        tuple(row) for row in
+        db.query(Dog.id, Dog.name, Dog.father_id, Dog.mother_id)
+          .filter(Dog.id.in_(dog_ids)).all()
+    ]
+
+
 # ---------------------------------------------------------------------------
 # 1. 祖先取得
 # ---------------------------------------------------------------------------
@@ -132,6 +147,134 @@ def _walk(
     _walk(dog.mother_id, depth + 1, max_depth, result, db, visited)
 
 
+# ---------------------------------------------------------------------------
+# 1-b. 血統グラフ（一括ロード＋メモ化）
+# ---------------------------------------------------------------------------
+
+# IN 句 1 回あたりの最大 ID 数
+_PEDIGREE_IN_CHUNK = 500
+
+
+class _PedigreeNode:
+    """血統グラフの 1 ノード（Dog の必要最小限の属性のみ）。"""
+
+    __slots__ = ('id', 'name', 'father_id', 'mother_id')
+
+    def __init__(self, dog_id, name, father_id, mother_id):
+        self.id = dog_id
+        self.name = name
+        self.father_id = father_id
+        self.mother_id = mother_id
+
+
+class PedigreeGraph:
+    """
+    1 回の評価（または複数ペアの一括評価）で共有する血統グラフ。
+
+    get_ancestors / _walk は祖先ノード・経路ごとに db.query(Dog) を発行するが、
+    こちらは世代単位で (id, name, father_id, mother_id) を IN 句で一括取得して
+    隣接リストに保持する。祖先の世代距離（get_ancestors 相当）と
+    祖先自身の近交係数 F_A をメモ化し、COI・AVK・祖先集中度・ライン依存度で共有する。
+
+    評価中に犬レコードが更新されることは想定しない（評価ごとに作り直す）。
+    """
+
+    def __init__(self, db, dog_ids=()):
+        self.db = db
+        self.nodes: dict[int, _PedigreeNode | None] = {}
+        self.fa_cache: dict[tuple[int, int], float] = {}
+        self.query_count = 0
+        self._ancestors_memo: dict[tuple[int, int], dict[int, list[int]]] = {}
+        if dog_ids:
+            self.load(dog_ids)
+
+    def load(self, dog_ids) -> None:
+        """dog_ids とその全祖先を、世代ごとに 1 回の一括クエリで読み込む。"""
+        frontier = {i for i in dog_ids if i is not None and i not in self.nodes}
+        while frontier:
+            ids = sorted(frontier)
+            found: dict[int, _PedigreeNode] = {}
+            for i in range(0, len(ids), _PEDIGREE_IN_CHUNK):
+                rows = _fetch_pedigree_rows(ids[i:i + _PEDIGREE_IN_CHUNK], self.db)
+                self.query_count += 1
+                for dog_id, name, father_id, mother_id in rows:
+                    found[dog_id] = _PedigreeNode(dog_id, name, father_id, mother_id)
+
+            parent_ids = set()
+            for dog_id in ids:
+                node = found.get(dog_id)
+                self.nodes[dog_id] = node
+                if node is not None:
+                    parent_ids.add(node.father_id)
+                    parent_ids.add(node.mother_id)
+            frontier = {p for p in parent_ids if p is not None and p not in self.nodes}
+
+    def get(self, dog_id: int | None) -> _PedigreeNode | None:
+        """犬ノードを返す（未ロードなら祖先ごと読み込む）。存在しなければ None。"""
+        if dog_id is None:
+            return None
+        if dog_id not in self.nodes:
+            self.load([dog_id])
+        return self.nodes.get(dog_id)
+
+    def name(self, dog_id: int) -> str:
+        node = self.get(dog_id)
+        return node.name if node else f'ID:{dog_id}'
+
+    def ancestors(self, dog_id: int | None, max_depth: int) -> dict[int, list[int]]:
+        """
+        get_ancestors と同じ形式・同じ探索順で祖先の世代距離を返す（メモ化）。
+        戻り値は評価内で共有されるため、呼び出し側で変更しないこと。
+        """
+        key = (dog_id, max_depth)
+        memo = self._ancestors_memo.get(key)
+        if memo is None:
+            if dog_id is not None:
+                self.get(dog_id)
+            result: dict[int, list[int]] = defaultdict(list)
+            self._walk(dog_id, 0, max_depth, result, set())
+            memo = self._ancestors_memo[key] = dict(result)
+        return memo
+
+    def _walk(self, dog_id, depth, max_depth, result, visited) -> None:
+        """_walk と同じ DFS をメモリ上の隣接リストで行う。"""
+        if dog_id is None or depth > max_depth:
+            return
+        if depth > 0:
+            result[dog_id].append(depth)
+        key = (dog_id, depth)
+        if key in visited:
+            return
+        visited.add(key)
+        node = self.nodes.get(dog_id)
+        if node is None:
+            return
+        self._walk(node.father_id, depth + 1, max_depth, result, visited)
+        self._walk(node.mother_id, depth + 1, max_depth, result, visited)
+
+
+def _ancestors_of(dog_id: int | None, max_depth: int, db, graph: PedigreeGraph | None) -> dict[int, list[int]]:
+    """graph があればメモ化済みの祖先を、なければ get_ancestors の結果を返す。"""
+    if graph is not None:
+        return graph.ancestors(dog_id, max_depth)
+    return get_ancestors(dog_id, max_depth, db)
+
+
+def _name_of(dog_id: int, db, graph: PedigreeGraph | None) -> str:
+    """graph があればグラフから、なければ _get_dog_name で犬名を返す。"""
+    if graph is not None:
+        return graph.name(dog_id)
+    return _get_dog_name(dog_id, db)
+
+
+def _dog_getter(db, graph: PedigreeGraph | None):
+    """dog_id -> 犬（father_id / mother_id / name を持つ）を返す関数を作る。"""
+    if graph is not None:
+        return graph.get
+    from app.models_breeder import Dog
+    return lambda dog_id: db.query(Dog).filter(Dog.id == dog_id).first()
+
+
 # ---------------------------------------------------------------------------
 # 2. 共通祖先の抽出
 # ---------------------------------------------------------------------------
@@ -141,9 +284,11 @@ def find_common_ancestors(
     dam_id: int,
     max_depth: int,
     db,
+    graph: PedigreeGraph | None = None,
 ) -> dict[int, dict]:
     """
     父犬・母犬の共通祖先を抽出する。
+    graph を渡した場合は DB を引かずに血統グラフから求める。
 
     Returns
     -------
@@ -152,8 +297,8 @@ def find_common_ancestors(
         'dam_gens':  [int, ...],   # 母犬側からの世代距離リスト
     }]
     """
-    sire_anc = get_ancestors(sire_id, max_depth, db)
-    dam_anc  = get_ancestors(dam_id,  max_depth, db)
+    sire_anc = _ancestors_of(sire_id, max_depth, db, graph)
+    dam_anc  = _ancestors_of(dam_id,  max_depth, db, graph)
 
     common: dict[int, dict] = {}
     for anc_id in set(sire_anc.keys()) & set(dam_anc.keys()):
@@ -173,10 +318,13 @@ def calculate_ancestor_inbreeding(
     max_depth: int,
     db,
     _cache: dict | None = None,
+    graph: PedigreeGraph | None = None,
 ) -> float:
     """
     共通祖先 A 自身の近交係数 F_A を計算する。
     その犬の父母から再帰的に calculate_coi を呼び出す。
+    graph を渡した場合、F_A は graph.fa_cache に (dog_id, max_depth) 単位で保持され、
+    同じ評価内の全指標・全ペアで共有される。
 
     Returns
     -------
@@ -184,6 +332,18 @@ def calculate_ancestor_inbreeding(
     """
     if dog_id is None:
         return 0.0
+    if graph is not None:
+        key = (dog_id, max_depth)
+        if key in graph.fa_cache:
+            return graph.fa_cache[key]
+        # 循環した血統データで無限再帰しないよう、計算中は 0.0 を入れておく
+        graph.fa_cache[key] = 0.0
+        node = graph.get(dog_id)
+        if node is None or node.father_id is None or node.mother_id is None:
+            return 0.0
+        fa = calculate_coi(node.father_id, node.mother_id, max_depth, db, graph=graph)['coi']
+        graph.fa_cache[key] = fa
+        return fa
     if _cache is None:
         _cache = {}
     if dog_id in _cache:
@@ -211,6 +371,7 @@ def calculate_coi(
     max_depth: int = 5,
     db=None,
     _fa_cache: dict | None = None,
+    graph: PedigreeGraph | None = None,
 ) -> dict:
     """
     ライトの近交係数公式で COI を計算する。
@@ -224,6 +385,7 @@ def calculate_coi(
     max_depth : 最大探索世代数（デフォルト 5）
     db        : SQLAlchemy セッション
     _fa_cache : F_A 計算の再帰キャッシュ（内部用）
+    graph     : 共有する血統グラフ（省略時は従来どおり 1 頭ずつ DB を引く）
 
     Returns
     -------
@@ -235,7 +397,10 @@ def calculate_coi(
     if _fa_cache is None:
         _fa_cache = {}
 
-    common = find_common_ancestors(sire_id, dam_id, max_depth, db)
+    if graph is not None:
+        common = find_common_ancestors(sire_id, dam_id, max_depth, db, graph=graph)
+    else:
+        common = find_common_ancestors(sire_id, dam_id, max_depth, db)
 
     total_coi = 0.0
     common_ancestors_detail = []
@@ -245,7 +410,10 @@ def calculate_coi(
         dam_gens  = gens['dam_gens']
 
         # 共通祖先自身の F_A を再帰計算
-        fa = calculate_ancestor_inbreeding(anc_id, max_depth, db, _fa_cache)
+        if graph is not None:
+            fa = calculate_ancestor_inbreeding(anc_id, max_depth, db, graph=graph)
+        else:
+            fa = calculate_ancestor_inbreeding(anc_id, max_depth, db, _fa_cache)
 
         # 全経路の組み合わせで寄与率を計算
         paths_detail = []
@@ -270,7 +438,7 @@ def calculate_coi(
         patterns = list({f'{n1}x{n2}' for n1 in sire_gens for n2 in dam_gens})
 
         # 祖先名を取得
-        anc_name = _get_dog_name(anc_id, db)
+        anc_name = _name_of(anc_id, db, graph)
 
         common_ancestors_detail.append({
             'dog_id': anc_id,
@@ -327,6 +495,7 @@ def detect_close_inbreeding_patterns(
     sire_id: int,
     dam_id: int,
     db,
+    graph: PedigreeGraph | None = None,
 ) -> list[dict]:
     """
     危険な近親交配パターンを検出する。
@@ -343,12 +512,12 @@ def detect_close_inbreeding_patterns(
     -------
     list of dict: [{type, ancestor_id, ancestor_name, severity}, ...]
     """
-    from app.models_breeder import Dog
+    get_dog = _dog_getter(db, graph)
 
     patterns = []
 
-    sire = db.query(Dog).filter(Dog.id == sire_id).first()
-    dam  = db.query(Dog).filter(Dog.id == dam_id).first()
+    sire = get_dog(sire_id)
+    dam  = get_dog(dam_id)
     if not sire or not dam:
         return patterns
 
@@ -375,7 +544,7 @@ def detect_close_inbreeding_patterns(
 
     if len(shared_parents) == 2:
         for pid in shared_parents:
-            parent = db.query(Dog).filter(Dog.id == pid).first()
+            parent = get_dog(pid)
             pname = parent.name if parent else f'ID:{pid}'
             patterns.append({
                 'type': '兄妹交配',
@@ -385,7 +554,7 @@ def detect_close_inbreeding_patterns(
             })
     elif len(shared_parents) == 1:
         pid = list(shared_parents)[0]
-        parent = db.query(Dog).filter(Dog.id == pid).first()
+        parent = get_dog(pid)
         pname = parent.name if parent else f'ID:{pid}'
         patterns.append({
             'type': '半兄妹交配',
@@ -397,7 +566,7 @@ def detect_close_inbreeding_patterns(
     # --- 祖父母×孫（1世代先の親の親が相手） ---
     sire_grandparents = set()
     for pid in sire_parents:
-        p = db.query(Dog).filter(Dog.id == pid).first()
+        p = get_dog(pid)
         if p:
             if p.father_id: sire_grandparents.add(p.father_id)
             if p.mother_id: sire_grandparents.add(p.mother_id)
@@ -412,7 +581,7 @@ def detect_close_inbreeding_patterns(
 
     dam_grandparents = set()
     for pid in dam_parents:
-        p = db.query(Dog).filter(Dog.id == pid).first()
+        p = get_dog(pid)
         if p:
             if p.father_id: dam_grandparents.add(p.father_id)
             if p.mother_id: dam_grandparents.add(p.mother_id)
@@ -426,7 +595,10 @@ def detect_close_inbreeding_patterns(
         })
 
     # --- 共通祖先の出現パターン（2x2, 2x3, 3x3 等）---
-    common = find_common_ancestors(sire_id, dam_id, max_depth=5, db=db)
+    if graph is not None:
+        common = find_common_ancestors(sire_id, dam_id, max_depth=5, db=db, graph=graph)
+    else:
+        common = find_common_ancestors(sire_id, dam_id, max_depth=5, db=db)
 
     if len(common) >= 3:
         patterns.append({
@@ -437,8 +609,7 @@ def detect_close_inbreeding_patterns(
         })
 
     for anc_id, gens in common.items():
-        from app.models_breeder import Dog as DogModel
-        anc = db.query(DogModel).filter(DogModel.id == anc_id).first()
+        anc = get_dog(anc_id)
         anc_name = anc.name if anc else f'ID:{anc_id}'
 
         for n1 in gens['sire_gens']:
@@ -482,6 +653,7 @@ def calculate_genetic_disease_risk(
     sire_id: int,
     dam_id: int,
     db,
+    prefetch: MatingPrefetch | None = None,
 ) -> list[dict]:
     """
     両親の遺伝病検査結果を比較してリスクを評価する。
@@ -498,14 +670,18 @@ def calculate_genetic_disease_risk(
     -------
     list of dict: [{disease_name, sire_status, dam_status, risk, message}, ...]
     """
-    from app.models_breeder import GeneticTestResult
+    if prefetch is not None:
+        sire_genes = prefetch.genes(sire_id)
+        dam_genes  = prefetch.genes(dam_id)
+    else:
+        from app.models_breeder import GeneticTestResult
 
-    sire_genes = db.query(GeneticTestResult).filter(
-        GeneticTestResult.dog_id == sire_id
-    ).all()
-    dam_genes = db.query(GeneticTestResult).filter(
-        GeneticTestResult.dog_id == dam_id
-    ).all()
+        sire_genes = db.query(GeneticTestResult).filter(
+            GeneticTestResult.dog_id == sire_id
+        ).all()
+        dam_genes = db.query(GeneticTestResult).filter(
+            GeneticTestResult.dog_id == dam_id
+        ).all()
 
     sire_map = {g.disease_name: g.result for g in sire_genes}
     dam_map  = {g.disease_name: g.result for g in dam_genes}
@@ -561,6 +737,7 @@ def build_warnings_and_points(
     sire_id: int,
     dam_id: int,
     db,
+    graph: PedigreeGraph | None = None,
 ) -> tuple[list[str], list[str], list[str]]:
     """
     警告・ポジティブポイント・ネガティブポイントを生成する。
@@ -624,9 +801,9 @@ def build_warnings_and_points(
         positive.append('登録済みの遺伝病検査では高リスクな組み合わせは検出されませんでした。')
 
     # 血統情報不足
-    from app.models_breeder import Dog
-    sire = db.query(Dog).filter(Dog.id == sire_id).first()
-    dam  = db.query(Dog).filter(Dog.id == dam_id).first()
+    get_dog = _dog_getter(db, graph)
+    sire = get_dog(sire_id)
+    dam  = get_dog(dam_id)
     if sire and (sire.father_id is None and sire.mother_id is None):
         warnings.append('父犬の血統情報（父母）が未登録です。COI計算が不完全な可能性があります。')
     if dam and (dam.father_id is None and dam.mother_id is None):
@@ -782,6 +959,10 @@ def evaluate_mating_compatibility(
     max_depth: int = 5,
     db=None,
     use_ai_comment: bool = True,
+    graph: PedigreeGraph | None = None,
+    prefetch: MatingPrefetch | None = None,
+    coi_result: dict | None = None,
+    use_cache: bool = False,
 ) -> dict:
     """
     交配相性の総合評価を返すメイン関数。
@@ -793,18 +974,29 @@ def evaluate_mating_compatibility(
     max_depth      : 最大探索世代数（デフォルト 5）
     db             : SQLAlchemy セッション
     use_ai_comment : AI コメントを使用するか（デフォルト True）
+    graph          : 共有する血統グラフ（省略時はこの評価用に作成する）
+    prefetch       : 一括読み込み済みの遺伝病検査等（省略時は DB を引く）
+    coi_result     : 計算済みの calculate_coi の結果（省略時は計算する）
+    use_cache      : True なら COI を PedigreeMetricsCache から取得する
 
     Returns
     -------
     dict : 仕様書 # 8 の出力 JSON 形式に準拠
     """
-    from app.models_breeder import Dog
+    if graph is None:
+        graph = PedigreeGraph(db, (sire_id, dam_id))
 
-    sire = db.query(Dog).filter(Dog.id == sire_id).first()
-    dam  = db.query(Dog).filter(Dog.id == dam_id).first()
+    sire = graph.get(sire_id)
+    dam  = graph.get(dam_id)
 
     # --- COI 計算（数式ロジック）---
-    coi_result = calculate_coi(sire_id, dam_id, max_depth, db)
+    if coi_result is None:
+        if use_cache:
+            cache = PedigreeMetricsCache(db, graph)
+            coi_result = cache.get(sire_id, dam_id, max_depth)['coi']
+            cache.save()
+        else:
+            coi_result = calculate_coi(sire_id, dam_id, max_depth, db, graph=graph)
     coi        = coi_result['coi']
     coi_pct    = coi_result['coi_percent']
     common_ancestors = coi_result['common_ancestors']
@@ -813,14 +1005,18 @@ def evaluate_mating_compatibility(
     rank_info = get_coi_rank(coi_pct)
 
     # --- 近親パターン検出 ---
-    close_patterns = detect_close_inbreeding_patterns(sire_id, dam_id, db)
+    close_patterns = detect_close_inbreeding_patterns(sire_id, dam_id, db, graph=graph)
 
     # --- 遺伝病リスク ---
-    gene_risks = calculate_genetic_disease_risk(sire_id, dam_id, db)
+    if prefetch is not None:
+        gene_risks = calculate_genetic_disease_risk(sire_id, dam_id, db, prefetch=prefetch)
+    else:
+        gene_risks = calculate_genetic_disease_risk(sire_id, dam_id, db)
 
     # --- 警告・ポイント ---
     warnings, positive_points, negative_points = build_warnings_and_points(
-        coi_pct, close_patterns, gene_risks, common_ancestors, sire_id, dam_id, db
+        coi_pct, close_patterns, gene_risks, common_ancestors, sire_id, dam_id, db,
+        graph=graph,
     )
 
     # --- 改善案（ルールベース）---
@@ -871,7 +1067,7 @@ def evaluate_mating_compatibility(
 # AVK（Ancestor Loss Coefficient）計算
 # ---------------------------------------------------------------------------
 
-def calculate_avk(sire_id: int, dam_id: int, max_depth: int, db) -> dict:
+def calculate_avk(sire_id: int, dam_id: int, max_depth: int, db, graph: PedigreeGraph | None = None) -> dict:
     """
     AVK（Ancestor Loss Coefficient / 祖先消失係数）を計算する。
 
@@ -894,8 +1090,8 @@ def calculate_avk(sire_id: int, dam_id: int, max_depth: int, db) -> dict:
         ancestor_loss_percent : float 祖先消失率%
         diversity_level     : str   多様性レベル
     """
-    sire_ancestors = get_ancestors(sire_id, max_depth, db)
-    dam_ancestors  = get_ancestors(dam_id,  max_depth, db)
+    sire_ancestors = _ancestors_of(sire_id, max_depth, db, graph)
+    dam_ancestors  = _ancestors_of(dam_id,  max_depth, db, graph)
 
     # 子犬視点の祖先（父・母の祖先 + 父・母自身）
     all_ancestor_ids = set(sire_ancestors.keys()) | set(dam_ancestors.keys())
@@ -938,7 +1134,7 @@ def calculate_avk(sire_id: int, dam_id: int, max_depth: int, db) -> dict:
 # 祖先集中度スコア
 # ---------------------------------------------------------------------------
 
-def calculate_ancestor_concentration(sire_id: int, dam_id: int, max_depth: int, db) -> list:
+def calculate_ancestor_concentration(sire_id: int, dam_id: int, max_depth: int, db, graph: PedigreeGraph | None = None) -> list:
     """
     同一祖先が何回出現しているかを集計し、集中度を返す。
 
@@ -951,8 +1147,8 @@ def calculate_ancestor_concentration(sire_id: int, dam_id: int, max_depth: int,
         generations         : list 出現した世代のリスト（重複あり）
         concentration_level : str  通常/軽度/中度/高度
     """
-    sire_ancestors = get_ancestors(sire_id, max_depth, db)
-    dam_ancestors  = get_ancestors(dam_id,  max_depth, db)
+    sire_ancestors = _ancestors_of(sire_id, max_depth, db, graph)
+    dam_ancestors  = _ancestors_of(dam_id,  max_depth, db, graph)
 
     all_ids = set(sire_ancestors.keys()) | set(dam_ancestors.keys())
     result = []
@@ -978,7 +1174,7 @@ def calculate_ancestor_concentration(sire_id: int, dam_id: int, max_depth: int,
 
         result.append({
             'dog_id': anc_id,
-            'name': _get_dog_name(anc_id, db),
+            'name': _name_of(anc_id, db, graph),
             'appearance_count': count,
             'sire_appearances': len(sire_gens),
             'dam_appearances': len(dam_gens),
@@ -995,7 +1191,14 @@ def calculate_ancestor_concentration(sire_id: int, dam_id: int, max_depth: int,
 # ライン依存度
 # ---------------------------------------------------------------------------
 
-def calculate_line_dependency(sire_id: int, dam_id: int, max_depth: int, db) -> dict:
+def calculate_line_dependency(
+    sire_id: int,
+    dam_id: int,
+    max_depth: int,
+    db,
+    graph: PedigreeGraph | None = None,
+    concentration: list | None = None,
+) -> dict:
     """
     特定の祖先または血統ラインへの依存度を計算する。
 
@@ -1008,8 +1211,11 @@ def calculate_line_dependency(sire_id: int, dam_id: int, max_depth: int, db) ->
         dependency_level    : str  low/medium/high/very_high
         total_appearances   : int  全祖先の出現数合計
         top_ancestors       : list 上位5祖先
+
+    concentration を渡した場合は祖先集中度を再計算しない。
     """
-    concentration = calculate_ancestor_concentration(sire_id, dam_id, max_depth, db)
+    if concentration is None:
+        concentration = calculate_ancestor_concentration(sire_id, dam_id, max_depth, db, graph=graph)
 
     if not concentration:
         return {
@@ -1189,7 +1395,7 @@ def evaluate_breed_risks(sire_breed: str | None, dam_breed: str | None, sire_gen
 # 健康履歴評価
 # ---------------------------------------------------------------------------
 
-def evaluate_health_records(sire_id: int, dam_id: int, db) -> dict:
+def evaluate_health_records(sire_id: int, dam_id: int, db, prefetch: MatingPrefetch | None = None) -> dict:
     """
     父犬・母犬の健康履歴を評価し、リスクスコアと警告を返す。
 
@@ -1207,11 +1413,14 @@ def evaluate_health_records(sire_id: int, dam_id: int, db) -> dict:
     dam_issues  = []
 
     for dog_id, side, issues in [(sire_id, '父犬', sire_issues), (dam_id, '母犬', dam_issues)]:
-        try:
-            from app.models_breeder import DogHealthRecord
-            records = db.query(DogHealthRecord).filter(DogHealthRecord.dog_id == dog_id).all()
-        except Exception:
-            records = []
+        if prefetch is not None:
+            records = prefetch.health_records(dog_id)
+        else:
+            try:
+                from app.models_breeder import DogHealthRecord
+                records = db.query(DogHealthRecord).filter(DogHealthRecord.dog_id == dog_id).all()
+            except Exception:
+                records = []
 
         for r in records:
             issue = {
@@ -1260,7 +1469,7 @@ def evaluate_health_records(sire_id: int, dam_id: int, db) -> dict:
 # 繁殖履歴評価
 # ---------------------------------------------------------------------------
 
-def evaluate_breeding_history(sire_id: int, dam_id: int, db) -> dict:
+def evaluate_breeding_history(sire_id: int, dam_id: int, db, prefetch: MatingPrefetch | None = None) -> dict:
     """
     父犬・母犬の繁殖履歴を評価し、統計と警告を返す。
 
@@ -1275,6 +1484,8 @@ def evaluate_breeding_history(sire_id: int, dam_id: int, db) -> dict:
     warnings = []
 
     def _calc_stats(dog_id: int, role: str) -> dict:
+        if prefetch is not None:
+            return prefetch.breeding_stats(dog_id, role)
         try:
             from app.models_breeder import BreedingHistory
             if role == 'sire':
@@ -1283,29 +1494,7 @@ def evaluate_breeding_history(sire_id: int, dam_id: int, db) -> dict:
                 records = db.query(BreedingHistory).filter(BreedingHistory.dam_id == dog_id).all()
         except Exception:
             records = []
-
-        total = len(records)
-        if total == 0:
-            return {'total_litters': 0, 'success_rate': None, 'avg_puppy_count': None, 'stillbirth_rate': None, 'c_section_rate': None}
-
-        success = sum(1 for r in records if r.pregnancy_result == 'success')
-        total_puppies    = sum(r.puppy_count or 0 for r in records)
-        live_births      = sum(r.live_birth_count or 0 for r in records)
-        stillbirths      = sum(r.stillbirth_count or 0 for r in records)
-        c_sections       = sum(1 for r in records if r.c_section)
-
-        success_rate     = round(success / total * 100, 1) if total > 0 else None
-        avg_puppies      = round(total_puppies / total, 1) if total > 0 else None
-        stillbirth_rate  = round(stillbirths / total_puppies * 100, 1) if total_puppies > 0 else None
-        c_section_rate   = round(c_sections / total * 100, 1) if total > 0 else None
-
-        return {
-            'total_litters': total,
-            'success_rate': success_rate,
-            'avg_puppy_count': avg_puppies,
-            'stillbirth_rate': stillbirth_rate,
-            'c_section_rate': c_section_rate,
-        }
+        return _breeding_stats(records)
 
     sire_stats = _calc_stats(sire_id, 'sire')
     dam_stats  = _calc_stats(dam_id,  'dam')
@@ -1313,11 +1502,14 @@ def evaluate_breeding_history(sire_id: int, dam_id: int, db) -> dict:
     # 同ペアの過去記録
     pair_history = []
     try:
-        from app.models_breeder import BreedingHistory
-        pairs = db.query(BreedingHistory).filter(
-            BreedingHistory.sire_id == sire_id,
-            BreedingHistory.dam_id == dam_id
-        ).all()
+        if prefetch is not None:
+            pairs = prefetch.pair_histories(sire_id, dam_id)
+        else:
+            from app.models_breeder import BreedingHistory
+            pairs = db.query(BreedingHistory).filter(
+                BreedingHistory.sire_id == sire_id,
+                BreedingHistory.dam_id == dam_id
+            ).all()
         for p in pairs:
             pair_history.append({
                 'mating_date': str(p.mating_date) if p.mating_date else None,
@@ -1346,11 +1538,37 @@ def evaluate_breeding_history(sire_id: int, dam_id: int, db) -> dict:
     }
 
 
+def _breeding_stats(records: list) -> dict:
+    """繁殖履歴レコードから出産回数・成功率等の統計を算出する。"""
+    total = len(records)
+    if total == 0:
+        return {'total_litters': 0, 'success_rate': None, 'avg_puppy_count': None, 'stillbirth_rate': None, 'c_section_rate': None}
+
+    success = sum(1 for r in records if r.pregnancy_result == 'success')
+    total_puppies    = sum(r.puppy_count or 0 for r in records)
+    live_births      = sum(r.live_birth_count or 0 for r in records)
+    stillbirths      = sum(r.stillbirth_count or 0 for r in records)
+    c_sections       = sum(1 for r in records if r.c_section)
+
+    success_rate     = round(success / total * 100, 1) if total > 0 else None
+    avg_puppies      = round(total_puppies / total, 1) if total > 0 else None
+    stillbirth_rate  = round(stillbirths / total_puppies * 100, 1) if total_puppies > 0 else None
+    c_section_rate   = round(c_sections / total * 100, 1) if total > 0 else None
+
+    return {
+        'total_litters': total,
+        'success_rate': success_rate,
+        'avg_puppy_count': avg_puppies,
+        'stillbirth_rate': stillbirth_rate,
+        'c_section_rate': c_section_rate,
+    }
+
+
 # ---------------------------------------------------------------------------
 # 産子実績評価
 # ---------------------------------------------------------------------------
 
-def evaluate_offspring_performance(sire_id: int, dam_id: int, db) -> dict:
+def evaluate_offspring_performance(sire_id: int, dam_id: int, db, prefetch: MatingPrefetch | None = None) -> dict:
     """
     過去産子データから産子実績スコアを算出する。
 
@@ -1368,14 +1586,17 @@ def evaluate_offspring_performance(sire_id: int, dam_id: int, db) -> dict:
     """
     warnings = []
 
-    try:
-        from app.models_breeder import BreedingHistory, PuppyRecord, PuppyFollowUp
-        histories = db.query(BreedingHistory).filter(
-            BreedingHistory.sire_id == sire_id,
-            BreedingHistory.dam_id == dam_id
-        ).all()
-    except Exception:
-        histories = []
+    if prefetch is not None:
+        histories = prefetch.pair_histories(sire_id, dam_id)
+    else:
+        try:
+            from app.models_breeder import BreedingHistory, PuppyRecord, PuppyFollowUp
+            histories = db.query(BreedingHistory).filter(
+                BreedingHistory.sire_id == sire_id,
+                BreedingHistory.dam_id == dam_id
+            ).all()
+        except Exception:
+            histories = []
 
     if not histories:
         return {
@@ -1397,10 +1618,13 @@ def evaluate_offspring_performance(sire_id: int, dam_id: int, db) -> dict:
     disease_count  = 0
 
     for h in histories:
-        try:
-            puppies = db.query(PuppyRecord).filter(PuppyRecord.breeding_history_id == h.id).all()
-        except Exception:
-            puppies = []
+        if prefetch is not None:
+            puppies = prefetch.puppies(h.id)
+        else:
+            try:
+                puppies = db.query(PuppyRecord).filter(PuppyRecord.breeding_history_id == h.id).all()
+            except Exception:
+                puppies = []
 
         for p in puppies:
             total_puppies += 1
@@ -1412,6 +1636,10 @@ def evaluate_offspring_performance(sire_id: int, dam_id: int, db) -> dict:
                 defect_count += 1
 
             # フォローアップで疾患発見
+            if prefetch is not None:
+                if prefetch.has_disease_followup(p.id):
+                    disease_count += 1
+                continue
             try:
                 followups = db.query(PuppyFollowUp).filter(
                     PuppyFollowUp.puppy_id == p.id,
@@ -1648,71 +1876,467 @@ def calculate_total_score(
     }
 
 
+# ---------------------------------------------------------------------------
+# 血統由来指標（COI・AVK・祖先集中度・ライン依存度）の永続キャッシュ
+# ---------------------------------------------------------------------------
+
+# 指標の計算方法や出力形式を変えたら上げる（保存済みキャッシュを一括で無効化する）
+PEDIGREE_CACHE_VERSION = 1
+
+
+def calculate_pedigree_metrics(
+    sire_id: int,
+    dam_id: int,
+    max_depth: int,
+    db,
+    graph: PedigreeGraph | None = None,
+) -> dict:
+    """
+    血統だけで決まる 4 指標をまとめて計算する。
+
+    Returns
+    -------
+    dict: coi（calculate_coi の戻り値）, avk, ancestor_concentration, line_dependency
+    """
+    if graph is None:
+        graph = PedigreeGraph(db, (sire_id, dam_id))
+    coi_result = calculate_coi(sire_id, dam_id, max_depth, db, graph=graph)
+    avk = calculate_avk(sire_id, dam_id, max_depth, db, graph=graph)
+    concentration = calculate_ancestor_concentration(sire_id, dam_id, max_depth, db, graph=graph)
+    line_dep = calculate_line_dependency(
+        sire_id, dam_id, max_depth, db, graph=graph, concentration=concentration,
+    )
+    return {
+        'coi': coi_result,
+        'avk': avk,
+        'ancestor_concentration': concentration,
+        'line_dependency': line_dep,
+    }
+
+
+def _fetch_pedigree_ancestor_rows(dog_ids: list[int], db) -> list[tuple]:
+    """
+    dog_ids の血統書祖先情報
+    (dog_id, generation, position, name, registration_number) を一括取得する。
+    テスト時にモンキーパッチ可能。
+    """
+    from app.models_breeder import PedigreeAncestor
+    return [
+        tuple(row) for row in
+        db.query(
+            PedigreeAncestor.dog_id, PedigreeAncestor.generation, PedigreeAncestor.position,
+            PedigreeAncestor.name, PedigreeAncestor.registration_number,
+        ).filter(PedigreeAncestor.dog_id.in_(dog_ids)).all()
+    ]
+
+
+# 再計算したキャッシュ行（呼び出し元のセッションの ORM 行は書き換えない）
+_CacheEntry = namedtuple('_CacheEntry', 'pedigree_hash result_json')
+
+
+def _cache_session(db):
+    """キャッシュ保存用に、呼び出し元と同じ接続先の別セッションを開く。"""
+    from sqlalchemy.orm import Session
+    return Session(bind=db.get_bind())
+
+
+class PedigreeMetricsCache:
+    """
+    calculate_pedigree_metrics の結果を MatingPedigreeCache テーブルに永続化する。
+
+    キーは (sire_id, dam_id, max_depth)。有効性は血統指紋 pedigree_hash で判定する。
+    指紋は父犬・母犬から辿れる全祖先（F_A の再帰計算が参照する範囲）の
+    (id, 犬名, father_id, mother_id) と PedigreeAncestor 行から作るため、
+    どこかの祖先の父母・犬名・血統書祖先情報が変わると、その祖先を含むペアだけが
+    次回参照時に再計算され、無関係なペアは保存済みの結果がそのまま使われる。
+
+    再計算した結果は get() でためておき、save() で別セッションにまとめてコミットする
+    （呼び出し元のセッションのトランザクションはコミットもロールバックもしない）。
+    """
+
+    def __init__(self, db, graph: PedigreeGraph | None = None):
+        self.db = db
+        self.graph = graph if graph is not None else PedigreeGraph(db)
+        self.hits = 0
+        self.misses = 0
+        self._rows: dict[tuple[int, int, int], Any] = {}
+        self._closures: dict[int, frozenset] = {}
+        self._ancestor_rows: dict[int, list[tuple]] = {}
+        self._dirty: dict[tuple[int, int, int], _CacheEntry] = {}
+
+    def prefetch(self, pairs, max_depth: int) -> None:
+        """複数ペアの血統と保存済みキャッシュ行をまとめて読み込む。"""
+        pairs = [(s, d) for s, d in pairs if (s, d, max_depth) not in self._rows]
+        if not pairs:
+            return
+        self.graph.load([dog_id for pair in pairs for dog_id in pair])
+        for sire_id, dam_id in pairs:
+            self._rows[(sire_id, dam_id, max_depth)] = None
+
+        wanted = set(pairs)
+        try:
+            from app.models_breeder import MatingPedigreeCache
+            for chunk in _in_chunks({s for s, _ in pairs}):
+                rows = self.db.query(MatingPedigreeCache).filter(
+                    MatingPedigreeCache.sire_id.in_(chunk),
+                    MatingPedigreeCache.max_depth == max_depth,
+                ).all()
+                for row in rows:
+                    if (row.sire_id, row.dam_id) in wanted:
+                        self._rows[(row.sire_id, row.dam_id, max_depth)] = row
+        except Exception:
+            pass
+
+    def closure(self, dog_id: int) -> frozenset:
+        """dog_id 自身と全祖先の ID 集合を返す（メモ化）。"""
+        ids = self._closures.get(dog_id)
+        if ids is None:
+            seen = set()
+            stack = [dog_id]
+            while stack:
+                x = stack.pop()
+                if x is None or x in seen:
+                    continue
+                seen.add(x)
+                node = self.graph.get(x)
+                if node is not None:
+                    stack.append(node.father_id)
+                    stack.append(node.mother_id)
+            ids = self._closures[dog_id] = frozenset(seen)
+        return ids
+
+    def _load_ancestor_rows(self, dog_ids) -> None:
+        missing = [i for i in dog_ids if i not in self._ancestor_rows]
+        for dog_id in missing:
+            self._ancestor_rows[dog_id] = []
+        try:
+            for chunk in _in_chunks(missing):
+                for row in _fetch_pedigree_ancestor_rows(chunk, self.db):
+                    self._ancestor_rows[row[0]].append(row)
+        except Exception:
+            pass
+
+    def fingerprint(self, sire_id: int, dam_id: int, max_depth: int) -> str:
+        """ペアの血統指紋（SHA-256 の 16 進文字列）を返す。"""
+        ids = self.closure(sire_id) | self.closure(dam_id)
+        self._load_ancestor_rows(ids)
+        h = hashlib.sha256(f'v{PEDIGREE_CACHE_VERSION}:{sire_id}:{dam_id}:{max_depth}'.encode())
+        for dog_id in sorted(ids):
+            node = self.graph.get(dog_id)
+            entry = [dog_id, None] if node is None else [dog_id, node.name, node.father_id, node.mother_id]
+            entry.append(sorted(self._ancestor_rows.get(dog_id, []), key=repr))
+            h.update(json.dumps(entry, ensure_ascii=False, default=str).encode())
+        return h.hexdigest()
+
+    def get(self, sire_id: int, dam_id: int, max_depth: int) -> dict:
+        """キャッシュが有効ならそれを、無効なら再計算した calculate_pedigree_metrics の結果を返す。"""
+        key = (sire_id, dam_id, max_depth)
+        if key not in self._rows:
+            self.prefetch([(sire_id, dam_id)], max_depth)
+        row = self._rows[key]
+        fingerprint = self.fingerprint(sire_id, dam_id, max_depth)
+
+        if row is not None and row.pedigree_hash == fingerprint:
+            try:
+                metrics = json.loads(row.result_json)
+                self.hits += 1
+                return metrics
+            except (TypeError, ValueError):
+                pass
+
+        self.misses += 1
+        metrics = calculate_pedigree_metrics(sire_id, dam_id, max_depth, self.db, graph=self.graph)
+        payload = json.dumps(metrics, ensure_ascii=False, default=str)
+        entry = _CacheEntry(fingerprint, payload)
+        self._rows[key] = entry
+        self._dirty[key] = entry
+        # ヒット時と同じ形（JSON 往復後）で返す
+        return json.loads(payload)
+
+    def save(self) -> None:
+        """再計算した結果を別セッションでコミットする。失敗してもキャッシュなので評価は続行する。"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        try:
+            session = _cache_session(self.db)
+        except Exception:
+            return
+        try:
+            from app.models_breeder import MatingPedigreeCache
+            existing = {}
+            for chunk in _in_chunks({sire_id for sire_id, _, _ in dirty}):
+                for row in session.query(MatingPedigreeCache).filter(
+                    MatingPedigreeCache.sire_id.in_(chunk),
+                ).all():
+                    existing[(row.sire_id, row.dam_id, row.max_depth)] = row
+            for (sire_id, dam_id, max_depth), entry in dirty.items():
+                row = existing.get((sire_id, dam_id, max_depth))
+                if row is None:
+                    session.add(MatingPedigreeCache(
+                        sire_id=sire_id, dam_id=dam_id, max_depth=max_depth,
+                        pedigree_hash=entry.pedigree_hash, result_json=entry.result_json,
+                    ))
+                else:
+                    row.pedigree_hash = entry.pedigree_hash
+                    row.result_json = entry.result_json
+            session.commit()
+        except Exception:
+            session.rollback()
+        finally:
+            session.close()
+
+
+def refresh_pedigree_cache(db) -> dict:
+    """
+    保存済みキャッシュを一括で検証し、血統が変わったペアだけを再計算する。
+
+    Returns
+    -------
+    dict: checked（検証したペア数）, recomputed（再計算したペア数）
+    """
+    from app.models_breeder import MatingPedigreeCache
+    rows = db.query(MatingPedigreeCache).all()
+
+    cache = PedigreeMetricsCache(db)
+    cache.graph.load({r.sire_id for r in rows} | {r.dam_id for r in rows})
+    for r in rows:
+        cache._rows[(r.sire_id, r.dam_id, r.max_depth)] = r
+    for r in rows:
+        cache.get(r.sire_id, r.dam_id, r.max_depth)
+    cache.save()
+    return {'checked': len(rows), 'recomputed': cache.misses}
+
+
 # ---------------------------------------------------------------------------
 # 交配候補比較
 # ---------------------------------------------------------------------------
 
-def compare_mating_candidates(
+# AI コメント生成（外部 API 呼び出し）の並列数
+COMPARE_AI_COMMENT_WORKERS = 4
+
+
+def _in_chunks(ids) -> list[list]:
+    """ID 集合を IN 句用のチャンクに分割する。"""
+    ids = sorted(i for i in set(ids) if i is not None)
+    return [ids[i:i + _PEDIGREE_IN_CHUNK] for i in range(0, len(ids), _PEDIGREE_IN_CHUNK)]
+
+
+class MatingPrefetch:
+    """
+    交配候補の一括比較用に、評価に必要な犬ごとのデータをまとめて読み込んでおく。
+
+    evaluate_mating_compatibility_full は 1 ペアごとに遺伝病検査・健康履歴・
+    繁殖履歴・産子・フォローアップを個別に引くため、候補が増えるとクエリ数が
+    候補数 × 十数本になる。ここではテーブルごとに IN 句で一括取得し、
+    固定犬の繁殖統計などペアに依存しない集計はメモ化して候補間で共有する。
+    """
+
+    def __init__(self, db, sire_ids, dam_ids):
+        self._genes: dict[int, list] = defaultdict(list)
+        self._health: dict[int, list] = defaultdict(list)
+        self._as_sire: dict[int, list] = defaultdict(list)
+        self._as_dam: dict[int, list] = defaultdict(list)
+        self._pairs: dict[tuple[int, int], list] = defaultdict(list)
+        self._puppies: dict[int, list] = defaultdict(list)
+        self._diseased_puppies: set[int] = set()
+        self._stats: dict[tuple[int, str], dict] = {}
+        self._load(db, set(sire_ids), set(dam_ids))
+
+    def _load(self, db, sire_ids: set, dam_ids: set) -> None:
+        dog_ids = sire_ids | dam_ids
+        try:
+            from app.models_breeder import GeneticTestResult
+            for chunk in _in_chunks(dog_ids):
+                for g in db.query(GeneticTestResult).filter(GeneticTestResult.dog_id.in_(chunk)).all():
+                    self._genes[g.dog_id].append(g)
+        except Exception:
+            pass
+
+        try:
+            from app.models_breeder import DogHealthRecord
+            for chunk in _in_chunks(dog_ids):
+                for r in db.query(DogHealthRecord).filter(DogHealthRecord.dog_id.in_(chunk)).all():
+                    self._health[r.dog_id].append(r)
+        except Exception:
+            pass
+
+        histories = {}
+        try:
+            from app.models_breeder import BreedingHistory
+            for chunk in _in_chunks(sire_ids):
+                for h in db.query(BreedingHistory).filter(BreedingHistory.sire_id.in_(chunk)).all():
+                    histories[h.id] = h
+            for chunk in _in_chunks(dam_ids):
+                for h in db.query(BreedingHistory).filter(BreedingHistory.dam_id.in_(chunk)).all():
+                    histories[h.id] = h
+        except Exception:
+            pass
+        for h in sorted(histories.values(), key=lambda x: x.id):
+            if h.sire_id in sire_ids:
+                self._as_sire[h.sire_id].append(h)
+            if h.dam_id in dam_ids:
+                self._as_dam[h.dam_id].append(h)
+            if h.sire_id in sire_ids and h.dam_id in dam_ids:
+                self._pairs[(h.sire_id, h.dam_id)].append(h)
+
+        pair_history_ids = [h.id for hs in self._pairs.values() for h in hs]
+        try:
+            from app.models_breeder import PuppyRecord
+            for chunk in _in_chunks(pair_history_ids):
+                for pup in db.query(PuppyRecord).filter(PuppyRecord.breeding_history_id.in_(chunk)).all():
+                    self._puppies[pup.breeding_history_id].append(pup)
+        except Exception:
+            pass
+
+        puppy_ids = [pup.id for ps in self._puppies.values() for pup in ps]
+        try:
+            from app.models_breeder import PuppyFollowUp
+            for chunk in _in_chunks(puppy_ids):
+                rows = db.query(PuppyFollowUp.puppy_id).filter(
+                    PuppyFollowUp.puppy_id.in_(chunk),
+                    PuppyFollowUp.disease_found == 1,
+                ).all()
+                self._diseased_puppies.update(row[0] for row in rows)
+        except Exception:
+            pass
+
+    def genes(self, dog_id: int) -> list:
+        return self._genes.get(dog_id, [])
+
+    def health_records(self, dog_id: int) -> list:
+        return self._health.get(dog_id, [])
+
+    def breeding_stats(self, dog_id: int, role: str) -> dict:
+        """_breeding_stats の結果を (犬, 役割) 単位でメモ化して返す。"""
+        key = (dog_id, role)
+        stats = self._stats.get(key)
+        if stats is None:
+            records = self._as_sire.get(dog_id, []) if role == 'sire' else self._as_dam.get(dog_id, [])
+            stats = self._stats[key] = _breeding_stats(records)
+        return dict(stats)
+
+    def pair_histories(self, sire_id: int, dam_id: int) -> list:
+        return self._pairs.get((sire_id, dam_id), [])
+
+    def puppies(self, breeding_history_id: int) -> list:
+        return self._puppies.get(breeding_history_id, [])
+
+    def has_disease_followup(self, puppy_id: int) -> bool:
+        return puppy_id in self._diseased_puppies
+
+
+def _candidate_summary(cand_id: int, name: str, eval_result: dict) -> dict:
+    """評価結果から候補比較用の 1 行を作る。"""
+    return {
+        'candidate_id': cand_id,
+        'candidate_name': name,
+        'total_score': eval_result.get('total_score', 0),
+        'coi_percent': eval_result.get('coi_percent', 0),
+        'avk_percent': eval_result.get('avk', {}).get('avk_percent', 0),
+        'judgment': eval_result.get('judgment', ''),
+        'judgment_level': eval_result.get('judgment_level', ''),
+        'rank': eval_result.get('rank', ''),
+        'warnings': eval_result.get('warnings', []),
+        'positive_points': eval_result.get('positive_points', []),
+        'improvement_suggestions': eval_result.get('improvement_suggestions', []),
+        'detail': eval_result,
+    }
+
+
+def iter_mating_candidates(
     fixed_dog_id: int,
     fixed_role: str,
     candidate_ids: list[int],
     max_depth: int,
     db,
     use_ai_comment: bool = False,
-) -> list:
+    max_workers: int = COMPARE_AI_COMMENT_WORKERS,
+    use_cache: bool = False,
+):
     """
-    固定した犬（父犬または母犬）に対して、複数の候補をランキング評価する。
+    交配候補を 1 頭ずつ評価し、評価が終わった順に結果を yield する（ストリーミング用）。
 
-    Parameters
-    ----------
-    fixed_dog_id  : 固定する犬の ID
-    fixed_role    : 'sire'（固定が父犬）または 'dam'（固定が母犬）
-    candidate_ids : 候補犬の ID リスト
-    max_depth     : COI 計算の最大世代数
-    db            : SQLAlchemy セッション
+    固定犬と全候補の血統（PedigreeGraph）と評価データ（MatingPrefetch）を
+    最初にまとめて読み込むため、以降の評価では DB を引かない。
+    メモリ上の評価は十分速く、共有の血統グラフを書き換えながら進むため逐次で行い、
+    use_ai_comment=True の場合のみ、外部 API を呼ぶ AI コメント生成を
+    スレッドプールで並列に実行する（DB セッションはスレッドに渡さない）。
 
-    Returns
-    -------
-    list of dict（total_score の降順でソート済み）
-    """
-    results = []
+    use_cache=True の場合、血統由来の指標は PedigreeMetricsCache から取得し、
+    血統が変わった候補ペアだけを再計算する。
 
-    for cand_id in candidate_ids:
-        if fixed_role == 'sire':
-            sire_id, dam_id = fixed_dog_id, cand_id
-        else:
-            sire_id, dam_id = cand_id, fixed_dog_id
+    yield される dict は compare_mating_candidates の各要素と同じ形式で、
+    rank_position / recommendation は含まない。
+    """
+    pairs = [
+        (cand_id, (fixed_dog_id, cand_id) if fixed_role == 'sire' else (cand_id, fixed_dog_id))
+        for cand_id in candidate_ids
+    ]
+    graph = PedigreeGraph(db, [fixed_dog_id, *candidate_ids])
+    prefetch = MatingPrefetch(
+        db,
+        sire_ids=[sire_id for _, (sire_id, _) in pairs],
+        dam_ids=[dam_id for _, (_, dam_id) in pairs],
+    )
+    cache = None
+    if use_cache:
+        cache = PedigreeMetricsCache(db, graph)
+        cache.prefetch([pair for _, pair in pairs], max_depth)
 
+    pending = []
+    for cand_id, (sire_id, dam_id) in pairs:
         try:
             eval_result = evaluate_mating_compatibility_full(
                 sire_id=sire_id,
                 dam_id=dam_id,
                 max_depth=max_depth,
                 db=db,
-                use_ai_comment=use_ai_comment,
+                use_ai_comment=False,
+                graph=graph,
+                prefetch=prefetch,
+                pedigree_metrics=cache.get(sire_id, dam_id, max_depth) if cache else None,
             )
-            results.append({
-                'candidate_id': cand_id,
-                'candidate_name': _get_dog_name(cand_id, db),
-                'total_score': eval_result.get('total_score', 0),
-                'coi_percent': eval_result.get('coi_percent', 0),
-                'avk_percent': eval_result.get('avk', {}).get('avk_percent', 0),
-                'judgment': eval_result.get('judgment', ''),
-                'judgment_level': eval_result.get('judgment_level', ''),
-                'rank': eval_result.get('rank', ''),
-                'warnings': eval_result.get('warnings', []),
-                'positive_points': eval_result.get('positive_points', []),
-                'improvement_suggestions': eval_result.get('improvement_suggestions', []),
-                'detail': eval_result,
-            })
         except Exception as e:
-            results.append({
+            yield {
                 'candidate_id': cand_id,
-                'candidate_name': _get_dog_name(cand_id, db),
+                'candidate_name': graph.name(cand_id),
                 'total_score': 0,
                 'error': str(e),
-            })
+            }
+            continue
+
+        if use_ai_comment:
+            pending.append((cand_id, eval_result))
+        else:
+            yield _candidate_summary(cand_id, graph.name(cand_id), eval_result)
+
+    if cache is not None:
+        cache.save()
 
+    if not pending:
+        return
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(generate_ai_comment, eval_result): (cand_id, eval_result)
+            for cand_id, eval_result in pending
+        }
+        for future in as_completed(futures):
+            cand_id, eval_result = futures[future]
+            eval_result['comment'] = future.result()
+            yield _candidate_summary(cand_id, graph.name(cand_id), eval_result)
+
+
+def rank_mating_candidates(results: list, candidate_ids: list[int] | None = None) -> list:
+    """
+    候補の評価結果を total_score の降順に並べ、順位と推奨ラベルを付ける。
+    candidate_ids を渡すと、同点の並びを評価完了順ではなく入力順にそろえる。
+    """
+    if candidate_ids is not None:
+        position = {cand_id: i for i, cand_id in enumerate(candidate_ids)}
+        results.sort(key=lambda r: position.get(r['candidate_id'], 0))
     results.sort(key=lambda x: x.get('total_score', 0), reverse=True)
 
     for i, r in enumerate(results):
@@ -1729,6 +2353,39 @@ def compare_mating_candidates(
     return results
 
 
+def compare_mating_candidates(
+    fixed_dog_id: int,
+    fixed_role: str,
+    candidate_ids: list[int],
+    max_depth: int,
+    db,
+    use_ai_comment: bool = False,
+    use_cache: bool = False,
+) -> list:
+    """
+    固定した犬（父犬または母犬）に対して、複数の候補をランキング評価する。
+
+    Parameters
+    ----------
+    fixed_dog_id  : 固定する犬の ID
+    fixed_role    : 'sire'（固定が父犬）または 'dam'（固定が母犬）
+    candidate_ids : 候補犬の ID リスト
+    max_depth     : COI 計算の最大世代数
+    db            : SQLAlchemy セッション
+    use_cache     : 血統由来の指標を PedigreeMetricsCache から取得するか
+
+    Returns
+    -------
+    list of dict（total_score の降順でソート済み）
+    """
+    results = list(iter_mating_candidates(
+        fixed_dog_id, fixed_role, candidate_ids, max_depth, db,
+        use_ai_comment=use_ai_comment,
+        use_cache=use_cache,
+    ))
+    return rank_mating_candidates(results, candidate_ids)
+
+
 # ---------------------------------------------------------------------------
 # 総合評価（拡張版）
 # ---------------------------------------------------------------------------
@@ -1741,6 +2398,10 @@ def evaluate_mating_compatibility_full(
     use_ai_comment: bool = False,
     sire_breed: str | None = None,
     dam_breed: str | None = None,
+    graph: PedigreeGraph | None = None,
+    prefetch: MatingPrefetch | None = None,
+    pedigree_metrics: dict | None = None,
+    use_cache: bool = False,
 ) -> dict:
     """
     繁殖意思決定支援システムの総合評価関数。
@@ -1749,10 +2410,32 @@ def evaluate_mating_compatibility_full(
     AVK・祖先集中度・ライン依存度・健康履歴・繁殖履歴・産子実績・
     犬種別リスク・総合スコアを統合して返す。
 
+    血統を辿る指標（COI・AVK・祖先集中度・ライン依存度）は 1 つの
+    PedigreeGraph を共有し、祖先の読み込みと経路探索を 1 回で済ませる。
+    prefetch を渡した場合、遺伝病検査・健康履歴・繁殖履歴・産子データは
+    一括読み込み済みのものを使い、DB を引かない（候補の一括比較用）。
+    use_cache=True の場合、血統由来の 4 指標は PedigreeMetricsCache から取得し、
+    血統が変わっていなければ再計算しない。
+
     Returns
     -------
     dict: 全評価指標を含む総合評価 JSON
     """
+    if graph is None:
+        graph = PedigreeGraph(db, (sire_id, dam_id))
+
+    # 血統由来指標（COI・AVK・祖先集中度・ライン依存度）
+    if pedigree_metrics is None:
+        if use_cache:
+            cache = PedigreeMetricsCache(db, graph)
+            pedigree_metrics = cache.get(sire_id, dam_id, max_depth)
+            cache.save()
+        else:
+            pedigree_metrics = calculate_pedigree_metrics(sire_id, dam_id, max_depth, db, graph=graph)
+    avk           = pedigree_metrics['avk']
+    concentration = pedigree_metrics['ancestor_concentration']
+    line_dep      = pedigree_metrics['line_dependency']
+
     # 基本評価（COI・遺伝病・近親パターン）
     base = evaluate_mating_compatibility(
         sire_id=sire_id,
@@ -1760,35 +2443,33 @@ def evaluate_mating_compatibility_full(
         max_depth=max_depth,
         db=db,
         use_ai_comment=False,
+        graph=graph,
+        prefetch=prefetch,
+        coi_result=pedigree_metrics['coi'],
     )
 
-    # AVK
-    avk = calculate_avk(sire_id, dam_id, max_depth, db)
-
-    # 祖先集中度
-    concentration = calculate_ancestor_concentration(sire_id, dam_id, max_depth, db)
-
-    # ライン依存度
-    line_dep = calculate_line_dependency(sire_id, dam_id, max_depth, db)
-
     # 健康履歴
-    health = evaluate_health_records(sire_id, dam_id, db)
+    health = evaluate_health_records(sire_id, dam_id, db, prefetch=prefetch)
 
     # 繁殖履歴
-    breeding = evaluate_breeding_history(sire_id, dam_id, db)
+    breeding = evaluate_breeding_history(sire_id, dam_id, db, prefetch=prefetch)
 
     # 産子実績
-    offspring = evaluate_offspring_performance(sire_id, dam_id, db)
+    offspring = evaluate_offspring_performance(sire_id, dam_id, db, prefetch=prefetch)
 
     # 犬種別リスク
     sire_genes = []
     dam_genes  = []
-    try:
-        from app.models_breeder import GeneticTestResult
-        sire_genes = db.query(GeneticTestResult).filter(GeneticTestResult.dog_id == sire_id).all()
-        dam_genes  = db.query(GeneticTestResult).filter(GeneticTestResult.dog_id == dam_id).all()
-    except Exception:
-        pass
+    if prefetch is not None:
+        sire_genes = prefetch.genes(sire_id)
+        dam_genes  = prefetch.genes(dam_id)
+    else:
+        try:
+            from app.models_breeder import GeneticTestResult
+            sire_genes = db.query(GeneticTestResult).filter(GeneticTestResult.dog_id == sire_id).all()
+            dam_genes  = db.query(GeneticTestResult).filter(GeneticTestResult.dog_id == dam_id).all()
+        except Exception:
+            pass
 
     breed_risks = evaluate_breed_risks(sire_breed, dam_breed, sire_genes, dam_genes, db)
 
@@ -0,0 +1,377 @@
+"""
+プロセス横断の変更通知バス（Redis不要）
+
+「チャンネル（例: floor:<店舗ID>）ごとの版数」を DB に持ち、版数を進めたことを
+全 gunicorn ワーカーへ配信する。各ワーカーは自プロセス内の待機キュー
+（SSE / ロングポーリング）に版数を流す。
+
+- PostgreSQL: 版数テーブル + LISTEN/NOTIFY。ワーカーごとに LISTEN 専用接続を1本持つ。
+- それ以外（ローカル開発の SQLite 等）: 共有 SQLite ファイルに版数と通番を持ち、
+  監視スレッドが短い間隔で通番の増分だけを読む。
+
+版数は「前回+1 と現在時刻(ms) の大きい方」で単調増加し、どのワーカーが
+応答しても同じ値を返す（旧実装のミリ秒版数とも大小比較できる）。
+
+設定（環境変数・任意）:
+  CHANGE_BUS_BACKEND     : 'postgres' / 'file'（既定: DATABASE_URL から自動判定）
+  CHANGE_BUS_PATH        : file バックエンドの SQLite パス（既定 database/change_bus.db）
+  CHANGE_BUS_POLL_SEC    : file バックエンドの監視間隔（秒）。既定 0.25
+"""
+import os
+import queue
+import select
+import sqlite3
+import threading
+import time
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+PG_CHANNEL = 'app_change_bus'
+_TABLE = 'T_変更通知版数'
+
+_RECONNECT_DELAY_SEC = 5
+_LISTEN_IDLE_SEC = 30
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class ChangeBus:
+    """バックエンド共通部分：ローカル待機キューへの配信と版数キャッシュ。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}                     # channel -> 最新版数（このプロセスで把握している値）
+        self._waiters = defaultdict(list)       # channel -> [queue.Queue]
+        self._watch_started = False
+
+    # ---- バックエンド実装 ----
+    def _bump(self, channel: str) -> int:
+        raise NotImplementedError
+
+    def _load(self, channel: str) -> int:
+        raise NotImplementedError
+
+    def _watch(self):
+        raise NotImplementedError
+
+    def _cache_trusted(self) -> bool:
+        """キャッシュ値を DB と同等とみなしてよいか（監視が生きているか）"""
+        return False
+
+    # ---- 公開 API ----
+    def publish(self, channel: str) -> int:
+        """チャンネルの版数を進めて全ワーカーへ通知する。新しい版数を返す。"""
+        version = self._bump(channel)
+        self._deliver(channel, version)
+        return version
+
+    def version(self, channel: str) -> int:
+        """チャンネルの現在の版数（未使用のチャンネルは 0）"""
+        self._ensure_watch()
+        if self._cache_trusted():
+            with self._lock:
+                cached = self._versions.get(channel)
+            if cached is not None:
+                return cached
+        version = self._load(channel)
+        with self._lock:
+            if version > self._versions.get(channel, 0):
+                self._versions[channel] = version
+            return self._versions.get(channel, version)
+
+    def subscribe(self, channel: str, maxsize: int = 8) -> queue.Queue:
+        """版数更新を受け取るキューを登録する（使い終わったら unsubscribe）"""
+        self._ensure_watch()
+        q = queue.Queue(maxsize=maxsize)
+        with self._lock:
+            self._waiters[channel].append(q)
+        return q
+
+    def unsubscribe(self, channel: str, q: queue.Queue):
+        with self._lock:
+            waiters = self._waiters.get(channel)
+            if waiters and q in waiters:
+                waiters.remove(q)
+            if not waiters:
+                self._waiters.pop(channel, None)
+
+    def wait(self, channel: str, since: int, timeout: float) -> int:
+        """版数が since を超えるか timeout 秒経過するまで待ち、その時点の版数を返す（ロングポーリング用）"""
+        current = self.version(channel)
+        if current > since:
+            return current
+        q = self.subscribe(channel)
+        try:
+            current = self.version(channel)   # 登録前に進んでいた場合の取りこぼし防止
+            deadline = time.monotonic() + timeout
+            while current <= since:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    current = max(current, q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            return current
+        finally:
+            self.unsubscribe(channel, q)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'backend': type(self).__name__,
+                'channels_cached': len(self._versions),
+                'waiters': sum(len(v) for v in self._waiters.values()),
+                'watching': self._watch_started,
+                'cache_trusted': self._cache_trusted(),
+            }
+
+    # ---- 内部 ----
+    def _deliver(self, channel: str, version: int):
+        """版数を記録し、待機中のキューへ流す（古い版数・重複は無視）"""
+        with self._lock:
+            if version <= self._versions.get(channel, 0):
+                return
+            self._versions[channel] = version
+            waiters = list(self._waiters.get(channel, ()))
+        for q in waiters:
+            try:
+                q.put_nowait(version)
+            except queue.Full:
+                pass
+
+    def _ensure_watch(self):
+        if self._watch_started:
+            return
+        with self._lock:
+            if self._watch_started:
+                return
+            self._watch_started = True
+        threading.Thread(target=self._watch, name=f'change-bus-{type(self).__name__}',
+                         daemon=True).start()
+
+
+class PostgresChangeBus(ChangeBus):
+    """版数テーブル + LISTEN/NOTIFY による実装"""
+
+    def __init__(self):
+        super().__init__()
+        self._listening = False
+        self._table_ready = False
+
+    def _conn(self):
+        from app.utils.db import get_db
+        return get_db()
+
+    def _ensure_table(self, cur):
+        if self._table_ready:
+            return
+        cur.execute(f'''
+            CREATE TABLE IF NOT EXISTS "{_TABLE}" (
+                channel VARCHAR(200) PRIMARY KEY,
+                version BIGINT NOT NULL
+            )
+        ''')
+        self._table_ready = True
+
+    def _bump(self, channel: str) -> int:
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            self._ensure_table(cur)
+            cur.execute(f'''
+                INSERT INTO "{_TABLE}" (channel, version) VALUES (%s, %s)
+                ON CONFLICT (channel) DO UPDATE
+                   SET version = GREATEST("{_TABLE}".version + 1, EXCLUDED.version)
+                RETURNING version
+            ''', (channel, _now_ms()))
+            version = int(cur.fetchone()[0])
+            cur.execute('SELECT pg_notify(%s, %s)', (PG_CHANNEL, f'{channel}|{version}'))
+            return version
+        finally:
+            conn.close()
+
+    def _load(self, channel: str) -> int:
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            self._ensure_table(cur)
+            cur.execute(f'SELECT version FROM "{_TABLE}" WHERE channel = %s', (channel,))
+            row = cur.fetchone()
+            return int(row[0]) if row else 0
+        finally:
+            conn.close()
+
+    def _cache_trusted(self) -> bool:
+        return self._listening
+
+    def _resync(self, cur):
+        """LISTEN 再接続時、切断中に取りこぼした版数をまとめて取り込む"""
+        with self._lock:
+            channels = list(set(self._versions) | set(self._waiters))
+        if not channels:
+            return
+        cur.execute(f'SELECT channel, version FROM "{_TABLE}" WHERE channel = ANY(%s)', (channels,))
+        for channel, version in cur.fetchall():
+            self._deliver(channel, int(version))
+
+    def _watch(self):
+        from app.utils.db import _pg_connect
+        while True:
+            conn = None
+            try:
+                conn = _pg_connect()
+                cur = conn.cursor()
+                self._ensure_table(cur)
+                cur.execute(f'LISTEN {PG_CHANNEL}')
+                self._resync(cur)
+                self._listening = True
+                logger.info('change_bus: LISTEN %s を開始しました', PG_CHANNEL)
+                while True:
+                    if select.select([conn], [], [], _LISTEN_IDLE_SEC) == ([], [], []):
+                        cur.execute('SELECT 1')   # 切断検知
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        note = conn.notifies.pop(0)
+                        channel, _, ver = note.payload.rpartition('|')
+                        try:
+                            self._deliver(channel, int(ver))
+                        except ValueError:
+                            pass
+            except Exception:  # noqa: BLE001
+                logger.exception('change_bus: LISTEN 接続でエラー（%s秒後に再接続）', _RECONNECT_DELAY_SEC)
+            finally:
+                self._listening = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(_RECONNECT_DELAY_SEC)
+
+
+class FileChangeBus(ChangeBus):
+    """共有 SQLite ファイルによる実装（ローカル開発・単一ホスト向け）"""
+
+    def __init__(self, path: str, poll_sec: float):
+        super().__init__()
+        self.path = path
+        self.poll_sec = poll_sec
+        self._seq = 0
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS bus_versions (
+                    channel TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    seq INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_bus_versions_seq ON bus_versions(seq)')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _bump(self, channel: str) -> int:
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT version FROM bus_versions WHERE channel = ?', (channel,)).fetchone()
+            seq = conn.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM bus_versions').fetchone()[0]
+            version = max((row[0] + 1) if row else 0, _now_ms())
+            conn.execute('INSERT OR REPLACE INTO bus_versions (channel, version, seq) VALUES (?, ?, ?)',
+                         (channel, version, seq))
+            conn.execute('COMMIT')
+            return version
+        except Exception:
+            try:
+                conn.execute('ROLLBACK')
+            except Exception:
+                pass
+            raise
+        finally:
+            conn.close()
+
+    def _load(self, channel: str) -> int:
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT version FROM bus_versions WHERE channel = ?', (channel,)).fetchone()
+            return int(row[0]) if row else 0
+        finally:
+            conn.close()
+
+    def _cache_trusted(self) -> bool:
+        # ローカルファイルの読み取りは安価なので、常に最新値を読む
+        return False
+
+    def _watch(self):
+        conn = None
+        while True:
+            try:
+                if conn is None:
+                    conn = self._connect()
+                    self._seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM bus_versions').fetchone()[0]
+                rows = conn.execute(
+                    'SELECT channel, version, seq FROM bus_versions WHERE seq > ? ORDER BY seq',
+                    (self._seq,)).fetchall()
+                for channel, version, seq in rows:
+                    self._seq = max(self._seq, seq)
+                    self._deliver(channel, int(version))
+            except Exception:  # noqa: BLE001
+                logger.exception('change_bus: 監視でエラー')
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                conn = None
+                time.sleep(_RECONNECT_DELAY_SEC)
+                continue
+            time.sleep(self.poll_sec)
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def _backend_name() -> str:
+    name = os.environ.get('CHANGE_BUS_BACKEND', '').strip().lower()
+    if name in ('postgres', 'file'):
+        return name
+    url = os.environ.get('DATABASE_URL', '')
+    try:
+        import psycopg2  # noqa: F401
+        has_pg = True
+    except Exception:
+        has_pg = False
+    return 'postgres' if has_pg and url.startswith(('postgres://', 'postgresql://')) else 'file'
+
+
+def get_change_bus() -> ChangeBus:
+    """プロセス内で共有する変更通知バスを返す。"""
+    global _bus
+    if _bus is not None:
+        return _bus
+    with _bus_lock:
+        if _bus is None:
+            if _backend_name() == 'postgres':
+                _bus = PostgresChangeBus()
+            else:
+                _bus = FileChangeBus(
+                    os.environ.get('CHANGE_BUS_PATH', os.path.join('database', 'change_bus.db')),
+                    float(os.environ.get('CHANGE_BUS_POLL_SEC', '0.25')),
+                )
+        return _bus
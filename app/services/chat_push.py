@@ -0,0 +1,146 @@
+"""
+チャットのプッシュ配信（SSE）
+
+社内チャット（ルーム単位）と顧問先チャット（顧問先単位）で、新着メッセージと
+既読の変化を change_bus のチャンネルで全 gunicorn ワーカーへ通知し、各ワーカーの
+SSE 接続へ流す。
+
+- 書き込み側はコミット後に notify(channel) を呼ぶだけ
+- SSE 接続は通知が来たときだけ fetch() でDBを読む。何も起きていない間は
+  ハートビート（コメント行）を送るだけで、DBには一切問い合わせない
+- 接続は STREAM_MAX_SEC で区切り、ブラウザの EventSource に再接続させる
+  （Last-Event-ID で続きから取得する）。gunicorn の --timeout（120秒）より十分短くする
+- SSE 接続は gunicorn の gthread ワーカーのスレッドを1本ずつ占有するため、1プロセスあたりの
+  同時接続数を MAX_STREAMS に制限する。空きが無ければ busy イベントを送って終了し、
+  画面は従来のポーリング API に切り替える（SSE が使えない環境でも同様）
+
+設定（環境変数・任意）:
+  CHAT_STREAM_HEARTBEAT_SEC   : ハートビート間隔（秒）。既定 25
+  CHAT_STREAM_MAX_SEC         : 1接続の最大継続時間（秒）。既定 55、上限 60
+  CHAT_STREAM_MAX_PER_WORKER  : 1プロセスあたりの同時 SSE 接続数。既定 4（Procfile の --threads 8 の半分）
+"""
+import os
+import json
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+RETRY_MS = 3000               # 切断時にブラウザが再接続するまでの待ち時間
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, str(default))))
+    except Exception:
+        return default
+
+
+_STREAM_MAX_CAP_SEC = 60      # gunicorn --timeout 120 の半分
+
+STREAM_MAX_SEC = min(_env_int('CHAT_STREAM_MAX_SEC', 55), _STREAM_MAX_CAP_SEC)
+HEARTBEAT_SEC = min(_env_int('CHAT_STREAM_HEARTBEAT_SEC', 25), STREAM_MAX_SEC)
+MAX_STREAMS = _env_int('CHAT_STREAM_MAX_PER_WORKER', 4)
+
+_stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+
+def room_channel(room_id) -> str:
+    """社内チャットルームの通知チャンネル"""
+    return f'ichat:{room_id}'
+
+
+def client_channel(client_id) -> str:
+    """顧問先チャットの通知チャンネル"""
+    return f'cchat:{client_id}'
+
+
+def notify(channel: str):
+    """メッセージ追加・既読の変化を全ワーカーの SSE 接続へ通知する（コミット後に呼ぶ）"""
+    from app.services.change_bus import get_change_bus
+    try:
+        get_change_bus().publish(channel)
+    except Exception as e:
+        logger.warning('[chat_push] change notification failed: %s', e)
+
+
+def format_event(event: str, data, event_id=None) -> str:
+    """SSE のイベント1件分の文字列を作る"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False, default=str))
+    return '\n'.join(lines) + '\n\n'
+
+
+def last_event_id(request, default: int = 0) -> int:
+    """再接続時の Last-Event-ID ヘッダ（無ければ ?since_id=）を整数で返す"""
+    raw = request.headers.get('Last-Event-ID') or request.args.get('since_id')
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        return default
+
+
+def stream(channel: str, fetch, heartbeat: float = None, max_age: float = None, bus=None, slots=None):
+    """SSE のジェネレータを返す。
+
+    fetch() は [(event, data, event_id), ...] を返す関数で、接続直後に1回
+    （再接続までの取りこぼし分）と、チャンネルに通知が来るたびに呼ばれる。
+    fetch() 側で「前回送った位置」を保持し、差分だけを返すこと。
+    同時接続数が上限なら fetch() を呼ばずに busy イベントだけ送って終わる。
+    """
+    heartbeat = heartbeat or HEARTBEAT_SEC
+    max_age = max_age or STREAM_MAX_SEC
+    slots = slots or _stream_slots
+
+    def gen():
+        nonlocal bus
+        if not slots.acquire(blocking=False):
+            yield f'retry: {RETRY_MS}\n\n'
+            yield format_event('busy', {'poll': True})
+            return
+        try:
+            yield from _run()
+        finally:
+            slots.release()
+
+    def _run():
+        nonlocal bus
+        if bus is None:
+            from app.services.change_bus import get_change_bus
+            bus = get_change_bus()
+        # 取得より先に購読しておき、取得〜待機の間の通知を取りこぼさない
+        q = bus.subscribe(channel)
+        try:
+            yield f'retry: {RETRY_MS}\n\n'
+            deadline = time.monotonic() + max_age
+            pending = True
+            while True:
+                if pending:
+                    for event, data, event_id in fetch():
+                        yield format_event(event, data, event_id)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    q.get(timeout=min(heartbeat, remaining))
+                except queue.Empty:
+                    pending = False
+                    yield ': heartbeat\n\n'
+                    continue
+                # 連続した通知は1回の取得にまとめる
+                while True:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        break
+                pending = True
+        finally:
+            bus.unsubscribe(channel, q)
+
+    return gen()
@@ -12,12 +12,15 @@ ChatWork のAPIトークンはアカウント（個人）ごとに発行され
 
 処理概要（各ルーム共通）:
   1. ルーム→顧問先マッピングを走査
-  2. 各ルームのファイル一覧を取得し、未受信（T_受信ファイルに無い file_id）を検出
-  3. ダウンロード → 顧問先の店舗に応じたストレージへ保存
-  4. T_受信ファイル（重複防止ログ）と T_ファイル（顧問先の共有ファイル）へ記録
+  2. 前回からファイル数が変わったルームだけ、ファイル一覧を並列取得し、
+     未受信（T_受信ファイルに無い file_id）を検出
+  3. ダウンロード → 顧問先の店舗に応じたストレージへストリーム保存
+  4. T_受信ファイル（重複防止ログ）と T_ファイル（顧問先の共有ファイル）へ記録し、
+     ルームの高水位（synced_file_num / last_file_id）を更新
 """
-from io import BytesIO
-from datetime import datetime
+import tempfile
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from app.db import SessionLocal
 from app.models_integrations import (
@@ -25,7 +28,12 @@ from app.models_integrations import (
 )
 from app.models_clients import TClient, TFile
 from app.utils.integrations.chatwork import ChatworkClient, ChatworkError
-from app.utils.tenant_storage_adapter import get_storage_adapters, upload_to_adapters
+from app.utils.tenant_storage_adapter import get_storage_adapters, upload_stream_to_adapters
+
+LIST_WORKERS = 4                    # ファイル一覧の同時取得数（トークン単位のレート制限は共有）
+FULL_RESCAN_HOURS = 24              # この時間を過ぎたルームは file_num が同じでも一覧を取り直す
+SPOOL_MAX_BYTES = 8 * 1024 * 1024   # ダウンロードをメモリに保持する上限（超えたら一時ファイル）
+COMMIT_EVERY = 20                   # 受信記録をまとめてコミットする件数
 
 
 def get_active_setting(db, tenant_id: int):
@@ -38,12 +46,97 @@ def get_active_setting(db, tenant_id: int):
               .first())
 
 
-def _already_received(db, tenant_id: int, file_id) -> bool:
-    return db.query(TReceivedFile).filter(
-        TReceivedFile.tenant_id == tenant_id,
-        TReceivedFile.provider == 'chatwork',
-        TReceivedFile.external_id == str(file_id),
-    ).first() is not None
+def _received_ids(db, tenant_id: int) -> set:
+    """テナントの受信済み file_id（external_id）を1クエリでまとめて取得する"""
+    rows = (db.query(TReceivedFile.external_id)
+              .filter(TReceivedFile.tenant_id == tenant_id,
+                      TReceivedFile.provider == 'chatwork')
+              .all())
+    return {r[0] for r in rows}
+
+
+def _room_file_counts(cw_client) -> dict:
+    """参加ルームごとの現在のファイル数 {room_id(str): file_num}。取得失敗時は空"""
+    try:
+        rooms = cw_client.list_rooms()
+    except Exception:  # noqa: BLE001 - 取得できなければ全ルームを一覧取得する
+        return {}
+    return {str(r.get('room_id')): r.get('file_num')
+            for r in rooms or [] if r.get('room_id') is not None}
+
+
+def _room_unchanged(m, file_num, now) -> bool:
+    """前回同期からファイル数が変わっていないルームか（高水位による省略判定）"""
+    if file_num is None or m.synced_file_num is None or m.synced_at is None:
+        return False
+    # 削除と追加が同数だった場合の取りこぼし対策として、一定時間ごとに必ず一覧を取り直す
+    if now - m.synced_at > timedelta(hours=FULL_RESCAN_HOURS):
+        return False
+    try:
+        return int(file_num) == int(m.synced_file_num)
+    except (TypeError, ValueError):
+        return False
+
+
+def _list_files_concurrently(cw_client, mappings):
+    """各ルームのファイル一覧を並列取得し、取れた順に (mapping, files, error) を返す。
+
+    ワーカーは ChatWork API だけを叩き、DBセッションには触れない。
+    レート制限への追従は ChatworkClient 側（トークン単位で共有）が行う。
+    """
+    if not mappings:
+        return
+    with ThreadPoolExecutor(max_workers=min(LIST_WORKERS, len(mappings))) as pool:
+        futures = {pool.submit(cw_client.list_files, m.room_id): m for m in mappings}
+        for fut in as_completed(futures):
+            m = futures[fut]
+            try:
+                yield m, fut.result() or [], None
+            except Exception as e:  # noqa: BLE001 - 1ルームの失敗で全体を止めない
+                yield m, None, e
+
+
+def _transfer_file(cw_client, room_id, file_id, filename, client_obj, adapters, subfolder):
+    """ChatWork から1ファイルを取得し、メモリに全体を載せずにストレージへ保存する"""
+    detail = cw_client.get_file_download_url(room_id, file_id)
+    download_url = detail.get('download_url')
+    if not download_url:
+        raise ChatworkError('ダウンロードURLを取得できませんでした')
+    # 小さいファイルはメモリ上、SPOOL_MAX_BYTES を超えたら一時ファイルへ逃がす
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as buf:
+        cw_client.download_file_to(download_url, buf)
+        return upload_stream_to_adapters(
+            adapters, buf, filename,
+            client_id=client_obj.id,
+            client_folder_path=client_obj.storage_folder_path,
+            subfolder=subfolder,
+        )
+
+
+def _commit_records(db, pending, result: dict) -> int:
+    """まとめて追加した受信記録をコミットし、記録できなかった件数を返す。
+
+    pending: [(filename, [追加した行...])]
+    まとめてのコミットに失敗したら（受信記録の一意制約違反など）ロールバックし、
+    1件ずつコミットし直して失敗した分だけをエラーにする（他の記録を巻き込まない）。
+    """
+    if not pending:
+        return 0
+    try:
+        db.commit()
+        return 0
+    except Exception:  # noqa: BLE001
+        db.rollback()
+    failed = 0
+    for filename, rows in pending:
+        try:
+            db.add_all(rows)
+            db.commit()
+        except Exception as e:  # noqa: BLE001 - 1件の失敗で全体を止めない
+            db.rollback()
+            failed += 1
+            result['errors'].append(f'{filename}: 記録に失敗しました: {e}')
+    return failed
 
 
 def _process_mappings(db, tenant_id: int, cw_client, mappings, result: dict,
@@ -54,6 +147,12 @@ def _process_mappings(db, tenant_id: int, cw_client, mappings, result: dict,
     mappings : TChatworkRoomMapping のリスト
     result   : {'saved','skipped','errors',...} を加算していく
     staff_id/staff_type: 担当者アカウント経由の場合、担当者個人ストレージを最優先で使う
+
+    1. 受信済み file_id をテナント単位で1回だけ取得（ファイルごとの SELECT をしない）
+    2. ルーム一覧の file_num が前回同期時と同じルームは一覧取得ごと省略
+    3. 残りのルームのファイル一覧を並列取得し、取れたルームから順に
+       ダウンロード→保存（ストリーム）→記録（COMMIT_EVERY 件ごとにコミット）
+    4. ルームを処理し終えたら高水位（ファイル数・最大file_id）を更新
     """
     # ストレージアダプタ（主＋ミラー）を解決（担当者個人→店舗→本部）。store_id別にキャッシュ
     _adapters_cache = {}
@@ -64,77 +163,105 @@ def _process_mappings(db, tenant_id: int, cw_client, mappings, result: dict,
                 staff_id=staff_id, staff_type=staff_type)
         return _adapters_cache[store_id]
 
+    if not mappings:
+        return
+    received = _received_ids(db, tenant_id)
+    client_ids = {m.client_id for m in mappings}
+    clients = {c.id: c for c in db.query(TClient).filter(
+        TClient.id.in_(client_ids), TClient.tenant_id == tenant_id).all()}
+    file_counts = _room_file_counts(cw_client)
+
+    now = datetime.utcnow()
+    targets = []
     for m in mappings:
-        client_obj = db.query(TClient).filter(
-            TClient.id == m.client_id,
-            TClient.tenant_id == tenant_id,
-        ).first()
-        if not client_obj:
+        if m.client_id not in clients:
+            continue
+        if _room_unchanged(m, file_counts.get(str(m.room_id)), now):
+            result['rooms_unchanged'] = result.get('rooms_unchanged', 0) + 1
             continue
+        targets.append(m)
 
-        try:
-            files = cw_client.list_files(m.room_id)
-        except ChatworkError as e:
-            result['errors'].append(f'ルーム{m.room_id}: {e}')
+    for m, files, err in _list_files_concurrently(cw_client, targets):
+        if err is not None:
+            result['errors'].append(f'ルーム{m.room_id}: {err}')
             continue
+        client_obj = clients[m.client_id]
+        subfolder = m.subfolder or 'ChatWork受信'
+        max_file_id = m.last_file_id or 0
+        pending = []
+        failed = 0
 
-        for f in files or []:
+        for f in files:
             file_id = f.get('file_id')
             filename = f.get('filename') or f'chatwork_{file_id}'
             if file_id is None:
                 continue
-            if _already_received(db, tenant_id, file_id):
+            try:
+                max_file_id = max(max_file_id, int(file_id))
+            except (TypeError, ValueError):
+                pass
+            if str(file_id) in received:
                 result['skipped'] += 1
                 continue
+            received.add(str(file_id))
 
             try:
-                detail = cw_client.get_file_download_url(m.room_id, file_id)
-                download_url = detail.get('download_url')
-                if not download_url:
-                    raise ChatworkError('ダウンロードURLを取得できませんでした')
-                data = cw_client.download_file_bytes(download_url)
-
                 adapters = _adapters_for(getattr(client_obj, 'store_id', None))
-                storage_url = upload_to_adapters(
-                    adapters, data, filename,
-                    client_id=client_obj.id,
-                    client_folder_path=client_obj.storage_folder_path,
-                    subfolder=(m.subfolder or 'ChatWork受信'),
-                )
-
-                db.add(TReceivedFile(
-                    tenant_id=tenant_id, provider='chatwork',
-                    external_id=str(file_id), room_id=str(m.room_id),
-                    client_id=client_obj.id, filename=filename,
-                    storage_url=storage_url, status='saved',
-                ))
-                db.add(TFile(
-                    client_id=client_obj.id, filename=filename,
-                    file_url=storage_url or '',
-                    uploader='ChatWork自動連携',
-                    timestamp=datetime.utcnow(),
-                ))
-                db.commit()
+                storage_url = _transfer_file(cw_client, m.room_id, file_id, filename,
+                                             client_obj, adapters, subfolder)
+                rows = [
+                    TReceivedFile(
+                        tenant_id=tenant_id, provider='chatwork',
+                        external_id=str(file_id), room_id=str(m.room_id),
+                        client_id=client_obj.id, filename=filename,
+                        storage_url=storage_url, status='saved',
+                    ),
+                    TFile(
+                        client_id=client_obj.id, filename=filename,
+                        file_url=storage_url or '',
+                        uploader='ChatWork自動連携',
+                        timestamp=datetime.utcnow(),
+                    ),
+                ]
                 result['saved'] += 1
             except Exception as e:  # noqa: BLE001 - 1件の失敗で全体を止めない
-                db.rollback()
-                db.add(TReceivedFile(
+                rows = [TReceivedFile(
                     tenant_id=tenant_id, provider='chatwork',
                     external_id=str(file_id), room_id=str(m.room_id),
                     client_id=client_obj.id, filename=filename,
                     status='error', error_message=str(e)[:500],
-                ))
-                db.commit()
+                )]
                 result['errors'].append(f'{filename}: {e}')
+            db.add_all(rows)
+            pending.append((filename, rows))
+            if len(pending) >= COMMIT_EVERY:
+                failed += _commit_records(db, pending, result)
+                pending = []
+
+        failed += _commit_records(db, pending, result)
+        if failed:
+            # 記録できなかったファイルがあるルームは高水位を進めず、次回も一覧を取り直す
+            continue
+        # ルームを処理し終えたら高水位を更新（一覧に漏れがあっても次回は file_num 差で再走査）
+        file_num = file_counts.get(str(m.room_id))
+        m.synced_file_num = int(file_num) if file_num is not None else None
+        m.last_file_id = max_file_id or None
+        m.synced_at = datetime.utcnow()
+        try:
+            db.commit()
+        except Exception as e:  # noqa: BLE001
+            db.rollback()
+            result['errors'].append(f'ルーム{m.room_id}: 記録に失敗しました: {e}')
 
 
 def sync_tenant(tenant_id: int) -> dict:
     """テナント共通トークンで staff_account_id IS NULL のルームを同期する（従来方式）。
 
     Returns:
-        dict: {'saved': int, 'skipped': int, 'errors': [str], 'rooms': int}
+        dict: {'saved': int, 'skipped': int, 'errors': [str], 'rooms': int,
+               'rooms_unchanged': int}
     """
-    result = {'saved': 0, 'skipped': 0, 'errors': [], 'rooms': 0}
+    result = {'saved': 0, 'skipped': 0, 'errors': [], 'rooms': 0, 'rooms_unchanged': 0}
     db = SessionLocal()
     try:
         setting = get_active_setting(db, tenant_id)
@@ -162,7 +289,7 @@ def sync_tenant(tenant_id: int) -> dict:
 
 def sync_staff_account(account_id: int) -> dict:
     """担当ごとの ChatWork アカウント1つを巡回して添付を保存する。"""
-    result = {'saved': 0, 'skipped': 0, 'errors': [], 'rooms': 0}
+    result = {'saved': 0, 'skipped': 0, 'errors': [], 'rooms': 0, 'rooms_unchanged': 0}
     db = SessionLocal()
     try:
         acc = db.query(TStaffChatworkAccount).filter(
@@ -192,6 +319,29 @@ def sync_staff_account(account_id: int) -> dict:
         db.close()
 
 
+def sync_tenant_all(tenant_id: int) -> dict:
+    """1テナント分をまとめて同期（共通トークン＋そのテナントの担当アカウント）。
+
+    スケジューラのジョブ単位（テナント×ChatWork）から呼ばれる。
+    """
+    result = sync_tenant(tenant_id)
+    result['accounts'] = 0
+    db = SessionLocal()
+    try:
+        account_ids = [a.id for a in db.query(TStaffChatworkAccount).filter(
+            TStaffChatworkAccount.tenant_id == tenant_id,
+            TStaffChatworkAccount.status == 'active').all()]
+    finally:
+        db.close()
+    for aid in account_ids:
+        r = sync_staff_account(aid)
+        result['accounts'] += 1
+        for key in ('saved', 'skipped', 'rooms', 'rooms_unchanged'):
+            result[key] = result.get(key, 0) + r.get(key, 0)
+        result['errors'].extend(r['errors'])
+    return result
+
+
 def sync_all_tenants() -> dict:
     """ChatWork連携が有効な全対象を同期（スケジューラ用）。
 
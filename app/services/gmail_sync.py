@@ -13,9 +13,13 @@ Gmail 受信添付 → 選択ストレージ 自動保存サービス
 
 Web手動同期と定期バッチ（batch_gmail.py）の双方から利用可能。
 """
+import os
 import json
-from io import BytesIO
+import time
+import imaplib
+import logging
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from app.db import SessionLocal
 from app.models_integrations import (
@@ -25,6 +29,46 @@ from app.models_clients import TClient, TFile
 from app.utils.integrations.gmail_imap import GmailImapClient, GmailImapError
 from app.utils.tenant_storage_adapter import get_storage_adapters, upload_to_adapters
 
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+# 全テナント/全アカウント巡回時の同時接続数と、1アカウントあたりの持ち時間（秒）。
+# 1周期（既定5分）内に終わらせるため、遅いメールボックスは打ち切って次回に回す。
+SYNC_WORKERS = _env_int('MAIL_SYNC_WORKERS', 4)
+ACCOUNT_BUDGET_SEC = _env_int('MAIL_SYNC_ACCOUNT_BUDGET_SEC', 120)
+
+
+def run_accounts_parallel(sync_fn, ids, workers: int = None, budget_sec: int = None):
+    """ids を最大 workers 並列で sync_fn(id, deadline=...) に渡し、(id, result) を返す。
+
+    持ち時間は各アカウントの処理開始時点から数える。1件の例外は他に波及させず、
+    そのアカウントのエラーとして返す。
+    """
+    workers = workers or SYNC_WORKERS
+    budget_sec = budget_sec or ACCOUNT_BUDGET_SEC
+
+    def _run(target_id):
+        return sync_fn(target_id, deadline=time.monotonic() + budget_sec)
+
+    if not ids:
+        return
+    with ThreadPoolExecutor(max_workers=min(workers, len(ids))) as pool:
+        futures = {pool.submit(_run, i): i for i in ids}
+        for fut in as_completed(futures):
+            target_id = futures[fut]
+            try:
+                yield target_id, fut.result()
+            except Exception as e:  # noqa: BLE001
+                logger.exception('mail sync failed: %s', target_id)
+                yield target_id, {'saved': 0, 'skipped': 0, 'errors': [f'{target_id}: {e}']}
+
 
 def get_active_setting(db, tenant_id: int):
     return (db.query(TIntegrationSetting)
@@ -74,8 +118,69 @@ def _already_received(db, tenant_id: int, external_id: str) -> bool:
     ).first() is not None
 
 
-def sync_tenant(tenant_id: int) -> dict:
-    """指定テナントのGmail新着添付をストレージへ保存"""
+def _save_message(db, tenant_id: int, client, msg: dict, adapters_for, result: dict):
+    """1通分の添付を保存する。添付本体は保存直前に1件ずつ取得する。
+
+    受信済みの添付はダウンロード自体を行わない。IMAPの取得エラーは呼び出し元へ
+    送出し（＝このメール以降は次回再取得）、保存先のエラーは添付単位で記録する。
+    """
+    sender = msg['from']
+    client_id, subfolder = _resolve_client_id(db, tenant_id, sender)
+    client_obj = None
+    if client_id:
+        client_obj = db.query(TClient).filter(
+            TClient.id == client_id, TClient.tenant_id == tenant_id).first()
+
+    for idx, part in enumerate(msg['attachments']):
+        filename = part['filename']
+        external_id = f"{msg['uid']}:{idx}:{filename}"
+        if _already_received(db, tenant_id, external_id):
+            result['skipped'] += 1
+            continue
+        data = client.fetch_attachment(msg['uid'], part)
+        if not data:
+            continue
+        try:
+            folder_path = client_obj.storage_folder_path if client_obj else None
+            adapters = adapters_for(getattr(client_obj, 'store_id', None) if client_obj else None)
+            storage_url = upload_to_adapters(
+                adapters, data, filename,
+                client_id=(client_obj.id if client_obj else 0),
+                client_folder_path=folder_path,
+                subfolder=subfolder,
+            )
+            db.add(TReceivedFile(
+                tenant_id=tenant_id, provider='gmail',
+                external_id=external_id, room_id=sender,
+                client_id=(client_obj.id if client_obj else None),
+                filename=filename, storage_url=storage_url, status='saved',
+            ))
+            if client_obj:
+                db.add(TFile(
+                    client_id=client_obj.id, filename=filename,
+                    file_url=storage_url or '',
+                    uploader='Gmail自動連携', timestamp=datetime.utcnow(),
+                ))
+            db.commit()
+            result['saved'] += 1
+        except Exception as e:  # noqa: BLE001
+            db.rollback()
+            db.add(TReceivedFile(
+                tenant_id=tenant_id, provider='gmail',
+                external_id=external_id, room_id=sender,
+                client_id=(client_obj.id if client_obj else None),
+                filename=filename, status='error', error_message=str(e)[:500],
+            ))
+            db.commit()
+            result['errors'].append(f'{filename}: {e}')
+
+
+def sync_tenant(tenant_id: int, deadline: float = None) -> dict:
+    """指定テナントのGmail新着添付をストレージへ保存
+
+    deadline（time.monotonic() 基準）を過ぎたら途中で打ち切り、処理済みUIDまでを
+    記録して返す（result['timed_out']=True）。
+    """
     result = {'saved': 0, 'skipped': 0, 'errors': [], 'messages': 0}
     db = SessionLocal()
     try:
@@ -96,74 +201,35 @@ def sync_tenant(tenant_id: int) -> dict:
         except (TypeError, ValueError):
             imap_port = 993
 
-        client = GmailImapClient(email_address, setting.api_token, host=imap_host, port=imap_port)
-        try:
-            client.connect()
-            messages, max_uid = client.fetch_new_with_attachments(since_uid=since_uid)
-        except GmailImapError as e:
-            result['errors'].append(str(e))
-            return result
-        finally:
-            client.close()
-
-        result['messages'] = len(messages)
         _adapters_cache = {}
         def _adapters_for(store_id):
             if store_id not in _adapters_cache:
                 _adapters_cache[store_id] = get_storage_adapters(tenant_id, store_id=store_id)
             return _adapters_cache[store_id]
 
-        for msg in messages:
-            sender = msg['from']
-            client_id, subfolder = _resolve_client_id(db, tenant_id, sender)
-            client_obj = None
-            if client_id:
-                client_obj = db.query(TClient).filter(
-                    TClient.id == client_id, TClient.tenant_id == tenant_id).first()
-
-            for idx, att in enumerate(msg['attachments']):
-                filename = att['filename']
-                external_id = f"{msg['uid']}:{idx}:{filename}"
-                if _already_received(db, tenant_id, external_id):
-                    result['skipped'] += 1
-                    continue
-                try:
-                    folder_path = client_obj.storage_folder_path if client_obj else None
-                    adapters = _adapters_for(getattr(client_obj, 'store_id', None) if client_obj else None)
-                    storage_url = upload_to_adapters(
-                        adapters, att['data'], filename,
-                        client_id=(client_obj.id if client_obj else 0),
-                        client_folder_path=folder_path,
-                        subfolder=subfolder,
-                    )
-                    db.add(TReceivedFile(
-                        tenant_id=tenant_id, provider='gmail',
-                        external_id=external_id, room_id=sender,
-                        client_id=(client_obj.id if client_obj else None),
-                        filename=filename, storage_url=storage_url, status='saved',
-                    ))
-                    if client_obj:
-                        db.add(TFile(
-                            client_id=client_obj.id, filename=filename,
-                            file_url=storage_url or '',
-                            uploader='Gmail自動連携', timestamp=datetime.utcnow(),
-                        ))
-                    db.commit()
-                    result['saved'] += 1
-                except Exception as e:  # noqa: BLE001
-                    db.rollback()
-                    db.add(TReceivedFile(
-                        tenant_id=tenant_id, provider='gmail',
-                        external_id=external_id, room_id=sender,
-                        client_id=(client_obj.id if client_obj else None),
-                        filename=filename, status='error', error_message=str(e)[:500],
-                    ))
-                    db.commit()
-                    result['errors'].append(f'{filename}: {e}')
+        # 接続したままメールを1通ずつ処理する（添付は1件ずつ取得→保存→解放）。
+        # 添付の無いメールは BODYSTRUCTURE だけで判定され本文はダウンロードしない。
+        processed_uid = since_uid
+        client = GmailImapClient(email_address, setting.api_token, host=imap_host, port=imap_port)
+        try:
+            client.connect()
+            for msg in client.iter_new_messages(since_uid=since_uid):
+                if deadline is not None and time.monotonic() > deadline:
+                    # 持ち時間切れ。残りは次回（since_uid から再開）
+                    result['timed_out'] = True
+                    break
+                if msg['attachments']:
+                    result['messages'] += 1
+                    _save_message(db, tenant_id, client, msg, _adapters_for, result)
+                processed_uid = max(processed_uid, msg['uid'])
+        except (GmailImapError, imaplib.IMAP4.error, OSError) as e:
+            result['errors'].append(str(e))
+        finally:
+            client.close()
 
         # 処理済みUIDを保存（次回はこれ以降のみ取得）
-        if max_uid and max_uid > since_uid:
-            extra['since_uid'] = max_uid
+        if processed_uid > since_uid:
+            extra['since_uid'] = processed_uid
             setting.extra = json.dumps(extra, ensure_ascii=False)
             db.commit()
 
@@ -173,7 +239,10 @@ def sync_tenant(tenant_id: int) -> dict:
 
 
 def sync_all_tenants() -> dict:
-    """Gmail連携が有効な全テナントを同期（バッチ用）"""
+    """Gmail連携が有効な全テナントを同期（バッチ用）
+
+    テナントごとに接続を張り、最大 SYNC_WORKERS 並列・各 ACCOUNT_BUDGET_SEC 秒で巡回する。
+    """
     summary = {'tenants': 0, 'saved': 0, 'skipped': 0, 'errors': []}
     db = SessionLocal()
     try:
@@ -185,8 +254,7 @@ def sync_all_tenants() -> dict:
     finally:
         db.close()
 
-    for tid in tenant_ids:
-        r = sync_tenant(tid)
+    for _tid, r in run_accounts_parallel(sync_tenant, tenant_ids):
         summary['tenants'] += 1
         summary['saved'] += r['saved']
         summary['skipped'] += r['skipped']
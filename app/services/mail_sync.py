@@ -7,7 +7,8 @@ Gmail / Outlook(M365) / Yahoo / iCloud / その他 を IMAP で統一的に扱
 
 差出人 → 顧問先 の振り分けは Gmail 実装（gmail_sync）のロジックを再利用する。
 """
-from io import BytesIO
+import time
+import imaplib
 from datetime import datetime
 
 from app.db import SessionLocal
@@ -16,7 +17,7 @@ from app.models_clients import TClient, TFile
 from app.utils.integrations.mail import ImapMailClient, MailError
 from app.utils.tenant_storage_adapter import get_storage_adapters, upload_to_adapters
 # 差出人→顧問先の解決は Gmail 実装を再利用（明示マッピング→顧問先email一致→未分類）
-from app.services.gmail_sync import _resolve_client_id
+from app.services.gmail_sync import _resolve_client_id, run_accounts_parallel
 
 
 def _already_received(db, tenant_id: int, external_id: str) -> bool:
@@ -27,8 +28,68 @@ def _already_received(db, tenant_id: int, external_id: str) -> bool:
     ).first() is not None
 
 
-def sync_account(account_id: int) -> dict:
-    """1つの担当メールアカウントを巡回して添付を保存する。"""
+def _save_message(db, acc, client, msg: dict, adapters_for, result: dict):
+    """1通分の添付を保存する（添付本体は保存直前に1件ずつ取得）。"""
+    tenant_id = acc.tenant_id
+    sender = msg['from']
+    client_id, subfolder = _resolve_client_id(db, tenant_id, sender)
+    client_obj = None
+    if client_id:
+        client_obj = db.query(TClient).filter(
+            TClient.id == client_id, TClient.tenant_id == tenant_id).first()
+
+    for idx, part in enumerate(msg['attachments']):
+        filename = part['filename']
+        # アカウント単位でUIDが違うので account.id を含めて一意化
+        external_id = f"{acc.id}:{msg['uid']}:{idx}:{filename}"
+        if _already_received(db, tenant_id, external_id):
+            result['skipped'] += 1
+            continue
+        # 取得エラー（IMAP）は呼び出し元へ送出し、このメール以降は次回再取得する
+        data = client.fetch_attachment(msg['uid'], part)
+        if not data:
+            continue
+        try:
+            folder_path = client_obj.storage_folder_path if client_obj else None
+            adapters = adapters_for(getattr(client_obj, 'store_id', None) if client_obj else None)
+            storage_url = upload_to_adapters(
+                adapters, data, filename,
+                client_id=(client_obj.id if client_obj else 0),
+                client_folder_path=folder_path,
+                subfolder=(subfolder or 'メール受信'),
+            )
+            db.add(TReceivedFile(
+                tenant_id=tenant_id, provider='mail',
+                external_id=external_id, room_id=sender,
+                client_id=(client_obj.id if client_obj else None),
+                filename=filename, storage_url=storage_url, status='saved',
+            ))
+            if client_obj:
+                db.add(TFile(
+                    client_id=client_obj.id, filename=filename,
+                    file_url=storage_url or '',
+                    uploader=f'メール自動連携({acc.email})',
+                    timestamp=datetime.utcnow(),
+                ))
+            db.commit()
+            result['saved'] += 1
+        except Exception as e:  # noqa: BLE001
+            db.rollback()
+            db.add(TReceivedFile(
+                tenant_id=tenant_id, provider='mail',
+                external_id=external_id, room_id=sender,
+                client_id=(client_obj.id if client_obj else None),
+                filename=filename, status='error', error_message=str(e)[:500],
+            ))
+            db.commit()
+            result['errors'].append(f'{filename}: {e}')
+
+
+def sync_account(account_id: int, deadline: float = None) -> dict:
+    """1つの担当メールアカウントを巡回して添付を保存する。
+
+    deadline（time.monotonic() 基準）を過ぎたら処理済みUIDまでを記録して打ち切る。
+    """
     result = {'saved': 0, 'skipped': 0, 'errors': [], 'messages': 0}
     db = SessionLocal()
     try:
@@ -39,17 +100,6 @@ def sync_account(account_id: int) -> dict:
             return result
         tenant_id = acc.tenant_id
 
-        client = ImapMailClient(acc.email, acc.app_password, acc.imap_host, acc.imap_port)
-        try:
-            client.connect()
-            messages, max_uid = client.fetch_new_with_attachments(since_uid=acc.since_uid or 0)
-        except MailError as e:
-            result['errors'].append(f'{acc.email}: {e}')
-            return result
-        finally:
-            client.close()
-
-        result['messages'] = len(messages)
         # ストレージアダプタを解決（担当者個人→店舗→本部）。store_id別にキャッシュ
         # このアカウントは担当者本人のものなので、担当者個人ストレージを最優先で使う
         _staff_id = getattr(acc, 'staff_id', None)
@@ -62,59 +112,29 @@ def sync_account(account_id: int) -> dict:
                     staff_id=_staff_id, staff_type=_staff_type)
             return _adapters_cache[store_id]
 
-        for msg in messages:
-            sender = msg['from']
-            client_id, subfolder = _resolve_client_id(db, tenant_id, sender)
-            client_obj = None
-            if client_id:
-                client_obj = db.query(TClient).filter(
-                    TClient.id == client_id, TClient.tenant_id == tenant_id).first()
-
-            for idx, att in enumerate(msg['attachments']):
-                filename = att['filename']
-                # アカウント単位でUIDが違うので account.id を含めて一意化
-                external_id = f"{acc.id}:{msg['uid']}:{idx}:{filename}"
-                if _already_received(db, tenant_id, external_id):
-                    result['skipped'] += 1
-                    continue
-                try:
-                    folder_path = client_obj.storage_folder_path if client_obj else None
-                    adapters = _adapters_for(getattr(client_obj, 'store_id', None) if client_obj else None)
-                    storage_url = upload_to_adapters(
-                        adapters, att['data'], filename,
-                        client_id=(client_obj.id if client_obj else 0),
-                        client_folder_path=folder_path,
-                        subfolder=(subfolder or 'メール受信'),
-                    )
-                    db.add(TReceivedFile(
-                        tenant_id=tenant_id, provider='mail',
-                        external_id=external_id, room_id=sender,
-                        client_id=(client_obj.id if client_obj else None),
-                        filename=filename, storage_url=storage_url, status='saved',
-                    ))
-                    if client_obj:
-                        db.add(TFile(
-                            client_id=client_obj.id, filename=filename,
-                            file_url=storage_url or '',
-                            uploader=f'メール自動連携({acc.email})',
-                            timestamp=datetime.utcnow(),
-                        ))
-                    db.commit()
-                    result['saved'] += 1
-                except Exception as e:  # noqa: BLE001
-                    db.rollback()
-                    db.add(TReceivedFile(
-                        tenant_id=tenant_id, provider='mail',
-                        external_id=external_id, room_id=sender,
-                        client_id=(client_obj.id if client_obj else None),
-                        filename=filename, status='error', error_message=str(e)[:500],
-                    ))
-                    db.commit()
-                    result['errors'].append(f'{filename}: {e}')
+        # 接続したまま1通ずつ処理する（添付の無いメールは本文をダウンロードしない）
+        since_uid = acc.since_uid or 0
+        processed_uid = since_uid
+        client = ImapMailClient(acc.email, acc.app_password, acc.imap_host, acc.imap_port)
+        try:
+            client.connect()
+            for msg in client.iter_new_messages(since_uid=since_uid):
+                if deadline is not None and time.monotonic() > deadline:
+                    # 持ち時間切れ。残りは次回（since_uid から再開）
+                    result['timed_out'] = True
+                    break
+                if msg['attachments']:
+                    result['messages'] += 1
+                    _save_message(db, acc, client, msg, _adapters_for, result)
+                processed_uid = max(processed_uid, msg['uid'])
+        except (MailError, imaplib.IMAP4.error, OSError) as e:
+            result['errors'].append(f'{acc.email}: {e}')
+        finally:
+            client.close()
 
         # 処理済みUIDを保存
-        if max_uid and max_uid > (acc.since_uid or 0):
-            acc.since_uid = max_uid
+        if processed_uid > since_uid:
+            acc.since_uid = processed_uid
             db.commit()
         return result
     finally:
@@ -133,8 +153,7 @@ def sync_tenant(tenant_id: int) -> dict:
         db.close()
 
     total['accounts'] = len(ids)
-    for aid in ids:
-        r = sync_account(aid)
+    for _aid, r in run_accounts_parallel(sync_account, ids):
         total['saved'] += r['saved']
         total['skipped'] += r['skipped']
         total['errors'].extend(r['errors'])
@@ -142,7 +161,11 @@ def sync_tenant(tenant_id: int) -> dict:
 
 
 def sync_all_tenants() -> dict:
-    """メール連携が有効な全テナントを巡回（スケジューラ用）。"""
+    """メール連携が有効な全テナントを巡回（スケジューラ用）。
+
+    アカウントごとに最大 SYNC_WORKERS 並列・各 ACCOUNT_BUDGET_SEC 秒で処理する
+    （gmail_sync.run_accounts_parallel）。
+    """
     summary = {'accounts': 0, 'saved': 0, 'skipped': 0, 'errors': []}
     db = SessionLocal()
     try:
@@ -152,8 +175,7 @@ def sync_all_tenants() -> dict:
         db.close()
 
     summary['accounts'] = len(ids)
-    for aid in ids:
-        r = sync_account(aid)
+    for _aid, r in run_accounts_parallel(sync_account, ids):
         summary['saved'] += r['saved']
         summary['skipped'] += r['skipped']
         summary['errors'].extend(r['errors'])
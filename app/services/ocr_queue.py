@@ -0,0 +1,281 @@
+"""
+証憑OCRジョブキュー（通帳 / クレジット明細 / レシート）
+
+従来はアップロードのリクエスト内（レシート）や、その場で起動したスレッド（通帳・
+クレジット明細）でPDFのラスタライズ・前処理・OCR API 呼び出しを行っていたため、
+アップロードが集中するとスレッドが無制限に増え、プロセスの再起動で処理が消えていた。
+
+ここでは OCR を T_OCRジョブ に永続化し、プロセスごとに OCR_WORKERS 本の
+ワーカースレッドがリースを取って順に処理する。
+- アップロードはジョブを登録するだけで即座に応答できる
+- ジョブは条件付き UPDATE でリースを取ったワーカーだけが実行する（複数 gunicorn ワーカーで分担）
+- ワーカーが落ちてもリース期限（JOB_LEASE_MINUTES）切れで他が拾い直す
+- 失敗したジョブは指数バックオフで再試行し、MAX_ATTEMPTS 回で諦める
+- ページ（チャンク）単位の進捗を progress_done / progress_total に記録し、
+  各画面の /<id>/status で返す
+
+ジョブの中身は各 Blueprint が register_handler() で登録する。
+ハンドラを登録していないプロセス（batch_*.py 等）はジョブを取らない。
+
+設定（環境変数・任意）:
+  OCR_WORKERS          : 1プロセスあたりのOCRワーカースレッド数。既定 2（0 で無効）
+  OCR_JOB_MAX_ATTEMPTS : 1ジョブの最大実行回数。既定 3
+"""
+import os
+import json
+import socket
+import threading
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from app.db import SessionLocal
+from app.models_voucher import TOcrJob
+
+logger = logging.getLogger(__name__)
+
+JOB_LEASE_MINUTES = 20        # リース期限。進捗を報告するたびに延長する
+_POLL_INTERVAL_SEC = 15       # 新規ジョブの通知が無くてもこの間隔でDBを確認する
+_CLAIM_CANDIDATES = 10        # 1回のリース取得で候補として読むジョブ数
+_RETRY_BASE_SEC = 30          # 再試行の待ち時間: 30秒, 60秒, 120秒…
+_RETRY_MAX_SEC = 900
+_OWNER = f'{socket.gethostname()}:{os.getpid()}'
+
+_handlers = {}                # kind -> (run, on_error)
+_wakeup = threading.Event()
+_started = False
+_start_lock = threading.Lock()
+
+
+def _env_workers() -> int:
+    try:
+        return max(0, int(os.environ.get('OCR_WORKERS', '2')))
+    except Exception:
+        return 2
+
+
+def _env_max_attempts() -> int:
+    try:
+        return max(1, int(os.environ.get('OCR_JOB_MAX_ATTEMPTS', '3')))
+    except Exception:
+        return 3
+
+
+def register_handler(kind: str, run, on_error=None):
+    """ジョブ種別ごとの処理を登録する。
+
+    run(job, progress)      : job は dict（id, kind, target_id, tenant_id, tenpo_id,
+                              file_path, options, attempts）。例外を送出すると再試行される。
+                              progress(done, total) でページ単位の進捗を報告できる。
+    on_error(job, message)  : 再試行しきって諦めたときに呼ぶ（対象レコードを error にする等）
+    """
+    _handlers[kind] = (run, on_error)
+
+
+def enqueue(kind: str, target_id: int, tenant_id: int, file_path: str,
+            tenpo_id: int = None, options: dict = None) -> int:
+    """OCRジョブを登録してワーカーを起こす。登録したジョブIDを返す。"""
+    db = SessionLocal()
+    try:
+        job = TOcrJob(
+            kind=kind,
+            target_id=target_id,
+            tenant_id=tenant_id,
+            tenpo_id=tenpo_id,
+            file_path=file_path,
+            options=json.dumps(options or {}, ensure_ascii=False),
+            status='queued',
+            attempts=0,
+            next_run_at=datetime.utcnow(),
+        )
+        db.add(job)
+        db.commit()
+        job_id = job.id
+    finally:
+        db.close()
+    start_workers()
+    _wakeup.set()
+    return job_id
+
+
+def get_job_status(kind: str, target_id: int) -> dict:
+    """対象レコードの最新ジョブの状態を返す（ジョブが無ければ None）。
+
+    Returns: {'state', 'attempts', 'progress': {'done', 'total'}, 'queue_position', 'last_error'}
+    """
+    db = SessionLocal()
+    try:
+        job = (db.query(TOcrJob)
+               .filter(TOcrJob.kind == kind, TOcrJob.target_id == target_id)
+               .order_by(TOcrJob.id.desc()).first())
+        if job is None:
+            return None
+        position = 0
+        if job.status == 'queued':
+            # 自分より先に登録され、まだ始まっていないジョブの数
+            position = db.query(TOcrJob).filter(
+                TOcrJob.status == 'queued', TOcrJob.id < job.id).count()
+        return {
+            'state': job.status,
+            'attempts': job.attempts or 0,
+            'progress': {'done': job.progress_done or 0, 'total': job.progress_total or 0},
+            'queue_position': position,
+            'last_error': job.last_error,
+        }
+    finally:
+        db.close()
+
+
+def _claim_job(db, owner: str):
+    """実行できるジョブを1つリースする。取れたら job の dict を返す。
+
+    queued で実行時刻が来たもの、または running のままリースが切れたもの（ワーカー停止）が対象。
+    条件付き UPDATE の rowcount==1 になったワーカーだけがそのジョブを得る。
+    """
+    kinds = list(_handlers)
+    if not kinds:
+        return None
+    now = datetime.utcnow()
+    free = or_(TOcrJob.lease_until.is_(None), TOcrJob.lease_until < now)
+    due = or_(TOcrJob.next_run_at.is_(None), TOcrJob.next_run_at <= now)
+    runnable = TOcrJob.status.in_(['queued', 'running'])
+    candidates = [r[0] for r in (
+        db.query(TOcrJob.id)
+        .filter(runnable, free, due, TOcrJob.kind.in_(kinds))
+        .order_by(TOcrJob.next_run_at, TOcrJob.id)
+        .limit(_CLAIM_CANDIDATES).all())]
+    for job_id in candidates:
+        updated = (
+            db.query(TOcrJob)
+            .filter(TOcrJob.id == job_id, runnable, free, due)
+            .update({TOcrJob.status: 'running',
+                     TOcrJob.lease_owner: owner,
+                     TOcrJob.lease_until: now + timedelta(minutes=JOB_LEASE_MINUTES),
+                     TOcrJob.started_at: now,
+                     TOcrJob.attempts: TOcrJob.attempts + 1},
+                    synchronize_session=False)
+        )
+        db.commit()
+        if updated == 1:
+            job = db.query(TOcrJob).filter(TOcrJob.id == job_id).first()
+            try:
+                options = json.loads(job.options) if job.options else {}
+            except ValueError:
+                options = {}
+            return {
+                'id': job.id, 'kind': job.kind, 'target_id': job.target_id,
+                'tenant_id': job.tenant_id, 'tenpo_id': job.tenpo_id,
+                'file_path': job.file_path, 'options': options,
+                'attempts': job.attempts or 0,
+            }
+    return None
+
+
+def _update_owned(job_id: int, owner: str, values: dict) -> bool:
+    """自分がリースを持っているジョブだけを更新する（取り直された後は触れない）"""
+    db = SessionLocal()
+    try:
+        updated = (db.query(TOcrJob)
+                   .filter(TOcrJob.id == job_id, TOcrJob.lease_owner == owner)
+                   .update(values, synchronize_session=False))
+        db.commit()
+        return updated == 1
+    except Exception:
+        db.rollback()
+        logger.exception('ocr_queue: ジョブの更新に失敗しました (id=%s)', job_id)
+        return False
+    finally:
+        db.close()
+
+
+def _progress_reporter(job_id: int, owner: str):
+    def _progress(done: int, total: int):
+        # 進捗の報告はリースの延長も兼ねる（長いPDFでも期限切れにならないように）
+        _update_owned(job_id, owner, {
+            TOcrJob.progress_done: done,
+            TOcrJob.progress_total: total,
+            TOcrJob.lease_until: datetime.utcnow() + timedelta(minutes=JOB_LEASE_MINUTES),
+        })
+    return _progress
+
+
+def _retry_delay(attempts: int) -> int:
+    return min(_RETRY_MAX_SEC, _RETRY_BASE_SEC * (2 ** max(0, attempts - 1)))
+
+
+def _execute_job(job: dict, owner: str):
+    run, on_error = _handlers[job['kind']]
+    progress = _progress_reporter(job['id'], owner)
+    try:
+        run(job, progress)
+    except Exception as e:  # noqa: BLE001 - 1ジョブの失敗で他を止めない
+        message = str(e)[:2000]
+        if job['attempts'] < _env_max_attempts():
+            delay = _retry_delay(job['attempts'])
+            logger.warning('ocr_queue: %s:%s 失敗（%s秒後に再試行 %s回目）: %s',
+                           job['kind'], job['target_id'], delay, job['attempts'], message)
+            _update_owned(job['id'], owner, {
+                TOcrJob.status: 'queued',
+                TOcrJob.lease_owner: None,
+                TOcrJob.lease_until: None,
+                TOcrJob.next_run_at: datetime.utcnow() + timedelta(seconds=delay),
+                TOcrJob.last_error: message,
+            })
+            return
+        logger.exception('ocr_queue: %s:%s 再試行上限に達しました', job['kind'], job['target_id'])
+        _update_owned(job['id'], owner, {
+            TOcrJob.status: 'error',
+            TOcrJob.lease_owner: None,
+            TOcrJob.lease_until: None,
+            TOcrJob.finished_at: datetime.utcnow(),
+            TOcrJob.last_error: message,
+        })
+        if on_error:
+            try:
+                on_error(job, message)
+            except Exception:
+                logger.exception('ocr_queue: エラー処理に失敗しました (id=%s)', job['id'])
+        return
+
+    _update_owned(job['id'], owner, {
+        TOcrJob.status: 'done',
+        TOcrJob.lease_owner: None,
+        TOcrJob.lease_until: None,
+        TOcrJob.finished_at: datetime.utcnow(),
+        TOcrJob.last_error: None,
+    })
+
+
+def _worker_loop(n: int):
+    owner = f'{_OWNER}:ocr{n}'
+    while True:
+        job = None
+        try:
+            db = SessionLocal()
+            try:
+                job = _claim_job(db, owner)
+            finally:
+                db.close()
+        except Exception:
+            logger.exception('ocr_queue: ジョブの取得に失敗しました')
+        if job is None:
+            _wakeup.wait(_POLL_INTERVAL_SEC)
+            _wakeup.clear()
+            continue
+        _execute_job(job, owner)
+
+
+def start_workers():
+    """OCRワーカーを起動する（プロセス毎に1度だけ。enqueue からも呼ばれる）"""
+    global _started
+    workers = _env_workers()
+    if workers <= 0:
+        return
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    for n in range(workers):
+        threading.Thread(target=_worker_loop, args=(n,), name=f'ocr-worker-{n}', daemon=True).start()
+    logger.info('ocr_queue: OCRワーカーを%s本起動しました', workers)
@@ -2,28 +2,38 @@
 アプリ内スケジューラ（cron不要）
 
 アプリ起動時に常駐スレッドを1本立ち上げ、一定間隔で
-「Gmail / ChatWork の受信 → 指定ストレージへ自動保存」を実行する。
+「Gmail / ChatWork / 担当メール の受信 → 指定ストレージへ自動保存」を実行する。
 
 - cron / systemd を使わないため、デプロイするだけで自動取得が回る。
-- 複数の gunicorn ワーカーが同時に動いても、DB(T_スケジューラ状態)への
-  条件付きUPDATEで実行権を1つに絞り、重複実行を防ぐ。
-  （ai-app-studio の db_backup スケジューラと同じ方式）
+- 同期は「テナント×連携」単位のジョブ（T_スケジューラジョブ）に分割する。
+  各ジョブはDBへの条件付きUPDATEでリースを取ったワーカーだけが実行するため、
+  複数の gunicorn ワーカー（と batch_*.py）が重複なく並列に分担できる。
+  1テナントが遅くても、他のテナントのジョブは別のワーカー/スレッドで進む。
+- ワーカーが途中で落ちても、リース期限（JOB_LEASE_MINUTES）切れで他が拾い直す。
+  実行中のジョブはリースを JOB_LEASE_RENEW_SEC ごとに延長するため、期限より長く
+  かかる同期が他のワーカーと二重に走ることはない（延長は JOB_MAX_RUN_MINUTES まで）。
 
 設定（環境変数・任意）:
   AUTO_SYNC_ENABLED           : '0' で無効化（既定: 有効）
   AUTO_SYNC_INTERVAL_MINUTES  : 実行間隔（分）。既定 5
+  AUTO_SYNC_THREADS           : 1ワーカー内でジョブを並列実行するスレッド数。既定 2
 """
 import os
 import json
 import time
+import socket
 import threading
 import logging
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 from sqlalchemy import or_
 
 from app.db import SessionLocal
-from app.models_integrations import TSchedulerState, TSchedulerConfig
+from app.models_integrations import (
+    TSchedulerState, TSchedulerConfig, TSchedulerJob,
+    TIntegrationSetting, TStaffChatworkAccount, TStaffMailAccount,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +43,13 @@ _STARTUP_DELAY_SEC = 30       # 起動直後の混雑を避けて少し待つ
 
 _ALLOWED_INTERVALS = [5, 10, 15, 30, 60]   # 画面で選べる間隔（分）
 
+JOB_KINDS = ('chatwork', 'gmail', 'mail')   # ジョブ種別（＝連携）。ジョブはテナントごと
+JOB_LEASE_MINUTES = 15        # リース期限。これを過ぎたジョブは他のワーカーが取り直せる
+JOB_LEASE_RENEW_SEC = JOB_LEASE_MINUTES * 60 // 3   # 実行中ジョブのリース延長間隔
+JOB_MAX_RUN_MINUTES = 60      # これを超えて実行中のジョブはリースを延長しない（固まったジョブ対策）
+_CLAIM_CANDIDATES = 20        # 1回のリース取得で候補として読むジョブ数
+_OWNER = f'{socket.gethostname()}:{os.getpid()}'
+
 _started = False
 _start_lock = threading.Lock()
 
@@ -75,6 +92,13 @@ def _interval_minutes() -> int:
     return _load_config()['interval_minutes']
 
 
+def _env_threads() -> int:
+    try:
+        return max(1, int(os.environ.get('AUTO_SYNC_THREADS', '2')))
+    except Exception:
+        return 2
+
+
 def set_config(enabled: bool, interval_minutes: int) -> dict:
     """画面から自動取得のオンオフ・間隔を保存する。"""
     interval_minutes = int(interval_minutes)
@@ -96,51 +120,256 @@ def set_config(enabled: bool, interval_minutes: int) -> dict:
     return {'enabled': bool(enabled), 'interval_minutes': interval_minutes}
 
 
-def _ensure_row(db):
-    """スケジューラ状態の行が無ければ作る（初回のみ）。"""
-    row = db.query(TSchedulerState).filter(TSchedulerState.job_name == JOB_NAME).first()
-    if row:
-        return
+# ------------------------------------------------------------
+# ジョブ（テナント×連携）の作成・リース・記録
+# ------------------------------------------------------------
+def _job_targets(db, kinds) -> dict:
+    """種別ごとに、同期対象のテナントID集合を返す"""
+    targets = {}
+    if 'chatwork' in kinds:
+        ids = {r[0] for r in db.query(TIntegrationSetting.tenant_id).filter(
+            TIntegrationSetting.provider == 'chatwork',
+            TIntegrationSetting.status == 'active').all()}
+        ids |= {r[0] for r in db.query(TStaffChatworkAccount.tenant_id).filter(
+            TStaffChatworkAccount.status == 'active').all()}
+        targets['chatwork'] = ids
+    if 'gmail' in kinds:
+        targets['gmail'] = {r[0] for r in db.query(TIntegrationSetting.tenant_id).filter(
+            TIntegrationSetting.provider == 'gmail',
+            TIntegrationSetting.status == 'active').all()}
+    if 'mail' in kinds:
+        targets['mail'] = {r[0] for r in db.query(TStaffMailAccount.tenant_id).filter(
+            TStaffMailAccount.status == 'active').all()}
+    return targets
+
+
+def _plan_jobs(db, kinds):
+    """連携設定に合わせてジョブ行を追加・削除する（どのワーカーが実行してもよい）"""
+    now = datetime.utcnow()
+    targets = _job_targets(db, kinds)
+    wanted = {f'{kind}:{tid}': (kind, tid) for kind, ids in targets.items() for tid in ids}
+    existing = {j.job_key: j for j in db.query(TSchedulerJob).filter(
+        TSchedulerJob.kind.in_(list(kinds))).all()}
+    for key, (kind, tid) in wanted.items():
+        if key not in existing:
+            db.add(TSchedulerJob(job_key=key, kind=kind, tenant_id=tid))
+    for key, job in existing.items():
+        # 連携が解除されたテナントのジョブ（実行中のものは終わってから）
+        if key not in wanted and (job.lease_until is None or job.lease_until < now):
+            db.delete(job)
     try:
-        db.add(TSchedulerState(job_name=JOB_NAME, last_run_at=None))
         db.commit()
     except Exception:
-        db.rollback()  # 別ワーカーが同時に作った場合など（unique制約）
+        db.rollback()  # 別ワーカーが同時に作った場合など（unique制約）。次回に持ち越し
 
 
-def _claim(db, interval_min: int) -> bool:
-    """前回実行から interval_min 経過していれば last_run_at を進めて実行権を得る。
+def _claim_job(db, owner: str, kinds, exclude=(), force: bool = False):
+    """実行期限の来たジョブを1つリースする。取れたら (id, kind, tenant_id) を返す。
 
-    条件付き UPDATE の rowcount==1 になったワーカーだけが True を得る（＝実行する）。
-    複数ワーカーが同時に来ても、行ロックにより1つだけが成功する。
+    条件付き UPDATE の rowcount==1 になったワーカーだけがそのジョブを得る。
+    force=True のときは next_run_at を無視する（バッチからの即時実行用）。
     """
     now = datetime.utcnow()
-    cutoff = now - timedelta(minutes=interval_min)
-    updated = (
-        db.query(TSchedulerState)
-        .filter(
-            TSchedulerState.job_name == JOB_NAME,
-            or_(TSchedulerState.last_run_at.is_(None),
-                TSchedulerState.last_run_at <= cutoff),
+    free = or_(TSchedulerJob.lease_until.is_(None), TSchedulerJob.lease_until < now)
+    due = or_(TSchedulerJob.next_run_at.is_(None), TSchedulerJob.next_run_at <= now)
+    q = db.query(TSchedulerJob.id).filter(free, TSchedulerJob.kind.in_(list(kinds)))
+    if not force:
+        q = q.filter(due)
+    if exclude:
+        q = q.filter(~TSchedulerJob.id.in_(list(exclude)))
+    candidates = [r[0] for r in q.order_by(TSchedulerJob.next_run_at)
+                                 .limit(_CLAIM_CANDIDATES).all()]
+    for job_id in candidates:
+        cond = [TSchedulerJob.id == job_id, free]
+        if not force:
+            cond.append(due)
+        updated = (
+            db.query(TSchedulerJob)
+            .filter(*cond)
+            .update({TSchedulerJob.lease_owner: owner,
+                     TSchedulerJob.lease_until: now + timedelta(minutes=JOB_LEASE_MINUTES),
+                     TSchedulerJob.last_started_at: now},
+                    synchronize_session=False)
         )
-        .update({TSchedulerState.last_run_at: now}, synchronize_session=False)
-    )
-    db.commit()
-    return updated == 1
+        db.commit()
+        if updated == 1:
+            row = db.query(TSchedulerJob.kind, TSchedulerJob.tenant_id).filter(
+                TSchedulerJob.id == job_id).first()
+            return job_id, row[0], row[1]
+    return None
+
+
+def _run_job(kind: str, tenant_id: int) -> dict:
+    if kind == 'chatwork':
+        from app.services.chatwork_sync import sync_tenant_all
+        return sync_tenant_all(tenant_id)
+    if kind == 'gmail':
+        from app.services.gmail_sync import sync_tenant as gm_sync_tenant
+        return gm_sync_tenant(tenant_id)
+    if kind == 'mail':
+        from app.services.mail_sync import sync_tenant as mail_sync_tenant
+        return mail_sync_tenant(tenant_id)
+    raise ValueError(f'unknown job kind: {kind}')
+
+
+def _renew_lease(job_id: int, owner: str) -> bool:
+    """自分が持っているリースの期限を延長する。リースを失っていたら False"""
+    db = SessionLocal()
+    try:
+        updated = (
+            db.query(TSchedulerJob)
+            .filter(TSchedulerJob.id == job_id, TSchedulerJob.lease_owner == owner)
+            .update({TSchedulerJob.lease_until:
+                     datetime.utcnow() + timedelta(minutes=JOB_LEASE_MINUTES)},
+                    synchronize_session=False)
+        )
+        db.commit()
+        return updated == 1
+    except Exception:
+        db.rollback()
+        logger.exception('scheduler: リースの延長に失敗しました (id=%s)', job_id)
+        return True  # 一時的なDBエラー。次の間隔で再試行する
+    finally:
+        db.close()
+
+
+def _keep_lease(job_id: int, owner: str, stop: threading.Event):
+    """ジョブ実行中、stop がセットされるまでリースを定期的に延長する"""
+    limit = time.monotonic() + JOB_MAX_RUN_MINUTES * 60
+    while not stop.wait(JOB_LEASE_RENEW_SEC):
+        if time.monotonic() > limit:
+            logger.warning('scheduler: ジョブが %d 分を超えたためリースの延長を止めます (id=%s)',
+                           JOB_MAX_RUN_MINUTES, job_id)
+            return
+        if not _renew_lease(job_id, owner):
+            logger.warning('scheduler: ジョブのリースを失いました (id=%s)', job_id)
+            return
+
+
+def _finish_job(job_id: int, owner: str, started_at: datetime, duration_ms: int,
+                status: str, detail: dict, interval_min: int):
+    """ジョブの実行結果と所要時間を記録し、リースを返して次回実行時刻を進める"""
+    db = SessionLocal()
+    try:
+        row = db.query(TSchedulerJob).filter(TSchedulerJob.id == job_id).first()
+        if row is None:
+            return
+        if row.lease_owner == owner:
+            # リース期限切れで他のワーカーが取り直していた場合はリースに触れない
+            row.lease_owner = None
+            row.lease_until = None
+            row.next_run_at = started_at + timedelta(minutes=interval_min)
+        row.last_finished_at = datetime.utcnow()
+        row.last_status = status
+        row.last_duration_ms = duration_ms
+        try:
+            row.last_detail = json.dumps(detail, ensure_ascii=False, default=str)[:2000]
+        except Exception:
+            row.last_detail = str(detail)[:2000]
+        row.run_count = (row.run_count or 0) + 1
+        if status == 'error':
+            row.error_count = (row.error_count or 0) + 1
+        row.total_duration_ms = (row.total_duration_ms or 0) + duration_ms
+        row.max_duration_ms = max(row.max_duration_ms or 0, duration_ms)
+        db.commit()
+    except Exception:
+        db.rollback()
+        logger.exception('scheduler: ジョブ結果の記録に失敗しました (id=%s)', job_id)
+    finally:
+        db.close()
+
+
+def _execute_job(job_id: int, kind: str, tenant_id: int, owner: str, interval_min: int) -> dict:
+    started_at = datetime.utcnow()
+    t0 = time.monotonic()
+    status = 'ok'
+    stop = threading.Event()
+    threading.Thread(target=_keep_lease, args=(job_id, owner, stop),
+                     name=f'scheduler-lease-{job_id}', daemon=True).start()
+    try:
+        result = _run_job(kind, tenant_id)
+        if result.get('errors'):
+            status = 'error'
+    except Exception as e:  # noqa: BLE001 - 1ジョブの失敗で他を止めない
+        logger.exception('scheduler: %s (tenant=%s) failed', kind, tenant_id)
+        result = {'saved': 0, 'skipped': 0, 'errors': [str(e)]}
+        status = 'error'
+    finally:
+        stop.set()
+    duration_ms = int((time.monotonic() - t0) * 1000)
+    _finish_job(job_id, owner, started_at, duration_ms, status, result, interval_min)
+    return result
+
+
+def run_jobs(kinds=None, force: bool = False, threads: int = None) -> dict:
+    """ジョブをリースしながら並列に処理する（アプリ内スケジューラ・バッチ共通）。
+
+    kinds : 対象の種別（既定: JOB_KINDS 全て）
+    force : True なら実行期限を待たず全ジョブを1回ずつ処理する（batch_*.py 用）。
+            他ワーカーがリース中のジョブは飛ばす（＝そちらで処理中）。
+    threads: このプロセス内の並列数（既定: AUTO_SYNC_THREADS）
+
+    Returns: {'jobs', 'saved', 'skipped', 'errors', 'by_kind': {kind: {...}}}
+    """
+    kinds = tuple(kinds or JOB_KINDS)
+    threads = threads or _env_threads()
+    interval = _interval_minutes()
+    db = SessionLocal()
+    try:
+        _plan_jobs(db, kinds)
+    finally:
+        db.close()
+
+    summary = {'jobs': 0, 'saved': 0, 'skipped': 0, 'errors': [],
+               'by_kind': {k: {'jobs': 0, 'saved': 0, 'skipped': 0, 'errors': 0} for k in kinds}}
+    done = set()
+    lock = threading.Lock()
+
+    def _worker(n):
+        owner = f'{_OWNER}:{n}'
+        while True:
+            db = SessionLocal()
+            try:
+                with lock:
+                    exclude = set(done) if force else ()
+                claimed = _claim_job(db, owner, kinds, exclude=exclude, force=force)
+            finally:
+                db.close()
+            if not claimed:
+                return
+            job_id, kind, tenant_id = claimed
+            with lock:
+                done.add(job_id)
+            r = _execute_job(job_id, kind, tenant_id, owner, interval)
+            with lock:
+                by_kind = summary['by_kind'][kind]
+                summary['jobs'] += 1
+                by_kind['jobs'] += 1
+                for key in ('saved', 'skipped'):
+                    summary[key] += r.get(key, 0)
+                    by_kind[key] += r.get(key, 0)
+                by_kind['errors'] += len(r.get('errors') or [])
+                summary['errors'].extend(f'{kind}:{tenant_id}: {e}' for e in r.get('errors') or [])
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(_worker, range(threads)))
+    return summary
 
 
 def _record_result(status: str, detail: dict):
     db = SessionLocal()
     try:
         row = db.query(TSchedulerState).filter(TSchedulerState.job_name == JOB_NAME).first()
-        if row:
-            row.last_finished_at = datetime.utcnow()
-            row.last_status = status
-            try:
-                row.last_detail = json.dumps(detail, ensure_ascii=False, default=str)[:2000]
-            except Exception:
-                row.last_detail = str(detail)[:2000]
-            db.commit()
+        if row is None:
+            row = TSchedulerState(job_name=JOB_NAME)
+            db.add(row)
+        row.last_finished_at = datetime.utcnow()
+        row.last_status = status
+        try:
+            row.last_detail = json.dumps(detail, ensure_ascii=False, default=str)[:2000]
+        except Exception:
+            row.last_detail = str(detail)[:2000]
+        db.commit()
     except Exception:
         db.rollback()
     finally:
@@ -148,7 +377,10 @@ def _record_result(status: str, detail: dict):
 
 
 def run_sync_once() -> dict:
-    """1回分の受信同期（ChatWork + Gmail）。手動呼び出しにも使える。"""
+    """1回分の受信同期（ChatWork + Gmail + 担当メール）を全テナント分まとめて実行する。
+
+    ジョブのリースを使わない手動呼び出し用。定期実行は run_jobs() を使う。
+    """
     detail = {}
     status = 'ok'
     try:
@@ -181,35 +413,74 @@ def _loop():
     while True:
         try:
             if _enabled():
-                interval = _interval_minutes()
-                db = SessionLocal()
-                try:
-                    _ensure_row(db)
-                    won = _claim(db, interval)
-                finally:
-                    db.close()
-                if won:
-                    logger.info('scheduler: 受信同期を実行します')
-                    run_sync_once()
+                summary = run_jobs()
+                if summary['jobs']:
+                    logger.info('scheduler: 受信同期ジョブ %d 件を実行しました（保存 %d 件）',
+                                summary['jobs'], summary['saved'])
         except Exception:  # noqa: BLE001
             logger.exception('scheduler: ループでエラー')
         time.sleep(_CHECK_INTERVAL_SEC)
 
 
-def get_state() -> dict:
-    """スケジューラの稼働状況を返す（画面表示用）。"""
+def _job_metrics(rows) -> dict:
+    """ジョブ行を種別ごとに集計（件数・実行中・エラー・所要時間）"""
+    now = datetime.utcnow()
+    out = {}
+    for j in rows:
+        m = out.setdefault(j.kind, {'jobs': 0, 'running': 0, 'errors': 0, 'runs': 0,
+                                    'last_finished_at': None, 'avg_duration_ms': None,
+                                    'max_duration_ms': None, '_total_ms': 0})
+        m['jobs'] += 1
+        if j.lease_until and j.lease_until >= now:
+            m['running'] += 1
+        if j.last_status == 'error':
+            m['errors'] += 1
+        m['runs'] += j.run_count or 0
+        m['_total_ms'] += j.total_duration_ms or 0
+        if j.last_finished_at and (m['last_finished_at'] is None
+                                   or j.last_finished_at > m['last_finished_at']):
+            m['last_finished_at'] = j.last_finished_at
+        if j.max_duration_ms is not None:
+            m['max_duration_ms'] = max(m['max_duration_ms'] or 0, j.max_duration_ms)
+    for m in out.values():
+        total = m.pop('_total_ms')
+        if m['runs']:
+            m['avg_duration_ms'] = int(total / m['runs'])
+    return out
+
+
+def get_state(tenant_id: int = None) -> dict:
+    """スケジューラの稼働状況を返す（画面表示用）。
+
+    tenant_id を渡すと、そのテナントのジョブだけで最終実行・状態を集計する。
+    'jobs' には種別ごとのジョブ数・実行中・エラー・平均/最大所要時間（ms）が入る。
+    """
     cfg = _load_config()
     info = {'enabled': cfg['enabled'], 'interval_minutes': cfg['interval_minutes'],
             'allowed_intervals': _ALLOWED_INTERVALS,
-            'last_finished_at': None, 'last_status': None}
+            'last_finished_at': None, 'last_status': None, 'jobs': {}}
     try:
         db = SessionLocal()
         try:
-            row = db.query(TSchedulerState).filter(
-                TSchedulerState.job_name == JOB_NAME).first()
-            if row:
-                info['last_finished_at'] = row.last_finished_at
-                info['last_status'] = row.last_status
+            q = db.query(TSchedulerJob)
+            if tenant_id is not None:
+                q = q.filter(TSchedulerJob.tenant_id == tenant_id)
+            rows = q.all()
+            info['jobs'] = _job_metrics(rows)
+            finished = [j for j in rows if j.last_finished_at]
+            if finished:
+                info['last_finished_at'] = max(j.last_finished_at for j in finished)
+                info['last_status'] = ('error' if any(j.last_status == 'error' for j in finished)
+                                       else 'ok')
+            if tenant_id is None:
+                # 手動の一括同期（run_sync_once）の記録も考慮する
+                row = db.query(TSchedulerState).filter(
+                    TSchedulerState.job_name == JOB_NAME).first()
+                if row and row.last_finished_at and (
+                        info['last_finished_at'] is None
+                        or row.last_finished_at > info['last_finished_at']):
+                    info['last_finished_at'] = row.last_finished_at
+                    info['last_status'] = row.last_status
         finally:
             db.close()
     except Exception:
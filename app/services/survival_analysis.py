@@ -81,6 +81,11 @@ def kaplan_meier_estimate(records: list[dict]) -> dict:
     打ち切り処理：
         同一時点に死亡と打ち切りがある場合、死亡を先に処理する（標準的な慣習）。
 
+    計算量：
+        レコードを 1 回走査して時点ごとの件数に集計し、ユニーク時点（m 個）を
+        昇順に 1 回なめるだけなので O(n + m log m)。複数の層をまとめて
+        推定する場合は kaplan_meier_by_strata() を使う。
+
     Parameters
     ----------
     records : list[dict]
@@ -99,9 +104,95 @@ def kaplan_meier_estimate(records: list[dict]) -> dict:
             n_censored: int,
         }
     """
-    # None を除外
-    valid = [r for r in records if r.get('time_months') is not None]
-    n_total = len(valid)
+    # 時点ごとの死亡数・打ち切り数を 1 パスで集計する
+    counts: dict = {}
+    for r in records:
+        t = r.get('time_months')
+        if t is None:
+            continue
+        _add_count(counts, t, r)
+    return _km_from_counts(counts)
+
+
+def kaplan_meier_by_strata(
+    records: list[dict],
+    stratum_key,
+    with_ci: bool = False,
+    alpha: float = 0.05,
+) -> dict:
+    """
+    層（犬種・ラインなど）ごとのカプランマイヤー推定を 1 回の走査でまとめて行う。
+
+    レコード全体を 1 度だけ走査して (層, 時点) ごとの死亡数・打ち切り数を集計し、
+    層ごとにユニーク時点を 1 回なめて生存曲線を作る。
+    各層の結果は kaplan_meier_estimate() に同じレコードを渡した場合と一致する。
+
+    Parameters
+    ----------
+    records : list[dict]
+        make_survival_record() 形式のレコードに層を表す値を加えたもの
+    stratum_key : str or callable
+        層を表すキー名、またはレコードから層を返す関数。
+        値が None のレコードは除外される。
+    with_ci : bool
+        True の場合、survival_curve に greenwood_confidence_interval() の
+        ci_lower / ci_upper を付与する
+    alpha : float
+        with_ci=True のときの有意水準
+
+    Returns
+    -------
+    dict
+        {層: kaplan_meier_estimate() と同じ形式の結果}
+    """
+    key_func = stratum_key if callable(stratum_key) else None
+
+    strata_counts: dict = {}
+    for r in records:
+        stratum = key_func(r) if key_func else r.get(stratum_key)
+        if stratum is None:
+            continue
+        counts = strata_counts.get(stratum)
+        if counts is None:
+            counts = strata_counts[stratum] = {}
+        t = r.get('time_months')
+        if t is None:
+            continue
+        _add_count(counts, t, r)
+
+    result = {}
+    for stratum, counts in strata_counts.items():
+        km = _km_from_counts(counts)
+        if with_ci:
+            km['survival_curve'] = greenwood_confidence_interval(km['survival_curve'], alpha)
+        result[stratum] = km
+    return result
+
+
+def _add_count(counts: dict, t, record: dict) -> None:
+    """counts[t] = [死亡数, 打ち切り数, レコード数, event 合計, censored 合計] を更新する。"""
+    slot = counts.get(t)
+    if slot is None:
+        slot = counts[t] = [0, 0, 0, 0, 0]
+    event = record['event']
+    if event == 1:
+        slot[0] += 1
+    elif event == 0:
+        slot[1] += 1
+    slot[2] += 1
+    slot[3] += event
+    slot[4] += record['censored']
+
+
+def _km_from_counts(counts: dict) -> dict:
+    """
+    時点ごとの集計（_add_count の形式）から生存曲線を作る。
+
+    n_i（時点 t_i 直前のリスク集合数）は「t_i 以上の時点を持つレコード数」なので、
+    時点を昇順に 1 回なめながら、前の時点までの死亡・打ち切りを差し引いて求める。
+    死亡のない時点（打ち切りのみ）は曲線に現れず、リスク集合から外れるだけ。
+    """
+    n_total = sum(slot[2] for slot in counts.values())
 
     if n_total == 0:
         return {
@@ -113,8 +204,8 @@ def kaplan_meier_estimate(records: list[dict]) -> dict:
             'n_censored': 0,
         }
 
-    n_events_total = sum(r['event'] for r in valid)
-    n_censored_total = sum(r['censored'] for r in valid)
+    n_events_total = sum(slot[3] for slot in counts.values())
+    n_censored_total = sum(slot[4] for slot in counts.values())
 
     # 信頼度評価
     if n_events_total < 5:
@@ -126,49 +217,31 @@ def kaplan_meier_estimate(records: list[dict]) -> dict:
     else:
         confidence = 'high'
 
-    # 時点ごとに集計（死亡を打ち切りより先に処理）
-    # sort key: (time_months, event DESC) → 死亡(event=1)が打ち切り(event=0)より先
-    sorted_records = sorted(valid, key=lambda r: (r['time_months'], -r['event']))
-
-    # ユニーク死亡時点を取得
-    death_times = sorted(set(r['time_months'] for r in sorted_records if r['event'] == 1))
-
     survival_rate = 1.0
     n_at_risk = n_total
-    cursor = 0
     curve = []
-
-    for t in death_times:
-        # この時点より前の打ち切りを処理してリスク集合を更新
-        while cursor < len(sorted_records) and sorted_records[cursor]['time_months'] < t:
-            n_at_risk -= 1
-            cursor += 1
-
-        # この時点での死亡数を数える
-        d = sum(1 for r in sorted_records if r['time_months'] == t and r['event'] == 1)
-        c = sum(1 for r in sorted_records if r['time_months'] == t and r['event'] == 0)
-
-        if n_at_risk > 0:
-            survival_rate = survival_rate * (1.0 - d / n_at_risk)
-
-        curve.append({
-            'age_months': t,
-            'survival_rate': round(survival_rate, 6),
-            'n_at_risk': n_at_risk,
-            'n_events': d,
-            'n_censored': c,
-        })
-
-        # この時点の死亡・打ち切りを処理
-        n_at_risk -= (d + c)
-        cursor += (d + c)
-
-    # 中央生存期間（S(t) <= 0.5 になる最初の時点）
     median_lifespan = None
-    for point in curve:
-        if point['survival_rate'] <= 0.5:
-            median_lifespan = point['age_months']
-            break
+
+    for t in sorted(counts):
+        d, c, n = counts[t][:3]
+        if d:
+            if n_at_risk > 0:
+                survival_rate = survival_rate * (1.0 - d / n_at_risk)
+            point = {
+                'age_months': t,
+                'survival_rate': round(survival_rate, 6),
+                'n_at_risk': n_at_risk,
+                'n_events': d,
+                'n_censored': c,
+            }
+            curve.append(point)
+
+            # 中央生存期間（S(t) <= 0.5 になる最初の時点）
+            if median_lifespan is None and point['survival_rate'] <= 0.5:
+                median_lifespan = t
+
+        # この時点の死亡・打ち切りをリスク集合から外す
+        n_at_risk -= n
 
     return {
         'survival_curve': curve,
@@ -0,0 +1,197 @@
+"""
+税務期限インデックス（T_税務期限）
+
+全顧問先の税務カレンダーやスタッフのダッシュボードは、表示のたびに全顧問先分の
+期限を Python で組み立ててから年・日付で絞り込んでいたため、顧問先が数千件ある
+テナントでは数秒かかっていた。
+
+ここでは tax_calendar.get_all_deadlines_for_client(client, year) の結果を
+顧問先×年ごとに T_税務期限 へ保存しておき、表示はインデックス付きの検索で行う。
+
+- 生成時の税務設定（法人/個人・決算月・延長・給与支払事務所・固定資産税 等）と
+  生成ロジックの版数・営業日カレンダーの版からフィンガープリントを作り、
+  T_税務期限生成状態 に記録する
+- 表示のたびに対象顧問先のフィンガープリントを1クエリで照合し、変わった顧問先
+  （設定変更・新規追加）だけを作り直す。顧問先の保存処理側に手を入れる必要はない
+- 期限の計算ロジック（祝日・期限の種類）を変えたら TAX_DEADLINE_INDEX_VERSION を上げる
+
+中間納税額の備考（納税実績から算出）は顧問先個別カレンダーでのみ表示するため対象外。
+"""
+import hashlib
+import json
+import logging
+from datetime import date, datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from app.models_clients import TTaxDeadline, TTaxDeadlineState
+from app.tax_calendar import _CLIENT_SETTING_FIELDS, business_calendar_version
+
+logger = logging.getLogger(__name__)
+
+TAX_DEADLINE_INDEX_VERSION = 1
+
+_IN_CHUNK = 500            # IN 句に渡すIDの最大件数
+_COMMIT_CHUNK = 200        # 作り直しをまとめてコミットする顧問先数
+
+
+def client_fingerprint(client, calendar_version=None) -> str:
+    """期限の生成結果を左右する税務設定・営業日カレンダーの版のハッシュ"""
+    if calendar_version is None:
+        calendar_version = business_calendar_version()
+    payload = ([TAX_DEADLINE_INDEX_VERSION, calendar_version]
+               + [getattr(client, f, None) for f in _CLIENT_SETTING_FIELDS])
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _load_states(db, client_ids, year):
+    states = {}
+    for ids in _chunks(client_ids, _IN_CHUNK):
+        for st in db.query(TTaxDeadlineState).filter(
+            TTaxDeadlineState.client_id.in_(ids),
+            TTaxDeadlineState.cal_year == year,
+        ).all():
+            states[st.client_id] = st
+    return states
+
+
+def _regenerate(db, client, year, fingerprint, state):
+    """顧問先1件・1年分の期限を作り直す（呼び出し側でコミットする）。
+
+    既存の状態行は「前回のフィンガープリントのままなら更新」という条件付き UPDATE で
+    取り合い、他のワーカーが先に作り直していたら何もしない。
+    """
+    from app.tax_calendar import get_all_deadlines_for_client
+
+    now = datetime.utcnow()
+    if state is not None:
+        claimed = db.query(TTaxDeadlineState).filter(
+            TTaxDeadlineState.id == state.id,
+            TTaxDeadlineState.fingerprint == state.fingerprint,
+        ).update({TTaxDeadlineState.fingerprint: fingerprint,
+                  TTaxDeadlineState.generated_at: now}, synchronize_session=False)
+        if claimed != 1:
+            return False
+    else:
+        db.add(TTaxDeadlineState(client_id=client.id, cal_year=year,
+                                 fingerprint=fingerprint, generated_at=now))
+
+    db.query(TTaxDeadline).filter(
+        TTaxDeadline.client_id == client.id,
+        TTaxDeadline.cal_year == year,
+    ).delete(synchronize_session=False)
+    db.bulk_insert_mappings(TTaxDeadline, [{
+        'tenant_id': client.tenant_id,
+        'client_id': client.id,
+        'cal_year': year,
+        'deadline_date': d['date'],
+        'original_date': d.get('original_date'),
+        'deadline_type': d['type'],
+        'category': d.get('category'),
+        'color': d.get('color'),
+        'note': d.get('note') or None,
+    } for d in get_all_deadlines_for_client(client, year)])
+    return True
+
+
+def ensure_index(db, clients, year) -> int:
+    """clients の year 年分の期限が最新の税務設定で生成済みであることを保証する。
+
+    作り直した顧問先の数を返す。
+    """
+    clients = [c for c in clients if c is not None]
+    if not clients:
+        return 0
+    states = _load_states(db, [c.id for c in clients], year)
+    calendar_version = business_calendar_version()
+    stale = []
+    for c in clients:
+        fp = client_fingerprint(c, calendar_version)
+        st = states.get(c.id)
+        if st is None or st.fingerprint != fp:
+            stale.append((c, fp, st))
+    if not stale:
+        return 0
+
+    regenerated = 0
+    for batch in _chunks(stale, _COMMIT_CHUNK):
+        try:
+            regenerated += sum(1 for c, fp, st in batch if _regenerate(db, c, year, fp, st))
+            db.commit()
+        except IntegrityError:
+            # 新規顧問先を他のワーカーと同時に作った場合。1件ずつやり直し、負けた分は相手に任せる
+            db.rollback()
+            for c, fp, st in batch:
+                try:
+                    if _regenerate(db, c, year, fp, st):
+                        regenerated += 1
+                    db.commit()
+                except IntegrityError:
+                    db.rollback()
+    if regenerated:
+        logger.info('tax_deadline_index: %s件の顧問先の%s年の期限を生成しました', regenerated, year)
+    return regenerated
+
+
+def _to_dict(row, client):
+    # 画面（tax_calendar.html）は client_type == '法人' かどうかで表示を分ける。
+    # 期限の種類によらず「法人」「個人」の2種類で返す
+    return {
+        'date': row.deadline_date,
+        'original_date': row.original_date or row.deadline_date,
+        'adjusted': row.original_date is not None and row.original_date != row.deadline_date,
+        'type': row.deadline_type,
+        'category': row.category or '',
+        'color': row.color or '',
+        'note': row.note or '',
+        'client_id': client.id,
+        'client_name': client.name,
+        'client_type': '法人' if client.type == '法人' else '個人',
+    }
+
+
+def _query_deadlines(db, clients, year, date_from, date_to=None, limit=None):
+    by_id = {c.id: c for c in clients if c is not None}
+    if not by_id:
+        return []
+    ensure_index(db, list(by_id.values()), year)
+
+    rows = []
+    for ids in _chunks(list(by_id), _IN_CHUNK):
+        q = db.query(TTaxDeadline).filter(
+            TTaxDeadline.client_id.in_(ids),
+            TTaxDeadline.cal_year == year,
+            TTaxDeadline.deadline_date >= date_from,
+        )
+        if date_to is not None:
+            q = q.filter(TTaxDeadline.deadline_date <= date_to)
+        q = q.order_by(TTaxDeadline.deadline_date, TTaxDeadline.id)
+        if limit is not None:
+            q = q.limit(limit)
+        rows.extend(q.all())
+    rows.sort(key=lambda r: (r.deadline_date, r.id))
+    if limit is not None:
+        rows = rows[:limit]
+    return [_to_dict(r, by_id[r.client_id]) for r in rows]
+
+
+def deadlines_for_year(db, clients, year):
+    """clients の year 年中の期限を日付順に返す（tax_calendar と同じ dict 形式）"""
+    return _query_deadlines(db, clients, year, date(year, 1, 1), date(year, 12, 31))
+
+
+def deadlines_in_month(db, clients, year, month):
+    """clients の year 年 month 月の期限を日付順に返す"""
+    from app.tax_calendar import last_day_of_month
+    return _query_deadlines(db, clients, year, date(year, month, 1), last_day_of_month(year, month))
+
+
+def upcoming_deadlines(db, clients, today=None, limit=5):
+    """clients の today 以降の直近の期限を最大 limit 件返す（今年分の生成結果から）"""
+    today = today or date.today()
+    return _query_deadlines(db, clients, today.year, today, limit=limit)
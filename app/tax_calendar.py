@@ -1,9 +1,23 @@
 """
 税務年間カレンダー 期限計算ロジック
 土日祝日の場合は翌営業日に自動調整
+
+営業日の判定は年ごとの営業日ビット列（営業日カレンダー）で行う。
+ビット列は TAX_CALENDAR_CACHE_PATH に保存して全プロセスで共有する。
+
+設定（環境変数・任意）:
+  TAX_CALENDAR_CACHE_PATH : 営業日カレンダーの保存先（既定 アプリのルートの database/business_calendar.bin）
+  TAX_CALENDAR_YEAR_FROM  : 事前計算する最初の年（既定 2000）
+  TAX_CALENDAR_YEAR_TO    : 事前計算する最後の年（既定 2060）
 """
+from array import array
 from datetime import date, timedelta
 import calendar
+import hashlib
+import os
+import struct
+import tempfile
+import threading
 
 
 # ========== 祝日判定 ==========
@@ -82,24 +96,231 @@ def _shubun(year):
     return date(year, 9, day)
 
 
-# 祝日キャッシュ
-_holiday_cache = {}
+# ========== 営業日カレンダー ==========
+# 年ごとに「営業日なら1」のビット列を持ち、読み込み時に
+#   - 翌営業日までの日数（1日1バイト）
+#   - 年初からの営業日数の累積
+# を展開する。is_holiday / next_business_day / count_business_days はいずれも O(1)
+# （年をまたぐ場合も年数分の定数回）で、1日ずつ祝日判定を繰り返さない。
+
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CAL_MAGIC = b'BDCAL'
+_CAL_FORMAT_VERSION = 1                 # 祝日の計算方法を変えたら上げる（保存済みファイルを作り直す）
+_CAL_HEADER = struct.Struct('<5sHHH')   # magic, version, year_from, year_to
+_CAL_YEAR_BYTES = 46                    # 366日分のビット列
+_NO_NEXT_IN_YEAR = 255                  # 年末までに営業日が無い（翌年の最初の営業日へ）
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, str(default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def _year_bitmap(year):
+    """year 年の営業日ビット列（bit i = 1月1日から i 日目が営業日）"""
+    holidays = _get_jp_holidays(year)
+    first = date(year, 1, 1)
+    bits = bytearray(_CAL_YEAR_BYTES)
+    for i in range(366 if calendar.isleap(year) else 365):
+        d = first + timedelta(days=i)
+        if d.weekday() < 5 and d not in holidays:
+            bits[i >> 3] |= 1 << (i & 7)
+    return bytes(bits)
+
+
+class _YearCalendar:
+    """1年分の営業日カレンダー"""
+    __slots__ = ('year', 'start_ord', 'business', 'next_off', 'cum')
+
+    def __init__(self, year, bitmap):
+        n = 366 if calendar.isleap(year) else 365
+        self.year = year
+        self.start_ord = date(year, 1, 1).toordinal()
+        self.business = bytes((bitmap[i >> 3] >> (i & 7)) & 1 for i in range(n))
+        next_off = bytearray(n)
+        gap = _NO_NEXT_IN_YEAR
+        for i in range(n - 1, -1, -1):
+            if self.business[i]:
+                gap = 0
+            elif gap != _NO_NEXT_IN_YEAR:
+                gap += 1
+            next_off[i] = gap
+        self.next_off = bytes(next_off)
+        cum = array('H', [0]) * (n + 1)
+        total = 0
+        for i in range(n):
+            total += self.business[i]
+            cum[i + 1] = total
+        self.cum = cum
+
+
+class BusinessCalendar:
+    """年ごとの _YearCalendar を保持する。範囲外の年は必要になった時点で計算する。
+
+    読み込んだ範囲については、翌営業日までの日数を通日（toordinal）で引ける
+    1本の表にもしておき、next_business_day を1回の添字参照で済ませる。
+    """
+
+    def __init__(self, bitmaps):
+        self._lock = threading.Lock()
+        self._years = {y: _YearCalendar(y, b) for y, b in bitmaps.items()}
+        # 読み込んだビット列の版（祝日データが変われば変わる）。範囲外の年は計算方法
+        # （_CAL_FORMAT_VERSION）だけで決まるため含めない
+        digest = hashlib.sha256()
+        for y in sorted(bitmaps):
+            digest.update(y.to_bytes(2, 'little'))
+            digest.update(bitmaps[y])
+        self.version = f'{_CAL_FORMAT_VERSION}:{digest.hexdigest()[:16]}'
+        self._span_start = 0
+        self._span_next_off = b''
+        years = sorted(self._years)
+        if years and years == list(range(years[0], years[-1] + 1)):
+            business = b''.join(self._years[y].business for y in years)
+            next_off = bytearray(len(business))
+            gap = _NO_NEXT_IN_YEAR
+            for i in range(len(business) - 1, -1, -1):
+                if business[i]:
+                    gap = 0
+                elif gap != _NO_NEXT_IN_YEAR:
+                    gap += 1
+                next_off[i] = gap
+            self._span_start = self._years[years[0]].start_ord
+            self._span_next_off = bytes(next_off)
+
+    def year(self, y):
+        cal = self._years.get(y)
+        if cal is None:
+            with self._lock:
+                cal = self._years.get(y)
+                if cal is None:
+                    cal = self._years[y] = _YearCalendar(y, _year_bitmap(y))
+        return cal
+
+    def is_business_day(self, d):
+        cal = self.year(d.year)
+        return bool(cal.business[d.toordinal() - cal.start_ord])
+
+    def next_business_day(self, d):
+        """d が営業日なら d、そうでなければ翌営業日"""
+        i = d.toordinal() - self._span_start
+        if 0 <= i < len(self._span_next_off):
+            off = self._span_next_off[i]
+            if off == 0:
+                return d
+            if off != _NO_NEXT_IN_YEAR:
+                return date.fromordinal(d.toordinal() + off)
+        while True:
+            cal = self.year(d.year)
+            off = cal.next_off[d.toordinal() - cal.start_ord]
+            if off != _NO_NEXT_IN_YEAR:
+                return d if off == 0 else date.fromordinal(d.toordinal() + off)
+            d = date(d.year + 1, 1, 1)
+
+    def count_business_days(self, start, end):
+        """start〜end（両端を含む）の営業日数"""
+        if end < start:
+            return 0
+        total = 0
+        for y in range(start.year, end.year + 1):
+            cal = self.year(y)
+            lo = start.toordinal() - cal.start_ord if y == start.year else 0
+            hi = end.toordinal() - cal.start_ord + 1 if y == end.year else len(cal.business)
+            total += cal.cum[hi] - cal.cum[lo]
+        return total
+
+
+def _read_calendar_file(path, year_from, year_to):
+    """保存済みのビット列を読む（形式・範囲が合わなければ None）"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < _CAL_HEADER.size:
+        return None
+    magic, version, y_from, y_to = _CAL_HEADER.unpack_from(data)
+    if magic != _CAL_MAGIC or version != _CAL_FORMAT_VERSION or y_from > year_from or y_to < year_to:
+        return None
+    if len(data) != _CAL_HEADER.size + (y_to - y_from + 1) * _CAL_YEAR_BYTES:
+        return None
+    bitmaps = {}
+    for k, y in enumerate(range(y_from, y_to + 1)):
+        offset = _CAL_HEADER.size + k * _CAL_YEAR_BYTES
+        bitmaps[y] = data[offset:offset + _CAL_YEAR_BYTES]
+    return bitmaps
+
+
+def _write_calendar_file(path, year_from, year_to, bitmaps):
+    """ビット列を一時ファイル経由で原子的に保存する（失敗しても計算結果はそのまま使う）"""
+    try:
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_CAL_HEADER.pack(_CAL_MAGIC, _CAL_FORMAT_VERSION, year_from, year_to))
+                for y in range(year_from, year_to + 1):
+                    f.write(bitmaps[y])
+            os.replace(tmp, path)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+    except OSError as e:
+        print(f'[tax_calendar] 営業日カレンダーの保存に失敗しました: {e}')
+
+
+_business_calendar = None
+_business_calendar_lock = threading.Lock()
+
+
+def load_business_calendar(path=None, year_from=None, year_to=None):
+    """営業日カレンダーを読み込む（保存済みファイルが無い・古い場合は計算して保存する）"""
+    global _business_calendar
+    path = path or os.environ.get('TAX_CALENDAR_CACHE_PATH') or os.path.join(
+        _APP_ROOT, 'database', 'business_calendar.bin')
+    year_from = year_from or _env_int('TAX_CALENDAR_YEAR_FROM', 2000)
+    year_to = year_to or _env_int('TAX_CALENDAR_YEAR_TO', 2060)
+    bitmaps = _read_calendar_file(path, year_from, year_to)
+    if bitmaps is None:
+        bitmaps = {y: _year_bitmap(y) for y in range(year_from, year_to + 1)}
+        _write_calendar_file(path, year_from, year_to, bitmaps)
+    _business_calendar = BusinessCalendar(bitmaps)
+    _template_memo.clear()   # 営業日が変わると期限日も変わるため作り直す
+    return _business_calendar
+
+
+def get_business_calendar():
+    cal = _business_calendar
+    if cal is None:
+        with _business_calendar_lock:
+            cal = _business_calendar or load_business_calendar()
+    return cal
+
+
+def business_calendar_version():
+    """営業日カレンダーの版。期限を保存しておく側（tax_deadline_index）が作り直しの判定に使う"""
+    return (_business_calendar or get_business_calendar()).version
 
 
 def is_holiday(d):
     """土日または祝日かどうか判定"""
-    if d.weekday() >= 5:  # 土=5, 日=6
-        return True
-    if d.year not in _holiday_cache:
-        _holiday_cache[d.year] = _get_jp_holidays(d.year)
-    return d in _holiday_cache[d.year]
+    return not (_business_calendar or get_business_calendar()).is_business_day(d)
 
 
 def next_business_day(d):
     """土日祝日の場合は翌営業日を返す"""
-    while is_holiday(d):
-        d += timedelta(days=1)
-    return d
+    return (_business_calendar or get_business_calendar()).next_business_day(d)
+
+
+def count_business_days(start, end):
+    """start〜end（両端を含む）の営業日数を返す"""
+    return get_business_calendar().count_business_days(start, end)
 
 
 # ========== ユーティリティ ==========
@@ -805,14 +1026,20 @@ def get_legal_report_deadlines(client, year=None):
 
 # ========== 顧問先別全期限 ==========
 
-def get_all_deadlines_for_client(client, year=None, db_session=None):
-    """
-    顧問先１件の全税務期限を返す
-    給与支払事務所設置届・納期特例の設定に応じて源泉所得税期限も含む。
-    """
-    if year is None:
-        year = date.today().year
+# 期限の一覧を左右する顧問先の税務設定（名前・ID以外はこれだけで結果が決まる）
+_CLIENT_SETTING_FIELDS = (
+    'type', 'fiscal_year_end_month', 'fiscal_year_end',
+    'corp_tax_extension', 'consumption_tax_extension',
+    'prefectural_tax_extension', 'municipal_tax_extension',
+    'salary_office_notification', 'withholding_tax_special',
+    'has_fixed_asset_tax', 'has_depreciable_asset_tax',
+)
+_TEMPLATE_MEMO_MAX = 4096
+_template_memo = {}   # (year, 税務設定) -> 期限一覧（client_id/client_name を除く）
+
 
+def _client_deadline_template(client, year):
+    """顧問先の税務設定に応じた期限一覧（client_id/client_name 以外）を作る"""
     deadlines = []
 
     if client.type == '法人':
@@ -831,28 +1058,20 @@ def get_all_deadlines_for_client(client, year=None, db_session=None):
                 prefectural_tax_extension=pref_ext,
                 municipal_tax_extension=muni_ext
             ):
-                d['client_id'] = client.id
-                d['client_name'] = client.name
                 d['client_type'] = '法人'
                 deadlines.append(d)
     else:
         for d in get_individual_deadlines(year):
-            d['client_id'] = client.id
-            d['client_name'] = client.name
             d['client_type'] = '個人'
             deadlines.append(d)
 
     # 源泉所得税期限（給与支払事務所設置届の有無に応じて追加）
     for d in get_withholding_deadlines_for_client(client, year):
-        d['client_id'] = client.id
-        d['client_name'] = client.name
         d['client_type'] = client.type or ''
         deadlines.append(d)
 
     # 特別徴収住民税期限（給与支払事務所設置届の有無に応じて追加）
     for d in get_inhabitant_tax_deadlines_for_client(client, year):
-        d['client_id'] = client.id
-        d['client_name'] = client.name
         d['client_type'] = client.type or ''
         deadlines.append(d)
 
@@ -860,8 +1079,6 @@ def get_all_deadlines_for_client(client, year=None, db_session=None):
     # 固定資産税・償却資産税の納付期限は同じ時期なので、どちらかがあれば表示する
     if bool(getattr(client, 'has_fixed_asset_tax', 0) or 0) or bool(getattr(client, 'has_depreciable_asset_tax', 0) or 0):
         for d in get_fixed_asset_tax_deadlines(year):
-            d['client_id'] = client.id
-            d['client_name'] = client.name
             d['client_type'] = client.type or ''
             deadlines.append(d)
 
@@ -873,16 +1090,39 @@ def get_all_deadlines_for_client(client, year=None, db_session=None):
 
     # 給与支払報告書提出期限（給与支払事務所設置届の有無に応じて追加）
     for d in get_salary_report_deadlines(client, year):
-        d['client_id'] = client.id
-        d['client_name'] = client.name
         d['client_type'] = client.type or ''
         deadlines.append(d)
 
     # 法定調書・合計表提出期限（給与支払事務所設置届の有無に応じて追加）
     for d in get_legal_report_deadlines(client, year):
+        d['client_type'] = client.type or ''
+        deadlines.append(d)
+
+    return deadlines
+
+
+def get_all_deadlines_for_client(client, year=None, db_session=None):
+    """
+    顧問先１件の全税務期限を返す
+    給与支払事務所設置届・納期特例の設定に応じて源泉所得税期限も含む。
+    税務設定が同じ顧問先の期限は同じなので、(年, 税務設定) ごとに一度だけ組み立てて使い回す。
+    """
+    if year is None:
+        year = date.today().year
+
+    key = (year,) + tuple(getattr(client, f, None) for f in _CLIENT_SETTING_FIELDS)
+    template = _template_memo.get(key)
+    if template is None:
+        template = _client_deadline_template(client, year)
+        if len(_template_memo) >= _TEMPLATE_MEMO_MAX:
+            _template_memo.clear()
+        _template_memo[key] = template
+
+    deadlines = []
+    for t in template:
+        d = dict(t)
         d['client_id'] = client.id
         d['client_name'] = client.name
-        d['client_type'] = client.type or ''
         deadlines.append(d)
 
     # 中間納税額算定（納税実績がある場合、中間申告期限の備考に金額を追加）
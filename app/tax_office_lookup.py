@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+郵便番号 → 税務署・都道府県税事務所・市区町村役所 の検索エンジン
+
+従来は検索のたびに国税庁の税務署検索（HTML）と zipcloud API を呼んでいたため、
+1件あたり数百ミリ秒〜数秒かかり、ネットワークが無いと使えなかった。
+ここでは次の順に引き、見つかった時点で返す。
+
+1. 郵便番号インデックス（TAX_OFFICE_INDEX_PATH。tools/build_tax_office_index.py で
+   日本郵便の KEN_ALL.CSV 等から作る）: 郵便番号の昇順配列を二分探索し、
+   都道府県・市区町村・税務署・都道府県税事務所を文字列表の番号で引く
+2. 遠隔照会結果の永続キャッシュ（TAX_OFFICE_CACHE_PATH の SQLite。全ワーカーで共有）
+3. 国税庁・zipcloud への照会（結果は 2 に保存し、次回からはネットワーク不要）
+
+都道府県税事務所名はインデックスに無ければ prefecture_tax_office_map から求める。
+
+設定（環境変数・任意）:
+  TAX_OFFICE_INDEX_PATH : 郵便番号インデックス（既定 app/data/zip_tax_office.bin。無ければ 2→3 のみ）
+  TAX_OFFICE_CACHE_PATH : 遠隔照会結果のキャッシュ（既定 database/tax_office_cache.db）
+  既定のパスはどちらも作業ディレクトリではなくアプリのルートを基準にする。
+"""
+import json
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+_INDEX_MAGIC = b'ZTAX'
+_INDEX_VERSION = 1
+_INDEX_HEADER = struct.Struct('<4sHII')   # magic, version, 郵便番号数, 文字列表のバイト数
+_FIELDS = 4                               # 都道府県, 市区町村, 税務署, 都道府県税事務所
+_NONE = 0xFFFF                            # 該当なし
+_MEMO_MAX = 4096
+
+TOKYO_23KU = frozenset([
+    '千代田区', '中央区', '港区', '新宿区', '文京区', '台東区', '墨田区', '江東区',
+    '品川区', '目黒区', '大田区', '世田谷区', '渋谷区', '中野区', '杉並区', '豊島区',
+    '北区', '荒川区', '板橋区', '練馬区', '足立区', '葛飾区', '江戸川区',
+])
+
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_lock = threading.Lock()
+_index = {'loaded': False, 'data': None}
+_memo = {}
+_schema_ready = set()   # テーブル作成済みのキャッシュファイル
+
+
+def normalize_zipcode(zipcode):
+    """ハイフン・空白を除いた7桁の郵便番号（形式が正しくなければ None）"""
+    z = (zipcode or '').strip()
+    for ch in ('-', 'ー', '－', ' ', '　'):
+        z = z.replace(ch, '')
+    return z if len(z) == 7 and z.isdigit() else None
+
+
+# ── 結果の組み立て ──
+
+def municipality_office_name(prefecture, city):
+    """市区町村役所名（市区町村名 + 役所/役場）。東京23区は市区町村への申告が無いので None"""
+    if not city or (prefecture == '東京都' and city in TOKYO_23KU):
+        return None
+    if city.endswith('町') or city.endswith('村'):
+        return city + '役場'
+    return city + '役所'
+
+
+def build_result(prefecture, city, tax_office_name, pref_tax_office_name=None):
+    """get_tax_office_by_zipcode の応答と同じ形式の dict を作る"""
+    result = {}
+    if tax_office_name:
+        result['tax_office_name'] = tax_office_name
+    else:
+        result['tax_office_error'] = '税務署が見つかりませんでした。郵便番号を確認してください。'
+    if prefecture:
+        result['prefecture'] = prefecture
+    if city:
+        result['city'] = city
+    if prefecture and city and not pref_tax_office_name:
+        from app.prefecture_tax_office_map import get_pref_tax_office_name
+        pref_tax_office_name = get_pref_tax_office_name(prefecture, city)
+    if pref_tax_office_name:
+        result['pref_tax_office_name'] = pref_tax_office_name
+    muni_office = municipality_office_name(prefecture, city)
+    if muni_office:
+        result['municipality_office_name'] = muni_office
+    if prefecture == '東京都' and city in TOKYO_23KU:
+        result['is_tokyo_23ku'] = True
+        result['tokyo_23ku_note'] = '東京23区は都税事務所への申告のみとなります（市区町村への申告は不要です）'
+    return result
+
+
+# ── 1. 郵便番号インデックス ──
+
+def _index_path():
+    return os.environ.get('TAX_OFFICE_INDEX_PATH') or os.path.join(
+        _APP_ROOT, 'app', 'data', 'zip_tax_office.bin')
+
+
+def write_index(path, records):
+    """records: {7桁郵便番号: (都道府県, 市区町村, 税務署, 都道府県税事務所)} をインデックスに書き出す"""
+    strings = []
+    string_ids = {}
+
+    def sid(value):
+        if not value:
+            return _NONE
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    zips = array('I')
+    fields = array('H')
+    for z in sorted(records):
+        zips.append(int(z))
+        fields.extend(sid(v) for v in records[z])
+    if len(strings) >= _NONE:
+        raise ValueError('文字列表が大きすぎます')
+    blob = '\0'.join(strings).encode('utf-8')
+
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, len(zips), len(blob)))
+        f.write(blob)
+        f.write(zips.tobytes())
+        f.write(fields.tobytes())
+    os.replace(tmp, path)
+
+
+def _read_index(path):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < _INDEX_HEADER.size:
+        return None
+    magic, version, count, blob_len = _INDEX_HEADER.unpack_from(data)
+    if magic != _INDEX_MAGIC or version != _INDEX_VERSION:
+        return None
+    pos = _INDEX_HEADER.size
+    blob = data[pos:pos + blob_len]
+    pos += blob_len
+    zips = array('I')
+    zips.frombytes(data[pos:pos + count * zips.itemsize])
+    pos += count * zips.itemsize
+    fields = array('H')
+    fields.frombytes(data[pos:pos + count * _FIELDS * fields.itemsize])
+    if len(zips) != count or len(fields) != count * _FIELDS:
+        return None
+    strings = blob.decode('utf-8').split('\0') if blob else []
+    return zips, fields, strings
+
+
+def _get_index():
+    if not _index['loaded']:
+        with _lock:
+            if not _index['loaded']:
+                _index['data'] = _read_index(_index_path())
+                _index['loaded'] = True
+    return _index['data']
+
+
+def lookup_index(zip7):
+    """インデックスから (都道府県, 市区町村, 税務署, 都道府県税事務所) を返す（無ければ None）"""
+    index = _get_index()
+    if index is None:
+        return None
+    zips, fields, strings = index
+    key = int(zip7)
+    i = bisect_left(zips, key)
+    if i >= len(zips) or zips[i] != key:
+        return None
+    base = i * _FIELDS
+    return tuple(strings[fields[base + k]] if fields[base + k] != _NONE else None for k in range(_FIELDS))
+
+
+# ── 2. 遠隔照会結果の永続キャッシュ ──
+
+def _cache_path():
+    return os.environ.get('TAX_OFFICE_CACHE_PATH') or os.path.join(
+        _APP_ROOT, 'database', 'tax_office_cache.db')
+
+
+def _connect():
+    path = _cache_path()
+    if path not in _schema_ready:
+        with _lock:
+            if path not in _schema_ready:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                conn = sqlite3.connect(path, timeout=5)
+                try:
+                    with conn:
+                        conn.execute('CREATE TABLE IF NOT EXISTS zip_tax_office ('
+                                     'zipcode TEXT PRIMARY KEY, payload TEXT NOT NULL, fetched_at REAL NOT NULL)')
+                finally:
+                    conn.close()
+                _schema_ready.add(path)
+    return sqlite3.connect(path, timeout=5)
+
+
+def cache_get(zip7):
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute('SELECT payload FROM zip_tax_office WHERE zipcode = ?', (zip7,)).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+    except (sqlite3.Error, OSError, ValueError) as e:
+        print(f'[tax_office_lookup] キャッシュ読み込みエラー: {e}')
+        return None
+
+
+def cache_put(zip7, payload):
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO zip_tax_office (zipcode, payload, fetched_at) VALUES (?, ?, ?)',
+                             (zip7, json.dumps(payload, ensure_ascii=False), time.time()))
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError) as e:
+        print(f'[tax_office_lookup] キャッシュ保存エラー: {e}')
+
+
+def iter_cache():
+    """キャッシュ済みの (郵便番号, payload) を返す（インデックス作成用）"""
+    try:
+        conn = _connect()
+        try:
+            rows = conn.execute('SELECT zipcode, payload FROM zip_tax_office').fetchall()
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError):
+        return []
+    return [(z, json.loads(p)) for z, p in rows]
+
+
+# ── 3. 遠隔照会（国税庁 税務署検索 / zipcloud） ──
+
+def fetch_nta_tax_office(zip7):
+    """国税庁の税務署検索で管轄税務署名を取得する（通信エラーは例外を送出）"""
+    import requests as http_requests
+    from bs4 import BeautifulSoup
+
+    nta_data = {
+        'KSTYPE': 'ksz',
+        'TODOFUKEN_TO_ASCII': '',
+        'ADDR_TO_ASCII': '',
+        'kszc1': zip7[:3],
+        'kszc2': zip7[3:],
+        'ksaTodofuken': '',
+        'ksaddr': '',
+    }
+    headers = {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'Referer': 'https://www.nta.go.jp/about/organization/access/map.htm',
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    }
+    resp = http_requests.post(
+        'https://www.nta.go.jp/cgi-bin/zeimusho/kensaku/kensakuprocess.php',
+        data=nta_data, headers=headers, timeout=10
+    )
+    text = resp.content.decode('utf-8', errors='replace')
+    full_text = BeautifulSoup(text, 'html.parser').get_text()
+    matches = re.findall(r'を管轄する税務署[\s\n]*([^\s電話\n]+)', full_text)
+    return matches[0] if matches else None
+
+
+def fetch_zipcloud_address(zip7):
+    """zipcloud API で (都道府県, 市区町村) を取得する（失敗時は (None, None)）"""
+    import requests as http_requests
+    try:
+        zip_resp = http_requests.get(f'https://zipcloud.ibsnet.co.jp/api/search?zipcode={zip7}', timeout=5)
+        zip_data = zip_resp.json()
+        if zip_data.get('results'):
+            r0 = zip_data['results'][0]
+            return r0.get('address1', '') or None, r0.get('address2', '') or None
+    except Exception:
+        pass
+    return None, None
+
+
+# ── 検索 ──
+
+def lookup_zipcode(zipcode, allow_remote=True):
+    """郵便番号から税務署等を返す。
+
+    Returns: build_result() の dict に 'source'（'index' / 'cache' / 'remote'）を加えたもの。
+             どこにも見つからなければ None。
+    遠隔照会で国税庁への接続に失敗した場合は例外を送出する。
+    """
+    zip7 = normalize_zipcode(zipcode)
+    if zip7 is None:
+        return None
+    hit = _memo.get(zip7)
+    if hit is not None:
+        return dict(hit)
+
+    found = None
+    indexed = lookup_index(zip7)
+    if indexed is not None and indexed[2]:
+        prefecture, city, tax_office, pref_office = indexed
+        found = dict(build_result(prefecture, city, tax_office, pref_office), source='index')
+
+    if found is None:
+        cached = cache_get(zip7)
+        if cached is not None:
+            found = dict(build_result(cached.get('prefecture'), cached.get('city'),
+                                      cached.get('tax_office_name')), source='cache')
+
+    if found is None and allow_remote:
+        tax_office = fetch_nta_tax_office(zip7)
+        if indexed is not None:
+            prefecture, city = indexed[0], indexed[1]
+        else:
+            prefecture, city = fetch_zipcloud_address(zip7)
+        if tax_office and prefecture and city:
+            # 税務署・住所とも取れた答えだけ保存する（zipcloud の失敗などで欠けた場合は次回も照会し直す）
+            cache_put(zip7, {'prefecture': prefecture, 'city': city, 'tax_office_name': tax_office})
+        if tax_office or prefecture:
+            found = dict(build_result(prefecture, city, tax_office), source='remote')
+
+    if found is not None and found.get('tax_office_name') and found.get('prefecture') and found.get('city'):
+        if len(_memo) >= _MEMO_MAX:
+            _memo.clear()
+        _memo[zip7] = found
+    return dict(found) if found is not None else None
@@ -3,11 +3,75 @@ ChatWork API クライアント（最小実装）
 
 APIリファレンス: https://developer.chatwork.com/reference
 認証: HTTPヘッダ  X-ChatWorkToken: <api_token>
+
+レート制限（トークンごとに5分あたり300回）:
+  応答ヘッダ x-ratelimit-remaining / x-ratelimit-reset を同一トークンの全スレッドで
+  共有し、残りが RATE_LIMIT_MARGIN 以下になったらリセット時刻まで待つ。
+  429 が返った場合もリセットまで待って1回だけ再試行する。
 """
+import time
+import threading
+
 import requests
 
 API_BASE = 'https://api.chatwork.com/v2'
 TIMEOUT = 30
+RATE_LIMIT_MARGIN = 5        # この回数を残して待機に入る
+MAX_RATE_WAIT_SEC = 300      # 1回の待機の上限（秒）
+DOWNLOAD_CHUNK = 64 * 1024
+
+
+class _RateLimiter:
+    """トークン単位のレート制限状態（スレッド間で共有）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.remaining = None
+        self.reset_at = 0.0
+
+    def wait(self):
+        # 待ち時間はロック内で決め、眠るのはロックを放してから（他スレッドの
+        # update() や別トークンの処理を止めない）。残り回数が尽きていれば同じ
+        # トークンの他スレッドも同じリセット時刻まで待つことになる。
+        delay = 0.0
+        with self._lock:
+            if self.remaining is not None and self.remaining <= RATE_LIMIT_MARGIN:
+                delay = self.reset_at - time.time()
+                if delay <= 0:
+                    self.remaining = None
+            elif self.remaining is not None:
+                self.remaining -= 1
+        if delay > 0:
+            time.sleep(min(delay, MAX_RATE_WAIT_SEC))
+            with self._lock:
+                if self.reset_at <= time.time():
+                    self.remaining = None
+
+    def update(self, headers):
+        try:
+            remaining = int(headers.get('x-ratelimit-remaining'))
+            reset_at = float(headers.get('x-ratelimit-reset'))
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            self.remaining = remaining
+            self.reset_at = reset_at
+
+    def exhausted(self):
+        with self._lock:
+            self.remaining = 0
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _limiter_for(token: str) -> _RateLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(token)
+        if limiter is None:
+            limiter = _limiters[token] = _RateLimiter()
+        return limiter
 
 
 class ChatworkError(RuntimeError):
@@ -20,14 +84,24 @@ class ChatworkClient:
         if not api_token:
             raise ChatworkError('ChatWork APIトークンが未設定です')
         self.token = api_token.strip()
+        self._limiter = _limiter_for(self.token)
 
     @property
     def _headers(self):
         return {'X-ChatWorkToken': self.token}
 
     def _get(self, path: str, params: dict = None):
-        resp = requests.get(f'{API_BASE}{path}', headers=self._headers,
-                            params=params or {}, timeout=TIMEOUT)
+        for attempt in range(2):
+            self._limiter.wait()
+            resp = requests.get(f'{API_BASE}{path}', headers=self._headers,
+                                params=params or {}, timeout=TIMEOUT)
+            self._limiter.update(resp.headers)
+            if resp.status_code != 429:
+                break
+            # 上限超過: リセット時刻まで待って1回だけ再試行
+            self._limiter.exhausted()
+        if resp.status_code == 429:
+            raise ChatworkError('ChatWork APIのレート制限を超えました（しばらく待って再実行してください）')
         if resp.status_code == 401:
             raise ChatworkError('ChatWork認証に失敗しました（トークンを確認してください）')
         if resp.status_code >= 400:
@@ -39,7 +113,7 @@ class ChatworkClient:
         return self._get('/me')
 
     def list_rooms(self) -> list:
-        """参加中のルーム一覧を取得"""
+        """参加中のルーム一覧を取得（各ルームの file_num / last_update_time を含む）"""
         return self._get('/rooms')
 
     def list_files(self, room_id, account_id=None) -> list:
@@ -60,3 +134,15 @@ class ChatworkClient:
         if resp.status_code >= 400:
             raise ChatworkError(f'ファイルのダウンロードに失敗しました ({resp.status_code})')
         return resp.content
+
+    def download_file_to(self, download_url: str, fileobj) -> int:
+        """一時ダウンロードURLからファイル本体を fileobj へ逐次書き出す。書き込んだバイト数を返す"""
+        size = 0
+        with requests.get(download_url, timeout=TIMEOUT, stream=True) as resp:
+            if resp.status_code >= 400:
+                raise ChatworkError(f'ファイルのダウンロードに失敗しました ({resp.status_code})')
+            for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                if chunk:
+                    fileobj.write(chunk)
+                    size += len(chunk)
+        return size
@@ -9,12 +9,13 @@ Gmail の IMAP でメールを取得し、添付ファイルを抽出する。
   - アプリパスワード: https://myaccount.google.com/apppasswords
 """
 import imaplib
-import email
 from email.header import decode_header, make_header
-from email.utils import parseaddr
+
+from app.utils.integrations import imap_fetch
 
 IMAP_HOST = 'imap.gmail.com'
 IMAP_PORT = 993
+IMAP_TIMEOUT = 60   # ソケットタイムアウト（秒）。応答の無いサーバーで同期全体が止まらないように
 
 
 class GmailImapError(RuntimeError):
@@ -43,7 +44,7 @@ class GmailImapClient:
 
     def connect(self):
         try:
-            self._conn = imaplib.IMAP4_SSL(self.host, self.port)
+            self._conn = imaplib.IMAP4_SSL(self.host, self.port, timeout=IMAP_TIMEOUT)
             self._conn.login(self.email_address, self.app_password)
         except imaplib.IMAP4.error as e:
             raise GmailImapError(f'Gmail IMAPログインに失敗しました: {e}')
@@ -65,6 +66,38 @@ class GmailImapClient:
         self.close()
         return True
 
+    def _select(self, mailbox: str):
+        if not self._conn:
+            self.connect()
+        typ, _ = self._conn.select(mailbox, readonly=True)
+        if typ != 'OK':
+            raise GmailImapError(f'メールボックスを開けません: {mailbox}')
+
+    def iter_new_messages(self, since_uid: int = 0, mailbox: str = 'INBOX',
+                          max_messages: int = 100):
+        """
+        since_uid より大きいUIDのメールを、BODYSTRUCTURE とヘッダだけで1通ずつ返す。
+
+        添付の本体は含まない（必要なものだけ fetch_attachment で取得する）。
+        添付の無いメールも 'attachments': [] として返すので、呼び出し側は
+        返ってきたUIDまでを処理済みとして since_uid を進められる。
+        Yields: {'uid', 'from', 'subject', 'date',
+                 'attachments': [{'part', 'filename', 'encoding', 'size'}]}
+        """
+        self._select(mailbox)
+        uids = imap_fetch.search_new_uids(self._conn, since_uid, max_messages)
+        try:
+            yield from imap_fetch.iter_messages(self._conn, uids)
+        except imap_fetch.ImapFetchError as e:
+            raise GmailImapError(str(e))
+
+    def fetch_attachment(self, uid: int, part: dict) -> bytes:
+        """添付1件の本体を取得（デコード済み bytes）"""
+        try:
+            return imap_fetch.fetch_attachment(self._conn, uid, part)
+        except imap_fetch.ImapFetchError as e:
+            raise GmailImapError(str(e))
+
     def fetch_new_with_attachments(self, since_uid: int = 0, mailbox: str = 'INBOX',
                                    max_messages: int = 100) -> list:
         """
@@ -75,58 +108,15 @@ class GmailImapClient:
             'attachments': [{'filename': str, 'data': bytes}]
         }], および処理した最大UID
         """
-        if not self._conn:
-            self.connect()
-        typ, _ = self._conn.select(mailbox, readonly=True)
-        if typ != 'OK':
-            raise GmailImapError(f'メールボックスを開けません: {mailbox}')
-
-        # UID検索（since_uidの次から）
-        search_from = (since_uid or 0) + 1
-        typ, data = self._conn.uid('search', None, f'UID {search_from}:*')
-        if typ != 'OK':
-            return [], since_uid
-        uids = [int(x) for x in data[0].split()] if data and data[0] else []
-        # UID a:* は該当が無くても最後の1件を返すことがあるため since_uid 以下を除外
-        uids = sorted(u for u in uids if u > (since_uid or 0))
-        uids = uids[:max_messages]
-
         results = []
         max_uid = since_uid or 0
-        for uid in uids:
-            max_uid = max(max_uid, uid)
-            typ, msg_data = self._conn.uid('fetch', str(uid), '(RFC822)')
-            if typ != 'OK' or not msg_data or not msg_data[0]:
-                continue
-            raw = msg_data[0][1]
-            msg = email.message_from_bytes(raw)
-
-            from_addr = parseaddr(msg.get('From', ''))[1].lower()
-            subject = _decode(msg.get('Subject', ''))
-            date = msg.get('Date', '')
-
+        for msg in self.iter_new_messages(since_uid, mailbox, max_messages):
+            max_uid = max(max_uid, msg['uid'])
             attachments = []
-            for part in msg.walk():
-                if part.get_content_maintype() == 'multipart':
-                    continue
-                disp = (part.get('Content-Disposition') or '')
-                filename = part.get_filename()
-                if not filename and 'attachment' not in disp.lower():
-                    continue
-                if not filename:
-                    continue
-                filename = _decode(filename)
-                try:
-                    payload = part.get_payload(decode=True)
-                except Exception:
-                    payload = None
-                if payload:
-                    attachments.append({'filename': filename, 'data': payload})
-
+            for part in msg['attachments']:
+                data = self.fetch_attachment(msg['uid'], part)
+                if data:
+                    attachments.append({'filename': part['filename'], 'data': data})
             if attachments:
-                results.append({
-                    'uid': uid, 'from': from_addr, 'subject': subject,
-                    'date': date, 'attachments': attachments,
-                })
-
+                results.append(dict(msg, attachments=attachments))
         return results, max_uid
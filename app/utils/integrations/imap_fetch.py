@@ -0,0 +1,295 @@
+"""
+IMAP 添付取得の共通処理（Gmail / 汎用IMAP クライアントから利用）
+
+従来は UID ごとに (RFC822) で本文全体を取得していたため、添付の無いメールも
+丸ごとダウンロードし、全添付をメモリに抱えたまま保存処理へ渡していた。
+ここでは以下の手順で取得する:
+  1. UID FETCH をまとめて（_FETCH_BATCH 件ずつ）発行し、BODYSTRUCTURE と
+     差出人/件名/日付ヘッダだけを取得する
+  2. BODYSTRUCTURE からファイル名付きパート（＝添付）を特定し、
+     添付の無いメールは本文を一切ダウンロードしない
+  3. 添付は BODY.PEEK[パート番号] で1件ずつ取得・デコードする
+     （保存側は1件保存するごとに解放できる）
+"""
+import re
+import base64
+import quopri
+import email
+from email.message import Message
+from email.header import decode_header, make_header
+from email.utils import parseaddr
+
+_FETCH_BATCH = 50          # 1回の UID FETCH で扱うUID数
+_HEADER_ITEM = 'BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE)]'
+
+
+class ImapFetchError(RuntimeError):
+    pass
+
+
+def _decode(s) -> str:
+    if not s:
+        return ''
+    try:
+        return str(make_header(decode_header(s)))
+    except Exception:
+        return str(s)
+
+
+# ------------------------------------------------------------
+# FETCH 応答のパース
+# ------------------------------------------------------------
+class _Literal(bytes):
+    """{n} リテラルで受け取った値（ヘッダ本文・添付本体など）"""
+
+
+_LPAREN = object()
+_RPAREN = object()
+
+
+_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"\[]*(?:\[[^\]]*\][^\s()]*)?))')
+
+
+def _tokenize(data) -> list:
+    """imaplib の FETCH 応答（bytes と (prefix, literal) タプルの列）をトークン列にする"""
+    tokens = []
+    for item in data or []:
+        if isinstance(item, tuple):
+            text, literal = item[0], item[1]
+        else:
+            text, literal = item, None
+        if text is None:
+            continue
+        pos = 0
+        while pos < len(text):
+            m = _TOKEN_RE.match(text, pos)
+            if not m or m.end() == pos:
+                break
+            pos = m.end()
+            if m.group(1):
+                tokens.append(_LPAREN)
+            elif m.group(2):
+                tokens.append(_RPAREN)
+            elif m.group(3) is not None:
+                tokens.append(re.sub(rb'\\(.)', rb'\1', m.group(3)).decode('utf-8', 'replace'))
+            elif m.group(4) is not None:
+                tokens.append(_Literal(literal or b''))
+            elif m.group(5):
+                atom = m.group(5).decode('utf-8', 'replace')
+                tokens.append(None if atom.upper() == 'NIL' else atom)
+    return tokens
+
+
+def _parse_list(tokens, pos):
+    out = []
+    while pos < len(tokens):
+        tok = tokens[pos]
+        if tok is _LPAREN:
+            sub, pos = _parse_list(tokens, pos + 1)
+            out.append(sub)
+            continue
+        if tok is _RPAREN:
+            return out, pos + 1
+        out.append(tok)
+        pos += 1
+    return out, pos
+
+
+def parse_fetch_response(data) -> dict:
+    """FETCH 応答を {uid: {項目名(大文字): 値}} に変換する"""
+    tokens = _tokenize(data)
+    items, _ = _parse_list(tokens, 0)
+    result = {}
+    # 応答は「シーケンス番号 (項目 値 項目 値 ...)」の繰り返し
+    for entry in items:
+        if not isinstance(entry, list):
+            continue
+        fields = {}
+        for i in range(0, len(entry) - 1, 2):
+            key = entry[i]
+            if isinstance(key, str):
+                fields[key.upper()] = entry[i + 1]
+        try:
+            uid = int(fields.get('UID'))
+        except (TypeError, ValueError):
+            continue
+        result[uid] = fields
+    return result
+
+
+# ------------------------------------------------------------
+# BODYSTRUCTURE の解析
+# ------------------------------------------------------------
+def _text(value) -> str:
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return str(value or '')
+
+
+def _params(value) -> list:
+    if not isinstance(value, list):
+        return []
+    return [(_text(value[i]).lower(), _text(value[i + 1]))
+            for i in range(0, len(value) - 1, 2) if value[i]]
+
+
+def _filename(ctype_params, disp_params) -> str:
+    """Content-Disposition / Content-Type のパラメータからファイル名を得る。
+
+    RFC2231（filename*=utf-8''... や分割 filename*0*=）の解釈は
+    email パッケージに任せるため、ヘッダを組み立て直して get_filename() を使う。
+    """
+    if not ctype_params and not disp_params:
+        return ''
+
+    def _fmt(params):
+        parts = []
+        for k, v in params:
+            if k.endswith('*'):
+                parts.append(f'{k}={v}')
+            else:
+                v = v.replace('\\', '\\\\').replace('"', '\\"')
+                parts.append(f'{k}="{v}"')
+        return '; '.join(parts)
+
+    msg = Message()
+    if disp_params:
+        msg['Content-Disposition'] = 'attachment; ' + _fmt(disp_params)
+    if ctype_params:
+        msg['Content-Type'] = 'application/octet-stream; ' + _fmt(ctype_params)
+    try:
+        name = msg.get_filename()
+    except Exception:
+        name = None
+    return _decode(name) if name else ''
+
+
+def _walk_structure(bs, number: str, out: list):
+    if not isinstance(bs, list) or not bs:
+        return
+    if isinstance(bs[0], list):
+        # multipart: 先頭から子パートが並び、その後ろにサブタイプ等が続く
+        idx = 0
+        for child in bs:
+            if not isinstance(child, list):
+                break
+            idx += 1
+            _walk_structure(child, f'{number}.{idx}' if number else str(idx), out)
+        return
+
+    num = number or '1'
+    ctype = _text(bs[0]).lower()
+    subtype = _text(bs[1]).lower() if len(bs) > 1 else ''
+    encoding = _text(bs[5]).lower() if len(bs) > 5 else ''
+    try:
+        size = int(bs[6]) if len(bs) > 6 and bs[6] is not None else 0
+    except (TypeError, ValueError):
+        size = 0
+
+    # 拡張データ（disposition）の位置は本体種別で変わる
+    if ctype == 'text':
+        disp_index = 9
+    elif ctype == 'message' and subtype == 'rfc822':
+        disp_index = 11
+    else:
+        disp_index = 8
+    disposition = bs[disp_index] if len(bs) > disp_index else None
+    disp_params = _params(disposition[1]) if isinstance(disposition, list) and len(disposition) > 1 else []
+
+    filename = _filename(_params(bs[2]) if len(bs) > 2 else [], disp_params)
+    if filename:
+        out.append({'part': num, 'filename': filename, 'encoding': encoding, 'size': size})
+        return
+    if ctype == 'message' and subtype == 'rfc822' and len(bs) > 8:
+        # 転送メール等の中身も従来（msg.walk）同様に探索する
+        inner = bs[8]
+        if isinstance(inner, list) and inner and isinstance(inner[0], list):
+            _walk_structure(inner, num, out)
+        else:
+            _walk_structure(inner, f'{num}.1', out)
+
+
+def attachment_parts(bodystructure) -> list:
+    """BODYSTRUCTURE から添付パートの一覧を返す。
+
+    Returns: [{'part': '2' / '1.2' など, 'filename': str, 'encoding': str, 'size': int}]
+    """
+    out = []
+    _walk_structure(bodystructure, '', out)
+    return out
+
+
+def _decode_payload(raw: bytes, encoding: str) -> bytes:
+    if not raw:
+        return b''
+    if encoding == 'base64':
+        try:
+            return base64.b64decode(raw)
+        except Exception:
+            return b''
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(raw)
+    return bytes(raw)
+
+
+# ------------------------------------------------------------
+# 取得処理
+# ------------------------------------------------------------
+def search_new_uids(conn, since_uid: int, max_messages: int) -> list:
+    """since_uid より大きいUIDを昇順で最大 max_messages 件返す"""
+    search_from = (since_uid or 0) + 1
+    typ, data = conn.uid('search', None, f'UID {search_from}:*')
+    if typ != 'OK':
+        return []
+    uids = [int(x) for x in data[0].split()] if data and data[0] else []
+    # UID a:* は該当が無くても最後の1件を返すことがあるため since_uid 以下を除外
+    return sorted(u for u in uids if u > (since_uid or 0))[:max_messages]
+
+
+def fetch_attachment(conn, uid: int, part: dict) -> bytes:
+    """添付1件分だけを BODY.PEEK[パート番号] で取得してデコードする"""
+    section = f"BODY[{part['part']}]"
+    typ, data = conn.uid('fetch', str(uid), f"(UID BODY.PEEK[{part['part']}])")
+    if typ != 'OK':
+        raise ImapFetchError(f"添付の取得に失敗しました (UID {uid}, part {part['part']})")
+    fields = parse_fetch_response(data).get(uid) or {}
+    raw = fields.get(section)
+    return _decode_payload(raw if isinstance(raw, bytes) else b'', part.get('encoding'))
+
+
+def _fetch_summary(conn, uids: list) -> dict:
+    typ, data = conn.uid('fetch', ','.join(str(u) for u in uids),
+                         f'(UID BODYSTRUCTURE {_HEADER_ITEM})')
+    if typ != 'OK':
+        raise ImapFetchError(f'メール情報の取得に失敗しました (UID {uids[0]}-{uids[-1]})')
+    return parse_fetch_response(data)
+
+
+def iter_messages(conn, uids: list):
+    """UIDを _FETCH_BATCH 件ずつまとめて BODYSTRUCTURE とヘッダを取得し、1通ずつ返す。
+
+    添付の無いメールも 'attachments': [] として返す（呼び出し側が処理済みUIDを
+    進められるように）。添付の本体はここでは取得しない。
+    FETCH が失敗した場合や、応答に含まれないUIDを単独で取り直しても得られない
+    場合は ImapFetchError を送出する（そのUID以降は返さないので since_uid は進まない）。
+    """
+    for start in range(0, len(uids), _FETCH_BATCH):
+        batch = uids[start:start + _FETCH_BATCH]
+        fetched = _fetch_summary(conn, batch)
+        for uid in batch:
+            fields = fetched.get(uid)
+            if not fields:
+                # 一部のサーバはまとめて取得すると応答を省くことがあるため単独で取り直す
+                fields = _fetch_summary(conn, [uid]).get(uid)
+                if not fields:
+                    raise ImapFetchError(f'メール情報を取得できません (UID {uid})')
+            header = next((v for k, v in fields.items()
+                           if k.startswith('BODY[HEADER') and isinstance(v, bytes)), b'')
+            msg = email.message_from_bytes(header or b'')
+            yield {
+                'uid': uid,
+                'from': parseaddr(msg.get('From', ''))[1].lower(),
+                'subject': _decode(msg.get('Subject', '')),
+                'date': msg.get('Date', ''),
+                'attachments': attachment_parts(fields.get('BODYSTRUCTURE')),
+            }
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+テナント名・店舗名・アプリ管理者グループ名のキャッシュ
+
+画面ヘッダー（inject_context_info）で毎リクエスト参照される名称を、
+プロセス内に TTL 付きで保持する。名称を変更・削除するルートからは
+invalidate_* を呼び出して即時に破棄する。
+"""
+
+import os
+import threading
+import time
+
+from .db import get_db, _sql
+
+# 有効期限（秒）。他ワーカーでの変更はこの時間内に反映される
+NAME_CACHE_TTL = float(os.environ.get("NAME_CACHE_TTL", "300"))
+
+_MISSING = object()
+
+_lock = threading.Lock()
+_entries = {}  # (kind, id) -> (expires_at, value)
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _get_or_load(kind: str, key, loader):
+    """キャッシュから値を返す。無ければ loader() で取得して保存する（None は保存しない）"""
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get((kind, key))
+        if entry is not None and entry[0] > now:
+            _stats["hits"] += 1
+            return entry[1]
+        _stats["misses"] += 1
+
+    value = loader()
+    if value is not None:
+        with _lock:
+            _entries[(kind, key)] = (now + NAME_CACHE_TTL, value)
+    return value
+
+
+def _invalidate(kind: str, key):
+    with _lock:
+        if _entries.pop((kind, key), _MISSING) is not _MISSING:
+            _stats["invalidations"] += 1
+
+
+def _fetch_one(sql: str, params):
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute(_sql(conn, sql), params)
+        return cur.fetchone()
+    finally:
+        conn.close()
+
+
+# ---- テナント ----
+def get_tenant_name(tenant_id):
+    """テナント名を返す（存在しなければ None）"""
+    if not tenant_id:
+        return None
+
+    def _load():
+        row = _fetch_one('SELECT "名称" FROM "T_テナント" WHERE id=%s', (tenant_id,))
+        return row[0] if row else None
+
+    return _get_or_load("tenant", int(tenant_id), _load)
+
+
+def invalidate_tenant(tenant_id):
+    """テナント名のキャッシュを破棄"""
+    if tenant_id:
+        _invalidate("tenant", int(tenant_id))
+
+
+# ---- 店舗 ----
+def get_store_info(store_id):
+    """(店舗名, tenant_id) を返す（存在しなければ None）"""
+    if not store_id:
+        return None
+
+    def _load():
+        row = _fetch_one('SELECT "名称", tenant_id FROM "T_店舗" WHERE id=%s', (store_id,))
+        return (row[0], row[1]) if row else None
+
+    return _get_or_load("store", int(store_id), _load)
+
+
+def invalidate_store(store_id):
+    """店舗名のキャッシュを破棄"""
+    if store_id:
+        _invalidate("store", int(store_id))
+
+
+# ---- アプリ管理者グループ ----
+def get_app_manager_group_name(group_id):
+    """アプリ管理者グループ名を返す（存在しなければ None）"""
+    if not group_id:
+        return None
+
+    def _load():
+        from ..models_login import TAppManagerGroup
+        from ..db import SessionLocal
+        db = SessionLocal()
+        try:
+            grp = db.query(TAppManagerGroup).filter(TAppManagerGroup.id == group_id).first()
+            return grp.group_name if grp else None
+        finally:
+            db.close()
+
+    return _get_or_load("app_manager_group", int(group_id), _load)
+
+
+def invalidate_app_manager_group(group_id):
+    """アプリ管理者グループ名のキャッシュを破棄"""
+    if group_id:
+        _invalidate("app_manager_group", int(group_id))
+
+
+# ---- 管理用 ----
+def clear_name_cache():
+    """全エントリを破棄"""
+    with _lock:
+        _stats["invalidations"] += len(_entries)
+        _entries.clear()
+
+
+def get_name_cache_stats() -> dict:
+    """ヒット/ミス数などの統計を返す"""
+    with _lock:
+        stats = dict(_stats)
+        stats["size"] = len(_entries)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / total, 4) if total else 0.0
+    stats["ttl_seconds"] = NAME_CACHE_TTL
+    return stats
@@ -23,6 +23,10 @@ from pathlib import Path
 
 _log = logging.getLogger(__name__)
 
+# OCRキャッシュ（app.utils.ocr_cache）のキーに含める版数。
+# プロンプトや抽出処理を変えたら上げる（古いキャッシュ結果を使わないように）
+OCR_CACHE_VERSION = 1
+
 
 def _encode_image(filepath: str) -> str:
     """画像ファイルをBase64エンコードする"""
@@ -40,6 +44,8 @@ def extract_pedigree_info(filepath: str, scan_type: str = 'pedigree') -> dict:
     3. Google Cloud Vision API + 正規表現パース（Google のみの場合）
     4. どちらも未設定の場合はエラー
 
+    同じ内容のファイル・同じ scan_type・同じ処理方式の結果はOCRキャッシュから返す。
+
     Args:
         filepath: 画像またはPDFのパス
         scan_type: 'pedigree' | 'chip' | 'genetic' | 'hip'
@@ -48,6 +54,34 @@ def extract_pedigree_info(filepath: str, scan_type: str = 'pedigree') -> dict:
         dict: 抽出された情報（scan_typeによって異なる）
     """
     filepath = str(filepath)
+
+    # APIキーを階層順に取得
+    google_api_key, openai_api_key = _resolve_api_keys()
+
+    if not google_api_key and not openai_api_key:
+        raise Exception(
+            'OCR APIキーが設定されていません。'
+            'アプリ設定でGoogle Cloud Vision APIキーまたはOpenAI APIキーを設定してください。'
+        )
+
+    if google_api_key and openai_api_key:
+        engine = 'google_vision+gpt'
+    elif openai_api_key:
+        engine = 'gpt'
+    else:
+        engine = 'google_vision'
+
+    from app.utils import ocr_cache
+    return ocr_cache.cached(
+        'pedigree', filepath, OCR_CACHE_VERSION, {'scan_type': scan_type, 'engine': engine},
+        lambda: _extract_pedigree_info(filepath, scan_type, google_api_key, openai_api_key),
+        cacheable=lambda r: not r.get('_incomplete'),
+        store_params=lambda r: {'scan_type': scan_type, 'engine': r.get('_engine', engine)},
+    )
+
+
+def _extract_pedigree_info(filepath: str, scan_type: str, google_api_key: str, openai_api_key: str) -> dict:
+    """extract_pedigree_info の本体（キャッシュなし）"""
     ext = Path(filepath).suffix.lower()
 
     # PDFの場合は最初のページを画像に変換
@@ -62,15 +96,6 @@ def extract_pedigree_info(filepath: str, scan_type: str = 'pedigree') -> dict:
         except ImportError:
             raise Exception('PDFの処理にはpdf2imageが必要です。画像ファイル（JPG/PNG）でアップロードしてください。')
 
-    # APIキーを階層順に取得
-    google_api_key, openai_api_key = _resolve_api_keys()
-
-    if not google_api_key and not openai_api_key:
-        raise Exception(
-            'OCR APIキーが設定されていません。'
-            'アプリ設定でGoogle Cloud Vision APIキーまたはOpenAI APIキーを設定してください。'
-        )
-
     # ── ケース1: Google Vision + OpenAI GPT（最高精度）──────────────────────
     if google_api_key and openai_api_key:
         try:
@@ -81,12 +106,14 @@ def extract_pedigree_info(filepath: str, scan_type: str = 'pedigree') -> dict:
                 return result
         except Exception as e:
             _log.error(f'[OCR] Google Vision + OpenAI GPT エラー: {e}')
-            # フォールバック: OpenAI Vision で直接解析
-            return _extract_with_openai_vision(filepath, scan_type, openai_api_key)
+            # フォールバック: 下の OpenAI Vision で直接解析
 
     # ── ケース2: OpenAI Vision のみ（画像直接解析）──────────────────────────
     if openai_api_key:
-        return _extract_with_openai_vision(filepath, scan_type, openai_api_key)
+        result = _extract_with_openai_vision(filepath, scan_type, openai_api_key)
+        # キャッシュは実際に処理した方式のキーで保存する
+        result['_engine'] = 'gpt'
+        return result
 
     # ── ケース3: Google Vision のみ（正規表現パース）────────────────────────
     if google_api_key:
@@ -466,7 +493,8 @@ def _extract_with_openai_vision(filepath: str, scan_type: str, api_key: str) ->
     except (json.JSONDecodeError, ValueError):
         pass
 
-    return {'raw_text': content, 'pedigree_number': None, 'microchip_number': None}
+    return {'raw_text': content, 'pedigree_number': None, 'microchip_number': None,
+            '_incomplete': 'JSONを解析できませんでした'}
 
 
 def _parse_pedigree_text(text: str, scan_type: str) -> dict:
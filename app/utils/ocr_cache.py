@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+OCR結果のコンテンツアドレス型キャッシュ
+
+同じファイルの再アップロードや再抽出のたびに有料・低速の Vision API を
+呼ばないよう、構造化済みのOCR結果をディスクに保存する。
+
+- キー: SHA-256（種別 + プロンプト版数 + 列定義などのパラメータ + ファイル内容のハッシュ）
+  → ファイル名やアップロード先が違っても内容が同じなら同じキーになる。
+    プロンプトを変えたら呼び出し側の版数を上げれば古い結果は使われない。
+- 保存しない結果: cacheable(result) が False のもの（エラー・一部ページの欠落など）。
+  フォールバックで別の方式が結果を作った場合は store_params で実際の方式のキーに保存する。
+- refresh=True で読み出しを飛ばして取り直す（結果は上書き保存）。
+- 保存先: OCR_CACHE_DIR/<キー先頭2文字>/<キー>.json（複数ワーカーで共有できる）
+- 追い出し: 合計サイズが OCR_CACHE_MAX_MB を超えたら、最終利用（mtime）の
+  古いものから削除する。ヒット時に mtime を更新する（LRU）。
+
+設定（環境変数・任意）:
+  OCR_CACHE_ENABLED : '0' で無効化（既定: 有効）
+  OCR_CACHE_DIR     : 保存先ディレクトリ。既定 <アプリルート>/uploads/ocr_cache
+                      （起動時のカレントディレクトリに依存しない）
+  OCR_CACHE_MAX_MB  : 合計サイズの上限（MB）。既定 256
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+_CHUNK = 1024 * 1024
+_EVICT_TARGET_RATIO = 0.9   # 追い出し時は上限の90%まで減らす
+
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_lock = threading.Lock()
+_size = {"bytes": None}     # キャッシュ合計サイズの概算（初回に走査して以後は加算）
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+def _enabled() -> bool:
+    return os.environ.get("OCR_CACHE_ENABLED", "1") in ("1", "true", "True", "yes", "on")
+
+
+def _cache_dir() -> str:
+    return os.environ.get("OCR_CACHE_DIR") or os.path.join(_APP_ROOT, "uploads", "ocr_cache")
+
+
+def _max_bytes() -> int:
+    try:
+        return max(1, int(os.environ.get("OCR_CACHE_MAX_MB", "256"))) * 1024 * 1024
+    except (TypeError, ValueError):
+        return 256 * 1024 * 1024
+
+
+def _file_digest(path: str) -> bytes:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            h.update(chunk)
+    return h.digest()
+
+
+def _key(kind: str, digest: bytes, version, params) -> str:
+    h = hashlib.sha256()
+    header = json.dumps([kind, str(version), params], ensure_ascii=False,
+                        sort_keys=True, default=str)
+    h.update(header.encode("utf-8"))
+    h.update(b"\0")
+    h.update(digest)
+    return h.hexdigest()
+
+
+def make_key(kind: str, path: str, version, params=None) -> str:
+    """ファイル内容とOCR条件からキャッシュキー（16進 SHA-256）を作る"""
+    return _key(kind, _file_digest(path), version, params)
+
+
+def _entry_path(key: str) -> str:
+    return os.path.join(_cache_dir(), key[:2], key + ".json")
+
+
+def get(key: str):
+    """キャッシュされた結果を返す（無ければ None）"""
+    path = _entry_path(key)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            value = json.load(f)
+    except (OSError, ValueError):
+        with _lock:
+            _stats["misses"] += 1
+        return None
+    try:
+        os.utime(path, None)   # 最終利用時刻を更新（LRU）
+    except OSError:
+        pass
+    with _lock:
+        _stats["hits"] += 1
+    return value
+
+
+def put(key: str, value) -> None:
+    """結果を保存する。書き込みは一時ファイル経由で原子的に行う"""
+    path = _entry_path(key)
+    try:
+        data = json.dumps(value, ensure_ascii=False, default=str).encode("utf-8")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+    except (OSError, TypeError, ValueError) as e:
+        print(f"[OCRキャッシュ] 保存エラー: {e}")
+        return
+
+    with _lock:
+        _stats["stores"] += 1
+        if _size["bytes"] is not None:
+            _size["bytes"] += len(data)
+    _evict_if_needed()
+
+
+def _scan():
+    """キャッシュ内の全エントリを (mtime, size, path) で返す"""
+    entries = []
+    root = _cache_dir()
+    if not os.path.isdir(root):
+        return entries
+    for sub in os.listdir(root):
+        subdir = os.path.join(root, sub)
+        if not os.path.isdir(subdir):
+            continue
+        for name in os.listdir(subdir):
+            if not name.endswith(".json"):
+                continue
+            p = os.path.join(subdir, name)
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+    return entries
+
+
+def _evict_if_needed() -> None:
+    """合計サイズが上限を超えていたら、最終利用の古いものから削除する"""
+    limit = _max_bytes()
+    with _lock:
+        known = _size["bytes"]
+    if known is not None and known <= limit:
+        return
+
+    entries = _scan()
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    if total > limit:
+        target = int(limit * _EVICT_TARGET_RATIO)
+        for _, size, p in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(p)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+    with _lock:
+        _size["bytes"] = total
+        _stats["evictions"] += evicted
+
+
+def cached(kind: str, path: str, version, params, compute, cacheable=None,
+           store_params=None, refresh: bool = False):
+    """path の内容と条件が同じならキャッシュを返し、無ければ compute() して保存する。
+
+    cacheable(result)   : False の結果（エラー時の空データ・一部欠落等）は保存しない
+    store_params(result): 保存に使う条件（既定は params）。フォールバックで別方式が
+                          結果を作った場合に、その方式の条件で保存するために使う
+    refresh             : True ならキャッシュを読まずに compute() し直して保存する
+    キャッシュの読み書きに失敗した場合は compute() の結果をそのまま返す。
+    """
+    if not _enabled():
+        return compute()
+    try:
+        digest = _file_digest(path)
+    except OSError:
+        return compute()
+
+    if not refresh:
+        hit = get(_key(kind, digest, version, params))
+        if hit is not None:
+            print(f"[OCRキャッシュ] ヒット: {kind} {os.path.basename(path)}")
+            return hit
+
+    result = compute()
+    if result and (cacheable is None or cacheable(result)):
+        key_params = store_params(result) if store_params else params
+        put(_key(kind, digest, version, key_params), result)
+    return result
+
+
+def get_stats() -> dict:
+    with _lock:
+        return dict(_stats, bytes=_size["bytes"])
@@ -1,14 +1,31 @@
 """
 テナント用ストレージアダプタ（Dropbox / GCS / Cloudinary）
+
+保存先の解決（get_tenant_storage_configs / get_storage_adapters）は
+(テナント, 店舗, 担当者) 単位でプロセス内にキャッシュし、生成済みアダプタ
+（Dropbox/GCS の SDK クライアント）も使い回す。設定変更時は
+invalidate_storage_cache(tenant_id) を呼ぶと、変更通知バス（change_bus）経由で
+他のワーカーのキャッシュも無効になる。TTL（_CACHE_TTL_SEC）は通知が届かない
+場合の保険。
 """
 import os
 import re
+import time
+import logging
+import threading
 import unicodedata
+from io import BytesIO
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
 from werkzeug.utils import secure_filename  # noqa: F401 (後方互換のため残置)
 from app.db import SessionLocal
 from sqlalchemy import text
 
+logger = logging.getLogger(__name__)
+
+_CACHE_TTL_SEC = 300          # 保存先キャッシュの有効期間（秒）
+MIRROR_WORKERS = 4            # ミラー保存を並列に行うスレッド数（プロセス共通）
+
 
 # ファイル名に使えない文字（パス区切り・制御文字・OS禁止文字）
 _UNSAFE_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
@@ -44,6 +61,16 @@ class StorageAdapterBase:
     def __init__(self, storage_config, tenant_id: int):
         self.config = storage_config
         self.tenant_id = tenant_id
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _cached_client(self, factory):
+        """SDKクライアントをアダプタごとに1度だけ生成して使い回す（トークン更新・
+        アカウント情報取得の往復を毎回行わない）。キャッシュ済みアダプタはスレッド間で共有される。"""
+        with self._client_lock:
+            if self._client is None:
+                self._client = factory()
+            return self._client
     
     def upload(self, file_stream, original_name, client_id: int,
                client_folder_path: str = None, subfolder: str = None) -> str:
@@ -113,8 +140,11 @@ def get_dropbox_app_credentials(tenant_id: int = None):
 
 class DropboxAdapter(StorageAdapterBase):
     """ドロップボックスストレージアダプタ"""
-    
+
     def _get_client(self):
+        return self._cached_client(self._new_client)
+
+    def _new_client(self):
         try:
             import dropbox
         except Exception as e:
@@ -232,19 +262,22 @@ class GCSAdapter(StorageAdapterBase):
     """Google Cloud Storageアダプタ"""
     
     def _get_client_and_bucket(self):
+        return self._cached_client(self._new_client_and_bucket)
+
+    def _new_client_and_bucket(self):
         try:
             from google.cloud import storage
         except Exception as e:
             raise RuntimeError(f"GCS用 google-cloud-storage がインポートできません: {e}")
-        
+
         if self.config and self.config.service_account_json:
-            import tempfile
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.json') as f:
-                f.write(self.config.service_account_json)
-                temp_key_path = f.name
-            os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = temp_key_path
-        
-        client = storage.Client()
+            # 環境変数（プロセス共通）を書き換えると、並列保存中の他テナントの
+            # クライアントと認証情報が混ざるため、鍵情報から直接クライアントを作る
+            import json
+            client = storage.Client.from_service_account_info(
+                json.loads(self.config.service_account_json))
+        else:
+            client = storage.Client()
         bucket_name = self.config.bucket_name if self.config else None
         if not bucket_name:
             raise RuntimeError("GCS_BUCKET が未設定です")
@@ -536,11 +569,83 @@ def _mirror_configs(db, tenant_id, store_id):
         return []
 
 
+# ------------------------------------------------------------
+# 保存先（接続設定・アダプタ）のキャッシュ
+# ------------------------------------------------------------
+_cache_lock = threading.Lock()
+_storage_cache = {}   # (tenant_id, store_id, staff_id, staff_type) -> {'expires','version','configs','adapters'}
+
+
+def _storage_channel(tenant_id) -> str:
+    return f'storage:{tenant_id}'
+
+
+def _cache_version(tenant_id) -> int:
+    """テナントのストレージ設定の版数（change_bus）。取得できなければ 0（TTLのみで失効）"""
+    try:
+        from app.services.change_bus import get_change_bus
+        return get_change_bus().version(_storage_channel(tenant_id))
+    except Exception:
+        return 0
+
+
+def invalidate_storage_cache(tenant_id: int = None):
+    """ストレージ設定の変更後に呼ぶ。自プロセスのキャッシュを消し、他ワーカーへも通知する。
+    tenant_id=None は全テナント分を自プロセスでのみ破棄する。
+    """
+    with _cache_lock:
+        if tenant_id is None:
+            _storage_cache.clear()
+        else:
+            for key in [k for k in _storage_cache if k[0] == tenant_id]:
+                del _storage_cache[key]
+    if tenant_id is not None:
+        try:
+            from app.services.change_bus import get_change_bus
+            get_change_bus().publish(_storage_channel(tenant_id))
+        except Exception:
+            logger.warning('storage cache: 変更通知に失敗しました (tenant=%s)', tenant_id, exc_info=True)
+
+
+def _cache_entry(key):
+    """有効なキャッシュエントリを返す（期限切れ・版数違いは None）"""
+    with _cache_lock:
+        entry = _storage_cache.get(key)
+    if entry is None or entry['expires'] < time.monotonic():
+        return None
+    if entry['version'] != _cache_version(key[0]):
+        return None
+    return entry
+
+
+def _cache_store(key, version, **values):
+    with _cache_lock:
+        entry = _storage_cache.get(key)
+        if entry is None or entry['version'] != version or entry['expires'] < time.monotonic():
+            entry = {'version': version, 'expires': time.monotonic() + _CACHE_TTL_SEC}
+            _storage_cache[key] = entry
+        entry.update(values)
+        return entry
+
+
 def get_tenant_storage_configs(tenant_id: int, store_id: int = None,
                                staff_id: int = None, staff_type: str = None):
     """保存先の全接続（先頭=使用中/主、以降=ミラー）をリストで返す。
     主が来たスコープ（担当者 or 店舗 or 本部）に合わせて、そのスコープのミラーを付ける。
+    結果はキャッシュする（invalidate_storage_cache で破棄）。
     """
+    key = (tenant_id, store_id, staff_id, staff_type)
+    entry = _cache_entry(key)
+    if entry is not None and 'configs' in entry:
+        return list(entry['configs'])
+    version = _cache_version(tenant_id)
+    configs = _load_tenant_storage_configs(tenant_id, store_id, staff_id, staff_type)
+    _cache_store(key, version, configs=tuple(configs))
+    return list(configs)
+
+
+def _load_tenant_storage_configs(tenant_id, store_id, staff_id, staff_type):
+    """get_tenant_storage_configs の本体（DBから解決する）"""
     def _dedupe(prim, mirrors):
         out = [prim]
         seen = {getattr(prim, 'id', None)}
@@ -581,7 +686,13 @@ def get_storage_adapters(tenant_id: int, store_id: int = None,
     """使用中（主）＋ミラー の全アダプタをリストで返す（先頭が主）。
     隔離モードの店舗で専用ストレージが無い場合は StorageIsolationError を送出する
     （共有先＝本部既定/Cloudinaryへフォールバックしない fail-closed）。
+    生成したアダプタはキャッシュし、SDKクライアントごと使い回す。
     """
+    key = (tenant_id, store_id, staff_id, staff_type)
+    entry = _cache_entry(key)
+    if entry is not None and 'adapters' in entry:
+        return list(entry['adapters'])
+    version = _cache_version(tenant_id)
     configs = get_tenant_storage_configs(tenant_id, store_id=store_id,
                                          staff_id=staff_id, staff_type=staff_type)
     adapters = [_build_adapter(c, tenant_id) for c in configs]
@@ -596,24 +707,71 @@ def get_storage_adapters(tenant_id: int, store_id: int = None,
             finally:
                 db.close()
         adapters = [CloudinaryAdapter(tenant_id)]
-    return adapters
+    _cache_store(key, version, adapters=tuple(adapters))
+    return list(adapters)
+
+
+# ------------------------------------------------------------
+# 主＋ミラーへの保存
+# ------------------------------------------------------------
+_mirror_pool = None
+_mirror_pool_lock = threading.Lock()
+
+
+def _get_mirror_pool() -> ThreadPoolExecutor:
+    global _mirror_pool
+    with _mirror_pool_lock:
+        if _mirror_pool is None:
+            _mirror_pool = ThreadPoolExecutor(max_workers=MIRROR_WORKERS,
+                                              thread_name_prefix='storage-mirror')
+        return _mirror_pool
+
+
+def _upload_mirrors(mirrors, data_bytes, original_name, **kwargs):
+    """主の保存成功後、ミラーへ並列に保存して全件の完了を待つ。失敗は記録のみ。"""
+    if not mirrors:
+        return
+
+    def _one(ad):
+        try:
+            ad.upload(BytesIO(data_bytes), original_name, **kwargs)
+        except Exception:
+            # ミラー失敗は無視（主は成功済み）
+            logger.warning('storage mirror: %s への保存に失敗しました (%s)',
+                           type(ad).__name__, original_name, exc_info=True)
+
+    if len(mirrors) == 1:
+        _one(mirrors[0])
+        return
+    pool = _get_mirror_pool()
+    wait([pool.submit(_one, ad) for ad in mirrors])
 
 
 def upload_to_adapters(adapters, data_bytes, original_name, client_id,
                        client_folder_path=None, subfolder=None):
     """全アダプタ（先頭=主）へ保存する。主のURLを返す。
     主の失敗は例外送出（保存失敗）。ミラーの失敗は握りつぶす（主が成功していれば保存成立）。
+    ミラーは主の成功後に並列で保存する（往復時間は主＋最も遅いミラー）。
     """
-    from io import BytesIO
-    primary_url = None
-    for i, ad in enumerate(adapters):
-        try:
-            url = ad.upload(BytesIO(data_bytes), original_name, client_id=client_id,
-                            client_folder_path=client_folder_path, subfolder=subfolder)
-            if i == 0:
-                primary_url = url
-        except Exception:
-            if i == 0:
-                raise
-            # ミラー失敗は無視（主は成功済み）
+    if not adapters:
+        return None
+    kwargs = dict(client_id=client_id, client_folder_path=client_folder_path, subfolder=subfolder)
+    primary_url = adapters[0].upload(BytesIO(data_bytes), original_name, **kwargs)
+    _upload_mirrors(adapters[1:], data_bytes, original_name, **kwargs)
+    return primary_url
+
+
+def upload_stream_to_adapters(adapters, file_stream, original_name, client_id,
+                              client_folder_path=None, subfolder=None):
+    """upload_to_adapters のストリーム版（巻き戻し可能なファイルオブジェクトを受け取る）。
+    主へはストリームのまま渡す。ミラーがある場合のみ、並列保存のため内容を一度読み出す。
+    """
+    if not adapters:
+        return None
+    kwargs = dict(client_id=client_id, client_folder_path=client_folder_path, subfolder=subfolder)
+    file_stream.seek(0)
+    primary_url = adapters[0].upload(file_stream, original_name, **kwargs)
+    if len(adapters) > 1:
+        file_stream.seek(0)
+        _upload_mirrors(adapters[1:], file_stream.read(), original_name, **kwargs)
     return primary_url
@@ -9,15 +9,98 @@ import re
 import os
 import json
 import base64
+import random
 from typing import Dict, Optional, List
 
 
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+# プロバイダ（OpenAI / Google Vision / Azure）呼び出しの再試行設定
+_RETRY_STATUS = (429, 500, 502, 503, 504)
+_PROVIDER_RETRIES = 3       # 一時的なエラー（429/5xx・タイムアウト）の再試行回数
+_BACKOFF_BASE_SEC = 2       # 再試行までの待ち時間: 2, 4, 8 秒…（＋ゆらぎ）
+_BACKOFF_MAX_SEC = 60
+# 複数ページPDFのページ（チャンク）を並列にOCRするスレッド数
+PAGE_WORKERS = _env_int('OCR_PAGE_WORKERS', 3)
+# OCRキャッシュ（app.utils.ocr_cache）のキーに含める版数。
+# プロンプトや抽出・後処理の内容を変えたら上げる（古いキャッシュ結果を使わないように）
+OCR_CACHE_VERSION = 1
+
+
 def _encode_image_to_base64(image_path: str) -> str:
     """画像ファイルをBase64エンコードする"""
     with open(image_path, 'rb') as f:
         return base64.b64encode(f.read()).decode('utf-8')
 
 
+def _backoff_seconds(attempt: int, retry_after=None) -> float:
+    """再試行までの待ち時間（秒）。Retry-After ヘッダがあればそれに従う"""
+    if retry_after:
+        try:
+            return min(_BACKOFF_MAX_SEC, max(0.0, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+    return min(_BACKOFF_MAX_SEC, _BACKOFF_BASE_SEC * (2 ** attempt)) + random.uniform(0, 1)
+
+
+def _post_with_retry(url: str, retries: int = _PROVIDER_RETRIES, **kwargs):
+    """再試行付きの requests.post。
+
+    429 / 5xx とタイムアウト・接続エラーは指数バックオフで再試行する。
+    それ以外の応答と、再試行しきった後の応答はそのまま返す（判定は呼び出し側の raise_for_status）。
+    """
+    import requests
+    import time
+    for attempt in range(retries + 1):
+        try:
+            response = requests.post(url, **kwargs)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            if attempt >= retries:
+                raise
+            wait = _backoff_seconds(attempt)
+            print(f'[OCR] 通信エラーのため{wait:.1f}秒後に再試行します ({attempt + 1}/{retries}): {e}')
+            time.sleep(wait)
+            continue
+        if response.status_code in _RETRY_STATUS and attempt < retries:
+            wait = _backoff_seconds(attempt, response.headers.get('Retry-After'))
+            print(f'[OCR] HTTP {response.status_code} のため{wait:.1f}秒後に再試行します ({attempt + 1}/{retries})')
+            time.sleep(wait)
+            continue
+        return response
+
+
+def _map_pages(fn, items: list, progress=None) -> list:
+    """items の各要素に fn を PAGE_WORKERS 並列で適用し、入力順に結果を返す。
+
+    progress(done, total) は1件終わるごとに呼び出し元のスレッドで呼ばれる。
+    """
+    total = len(items)
+    if progress:
+        progress(0, total)
+    if total <= 1 or PAGE_WORKERS <= 1:
+        results = []
+        for i, item in enumerate(items):
+            results.append(fn(item))
+            if progress:
+                progress(i + 1, total)
+        return results
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    results = [None] * total
+    with ThreadPoolExecutor(max_workers=min(PAGE_WORKERS, total)) as pool:
+        futures = {pool.submit(fn, item): i for i, item in enumerate(items)}
+        for done, fut in enumerate(as_completed(futures), 1):
+            results[futures[fut]] = fut.result()
+            if progress:
+                progress(done, total)
+    return results
+
+
 def _pdf_to_images(pdf_path: str, dpi: int = 200) -> list:
     """PDFを全ページJPG画像リストに変換する（PyMuPDF使用）。画像ファイルはそのまま返す。"""
     ext = os.path.splitext(pdf_path)[1].lower()
@@ -44,7 +127,6 @@ def _pdf_to_images(pdf_path: str, dpi: int = 200) -> list:
 
 def _call_openai_vision_pages(image_paths: list, api_key: str, prompt: str, max_tokens: int = 8000, retry: int = 2) -> dict:
     """指定された画像ページリストをOpenAI Vision APIに送信する（contentがnullの場合はリトライ）"""
-    import requests
     import time
     system_message = (
         'あなたは日本語文書のOCR専門家です。'
@@ -74,7 +156,7 @@ def _call_openai_vision_pages(image_paths: list, api_key: str, prompt: str, max_
         'response_format': {'type': 'json_object'}
     }
     for attempt in range(retry + 1):
-        response = requests.post(
+        response = _post_with_retry(
             'https://api.openai.com/v1/chat/completions',
             headers=headers, json=payload, timeout=120
         )
@@ -88,7 +170,8 @@ def _call_openai_vision_pages(image_paths: list, api_key: str, prompt: str, max_
             if attempt < retry:
                 time.sleep(2)
                 continue
-            return {'transactions': [], 'raw_text': f'[APIエラー: finish_reason={finish_reason}]'}
+            return {'transactions': [], 'raw_text': f'[APIエラー: finish_reason={finish_reason}]',
+                    '_incomplete': f'応答が空でした (finish_reason={finish_reason})'}
         try:
             return json.loads(raw_content)
         except json.JSONDecodeError:
@@ -100,13 +183,13 @@ def _call_openai_vision_pages(image_paths: list, api_key: str, prompt: str, max_
                         transactions.append(obj)
                 except Exception:
                     pass
-            return {'transactions': transactions, 'raw_text': raw_content[:500]}
-    return {'transactions': [], 'raw_text': '[リトライ上限超過]'}
+            return {'transactions': transactions, 'raw_text': raw_content[:500],
+                    '_incomplete': 'JSONを解析できず明細を部分的に取り出しました'}
+    return {'transactions': [], 'raw_text': '[リトライ上限超過]', '_incomplete': 'リトライ上限超過'}
 
 
 def _call_openai_vision_with_system(image_path: str, api_key: str, prompt: str, max_tokens: int = 16000) -> dict:
     """通帳用Vision API呼び出し。システムプロンプト付き、detail=high、max_tokens大。"""
-    import requests
     import time
     system_message = (
         'あなたは日本の銀行通帳のOCR専門家です。'
@@ -152,7 +235,7 @@ def _call_openai_vision_with_system(image_path: str, api_key: str, prompt: str,
         # response_formatは指定しない（自由形式の方が数値精度が高い）
     }
     for attempt in range(3):
-        response = requests.post(
+        response = _post_with_retry(
             'https://api.openai.com/v1/chat/completions',
             headers=headers, json=payload, timeout=180
         )
@@ -166,7 +249,7 @@ def _call_openai_vision_with_system(image_path: str, api_key: str, prompt: str,
             if attempt < 2:
                 time.sleep(2)
                 continue
-            return {'transactions': []}
+            return {'transactions': [], '_incomplete': '応答が空でした'}
         # 自由形式レスポンスからJSONを抽出（コードブロックや説明文を除去）
         # まず```json ... ```ブロックを探す
         json_match = re.search(r'```(?:json)?\s*([\s\S]+?)```', raw_content)
@@ -184,13 +267,12 @@ def _call_openai_vision_with_system(image_path: str, api_key: str, prompt: str,
             if attempt < 2:
                 time.sleep(2)
                 continue
-            return {'transactions': []}
-    return {'transactions': []}
+            return {'transactions': [], '_incomplete': 'JSONを解析できませんでした'}
+    return {'transactions': [], '_incomplete': 'リトライ上限超過'}
 
 
 def _call_openai_vision(image_path: str, api_key: str, prompt: str, max_tokens: int = 2000) -> dict:
     """単一ファイル（画像またはPDF1ページ目）のVision API呼び出し（レシート用）"""
-    import requests
     ext = os.path.splitext(image_path)[1].lower()
     if ext == '.pdf':
         image_paths = _pdf_to_images(image_path)
@@ -225,14 +307,14 @@ def _call_openai_vision(image_path: str, api_key: str, prompt: str, max_tokens:
             'max_tokens': max_tokens,
             'response_format': {'type': 'json_object'}
         }
-        response = requests.post(
+        response = _post_with_retry(
             'https://api.openai.com/v1/chat/completions',
             headers=headers, json=payload, timeout=120
         )
         response.raise_for_status()
         raw_content = response.json()['choices'][0]['message'].get('content')
         if not raw_content:
-            return {}
+            return {'_incomplete': '応答が空でした'}
         return json.loads(raw_content)
 
 
@@ -265,10 +347,10 @@ JSONのみを返してください。説明文は不要です。"""
     return data
 
 
-def extract_bank_statement_with_openai_vision(image_path: str, api_key: str, column_def: dict = None) -> Dict:
+def extract_bank_statement_with_openai_vision(image_path: str, api_key: str, column_def: dict = None, progress=None) -> Dict:
     """
     OpenAI GPT-4o Vision APIを使用して通帳画像からデータを抜出する。
-    PDFは全ページをチャンク処理してマージ。
+    PDFは全ページをチャンクに分けて並列に処理し、ページ順にマージ。
     """
     # 列定義をプロンプトに組み込む
     if column_def and column_def.get('columns'):
@@ -473,31 +555,34 @@ JSONのみを返してください。説明文は不要です。"""
         all_transactions = []
         base_data = None
         raw_texts = []
+        incomplete = []
         CHUNK = 2
 
-        for chunk_start in range(0, len(image_paths), CHUNK):
+        def _ocr_chunk(chunk_start):
             chunk = image_paths[chunk_start:chunk_start + CHUNK]
+            prompt = prompt_header if chunk_start == 0 else prompt_transactions
+            return _call_openai_vision_pages(chunk, api_key, prompt, max_tokens=8000)
+
+        chunk_starts = list(range(0, len(image_paths), CHUNK))
+        for chunk_start, data in zip(chunk_starts, _map_pages(_ocr_chunk, chunk_starts, progress)):
             if chunk_start == 0:
-                data = _call_openai_vision_pages(chunk, api_key, prompt_header, max_tokens=8000)
                 base_data = data
-                raw_texts.append(data.get('raw_text', ''))
-                for t in data.get('transactions', []):
-                    t['deposit'] = to_float(t.get('deposit'))
-                    t['withdrawal'] = to_float(t.get('withdrawal'))
-                    t['balance'] = to_float(t.get('balance'))
-                    all_transactions.append(t)
-            else:
-                data = _call_openai_vision_pages(chunk, api_key, prompt_transactions, max_tokens=8000)
-                raw_texts.append(data.get('raw_text', ''))
-                for t in data.get('transactions', []):
-                    t['deposit'] = to_float(t.get('deposit'))
-                    t['withdrawal'] = to_float(t.get('withdrawal'))
-                    t['balance'] = to_float(t.get('balance'))
-                    all_transactions.append(t)
+            if data.get('_incomplete'):
+                incomplete.append(f'ページ{chunk_start + 1}-: {data["_incomplete"]}')
+            raw_texts.append(data.get('raw_text', ''))
+            for t in data.get('transactions', []):
+                t['deposit'] = to_float(t.get('deposit'))
+                t['withdrawal'] = to_float(t.get('withdrawal'))
+                t['balance'] = to_float(t.get('balance'))
+                all_transactions.append(t)
 
         result = base_data or {}
         result['transactions'] = all_transactions
         result['raw_text'] = '\n'.join(raw_texts)
+        if incomplete:
+            result['_incomplete'] = ' / '.join(incomplete)
+        else:
+            result.pop('_incomplete', None)
         return result
     finally:
         for p in image_paths:
@@ -507,7 +592,7 @@ JSONのみを返してください。説明文は不要です。"""
                 pass
 
 
-def extract_credit_statement_with_openai_vision(image_path: str, api_key: str) -> Dict:
+def extract_credit_statement_with_openai_vision(image_path: str, api_key: str, progress=None) -> Dict:
     """
     OpenAI GPT-4o Vision APIを使用してクレジット明細画像からデータを抜出する。
     PDFは全ページをチャンク処理してマージ。
@@ -578,28 +663,33 @@ JSONのみを返してください。説明文は不要です。"""
         all_transactions = []
         base_data = None
         raw_texts = []
+        incomplete = []
         CHUNK = 2
 
-        for chunk_start in range(0, len(image_paths), CHUNK):
+        def _ocr_chunk(chunk_start):
             chunk = image_paths[chunk_start:chunk_start + CHUNK]
+            prompt = prompt_header if chunk_start == 0 else prompt_transactions
+            return _call_openai_vision_pages(chunk, api_key, prompt, max_tokens=8000)
+
+        chunk_starts = list(range(0, len(image_paths), CHUNK))
+        for chunk_start, data in zip(chunk_starts, _map_pages(_ocr_chunk, chunk_starts, progress)):
             if chunk_start == 0:
-                data = _call_openai_vision_pages(chunk, api_key, prompt_header, max_tokens=8000)
                 base_data = data
-                raw_texts.append(data.get('raw_text', ''))
-                for t in data.get('transactions', []):
-                    t['amount'] = to_float(t.get('amount'))
-                    all_transactions.append(t)
-            else:
-                data = _call_openai_vision_pages(chunk, api_key, prompt_transactions, max_tokens=8000)
-                raw_texts.append(data.get('raw_text', ''))
-                for t in data.get('transactions', []):
-                    t['amount'] = to_float(t.get('amount'))
-                    all_transactions.append(t)
+            if data.get('_incomplete'):
+                incomplete.append(f'ページ{chunk_start + 1}-: {data["_incomplete"]}')
+            raw_texts.append(data.get('raw_text', ''))
+            for t in data.get('transactions', []):
+                t['amount'] = to_float(t.get('amount'))
+                all_transactions.append(t)
 
         result = base_data or {}
         result['total_amount'] = to_float(result.get('total_amount'))
         result['transactions'] = all_transactions
         result['raw_text'] = '\n'.join(raw_texts)
+        if incomplete:
+            result['_incomplete'] = ' / '.join(incomplete)
+        else:
+            result.pop('_incomplete', None)
         return result
     finally:
         for p in image_paths:
@@ -611,7 +701,6 @@ JSONのみを返してください。説明文は不要です。"""
 
 def _call_google_vision_single(image_path: str, api_key: str) -> str:
     """単一画像ファイルをGoogle Cloud Vision APIに送信してテキストを取得する"""
-    import requests
     import base64
     with open(image_path, 'rb') as f:
         image_content = base64.b64encode(f.read()).decode('utf-8')
@@ -623,7 +712,7 @@ def _call_google_vision_single(image_path: str, api_key: str) -> str:
             'imageContext': {'languageHints': ['ja', 'en']}
         }]
     }
-    response = requests.post(url, json=payload, timeout=30)
+    response = _post_with_retry(url, json=payload, timeout=30)
     response.raise_for_status()
     result = response.json()
     if 'error' in result:
@@ -643,11 +732,14 @@ def _call_google_vision_single(image_path: str, api_key: str) -> str:
     return text
 
 
-def extract_text_with_google_vision_api_key(image_path: str, api_key: str) -> str:
+def extract_text_with_google_vision_api_key(image_path: str, api_key: str, progress=None,
+                                            failed_pages: list = None) -> str:
     """
     Google Cloud Vision API（REST APIキー認証）で画像またはPDFからテキストを抽出する。
-    PDFの場合は全ページを画像変換して各ページを処理する。
+    PDFの場合は全ページを画像変換して各ページを並列に処理する。
     日本語漢字の認識精度が高い。
+    読み取りに失敗したページは空として続行し、failed_pages（リスト）を渡していれば
+    そのページ番号（1始まり）を追加する。
     """
     ext = os.path.splitext(image_path)[1].lower()
     if ext == '.pdf':
@@ -655,17 +747,20 @@ def extract_text_with_google_vision_api_key(image_path: str, api_key: str) -> st
         image_paths = _pdf_to_images(image_path, dpi=150)
         if not image_paths:
             raise ValueError('PDFを画像に変換できませんでした')
+        def _ocr_page(indexed):
+            i, page_path = indexed
+            try:
+                print(f'[OCR] Google Vision: ページ{i+1}/{len(image_paths)}処理中')
+                return _call_google_vision_single(page_path, api_key)
+            except Exception as e:
+                print(f'[OCR] ページ{i+1}エラー: {e}')
+                if failed_pages is not None:
+                    failed_pages.append(i + 1)
+                return ''
+
         try:
-            all_texts = []
-            for i, page_path in enumerate(image_paths):
-                try:
-                    print(f'[OCR] Google Vision: ページ{i+1}/{len(image_paths)}処理中')
-                    page_text = _call_google_vision_single(page_path, api_key)
-                    if page_text:
-                        all_texts.append(page_text)
-                except Exception as e:
-                    print(f'[OCR] ページ{i+1}エラー: {e}')
-            return '\n'.join(all_texts)
+            all_texts = _map_pages(_ocr_page, list(enumerate(image_paths)), progress)
+            return '\n'.join(t for t in all_texts if t)
         finally:
             for p in image_paths:
                 try:
@@ -680,7 +775,6 @@ def _call_openai_vision_with_text(text: str, api_key: str, prompt_template: str,
     """
     Google Visionで抜出したテキストをOpenAIに渡してJSON構造化する。
     """
-    import requests
     import time
     
     system_message = (
@@ -707,7 +801,7 @@ def _call_openai_vision_with_text(text: str, api_key: str, prompt_template: str,
     }
     
     for attempt in range(3):
-        response = requests.post(
+        response = _post_with_retry(
             'https://api.openai.com/v1/chat/completions',
             headers=headers, json=payload, timeout=120
         )
@@ -723,14 +817,14 @@ def _call_openai_vision_with_text(text: str, api_key: str, prompt_template: str,
             if attempt < 2:
                 time.sleep(2)
                 continue
-            return {}
+            return {'_incomplete': '応答が空でした'}
         print(f'[OCR] GPT-4o生レスポンス先頭300文字: {raw_content[:300]}')
         try:
             return json.loads(raw_content)
         except json.JSONDecodeError as e:
             print(f'[OCR] JSONパースエラー: {e}, レスポンス: {raw_content[:200]}')
-            return {'raw_text': raw_content[:500]}
-    return {}
+            return {'raw_text': raw_content[:500], '_incomplete': 'JSONを解析できませんでした'}
+    return {'_incomplete': 'リトライ上限超過'}
 
 
 def _extract_text_with_azure_document_intelligence(image_path: str, azure_endpoint: str, azure_key: str) -> str:
@@ -756,7 +850,7 @@ def _extract_text_with_azure_document_intelligence(image_path: str, azure_endpoi
         'Ocp-Apim-Subscription-Key': azure_key,
         'Content-Type': content_type,
     }
-    resp = requests.post(analyze_url, headers=headers, data=image_bytes, timeout=60)
+    resp = _post_with_retry(analyze_url, headers=headers, data=image_bytes, timeout=60)
     if resp.status_code not in (200, 202):
         print(f'[Azure ADI] 送信エラー: {resp.status_code} {resp.text[:200]}')
         return ''
@@ -886,14 +980,56 @@ OCRテキスト:
     return result
 
 
+def _ocr_cacheable(result: dict) -> bool:
+    """エラー時の空データや、一部のページ・応答が欠けた結果はキャッシュしない"""
+    return not result.get('_error') and not result.get('_incomplete')
+
+
+def _azure_config(endpoint: str = None, key: str = None) -> tuple:
+    """Azure Document Intelligence の接続先（DB設定 > 環境変数の順）"""
+    azure_endpoint = (endpoint or '').strip() or os.environ.get('AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT', '').strip()
+    azure_key = (key or '').strip() or os.environ.get('AZURE_DOCUMENT_INTELLIGENCE_KEY', '').strip()
+    return azure_endpoint, azure_key
+
+
 def process_bank_statement_image(image_path: str, api_key: str = None, google_vision_api_key: str = None, column_def: dict = None,
-                                  azure_document_intelligence_endpoint: str = None, azure_document_intelligence_key: str = None) -> Dict:
+                                  azure_document_intelligence_endpoint: str = None, azure_document_intelligence_key: str = None,
+                                  progress=None, refresh_cache: bool = False) -> Dict:
     """通帳画像を処理して情報を抜出する（通帳モード）。
+
+    同じ内容のファイル・同じ列定義・同じ処理方式の結果はOCRキャッシュから返す。
+    結果は実際に処理した方式（'_engine'）のキーで保存する。refresh_cache=True なら取り直す。
+    """
+    def _compute():
+        return _process_bank_statement_image(
+            image_path, api_key=api_key, column_def=column_def,
+            azure_document_intelligence_endpoint=azure_document_intelligence_endpoint,
+            azure_document_intelligence_key=azure_document_intelligence_key,
+            progress=progress)
+
+    if not api_key:
+        return _compute()
+    from app.utils import ocr_cache
+    engine = 'azure' if all(_azure_config(azure_document_intelligence_endpoint, azure_document_intelligence_key)) else 'vision'
+    return ocr_cache.cached('bank', image_path, OCR_CACHE_VERSION,
+                            {'engine': engine, 'column_def': column_def},
+                            _compute, cacheable=_ocr_cacheable,
+                            store_params=lambda r: {'engine': r.get('_engine', engine),
+                                                    'column_def': column_def},
+                            refresh=refresh_cache)
+
+
+def _process_bank_statement_image(image_path: str, api_key: str = None, column_def: dict = None,
+                                  azure_document_intelligence_endpoint: str = None, azure_document_intelligence_key: str = None,
+                                  progress=None) -> Dict:
+    """通帳画像を処理して情報を抜出する（キャッシュなし）。
     
     処理方式（優先順）:
     1. Azure Document Intelligence（ADI）+ GPT-4o構造化: 環境変数 AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT / AZURE_DOCUMENT_INTELLIGENCE_KEY が設定されている場合
     2. GPT-4o Vision直接（画像前処理付き）: ADI未設定の場合
-    3. エラー時: 空データを返す
+    3. エラー時: 空データを返す（'_error' にエラー内容を入れる）
+
+    progress(done, total): PDFのページ（チャンク）処理の進捗通知（任意）
     """
     empty = {'bank_name': None, 'branch_name': None, 'account_type': None,
              'account_number': None, 'account_holder': None,
@@ -903,8 +1039,7 @@ def process_bank_statement_image(image_path: str, api_key: str = None, google_vi
         return empty
 
     # Azure Document Intelligence が設定されている場合は優先使用（DB設定 > 環境変数の順）
-    azure_endpoint = (azure_document_intelligence_endpoint or '').strip() or os.environ.get('AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT', '').strip()
-    azure_key = (azure_document_intelligence_key or '').strip() or os.environ.get('AZURE_DOCUMENT_INTELLIGENCE_KEY', '').strip()
+    azure_endpoint, azure_key = _azure_config(azure_document_intelligence_endpoint, azure_document_intelligence_key)
     if azure_endpoint and azure_key:
         try:
             print(f'[OCR] Azure Document Intelligence処理開始: {image_path}')
@@ -914,6 +1049,7 @@ def process_bank_statement_image(image_path: str, api_key: str = None, google_vi
                 # GPT-4oでテキストを構造化
                 result = _structure_bank_text_with_gpt(ocr_text, api_key, column_def=column_def)
                 result['raw_text'] = ocr_text
+                result['_engine'] = 'azure'
                 print(f'[OCR] Azure ADI+GPT-4o構造化完了: {len(result.get("transactions", []))}件の取引')
                 return result
             else:
@@ -924,22 +1060,48 @@ def process_bank_statement_image(image_path: str, api_key: str = None, google_vi
     # GPT-4o Vision直接（画像前処理付き・列構造を視覚的に判断）
     try:
         print(f'[OCR] GPT-4o Vision直接処理開始: {image_path}')
-        result = extract_bank_statement_with_openai_vision(image_path, api_key, column_def=column_def)
+        result = extract_bank_statement_with_openai_vision(image_path, api_key, column_def=column_def, progress=progress)
+        result['_engine'] = 'vision'
         print(f'[OCR] GPT-4o Vision完了: {len(result.get("transactions", []))}件の取引')
         return result
     except Exception as e:
         print(f'[OCR] GPT-4o Visionエラー: {e}')
+        empty['_error'] = str(e)
     
     return empty
 
 
-def process_credit_statement_image(image_path: str, api_key: str = None, google_vision_api_key: str = None) -> Dict:
+def process_credit_statement_image(image_path: str, api_key: str = None, google_vision_api_key: str = None, progress=None,
+                                   refresh_cache: bool = False) -> Dict:
     """クレジット明細画像を処理して情報を抜出する（クレジット明細モード）。
+
+    同じ内容のファイル・同じ処理方式の結果はOCRキャッシュから返す。
+    結果は実際に処理した方式（'_engine'）のキーで保存する。refresh_cache=True なら取り直す。
+    """
+    def _compute():
+        return _process_credit_statement_image(image_path, api_key=api_key,
+                                               google_vision_api_key=google_vision_api_key,
+                                               progress=progress)
+
+    if not api_key and not google_vision_api_key:
+        return _compute()
+    from app.utils import ocr_cache
+    engine = 'google_vision+gpt' if (google_vision_api_key and api_key) else 'gpt'
+    return ocr_cache.cached('credit', image_path, OCR_CACHE_VERSION, {'engine': engine},
+                            _compute, cacheable=_ocr_cacheable,
+                            store_params=lambda r: {'engine': r.get('_engine', engine)},
+                            refresh=refresh_cache)
+
+
+def _process_credit_statement_image(image_path: str, api_key: str = None, google_vision_api_key: str = None, progress=None) -> Dict:
+    """クレジット明細画像を処理して情報を抜出する（キャッシュなし）。
     
     処理方式（優先順）:
     1. Google Vision API（文字認識）+ GPT-4o（構造化）: 最高精度
     2. GPT-4o Vision単体: 標準精度
-    3. エラー時: 空データを返す
+    3. エラー時: 空データを返す（'_error' にエラー内容を入れる）
+
+    progress(done, total): PDFのページ（チャンク）処理の進捗通知（任意）
     """
     empty = {'card_company': None, 'card_name': None, 'member_name': None,
              'statement_month': None, 'payment_date': None,
@@ -952,7 +1114,9 @@ def process_credit_statement_image(image_path: str, api_key: str = None, google_
     if google_vision_api_key and api_key:
         try:
             print(f"[OCR] Google Vision APIで文字認識中: {image_path}")
-            ocr_text = extract_text_with_google_vision_api_key(image_path, google_vision_api_key)
+            failed_pages = []
+            ocr_text = extract_text_with_google_vision_api_key(image_path, google_vision_api_key, progress=progress,
+                                                               failed_pages=failed_pages)
             print(f"[OCR] Google Vision成功: {len(ocr_text)}文字")
             print(f"[OCR] OCRテキスト先頭200文字: {repr(ocr_text[:200])}")
             
@@ -998,6 +1162,9 @@ OCRテキスト:
             
             if not data.get('raw_text'):
                 data['raw_text'] = ocr_text
+            if failed_pages:
+                data['_incomplete'] = f"Google Vision: ページ{','.join(map(str, sorted(failed_pages)))}の読み取りに失敗"
+            data['_engine'] = 'google_vision+gpt'
             
             print(f"[OCR] 構造化完了: {len(data.get('transactions', []))}件の明細")
             print(f"[OCR] GPT-4oレスポンス先頭500文字: {str(data)[:500]}")
@@ -1009,7 +1176,9 @@ OCRテキスト:
     # 方式2: GPT-4o Vision単体
     if api_key:
         try:
-            return extract_credit_statement_with_openai_vision(image_path, api_key)
+            data = extract_credit_statement_with_openai_vision(image_path, api_key, progress=progress)
+            data['_engine'] = 'gpt'
+            return data
         except Exception as e:
             import traceback
             err_detail = traceback.format_exc()
@@ -1019,12 +1188,23 @@ OCRテキスト:
     return empty
 
 
-def process_receipt_image(image_path: str, api_key: str = None) -> Dict:
+def process_receipt_image(image_path: str, api_key: str = None, refresh_cache: bool = False) -> Dict:
     """
     レシート画像を処理して情報を抽出する。
-    api_keyが指定されている場合はOpenAI Vision APIを使用。
+    api_keyが指定されている場合はOpenAI Vision APIを使用（同じ内容のファイルはOCRキャッシュから返す。
+    refresh_cache=True なら取り直す）。
     指定がない場合は手動入力モード（空データ）を返す。
     """
+    if not api_key:
+        return _process_receipt_image(image_path, api_key=api_key)
+    from app.utils import ocr_cache
+    return ocr_cache.cached('receipt', image_path, OCR_CACHE_VERSION, {'engine': 'gpt'},
+                            lambda: _process_receipt_image(image_path, api_key=api_key),
+                            cacheable=_ocr_cacheable, refresh=refresh_cache)
+
+
+def _process_receipt_image(image_path: str, api_key: str = None) -> Dict:
+    """レシート画像を処理して情報を抽出する（キャッシュなし）"""
     empty_result = {
         'full_text': '',
         'raw_text': '',
@@ -1057,9 +1237,12 @@ def process_receipt_image(image_path: str, api_key: str = None) -> Dict:
             'corporate_number': data.get('corporate_number'),
             'summary': data.get('summary'),
         }
+        if data.get('_incomplete'):
+            result['_incomplete'] = data['_incomplete']
         return result
     except Exception as e:
         print(f"OpenAI Vision APIエラー: {e}")
+        empty_result['_error'] = str(e)
         return empty_result
 
 
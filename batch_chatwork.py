@@ -27,18 +27,19 @@ def main():
     try:
         # モデル登録・テーブル作成を走らせるため app を import
         import app  # noqa: F401
-        from app.services.chatwork_sync import sync_all_tenants
+        from app.services.scheduler import run_jobs
     except Exception as e:
         print(f"❌ 初期化エラー: {e}")
         return 1
 
     try:
-        summary = sync_all_tenants()
+        # テナントごとのジョブをリースしながら処理（アプリ内スケジューラと重複しない）
+        summary = run_jobs(kinds=('chatwork',), force=True)
     except Exception as e:
         print(f"❌ 同期処理エラー: {e}")
         return 1
 
-    print(f"✅ 完了: 対象テナント {summary['tenants']} / "
+    print(f"✅ 完了: 対象テナント {summary['jobs']} / "
           f"保存 {summary['saved']}件 / スキップ {summary['skipped']}件 / "
           f"エラー {len(summary['errors'])}件")
     for err in summary['errors'][:20]:
@@ -26,18 +26,19 @@ def main():
     print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] Gmail同期バッチ開始")
     try:
         import app  # noqa: F401  モデル登録・テーブル作成
-        from app.services.gmail_sync import sync_all_tenants
+        from app.services.scheduler import run_jobs
     except Exception as e:
         print(f"❌ 初期化エラー: {e}")
         return 1
 
     try:
-        summary = sync_all_tenants()
+        # テナントごとのジョブをリースしながら処理（アプリ内スケジューラと重複しない）
+        summary = run_jobs(kinds=('gmail',), force=True)
     except Exception as e:
         print(f"❌ 同期処理エラー: {e}")
         return 1
 
-    print(f"✅ 完了: 対象テナント {summary['tenants']} / "
+    print(f"✅ 完了: 対象テナント {summary['jobs']} / "
           f"保存 {summary['saved']}件 / スキップ {summary['skipped']}件 / "
           f"エラー {len(summary['errors'])}件")
     for err in summary['errors'][:20]:
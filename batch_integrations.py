@@ -17,6 +17,8 @@
   1. ChatWork連携が有効な全テナントのルームから新着ファイルを取得→保存
   2. Gmail連携が有効な全テナントの新着メール添付を取得→保存
   いずれも重複防止付き（T_受信ファイル / since_uid）。
+  テナント×連携ごとのジョブ（T_スケジューラジョブ）単位でリースを取って処理するため、
+  複数台で同時に起動しても、アプリ内スケジューラと重なっても同じテナントを二重に処理しない。
 """
 import sys
 from datetime import datetime
@@ -30,36 +32,23 @@ def main():
         print(f"❌ 初期化エラー: {e}")
         return 1
 
-    total_saved = 0
-    total_errors = 0
-
-    # ChatWork
+    # テナント×連携ごとのジョブをリースしながら処理する。アプリ内スケジューラ
+    # （gunicornワーカー）が同時に動いていても、処理中のテナントは重複しない。
     try:
-        from app.services.chatwork_sync import sync_all_tenants as cw_sync
-        r = cw_sync()
-        total_saved += r['saved']
-        total_errors += len(r['errors'])
-        print(f"  💬 ChatWork: テナント{r['tenants']} / 保存{r['saved']} / "
-              f"スキップ{r['skipped']} / エラー{len(r['errors'])}")
-        for e in r['errors'][:10]:
-            print(f"     - {e}")
+        from app.services.scheduler import run_jobs
+        summary = run_jobs(kinds=('chatwork', 'gmail'), force=True)
     except Exception as e:
-        total_errors += 1
-        print(f"  ❌ ChatWork同期エラー: {e}")
+        print(f"❌ 同期処理エラー: {e}")
+        return 1
 
-    # Gmail
-    try:
-        from app.services.gmail_sync import sync_all_tenants as gm_sync
-        r = gm_sync()
-        total_saved += r['saved']
-        total_errors += len(r['errors'])
-        print(f"  📧 Gmail: テナント{r['tenants']} / 保存{r['saved']} / "
-              f"スキップ{r['skipped']} / エラー{len(r['errors'])}")
-        for e in r['errors'][:10]:
-            print(f"     - {e}")
-    except Exception as e:
-        total_errors += 1
-        print(f"  ❌ Gmail同期エラー: {e}")
+    labels = {'chatwork': '💬 ChatWork', 'gmail': '📧 Gmail'}
+    for kind, r in summary['by_kind'].items():
+        print(f"  {labels[kind]}: テナント{r['jobs']} / 保存{r['saved']} / "
+              f"スキップ{r['skipped']} / エラー{r['errors']}")
+    for e in summary['errors'][:10]:
+        print(f"     - {e}")
+    total_saved = summary['saved']
+    total_errors = len(summary['errors'])
 
     print(f"✅ 完了: 合計保存 {total_saved}件 / エラー {total_errors}件")
     return 0
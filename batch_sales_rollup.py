@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+POS 売上集計（T_売上集計）バックフィルバッチ
+
+【実行方法】
+  python batch_sales_rollup.py                         # 全店舗・全期間
+  python batch_sales_rollup.py --store 3 --store 5     # 店舗を指定
+  python batch_sales_rollup.py --start 2025-01-01 --end 2025-12-31
+
+【処理内容】
+  伝票・明細・支払記録から、店舗×日ごとの売上集計行を作り直す。
+  通常運用では /api/sales/* の読み出し時に「再計算待ち」「未集計」の日だけが
+  作り直されるため、導入直後や集計ロジック変更後に 1 回実行すればよい。
+"""
+import argparse
+import sys
+from datetime import datetime
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="POS 売上集計のバックフィル")
+    parser.add_argument("--store", type=int, action="append", dest="stores", help="店舗ID（複数指定可）")
+    parser.add_argument("--start", help="開始日 YYYY-MM-DD（省略時は各店舗の最初の伝票日）")
+    parser.add_argument("--end", help="終了日 YYYY-MM-DD（省略時は今日）")
+    args = parser.parse_args(argv)
+
+    print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] 売上集計バックフィル開始")
+    try:
+        from flask import Flask
+        from app.blueprints.pos_app import rebuild_sales_rollups
+    except Exception as e:
+        print(f"❌ 初期化エラー: {e}")
+        return 1
+
+    # POS のテナント自動フィルタは g / session を参照するため、空のリクエストコンテキストで実行する
+    ctx_app = Flask(__name__)
+    try:
+        with ctx_app.test_request_context("/__batch_sales_rollup__"):
+            summary = rebuild_sales_rollups(args.stores, args.start, args.end)
+    except Exception as e:
+        print(f"❌ 集計処理エラー: {e}")
+        return 1
+
+    print(f"✅ 完了: 店舗 {summary['stores']} / 日数 {summary['days']} / 集計行 {summary['rows']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
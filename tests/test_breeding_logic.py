@@ -424,6 +424,269 @@ class TestCalculateCOI(unittest.TestCase):
         self.assertAlmostEqual(total, result['coi_percent'], places=3)
 
 
+class TestPedigreeGraph(unittest.TestCase):
+    """
+    PedigreeGraph（一括ロード＋メモ化）が従来の 1 頭ずつの探索と
+    同じ結果を返し、クエリ数が世代数に抑えられることを確認する。
+    """
+
+    def setUp(self):
+        self._originals = None
+        self._orig_fetch = bl._fetch_pedigree_rows
+        self.fetch_calls = []
+
+    def tearDown(self):
+        bl._fetch_pedigree_rows = self._orig_fetch
+        if self._originals:
+            restore_bl(self._originals)
+
+    def _use_graph_db(self, dogs):
+        dog_map = {d.id: d for d in dogs}
+
+        def fake_fetch(dog_ids, db):
+            self.fetch_calls.append(list(dog_ids))
+            return [(d.id, d.name, d.father_id, d.mother_id)
+                    for d in (dog_map.get(i) for i in dog_ids) if d]
+
+        bl._fetch_pedigree_rows = fake_fetch
+
+    def _legacy(self, dogs, fn):
+        """従来経路（_walk を dog_map でパッチ）で fn を評価する。"""
+        _, originals = make_patched_bl(dogs)
+        try:
+            return fn()
+        finally:
+            restore_bl(originals)
+
+    def _inbred_pedigree(self):
+        # 祖父 A が父方・母方の両方に出現し、B 自身も近親交配で生まれている
+        A  = MockDog(100, 'A')
+        Bm = MockDog(101, 'Bm')
+        B  = MockDog(50,  'B',  father_id=100, mother_id=101)
+        C  = MockDog(51,  'C',  father_id=100, mother_id=101)
+        F  = MockDog(2,   'F',  father_id=50,  mother_id=51)
+        M  = MockDog(3,   'M',  father_id=100)
+        G  = MockDog(5,   'G',  father_id=50)
+        sire = MockDog(1, 'Sire', father_id=2, mother_id=3)
+        dam  = MockDog(4, 'Dam',  father_id=5, mother_id=3)
+        return [A, Bm, B, C, F, M, G, sire, dam]
+
+    def test_ancestors_match_legacy_walk(self):
+        """graph.ancestors は get_ancestors と同じ世代距離リストを返す"""
+        dogs = self._inbred_pedigree()
+        expected = self._legacy(dogs, lambda: bl.get_ancestors(1, max_depth=4, db=None))
+        self._use_graph_db(dogs)
+        graph = bl.PedigreeGraph(None, [1])
+        self.assertEqual(graph.ancestors(1, 4), expected)
+
+    def test_coi_matches_legacy(self):
+        """graph 経由の COI（F_A を含む）は従来経路と一致する"""
+        dogs = self._inbred_pedigree()
+        expected = self._legacy(dogs, lambda: bl.calculate_coi(1, 4, max_depth=5, db=None))
+        self._use_graph_db(dogs)
+        graph = bl.PedigreeGraph(None, [1, 4])
+        result = bl.calculate_coi(1, 4, max_depth=5, db=None, graph=graph)
+        self.assertAlmostEqual(result['coi'], expected['coi'], places=8)
+        self.assertGreater(result['coi'], 0.0)
+        self.assertEqual(
+            {ca['dog_id'] for ca in result['common_ancestors']},
+            {ca['dog_id'] for ca in expected['common_ancestors']},
+        )
+
+    def test_one_query_per_generation(self):
+        """祖先は世代ごとに 1 回の一括クエリで読み込まれる"""
+        dogs = self._inbred_pedigree()
+        self._use_graph_db(dogs)
+        graph = bl.PedigreeGraph(None, [1, 4])
+        # 起点 → 親 → 祖父母 → 曽祖父母 の 4 世代
+        self.assertEqual(graph.query_count, 4)
+        self.assertEqual(sorted(self.fetch_calls[0]), [1, 4])
+
+        bl.calculate_coi(1, 4, max_depth=5, db=None, graph=graph)
+        bl.calculate_avk(1, 4, 5, None, graph=graph)
+        bl.calculate_ancestor_concentration(1, 4, 5, None, graph=graph)
+        bl.calculate_line_dependency(1, 4, 5, None, graph=graph)
+        self.assertEqual(graph.query_count, 4)
+
+    def test_ancestors_memoized(self):
+        """同じ (犬, 世代数) の祖先探索は使い回される"""
+        dogs = self._inbred_pedigree()
+        self._use_graph_db(dogs)
+        graph = bl.PedigreeGraph(None, [1])
+        self.assertIs(graph.ancestors(1, 4), graph.ancestors(1, 4))
+
+    def test_missing_dog(self):
+        """存在しない犬は祖先なし・名前は ID 表記"""
+        self._use_graph_db([])
+        graph = bl.PedigreeGraph(None, [999])
+        self.assertIsNone(graph.get(999))
+        self.assertEqual(graph.ancestors(999, 5), {})
+        self.assertEqual(graph.name(999), 'ID:999')
+
+
+class TestPedigreeMetricsCache(unittest.TestCase):
+    """PedigreeMetricsCache（血統指紋つき永続キャッシュ）のテスト"""
+
+    class _CacheRow:
+        # クエリ条件（MatingPedigreeCache.sire_id.in_(...) 等）の組み立て用
+        sire_id = MagicMock()
+        max_depth = MagicMock()
+
+        def __init__(self, **kw):
+            self.__dict__.update(kw)
+
+    class _Store:
+        """MatingPedigreeCache テーブル相当（コミット済みの行だけを返す）"""
+        def __init__(self, rows=None):
+            self.rows = rows if rows is not None else []
+            self.pending = []
+            self.commits = 0
+            self.rollbacks = 0
+
+        def query(self, model):
+            store = self
+
+            class _Q:
+                def filter(self, *args):
+                    return self
+
+                def all(self):
+                    return list(store.rows)
+            return _Q()
+
+        def add(self, row):
+            self.pending.append(row)
+
+        def commit(self):
+            for row in self.pending:
+                if row not in self.rows:
+                    self.rows.append(row)
+            self.pending = []
+            self.commits += 1
+
+        def rollback(self):
+            self.pending = []
+            self.rollbacks += 1
+
+        def close(self):
+            pass
+
+    def setUp(self):
+        self._orig_fetch = bl._fetch_pedigree_rows
+        self._orig_fetch_anc = bl._fetch_pedigree_ancestor_rows
+        self._orig_session = bl._cache_session
+        # 保存用の別セッション（同じテーブルを共有する）
+        self.sessions = []
+
+        def _session(db):
+            self.sessions.append(self._Store(rows=db.rows))
+            return self.sessions[-1]
+        bl._cache_session = _session
+        self._models = sys.modules['app.models_breeder']
+        self._orig_model = self._models.MatingPedigreeCache
+        self._models.MatingPedigreeCache = self._CacheRow
+        self.ancestor_rows = []
+        bl._fetch_pedigree_ancestor_rows = lambda ids, db: [
+            r for r in self.ancestor_rows if r[0] in ids
+        ]
+
+    def tearDown(self):
+        bl._fetch_pedigree_rows = self._orig_fetch
+        bl._fetch_pedigree_ancestor_rows = self._orig_fetch_anc
+        bl._cache_session = self._orig_session
+        self._models.MatingPedigreeCache = self._orig_model
+
+    def _use_dogs(self, dogs):
+        dog_map = {d.id: d for d in dogs}
+        bl._fetch_pedigree_rows = lambda ids, db: [
+            (d.id, d.name, d.father_id, d.mother_id)
+            for d in (dog_map.get(i) for i in ids) if d
+        ]
+
+    def _dogs(self, dam_father=2):
+        return [
+            MockDog(2, 'F'), MockDog(3, 'M'), MockDog(6, 'X'),
+            MockDog(1, 'Sire', father_id=2, mother_id=3),
+            MockDog(4, 'Dam', father_id=dam_father, mother_id=3),
+            MockDog(7, 'Other', father_id=6),
+        ]
+
+    def test_miss_then_hit(self):
+        """初回は計算して保存し、2 回目は保存済みの結果を返す"""
+        store = self._Store()
+        self._use_dogs(self._dogs())
+        first = bl.PedigreeMetricsCache(store)
+        m1 = first.get(1, 4, 5)
+        first.save()
+        self.assertEqual((first.hits, first.misses), (0, 1))
+        self.assertAlmostEqual(m1['coi']['coi'], 0.25, places=6)
+        self.assertEqual(len(store.rows), 1)
+
+        second = bl.PedigreeMetricsCache(store)
+        m2 = second.get(1, 4, 5)
+        self.assertEqual((second.hits, second.misses), (1, 0))
+        self.assertEqual(m1, m2)
+        self.assertEqual(set(m2), {'coi', 'avk', 'ancestor_concentration', 'line_dependency'})
+
+    def test_only_affected_pairs_recomputed(self):
+        """祖先の父母が変わったペアだけが再計算される"""
+        store = self._Store()
+        self._use_dogs(self._dogs())
+        cache = bl.PedigreeMetricsCache(store)
+        cache.get(1, 4, 5)
+        cache.get(1, 7, 5)
+        cache.save()
+
+        # 母犬 4 の父を 2 → 6 に変更（1×7 のペアは無関係）
+        self._use_dogs(self._dogs(dam_father=6))
+        cache = bl.PedigreeMetricsCache(store)
+        changed = cache.get(1, 4, 5)
+        cache.get(1, 7, 5)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertAlmostEqual(changed['coi']['coi'], 0.125, places=6)
+
+    def test_save_leaves_caller_session_alone(self):
+        """保存は別セッションで行い、呼び出し元の未コミットの変更をコミットもロールバックもしない"""
+        store = self._Store()
+        self._use_dogs(self._dogs())
+        caller_change = object()
+        store.add(caller_change)
+        cache = bl.PedigreeMetricsCache(store)
+        cache.get(1, 4, 5)
+        cache.save()
+        self.assertEqual((store.commits, store.rollbacks), (0, 0))
+        self.assertEqual(store.pending, [caller_change])
+        self.assertEqual(len(self.sessions), 1)
+        self.assertEqual(self.sessions[0].commits, 1)
+        self.assertEqual(len(store.rows), 1)
+
+    def test_recomputed_row_updated_in_place(self):
+        """血統が変わったペアは既存行を更新する（行は増えない）"""
+        store = self._Store()
+        self._use_dogs(self._dogs())
+        cache = bl.PedigreeMetricsCache(store)
+        cache.get(1, 4, 5)
+        cache.save()
+        old_hash = store.rows[0].pedigree_hash
+
+        self._use_dogs(self._dogs(dam_father=6))
+        cache = bl.PedigreeMetricsCache(store)
+        cache.get(1, 4, 5)
+        self.assertEqual(store.rows[0].pedigree_hash, old_hash)
+        cache.save()
+        self.assertEqual(len(store.rows), 1)
+        self.assertNotEqual(store.rows[0].pedigree_hash, old_hash)
+
+    def test_pedigree_ancestor_rows_invalidate(self):
+        """血統書祖先情報が変わると指紋が変わる"""
+        self._use_dogs(self._dogs())
+        before = bl.PedigreeMetricsCache(None).fingerprint(1, 4, 5)
+        self.ancestor_rows = [(3, 1, 'dam', 'M', 'JKC-001')]
+        after = bl.PedigreeMetricsCache(None).fingerprint(1, 4, 5)
+        self.assertNotEqual(before, after)
+        self.assertEqual(after, bl.PedigreeMetricsCache(None).fingerprint(1, 4, 5))
+
+
 class TestGetCoiRank(unittest.TestCase):
 
     def test_rank_a(self):
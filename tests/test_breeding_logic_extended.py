@@ -303,6 +303,115 @@ def test_rule_based_improvements_high_coi():
         f"Expected COI improvement suggestion, got: {improvements}"
 
 
+# ============================================================
+# 候補一括比較（MatingPrefetch）テスト
+# ============================================================
+class _Row:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+def make_prefetch_db(rows_by_attr):
+    """
+    モデル名ごとに行を返す FakeDB。filter 条件は無視し、
+    MatingPrefetch 側で ID による振り分けが行われることを前提にする。
+    発行されたクエリ数を queries に記録する。
+    """
+    models = sys.modules['app.models_breeder']
+
+    class FakeQuery:
+        def __init__(self, rows):
+            self._rows = rows
+        def filter(self, *args):
+            return self
+        def all(self):
+            return list(self._rows)
+
+    class FakeDB:
+        queries = 0
+        def query(self, model):
+            FakeDB.queries += 1
+            for attr, rows in rows_by_attr.items():
+                target = models
+                for part in attr.split('.'):
+                    target = getattr(target, part)
+                if model is target:
+                    return FakeQuery(rows)
+            return FakeQuery([])
+
+    return FakeDB()
+
+
+def _compare_fixture(n_candidates):
+    dam = make_dog(1, 'Dam')
+    cands = [make_dog(100 + i, f'Sire{i}') for i in range(n_candidates)]
+    dog_map = {d.id: d for d in [dam, *cands]}
+    rows = {
+        'GeneticTestResult': [
+            _Row(dog_id=1, disease_name='PRA', result='carrier'),
+            _Row(dog_id=100, disease_name='PRA', result='carrier'),
+            _Row(dog_id=101, disease_name='PRA', result='clear'),
+        ],
+        'DogHealthRecord': [],
+        'BreedingHistory': [
+            _Row(id=10, sire_id=100, dam_id=1, pregnancy_result='success', puppy_count=2,
+                 live_birth_count=2, stillbirth_count=0, c_section=0, mating_date=None),
+        ],
+        'PuppyRecord': [
+            _Row(id=1000, breeding_history_id=10, survived=True, defects=None),
+            _Row(id=1001, breeding_history_id=10, survived=False, defects='cleft'),
+        ],
+        'PuppyFollowUp.puppy_id': [(1000,)],
+    }
+    return dog_map, make_prefetch_db(rows)
+
+
+def _patch_pedigree_rows(dog_map):
+    orig = bl._fetch_pedigree_rows
+    bl._fetch_pedigree_rows = lambda ids, db: [
+        (d.id, d.name, d.father_id, d.mother_id) for d in (dog_map.get(i) for i in ids) if d
+    ]
+    return orig
+
+
+def test_compare_candidates_batch_uses_prefetch():
+    """一括比較では遺伝病・繁殖・産子データを MatingPrefetch から評価する"""
+    dog_map, db = _compare_fixture(2)
+    orig = _patch_pedigree_rows(dog_map)
+    try:
+        results = bl.compare_mating_candidates(1, 'dam', [100, 101], 5, db)
+    finally:
+        bl._fetch_pedigree_rows = orig
+
+    by_id = {r['candidate_id']: r for r in results}
+    assert [r['rank_position'] for r in results] == [1, 2]
+    assert results[0]['candidate_id'] == 101, 'キャリア×キャリアの 100 は下位になる'
+    assert by_id[101]['candidate_name'] == 'Sire1'
+
+    offspring = by_id[100]['detail']['offspring_evaluation']
+    assert offspring['total_puppies'] == 2
+    assert offspring['defect_rate'] == 50.0
+    assert offspring['known_disease_rate'] == 50.0
+    assert by_id[100]['detail']['breeding_evaluation']['dam_stats']['total_litters'] == 1
+    pra = by_id[100]['detail']['genetic_disease_risks'][0]
+    assert pra['risk'] == 'high'
+
+
+def test_compare_candidates_query_count_independent_of_candidates():
+    """候補数を増やしても発行クエリ数は増えない"""
+    counts = []
+    for n in (2, 20):
+        dog_map, db = _compare_fixture(n)
+        orig = _patch_pedigree_rows(dog_map)
+        try:
+            results = list(bl.iter_mating_candidates(1, 'dam', list(dog_map)[1:], 5, db))
+        finally:
+            bl._fetch_pedigree_rows = orig
+        assert len(results) == n
+        counts.append(db.queries)
+    assert counts[0] == counts[1]
+
+
 # ============================================================
 # 実行
 # ============================================================
@@ -318,6 +427,8 @@ if __name__ == '__main__':
         test_compare_candidates_ranking_order,
         test_rule_based_summary_no_coi,
         test_rule_based_improvements_high_coi,
+        test_compare_candidates_batch_uses_prefetch,
+        test_compare_candidates_query_count_independent_of_candidates,
     ]
     passed = 0
     failed = 0
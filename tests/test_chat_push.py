@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+chat_push.py（チャットの SSE 配信）のユニットテスト
+
+通知が来たときだけ fetch() が呼ばれること・待機中はハートビートのみで
+DBを読まないこと・購読が必ず解除されることを検証する。
+"""
+import sys
+import os
+import json
+import queue
+
+# パスを追加してモジュールを直接インポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app', 'services'))
+import chat_push  # noqa: E402
+
+
+class _FakeBus:
+    def __init__(self):
+        self.queues = []
+
+    def subscribe(self, channel):
+        q = queue.Queue()
+        self.queues.append(q)
+        return q
+
+    def unsubscribe(self, channel, q):
+        self.queues.remove(q)
+
+    def publish(self):
+        for q in self.queues:
+            q.put(1)
+
+
+def _parse(chunk):
+    fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+    return fields.get('event'), json.loads(fields['data']), fields.get('id')
+
+
+class TestStream:
+    def test_fetch_only_on_connect_and_notify(self):
+        bus = _FakeBus()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            return [('message', {'n': len(calls)}, len(calls))]
+
+        gen = chat_push.stream('ichat:1', fetch, heartbeat=0.01, max_age=60, bus=bus)
+        assert next(gen).startswith('retry:')
+        assert _parse(next(gen)) == ('message', {'n': 1}, '1')   # 接続直後の取りこぼし分
+
+        # 通知が無い間はハートビートのみ（fetch は呼ばれない）
+        assert next(gen) == ': heartbeat\n\n'
+        assert next(gen) == ': heartbeat\n\n'
+        assert len(calls) == 1
+
+        # 連続した通知は1回の取得にまとめる
+        bus.publish()
+        bus.publish()
+        assert _parse(next(gen)) == ('message', {'n': 2}, '2')
+        assert len(calls) == 2
+        gen.close()
+        assert bus.queues == []
+
+    def test_stream_ends_after_max_age(self):
+        bus = _FakeBus()
+        chunks = list(chat_push.stream('cchat:1', lambda: [], heartbeat=0.01, max_age=0.03, bus=bus))
+        assert chunks[0].startswith('retry:')
+        assert all(c == ': heartbeat\n\n' for c in chunks[1:])
+        assert bus.queues == []
+
+
+class TestFormatEvent:
+    def test_without_id(self):
+        assert chat_push.format_event('read', {'read_upto': 5}) == 'event: read\ndata: {"read_upto": 5}\n\n'
+
+    def test_non_ascii(self):
+        assert '既読' in chat_push.format_event('message', {'m': '既読'}, 3)
+
+
+class TestStreamSlots:
+    def test_busy_when_no_slot_and_slot_released_on_close(self):
+        import threading
+        bus = _FakeBus()
+        slots = threading.BoundedSemaphore(1)
+        first = chat_push.stream('ichat:1', lambda: [], heartbeat=0.01, max_age=60, bus=bus, slots=slots)
+        assert next(first).startswith('retry:')
+
+        # 上限に達している間は fetch せず busy を返して終わる
+        fetched = []
+        busy = list(chat_push.stream('ichat:1', lambda: fetched.append(1) or [], bus=bus, slots=slots))
+        assert busy[0].startswith('retry:')
+        assert _parse(busy[1]) == ('busy', {'poll': True}, None)
+        assert len(busy) == 2 and fetched == []
+
+        first.close()
+        assert bus.queues == []
+        assert slots.acquire(blocking=False)
+
+    def test_max_age_is_below_worker_timeout(self):
+        assert chat_push.STREAM_MAX_SEC <= 60
+        assert chat_push.HEARTBEAT_SEC <= chat_push.STREAM_MAX_SEC
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+db.py（接続プール）のユニットテスト
+
+偽の接続関数でプールを作り、払い出し・返却・上限到達時の overflow・
+返却されないまま破棄されたラッパーの回収・fork 後のプール作り直しを検証する。
+"""
+import sys
+import os
+import gc
+import types
+
+import pytest
+
+# パスを追加してモジュールを直接インポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app', 'utils'))
+import db  # noqa: E402
+
+_IDLE, _INTRANS, _UNKNOWN = 0, 2, 4
+
+
+class FakeConn:
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = True
+        self.status = _IDLE
+        self.rollbacks = 0
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = _IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture(autouse=True)
+def fake_psycopg2(monkeypatch):
+    extensions = types.SimpleNamespace(TRANSACTION_STATUS_IDLE=_IDLE, TRANSACTION_STATUS_UNKNOWN=_UNKNOWN)
+    monkeypatch.setattr(db, 'psycopg2', types.SimpleNamespace(extensions=extensions))
+
+
+@pytest.fixture
+def connect():
+    made = []
+
+    def _connect():
+        made.append(FakeConn())
+        return made[-1]
+
+    _connect.made = made
+    return _connect
+
+
+class TestConnectionPool:
+    def test_released_connection_is_reused(self, connect):
+        pool = db.ConnectionPool(connect, max_size=2, timeout=0)
+        conn, pooled = pool.acquire()
+        assert pooled
+        conn.status = _INTRANS
+        pool.release(conn)
+        assert conn.rollbacks == 1  # 返却時にトランザクションを戻す
+        again, _ = pool.acquire()
+        assert again is conn and len(connect.made) == 1
+        assert pool.stats()['in_use'] == 1
+
+    def test_broken_connection_is_discarded(self, connect):
+        pool = db.ConnectionPool(connect, max_size=1, timeout=0)
+        conn, _ = pool.acquire()
+        pool.release(conn)
+        conn.status = _UNKNOWN
+        fresh, _ = pool.acquire()
+        assert fresh is not conn and conn.closed
+        assert pool.stats()['discarded'] == 1 and pool.stats()['size'] == 1
+
+    def test_overflow_when_exhausted(self, connect):
+        pool = db.ConnectionPool(connect, max_size=1, timeout=0.05)
+        first, _ = pool.acquire()
+        extra, pooled = pool.acquire()
+        assert not pooled and extra is not first
+        assert pool.stats()['overflow'] == 1 and pool.stats()['waits'] == 1
+        pool.release(extra, pooled)
+        assert extra.closed  # プール外の接続は閉じる
+        assert pool.stats()['size'] == 1
+
+    def test_failed_connect_frees_slot(self):
+        def broken():
+            raise RuntimeError('refused')
+
+        pool = db.ConnectionPool(broken, max_size=1, timeout=0)
+        with pytest.raises(RuntimeError):
+            pool.acquire()
+        assert pool.stats()['size'] == 0 and pool.stats()['in_use'] == 0
+
+
+class TestPooledConnection:
+    def test_close_returns_once(self, connect):
+        pool = db.ConnectionPool(connect, max_size=1, timeout=0)
+        raw, pooled = pool.acquire()
+        wrapper = db.PooledConnection(pool, raw, pooled)
+        wrapper.close()
+        wrapper.release()
+        assert pool.stats()['in_use'] == 0 and pool.stats()['idle'] == 1
+
+    def test_request_scoped_close_keeps_connection(self, connect):
+        pool = db.ConnectionPool(connect, max_size=1, timeout=0)
+        raw, pooled = pool.acquire()
+        wrapper = db.PooledConnection(pool, raw, pooled, request_scoped=True)
+        wrapper.close()
+        assert pool.stats()['in_use'] == 1
+        wrapper.release()
+        assert pool.stats()['in_use'] == 0
+
+    def test_garbage_collected_wrapper_frees_slot(self, connect):
+        pool = db.ConnectionPool(connect, max_size=1, timeout=0)
+        raw, pooled = pool.acquire()
+        wrapper = db.PooledConnection(pool, raw, pooled)
+        del wrapper
+        gc.collect()
+        assert pool.stats()['in_use'] == 0
+        again, pooled = pool.acquire()
+        assert pooled and again is raw
+
+
+class TestGetPool:
+    def test_pool_is_rebuilt_after_fork(self, monkeypatch):
+        monkeypatch.setattr(db, '_pool', None)
+        pool = db._get_pool()
+        assert db._get_pool() is pool
+        monkeypatch.setattr(db.os, 'getpid', lambda: pool.pid + 1)
+        child = db._get_pool()
+        assert child is not pool and child.pid == pool.pid + 1
+        assert db.get_pool_stats()['size'] == 0
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+imap_fetch.py のユニットテスト
+
+FETCH 応答のパース・BODYSTRUCTURE からの添付特定・
+バッチ取得（添付の無いメールは本文を取得しない）を検証する。
+"""
+import sys
+import os
+
+# パスを追加してモジュールを直接インポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app', 'utils', 'integrations'))
+from imap_fetch import (
+    parse_fetch_response,
+    attachment_parts,
+    iter_messages,
+    fetch_attachment,
+    ImapFetchError,
+)
+
+import pytest
+
+_HEADER = b'From: Foo <Foo@Example.com>\r\nSubject: =?utf-8?b?44OG44K544OI?=\r\n\r\n'
+
+_MIXED = (
+    b'1 (UID 7 BODYSTRUCTURE ((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 10 1 NIL NIL NIL NIL)'
+    b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "7BIT" 20 1 NIL NIL NIL NIL) "ALTERNATIVE" ("BOUNDARY" "x") NIL NIL NIL)'
+    b'("APPLICATION" "PDF" ("NAME" "a.pdf") NIL NIL "BASE64" 1234 NIL'
+    b' ("ATTACHMENT" ("FILENAME*" "utf-8\'\'%E8%AB%8B%E6%B1%82.pdf")) NIL NIL)'
+    b' "MIXED" ("BOUNDARY" "y") NIL NIL NIL) BODY[HEADER.FIELDS (FROM SUBJECT DATE)] {'
+    + str(len(_HEADER)).encode() + b'}'
+)
+_PLAIN = (
+    b'2 (UID 8 BODYSTRUCTURE ("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 10 1 NIL NIL NIL NIL)'
+    b' BODY[HEADER.FIELDS (FROM SUBJECT DATE)] {4}'
+)
+
+
+class _FakeConn:
+    def __init__(self):
+        self.calls = []
+
+    def uid(self, command, uids, items):
+        self.calls.append((command, uids, items))
+        if 'BODYSTRUCTURE' in items:
+            return 'OK', [(_MIXED, _HEADER), b')', (_PLAIN, b'\r\n\r\n'), b')']
+        return 'OK', [(b'1 (UID 7 BODY[2] {10}', b'aGVsbG8=\r\n'), b')']
+
+
+class _PartialConn(_FakeConn):
+    """まとめて取得すると UID 8 を省き、単独取得では single の応答を返す"""
+
+    def __init__(self, single):
+        super().__init__()
+        self.single = single
+
+    def uid(self, command, uids, items):
+        self.calls.append((command, uids, items))
+        if uids == '7,8':
+            return 'OK', [(_MIXED, _HEADER), b')']
+        return self.single
+
+
+class TestParseFetchResponse:
+    def test_literal_and_nested_lists(self):
+        parsed = parse_fetch_response([(_MIXED, _HEADER), b')'])
+        assert 7 in parsed
+        assert parsed[7]['BODY[HEADER.FIELDS (FROM SUBJECT DATE)]'] == _HEADER
+        assert isinstance(parsed[7]['BODYSTRUCTURE'], list)
+
+
+class TestAttachmentParts:
+    def test_rfc2231_filename_and_part_number(self):
+        bs = parse_fetch_response([(_MIXED, _HEADER), b')'])[7]['BODYSTRUCTURE']
+        parts = attachment_parts(bs)
+        assert parts == [{'part': '2', 'filename': '請求.pdf', 'encoding': 'base64', 'size': 1234}]
+
+    def test_plain_message_has_no_attachment(self):
+        bs = parse_fetch_response([(_PLAIN, b'\r\n\r\n'), b')'])[8]['BODYSTRUCTURE']
+        assert attachment_parts(bs) == []
+
+
+class TestIterMessages:
+    def test_batched_fetch_without_bodies(self):
+        conn = _FakeConn()
+        msgs = list(iter_messages(conn, [7, 8]))
+        # BODYSTRUCTURE は1回のFETCHでまとめて取得し、本文は取得しない
+        assert len(conn.calls) == 1
+        assert conn.calls[0][1] == '7,8'
+        assert msgs[0]['from'] == 'foo@example.com'
+        assert msgs[0]['subject'] == 'テスト'
+        assert msgs[1]['attachments'] == []
+
+    def test_fetch_single_attachment(self):
+        conn = _FakeConn()
+        part = {'part': '2', 'filename': 'a.pdf', 'encoding': 'base64', 'size': 8}
+        assert fetch_attachment(conn, 7, part) == b'hello'
+        assert 'BODY.PEEK[2]' in conn.calls[0][2]
+
+    def test_failed_batch_raises_before_yielding(self):
+        class _NoConn(_FakeConn):
+            def uid(self, command, uids, items):
+                return 'NO', [b'server error']
+
+        it = iter_messages(_NoConn(), [7, 8])
+        with pytest.raises(ImapFetchError):
+            next(it)
+
+    def test_missing_uid_is_refetched_singly(self):
+        conn = _PartialConn(('OK', [(_PLAIN, b'\r\n\r\n'), b')']))
+        msgs = list(iter_messages(conn, [7, 8]))
+        assert [c[1] for c in conn.calls] == ['7,8', '8']
+        assert [m['uid'] for m in msgs] == [7, 8]
+
+    def test_missing_uid_stops_iteration(self):
+        # 取り直しても得られないUIDは返さず、手前のUIDまでで止める
+        conn = _PartialConn(('OK', [None]))
+        it = iter_messages(conn, [7, 8])
+        assert next(it)['uid'] == 7
+        with pytest.raises(ImapFetchError):
+            next(it)
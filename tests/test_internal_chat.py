@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+社内チャット（internal_chat.py の既読カーソル / auto_migrations.py の既読移行）の結合テスト
+
+一時ディレクトリの SQLite に社内チャットのテーブルを作り、app.db などを差し替えて
+internal_chat.py を直接ロードする。未読数に自分の送信分が入らないこと・
+既読カーソルが後退しないこと・1対1ルームの表示名・旧既読テーブルからの移行を検証する。
+"""
+import sys
+import os
+import types
+import importlib.util
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('sqlalchemy')
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker, declarative_base  # noqa: E402
+
+_APP = os.path.join(os.path.dirname(__file__), '..', 'app')
+
+ALICE, BOB, CAROL = (1, 'admin', 'Alice'), (2, 'employee', 'Bob'), (3, 'admin', 'Carol')
+
+
+def _load(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='module')
+def chat(tmp_path_factory):
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('chat') / 'chat.db'}", future=True)
+    fake_db = types.ModuleType('app.db')
+    fake_db.Base = declarative_base()
+    fake_db.engine = engine
+    fake_db.SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+    decorators = types.ModuleType('app.utils.decorators')
+    decorators.ROLES = MagicMock()
+    decorators.require_roles = lambda *roles: (lambda f: f)
+    storage = types.ModuleType('app.utils.tenant_storage_adapter')
+    storage.get_storage_adapter = storage.get_tenant_storage_config = MagicMock()
+    services = types.ModuleType('app.services')
+    services.chat_push = MagicMock()
+    with pytest.MonkeyPatch.context() as mp:
+        if 'app' not in sys.modules:
+            mp.setitem(sys.modules, 'app', MagicMock())
+        mp.setitem(sys.modules, 'app.db', fake_db)
+        mp.setitem(sys.modules, 'app.utils', types.ModuleType('app.utils'))
+        mp.setitem(sys.modules, 'app.utils.decorators', decorators)
+        mp.setitem(sys.modules, 'app.utils.tenant_storage_adapter', storage)
+        mp.setitem(sys.modules, 'app.services', services)
+        models = _load('app.models_login', os.path.join(_APP, 'models_login.py'))
+        mp.setitem(sys.modules, 'app.models_login', models)
+        module = _load('internal_chat_under_test', os.path.join(_APP, 'blueprints', 'internal_chat.py'))
+        module.models = models
+        module.migrations = _load('auto_migrations_under_test', os.path.join(_APP, 'auto_migrations.py'))
+        fake_db.Base.metadata.create_all(engine, tables=[
+            models.TInternalChatRoom.__table__, models.TInternalChatMember.__table__,
+            models.TInternalMessage.__table__, models.TInternalMessageRead.__table__,
+        ])
+        yield module
+    engine.dispose()
+
+
+@pytest.fixture
+def rooms(chat):
+    """
+    ルーム 1（1対1: Alice / Bob）: Alice m1, Bob m2, Bob m3, Alice m4
+    ルーム 2（グループ: Alice / Bob / Carol）: Carol m5
+    既読カーソルは全員未設定。戻り値はメッセージID
+    """
+    db = chat.SessionLocal()
+    try:
+        for model in (chat.models.TInternalMessageRead, chat.models.TInternalMessage, chat.models.TInternalChatMember,
+                      chat.models.TInternalChatRoom):
+            db.query(model).delete()
+        db.add_all([
+            chat.models.TInternalChatRoom(id=1, tenant_id=7, room_type='direct'),
+            chat.models.TInternalChatRoom(id=2, tenant_id=7, room_type='group', name='kitchen'),
+        ])
+        for room_id, members in ((1, (ALICE, BOB)), (2, (ALICE, BOB, CAROL))):
+            db.add_all([chat.models.TInternalChatMember(room_id=room_id, staff_id=sid, staff_type=stype, staff_name=name)
+                        for sid, stype, name in members])
+        ids = {}
+        for key, room_id, (sid, stype, name) in (('m1', 1, ALICE), ('m2', 1, BOB), ('m3', 1, BOB),
+                                                  ('m4', 1, ALICE), ('m5', 2, CAROL)):
+            msg = chat.models.TInternalMessage(room_id=room_id, sender_id=sid, sender_type=stype,
+                                        sender_name=name, message=key)
+            db.add(msg)
+            db.flush()
+            ids[key] = msg.id
+        db.commit()
+        return ids
+    finally:
+        db.close()
+
+
+def _summaries(chat, staff):
+    db = chat.SessionLocal()
+    try:
+        return {r.id: r for r in chat._room_summaries(db, 7, staff[0], staff[1])}
+    finally:
+        db.close()
+
+
+def _mark(chat, room_id, staff, message_id):
+    db = chat.SessionLocal()
+    try:
+        advanced = chat._mark_read(db, room_id, staff[0], staff[1], message_id)
+        db.commit()
+        return advanced
+    finally:
+        db.close()
+
+
+def _cursor(chat, room_id, staff):
+    db = chat.SessionLocal()
+    try:
+        return db.query(chat.models.TInternalChatMember.last_read_message_id).filter_by(
+            room_id=room_id, staff_id=staff[0], staff_type=staff[1]).scalar()
+    finally:
+        db.close()
+
+
+class TestRoomSummaries:
+    def test_unread_excludes_own_messages(self, chat, rooms):
+        assert _summaries(chat, ALICE)[1].unread_count == 2   # Bob の m2, m3
+        assert _summaries(chat, BOB)[1].unread_count == 2     # Alice の m1, m4
+        assert _summaries(chat, CAROL)[2].unread_count == 0   # 自分の m5 だけ
+
+        _mark(chat, 1, ALICE, rooms['m3'])
+        alice = _summaries(chat, ALICE)
+        assert alice[1].unread_count == 0 and alice[2].unread_count == 1
+        assert alice[1].last_message.id == rooms['m4']
+
+    def test_direct_room_shows_other_member_name(self, chat, rooms):
+        assert _summaries(chat, ALICE)[1].display_name == 'Bob'
+        assert _summaries(chat, BOB)[1].display_name == 'Alice'
+        group = _summaries(chat, BOB)[2]
+        assert group.display_name == 'kitchen' and group.member_names == ['Alice', 'Carol']
+
+    def test_only_member_rooms_are_listed(self, chat, rooms):
+        assert set(_summaries(chat, CAROL)) == {2}
+
+
+class TestMarkRead:
+    def test_cursor_never_moves_backwards(self, chat, rooms):
+        assert _mark(chat, 1, BOB, rooms['m4']) is True
+        assert _mark(chat, 1, BOB, rooms['m1']) is False
+        assert _mark(chat, 1, BOB, rooms['m4']) is False
+        assert _cursor(chat, 1, BOB) == rooms['m4']
+        assert _mark(chat, 1, BOB, None) is False
+
+    def test_cursor_is_per_member(self, chat, rooms):
+        _mark(chat, 1, BOB, rooms['m4'])
+        assert _cursor(chat, 1, ALICE) is None
+        assert _cursor(chat, 2, BOB) is None
+
+
+class TestReadCursorMigration:
+    def test_backfill_takes_max_read_id_per_room_and_staff(self, chat, rooms):
+        db = chat.SessionLocal()
+        try:
+            db.add_all([
+                chat.models.TInternalMessageRead(message_id=rooms[key], staff_id=staff[0], staff_type=staff[1])
+                for key, staff in (('m3', ALICE), ('m2', ALICE), ('m5', ALICE), ('m1', BOB),
+                                   ('m4', (BOB[0], 'admin', 'not Bob')))
+            ])
+            db.commit()
+            chat.migrations.backfill_internal_chat_read_cursor(db, 'sqlite')
+            db.commit()
+        finally:
+            db.close()
+        assert _cursor(chat, 1, ALICE) == rooms['m3']
+        assert _cursor(chat, 2, ALICE) == rooms['m5']
+        assert _cursor(chat, 1, BOB) == rooms['m1']   # staff_type が違う既読行は混ぜない
+        assert _cursor(chat, 2, BOB) is None
+        assert _summaries(chat, ALICE)[1].unread_count == 0
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+ocr_cache.py のユニットテスト
+
+内容が同じファイルは名前が違ってもキャッシュが効くこと・条件（版数・列定義）が
+変わると別キーになること・エラー結果を保存しないこと・強制取り直し・
+実際に処理した方式のキーで保存すること・サイズ上限での追い出しを検証する。
+"""
+import sys
+import os
+
+import pytest
+
+# パスを追加してモジュールを直接インポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app', 'utils'))
+import ocr_cache  # noqa: E402
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    d = tmp_path / 'cache'
+    monkeypatch.setenv('OCR_CACHE_DIR', str(d))
+    monkeypatch.setenv('OCR_CACHE_ENABLED', '1')
+    monkeypatch.setitem(ocr_cache._size, 'bytes', None)
+    return d
+
+
+def _write(path, data: bytes):
+    path.write_bytes(data)
+    return str(path)
+
+
+class TestCached:
+    def test_same_content_different_name_hits(self, cache_dir, tmp_path):
+        a = _write(tmp_path / 'a.jpg', b'scan-bytes')
+        b = _write(tmp_path / 'b_1.jpg', b'scan-bytes')
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {'transactions': [{'amount': 100}]}
+
+        first = ocr_cache.cached('bank', a, 1, {'column_def': None}, compute)
+        second = ocr_cache.cached('bank', b, 1, {'column_def': None}, compute)
+        assert len(calls) == 1
+        assert first == second
+
+    def test_version_and_params_change_key(self, cache_dir, tmp_path):
+        a = _write(tmp_path / 'a.jpg', b'scan-bytes')
+        assert ocr_cache.make_key('bank', a, 1, {'c': 1}) != ocr_cache.make_key('bank', a, 2, {'c': 1})
+        assert ocr_cache.make_key('bank', a, 1, {'c': 1}) != ocr_cache.make_key('bank', a, 1, {'c': 2})
+        assert ocr_cache.make_key('bank', a, 1, None) != ocr_cache.make_key('credit', a, 1, None)
+
+    def test_error_result_not_stored(self, cache_dir, tmp_path):
+        a = _write(tmp_path / 'a.jpg', b'scan-bytes')
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {'transactions': [], '_error': 'timeout'}
+
+        for _ in range(2):
+            ocr_cache.cached('bank', a, 1, None, compute, cacheable=lambda r: not r.get('_error'))
+        assert len(calls) == 2
+
+
+    def test_refresh_recomputes_and_overwrites(self, cache_dir, tmp_path):
+        a = _write(tmp_path / 'a.jpg', b'scan-bytes')
+        values = iter([{'v': 1}, {'v': 2}])
+        ocr_cache.cached('bank', a, 1, None, lambda: next(values))
+        assert ocr_cache.cached('bank', a, 1, None, lambda: next(values), refresh=True) == {'v': 2}
+        assert ocr_cache.cached('bank', a, 1, None, lambda: {'v': 3}) == {'v': 2}
+
+    def test_result_stored_under_engine_that_produced_it(self, cache_dir, tmp_path):
+        a = _write(tmp_path / 'a.jpg', b'scan-bytes')
+        calls = []
+
+        def compute():
+            calls.append(1)
+            # azure を試したが失敗し、vision にフォールバックした結果
+            return {'transactions': [{'amount': 1}], '_engine': 'vision'}
+
+        def store(r):
+            return {'engine': r['_engine']}
+
+        for _ in range(2):
+            ocr_cache.cached('bank', a, 1, {'engine': 'azure'}, compute, store_params=store)
+        assert len(calls) == 2
+        hit = ocr_cache.cached('bank', a, 1, {'engine': 'vision'}, compute, store_params=store)
+        assert len(calls) == 2 and hit['_engine'] == 'vision'
+
+
+class TestEviction:
+    def test_oldest_entries_evicted_over_limit(self, cache_dir, monkeypatch):
+        monkeypatch.setenv('OCR_CACHE_MAX_MB', '1')
+        blob = 'x' * (300 * 1024)
+        keys = [f'{i:02d}' + 'a' * 62 for i in range(5)]
+        for i, key in enumerate(keys):
+            ocr_cache.put(key, {'raw_text': blob})
+            # mtime を明示的にずらして利用順を固定する
+            os.utime(ocr_cache._entry_path(key), (1000 + i, 1000 + i))
+        ocr_cache._size['bytes'] = None
+        ocr_cache._evict_if_needed()
+        remaining = [k for k in keys if os.path.exists(ocr_cache._entry_path(k))]
+        assert remaining == keys[-len(remaining):]
+        assert sum(os.path.getsize(ocr_cache._entry_path(k)) for k in remaining) <= 1024 * 1024
+
+
+class TestCacheDir:
+    def test_default_dir_is_anchored_to_app_root(self, monkeypatch, tmp_path):
+        monkeypatch.delenv('OCR_CACHE_DIR', raising=False)
+        monkeypatch.chdir(tmp_path)
+        root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        assert ocr_cache._cache_dir() == os.path.join(root, 'uploads', 'ocr_cache')
+
+    def test_env_overrides_default(self, monkeypatch, tmp_path):
+        monkeypatch.setenv('OCR_CACHE_DIR', str(tmp_path))
+        assert ocr_cache._cache_dir() == str(tmp_path)
@@ -0,0 +1,691 @@
+# -*- coding: utf-8 -*-
+"""
+pos_app.py（POS ブループリント）の結合テスト
+
+一時ディレクトリの SQLite にテーブルを作り、pos_app を直接ロードして検証する。
+本番 DB に触れないよう、ロード中だけ DATABASE_URL を差し替える。
+"""
+import sys
+import os
+import types
+import importlib.util
+from datetime import datetime
+
+import pytest
+
+flask = pytest.importorskip('flask')
+pytest.importorskip('sqlalchemy')
+
+from sqlalchemy import func, select  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def pos(tmp_path_factory):
+    db_path = tmp_path_factory.mktemp('pos') / 'pos.db'
+    saved = {k: os.environ.get(k) for k in ('DATABASE_URL', 'MULTI_TENANT_MODE')}
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['MULTI_TENANT_MODE'] = 'shared'
+    try:
+        path = os.path.join(os.path.dirname(__file__), '..', 'app', 'blueprints', 'pos_app.py')
+        spec = importlib.util.spec_from_file_location('pos_app_under_test', path)
+        module = importlib.util.module_from_spec(spec)
+        with flask.Flask(__name__).app_context():
+            spec.loader.exec_module(module)
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+    module.Base.metadata.create_all(module.engine)
+    yield module
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    for name, fn in list(vars(module).items()):
+        for ident in ('do_orm_execute', 'before_flush', 'after_flush', 'before_commit', 'after_commit', 'after_rollback'):
+            if callable(fn) and event.contains(Session, ident, fn):
+                event.remove(Session, ident, fn)
+    module.engine.dispose()
+
+
+@pytest.fixture
+def app(pos):
+    app = flask.Flask(__name__)
+    app.secret_key = 'test'
+    return app
+
+
+@pytest.fixture(scope='module')
+def two_tenants(pos):
+    """テナント 1 に店舗 1 件、テナント 2 に店舗 2 件"""
+    with flask.Flask(__name__).test_request_context('/'):
+        s = pos.SessionLocal()
+        try:
+            s.add_all([
+                pos.Store(id=101, tenant_id=1, code='t1-a', name='t1-a'),
+                pos.Store(id=201, tenant_id=2, code='t2-a', name='t2-a'),
+                pos.Store(id=202, tenant_id=2, code='t2-b', name='t2-b'),
+            ])
+            s.commit()
+        finally:
+            s.close()
+            pos.SessionLocal.remove()
+
+
+class TestTenantFilter:
+    def _session(self, pos, app, tenant_id):
+        ctx = app.test_request_context('/')
+        ctx.push()
+        flask.g.tenant_id = tenant_id
+        return ctx, pos.SessionLocal()
+
+    def _close(self, pos, ctx, s):
+        s.close()
+        pos.SessionLocal.remove()
+        ctx.pop()
+
+    def test_query_count_is_scoped(self, pos, app, two_tenants):
+        ctx, s = self._session(pos, app, 1)
+        try:
+            assert s.query(pos.Store).count() == 1
+            assert s.query(pos.Store.id).distinct().count() == 1
+        finally:
+            self._close(pos, ctx, s)
+
+    def test_select_from_aggregate_is_scoped(self, pos, app, two_tenants):
+        ctx, s = self._session(pos, app, 2)
+        try:
+            assert s.execute(select(func.count()).select_from(pos.Store)).scalar() == 2
+            assert s.scalar(select(func.max(pos.Store.id))) == 202
+        finally:
+            self._close(pos, ctx, s)
+
+    def test_entity_query_is_scoped(self, pos, app, two_tenants):
+        ctx, s = self._session(pos, app, 1)
+        try:
+            assert [st.id for st in s.query(pos.Store).all()] == [101]
+        finally:
+            self._close(pos, ctx, s)
+
+
+class _RecordingBus:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, channel):
+        self.published.append(channel)
+
+    def version(self, channel):
+        return self.published.count(channel)
+
+
+@pytest.fixture(scope='module', autouse=True)
+def _fake_change_bus():
+    """pos_app が遅延 import する change_bus を記録用に差し替える（全テスト共通）"""
+    import types
+    recorder = _RecordingBus()
+    module = types.ModuleType('app.services.change_bus')
+    module.get_change_bus = lambda: recorder
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setitem(sys.modules, 'app.services.change_bus', module)
+        yield recorder
+
+
+@pytest.fixture
+def bus(_fake_change_bus):
+    _fake_change_bus.published.clear()
+    return _fake_change_bus
+
+
+class TestGuestOrder:
+    def _seed(self, pos):
+        with flask.Flask(__name__).test_request_context('/'):
+            s = pos.SessionLocal()
+            try:
+                s.add(pos.Store(id=301, tenant_id=3, code='guest', name='guest'))
+                s.add(pos.TableSeat(id=31, tenant_id=3, store_id=301, table_no='A1', status='空席'))
+                s.add(pos.Menu(id=31, tenant_id=3, store_id=301, name='ramen', price=800))
+                token = f"31.guest.{pos.sign_payload('31.guest')}"
+                s.add(pos.QrToken(tenant_id=3, store_id=301, table_id=31, token=token))
+                s.commit()
+            finally:
+                s.close()
+                pos.SessionLocal.remove()
+        return token
+
+    def test_guest_order_notifies_table_store(self, pos, app, bus, monkeypatch):
+        token = self._seed(pos)
+        monkeypatch.setattr(pos, '_trigger_kds_print', lambda *a, **k: None)
+        body = {'token': token, 'items': [{'menu_id': 31, 'qty': 2}]}
+        # QR 側のセッションには store_id / tenant_id が無い
+        with app.test_request_context('/apps/pos/api/order', method='POST', json=body):
+            resp = pos.api_order()
+            assert flask.session.get('store_id') is None
+        assert resp.get_json()['ok'] is True
+        floor = [c for c in bus.published if c.startswith('floor:')]
+        assert floor == ['floor:301']
+
+
+@pytest.fixture(scope='module')
+def kds_store(pos):
+    """store 401: 親カテゴリ 41 → 子カテゴリ 42。ルールはメニュー 43 → プリンタ 2、カテゴリ 41 → プリンタ 1"""
+    with flask.Flask(__name__).test_request_context('/'):
+        s = pos.SessionLocal()
+        try:
+            s.add(pos.Store(id=401, tenant_id=4, code='kds', name='kds'))
+            s.add(pos.TableSeat(id=41, tenant_id=4, store_id=401, table_no='K1', status='着席'))
+            s.add_all([pos.Menu(id=mid, tenant_id=4, store_id=401, name=f'm{mid}', price=500)
+                       for mid in (41, 42, 43, 44)])
+            s.flush()
+            s.add(pos.Category(id=41, tenant_id=4, store_id=401, name='food'))
+            s.add(pos.Category(id=42, tenant_id=4, store_id=401, parent_id=41, name='noodle'))
+            s.add_all([
+                pos.Printer(id=1, tenant_id=4, store_id=401, name='kitchen', kind='escpos_tcp',
+                            connection='tcp://10.0.0.1:9100'),
+                pos.Printer(id=2, tenant_id=4, store_id=401, name='bar', kind='escpos_tcp',
+                            connection='tcp://10.0.0.2:9100'),
+            ])
+            s.flush()
+            s.add_all([
+                pos.ProductCategoryLink(tenant_id=4, store_id=401, product_id=41, category_id=41),
+                pos.ProductCategoryLink(tenant_id=4, store_id=401, product_id=42, category_id=42),
+                pos.ProductCategoryLink(tenant_id=4, store_id=401, product_id=43, category_id=42),
+                pos.PrintRule(id=1, tenant_id=4, store_id=401, menu_id=43, printer_id=2),
+                pos.PrintRule(id=2, tenant_id=4, store_id=401, category_id=41, printer_id=1),
+                pos.OrderHeader(id=41, tenant_id=4, store_id=401, table_id=41, status='新規'),
+            ])
+            s.flush()
+            s.add_all([pos.OrderItem(id=400 + mid, tenant_id=4, store_id=401, order_id=41, menu_id=mid,
+                                     qty=1, unit_price=500, tax_rate=0.10, status='新規',
+                                     added_at=datetime.now())
+                       for mid in (41, 42, 43, 44)])
+            s.commit()
+        finally:
+            s.close()
+            pos.SessionLocal.remove()
+
+
+class TestKdsPrintRoutes:
+    def test_first_matching_rule_per_item_without_per_item_queries(self, pos, app, bus, kds_store):
+        from sqlalchemy import event
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with app.test_request_context('/'):
+            flask.g.tenant_id = 4
+            s = pos.SessionLocal()
+            try:
+                routes = pos.get_print_routes(s, 401)
+                # 直接所属・子孫カテゴリはカテゴリ 41 のルール、メニュー指定が先のルールなら優先、無所属は対象外
+                assert [routes.kds_printer_id(m) for m in (41, 42, 43, 44)] == [1, 1, 2, None]
+
+                items = s.query(pos.OrderItem).filter(pos.OrderItem.order_id == 41).order_by(pos.OrderItem.id).all()
+                event.listen(pos.engine, 'before_cursor_execute', record)
+                try:
+                    tickets = pos._build_print_tickets(s, 41, items)
+                finally:
+                    event.remove(pos.engine, 'before_cursor_execute', record)
+            finally:
+                s.close()
+                pos.SessionLocal.remove()
+
+        assert sorted((p.id, [i.id for i in its]) for p, its, _ in tickets) == [(1, [441, 442]), (2, [443])]
+        assert not [q for q in statements if 'T_印刷ルール' in q or 'T_商品カテゴリ付与' in q]
+
+
+class TestPrintQueue:
+    """/api/order の KDS 印刷が印刷キュー経由でワーカーから送信されること"""
+
+    def _jobs(self, pos, order_id):
+        with pos.engine.connect() as conn:
+            return conn.execute(pos.text(
+                'SELECT kind, "プリンタID", status, dedupe_key FROM "T_印刷ジョブ" '
+                'WHERE "注文ID" = :id ORDER BY id'), {'id': order_id}).all()
+
+    def _wait_done(self, pos, order_id, n_jobs, timeout=10):
+        import time
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            jobs = self._jobs(pos, order_id)
+            if len(jobs) >= n_jobs and all(j.status == 'done' for j in jobs):
+                return jobs
+            time.sleep(0.05)
+        raise AssertionError(self._jobs(pos, order_id))
+
+    def test_kds_print_goes_through_queue_and_allows_reprint(self, pos, app, bus, kds_store, monkeypatch, tmp_path):
+        printed = []
+        monkeypatch.setattr(pos, 'print_escpos_tcp', lambda text, conn: printed.append(conn))
+        monkeypatch.setattr(pos, 'PRINT_DIR', str(tmp_path))
+
+        with app.test_request_context('/'):
+            flask.g.tenant_id = 4
+            flask.session['tenant_id'] = 4
+            s = pos.SessionLocal()
+            try:
+                items = s.query(pos.OrderItem).filter(pos.OrderItem.order_id == 41).order_by(pos.OrderItem.id).all()
+                pos._trigger_kds_print(s, 41, items)
+                # 同じ明細の二重登録は処理待ちの間は無視される
+                assert pos.enqueue_print_job(41, [441, 442, 443]) is False
+            finally:
+                s.close()
+                pos.SessionLocal.remove()
+
+        jobs = self._wait_done(pos, 41, 3)
+        assert [(j.kind, j.プリンタID) for j in jobs] == [('order', 0), ('ticket', 1), ('ticket', 2)]
+        assert sorted(printed) == ['tcp://10.0.0.1:9100', 'tcp://10.0.0.2:9100']
+
+        # 完了後は同じ明細を再印刷できる
+        with app.test_request_context('/'):
+            flask.g.tenant_id = 4
+            assert pos.enqueue_print_job(41, [441, 442, 443]) is True
+        self._wait_done(pos, 41, 6)
+        assert len(printed) == 4
+
+
+    def test_prune_removes_old_finished_jobs(self, pos, app, monkeypatch):
+        with app.test_request_context('/'):
+            worker = pos._get_print_worker()
+        with pos.engine.begin() as conn:
+            conn.execute(pos.text(
+                'INSERT INTO "T_印刷ジョブ" ("注文ID", kind, dedupe_key, status, created_at, updated_at) '
+                "VALUES (99, 'ticket', 'old-done', 'done', '2000-01-01 00:00:00', '2000-01-01 00:00:00'), "
+                "       (99, 'ticket', 'old-pending', 'pending', '2000-01-01 00:00:00', '2000-01-01 00:00:00')"))
+        worker._prune()
+        with pos.engine.connect() as conn:
+            left = conn.execute(pos.text('SELECT dedupe_key FROM "T_印刷ジョブ" WHERE "注文ID" = 99')).scalars().all()
+            conn.execute(pos.text('DELETE FROM "T_印刷ジョブ" WHERE "注文ID" = 99'))
+            conn.commit()
+        assert left == ['old-pending']
+
+    def test_worker_started_once_at_registration(self, pos, app, monkeypatch):
+        calls = []
+
+        def broken():
+            calls.append(1)
+            raise RuntimeError('db down')
+
+        monkeypatch.setattr(pos, '_get_print_worker', broken)
+        # 起動に失敗してもアプリの登録は止めない（リクエストごとの再試行もしない）
+        pos._start_print_worker_on_startup(types.SimpleNamespace(app=app))
+        assert calls == [1]
+        # リクエストのたびに起動を試みるアプリ全体のフックは持たない
+        assert not any(f.__module__ == pos.__name__
+                       for funcs in pos.bp.before_request_funcs.values() for f in funcs
+                       if 'print_worker' in f.__name__)
+
+
+
+@pytest.fixture(scope='module')
+def printer_store(pos):
+    with flask.Flask(__name__).test_request_context('/'):
+        s = pos.SessionLocal()
+        try:
+            s.add(pos.Store(id=501, tenant_id=5, code='ps', name='ps', printer_server_api_key='old-key'))
+            s.commit()
+        finally:
+            s.close()
+            pos.SessionLocal.remove()
+
+
+class TestPrinterServerApi:
+    def test_key_change_on_another_worker_invalidates_cache(self, pos, app, bus, printer_store):
+        with app.test_request_context('/'):
+            assert pos._get_printer_api_key(501) == (True, 'old-key')
+            with pos.engine.begin() as conn:
+                conn.execute(pos.text('UPDATE "M_店舗" SET "プリンターサーバーAPIキー" = \'new-key\' WHERE id = 501'))
+            assert pos._get_printer_api_key(501) == (True, 'old-key')  # TTL 内はキャッシュ
+            # 別ワーカーの invalidate_printer_api_key（このプロセスのキャッシュは触らず版数だけ進む）
+            bus.publish('printer_api_key:501')
+            assert pos._get_printer_api_key(501) == (True, 'new-key')
+            with pos.engine.begin() as conn:
+                conn.execute(pos.text('UPDATE "M_店舗" SET "プリンターサーバーAPIキー" = \'old-key\' WHERE id = 501'))
+            bus.publish('printer_api_key:501')
+
+    def test_long_poll_is_opt_in(self, pos, app, bus, printer_store):
+        import time
+        assert pos.PRINTER_SERVER_LONGPOLL_MAX_SEC == 0
+        with app.test_request_context('/apps/pos/api/printer-server/new-orders', query_string={
+                'store_id': 501, 'api_key': 'old-key', 'print_type': 'kitchen', 'wait': 20}):
+            started = time.monotonic()
+            resp = pos.api_printer_server_new_orders()
+            assert time.monotonic() - started < 2
+        assert resp.get_json() == {'ok': True, 'items': [], 'cursor': 0}
+
+
+# --- 売上集計（T_売上集計） -------------------------------------------------------
+SALES_STORE = 601
+SALES_RANGE = ('2025-03-01', '2025-04-30')
+
+
+@pytest.fixture(scope='module')
+def sales_store(pos):
+    """
+    store 601（テナント 6）:
+      伝票 61 … 3/1 会計。取消ラベルの明細を含む。人数は履歴の最新（3 人）
+      伝票 62 … 3/2 会計・売上計上日 3/1（過去日付モード）。人数は現在値（2 人）
+      伝票 63 … 4/10 会計。人数の記録なし（1 人扱い）
+      伝票 64 … 未会計（集計しない）
+    """
+    with flask.Flask(__name__).test_request_context('/'):
+        flask.g.tenant_id = 6
+        s = pos.SessionLocal()
+        try:
+            s.add(pos.Store(id=SALES_STORE, tenant_id=6, code='sales', name='sales'))
+            s.add(pos.TableSeat(id=61, tenant_id=6, store_id=SALES_STORE, table_no='S1', status='空席'))
+            s.add_all([
+                pos.Menu(id=61, tenant_id=6, store_id=SALES_STORE, name='ramen', price=1000),
+                pos.Menu(id=62, tenant_id=6, store_id=SALES_STORE, name='gyoza', price=500, tax_rate=0.08),
+            ])
+            s.flush()
+            s.add_all([
+                pos.OrderHeader(id=61, tenant_id=6, store_id=SALES_STORE, table_id=61, status='会計済',
+                                subtotal=2500, tax=240, total=2740, closed_at='2025-03-01 12:30:00'),
+                pos.OrderHeader(id=62, tenant_id=6, store_id=SALES_STORE, table_id=61, status='会計済',
+                                subtotal=1500, tax=120, total=1620, closed_at='2025-03-02 19:00:00'),
+                pos.OrderHeader(id=63, tenant_id=6, store_id=SALES_STORE, table_id=61, status='会計済',
+                                subtotal=1000, tax=100, total=1100, closed_at='2025-04-10 20:15:00'),
+                pos.OrderHeader(id=64, tenant_id=6, store_id=SALES_STORE, table_id=61, status='新規'),
+            ])
+            s.flush()
+
+            def item(iid, oid, mid, qty, price, rate, status='提供済', scheduled=None):
+                return pos.OrderItem(id=iid, tenant_id=6, store_id=SALES_STORE, order_id=oid, menu_id=mid,
+                                     qty=qty, unit_price=price, tax_rate=rate, status=status,
+                                     added_at=datetime(2025, 3, 1, 12), scheduled_date=scheduled)
+
+            s.add_all([
+                item(611, 61, 61, 2, 1000, 0.10),
+                item(612, 61, 62, 1, 500, 0.08),
+                item(613, 61, 61, 1, 1000, 0.10, status='取消'),
+                item(621, 62, 62, 3, 500, 0.08, scheduled=datetime(2025, 3, 1)),
+                item(631, 63, 61, 1, 1000, 0.10),
+                item(641, 64, 61, 5, 1000, 0.10),
+            ])
+            s.add_all([
+                pos.T_お客様詳細履歴(order_id=61, store_id=SALES_STORE, 合計人数=2, version=1,
+                                 created_at=datetime(2025, 3, 1, 12, 0)),
+                pos.T_お客様詳細履歴(order_id=61, store_id=SALES_STORE, 合計人数=3, version=2,
+                                 created_at=datetime(2025, 3, 1, 12, 30)),
+                pos.T_お客様詳細(order_id=62, store_id=SALES_STORE, 大人男性=1, 大人女性=1),
+            ])
+            s.commit()
+        finally:
+            s.close()
+            pos.SessionLocal.remove()
+
+
+def _legacy_daily(pos, s, start, end):
+    """集計テーブル導入前の /api/sales/daily（会計日で絞り、売上計上日優先で日付を決める）"""
+    from collections import defaultdict
+    orders = s.query(pos.OrderHeader).filter(
+        pos.OrderHeader.store_id == SALES_STORE, pos.OrderHeader.status == '会計済',
+        pos.OrderHeader.closed_at >= start, pos.OrderHeader.closed_at <= pos._end_of_day(end)).all()
+    daily = defaultdict(lambda: {'order_count': 0, 'subtotal': 0, 'tax_amount': 0, 'total_sales': 0, 'guests': 0})
+    for o in orders:
+        items = s.query(pos.OrderItem).filter(pos.OrderItem.order_id == o.id).all()
+        scheduled = next((it.scheduled_date for it in items if it.scheduled_date), None)
+        day = str(scheduled or o.closed_at)[:10]
+        totals = pos._calculate_order_totals(items)
+        d = daily[day]
+        d['order_count'] += 1
+        d['subtotal'] += totals['subtotal']
+        d['tax_amount'] += totals['tax']
+        d['total_sales'] += totals['total']
+        hist = s.query(pos.T_お客様詳細履歴).filter_by(order_id=o.id).order_by(pos.T_お客様詳細履歴.created_at.desc()).first()
+        cur = s.query(pos.T_お客様詳細).filter_by(order_id=o.id).first()
+        if hist is not None:
+            d['guests'] += hist.合計人数 or 1
+        elif cur is not None:
+            d['guests'] += (cur.大人男性 + cur.大人女性 + cur.子ども男 + cur.子ども女) or 1
+        else:
+            d['guests'] += 1
+    return [{'date': k, **v, 'avg_sales_per_guest': v['total_sales'] // v['guests']}
+            for k, v in sorted(daily.items())]
+
+
+def _legacy_monthly(pos, s, year):
+    from collections import defaultdict
+    monthly = defaultdict(lambda: {'order_count': 0, 'total_sales': 0, 'subtotal': 0, 'tax_amount': 0})
+    for o in s.query(pos.OrderHeader).filter(
+            pos.OrderHeader.status == '会計済',
+            pos.OrderHeader.closed_at >= f'{year}-01-01', pos.OrderHeader.closed_at <= f'{year}-12-31 23:59:59'):
+        totals = pos._calculate_order_totals(s.query(pos.OrderItem).filter(pos.OrderItem.order_id == o.id).all())
+        m = monthly[str(o.closed_at)[:7]]
+        m['order_count'] += 1
+        m['total_sales'] += totals['total']
+        m['subtotal'] += totals['subtotal']
+        m['tax_amount'] += totals['tax']
+    return [{'month': k, **v} for k, v in sorted(monthly.items())]
+
+
+def _legacy_products(pos, s, start, end):
+    """集計テーブル導入前の /api/sales/products（メニュー名ごとの数量・税抜・税込）"""
+    import math
+    from collections import defaultdict
+    agg = defaultdict(lambda: {'total_qty': 0, 'total_sales': 0, 'total_sales_incl': 0, 'tax_total': 0})
+    rows = (s.query(pos.OrderItem, pos.Menu)
+             .join(pos.OrderHeader, pos.OrderItem.order_id == pos.OrderHeader.id)
+             .join(pos.Menu, pos.Menu.id == pos.OrderItem.menu_id)
+             .filter(pos.OrderHeader.store_id == SALES_STORE, pos.OrderHeader.status == '会計済',
+                     pos.OrderHeader.closed_at >= start, pos.OrderHeader.closed_at <= pos._end_of_day(end))
+             .all())
+    for it, m in rows:
+        if not it.qty or (it.qty > 0 and '取消' in f'{it.status} {it.memo or ""}'):
+            continue
+        unit_tax = math.floor(it.unit_price * (it.tax_rate or m.tax_rate))
+        a = agg[m.name]
+        a['total_qty'] += it.qty
+        a['total_sales'] += it.unit_price * it.qty
+        a['tax_total'] += unit_tax * it.qty
+        a['total_sales_incl'] += (it.unit_price + unit_tax) * it.qty
+    return dict(agg)
+
+
+class TestSalesRollup:
+    def _request(self, app, **args):
+        ctx = app.test_request_context('/', query_string=args)
+        ctx.push()
+        flask.g.tenant_id = 6
+        flask.session.update(role='admin', tenant_id=6, store_id=SALES_STORE)
+        return ctx
+
+    def _compare(self, pos, app):
+        start, end = SALES_RANGE
+        ctx = self._request(app, start_date=start, end_date=end)
+        try:
+            daily = pos.api_sales_daily().get_json()['data']
+            products = {r['product_name']: {k: r[k] for k in ('total_qty', 'total_sales', 'total_sales_incl', 'tax_total')}
+                        for r in pos.api_sales_products().get_json()['data']}
+            s = pos.SessionLocal()
+            try:
+                assert daily == _legacy_daily(pos, s, start, end)
+                assert products == _legacy_products(pos, s, start, end)
+            finally:
+                s.close()
+                pos.SessionLocal.remove()
+        finally:
+            ctx.pop()
+
+        ctx = self._request(app, year='2025')
+        try:
+            monthly = pos.api_sales_monthly().get_json()['data']
+            s = pos.SessionLocal()
+            try:
+                assert monthly == _legacy_monthly(pos, s, '2025')
+            finally:
+                s.close()
+                pos.SessionLocal.remove()
+        finally:
+            ctx.pop()
+        return daily, monthly, products
+
+    def _marks(self, pos):
+        with pos.engine.connect() as conn:
+            return conn.execute(pos.text(
+                'SELECT day FROM "T_売上集計_再計算" WHERE "店舗ID" = :sid ORDER BY day'),
+                {'sid': SALES_STORE}).scalars().all()
+
+    def test_rollup_matches_live_queries(self, pos, app, sales_store):
+        daily, monthly, products = self._compare(pos, app)
+        assert [(d['date'], d['order_count'], d['total_sales'], d['guests']) for d in daily] == [
+            ('2025-03-01', 2, 4360, 5), ('2025-04-10', 1, 1100, 1)]
+        assert [m['month'] for m in monthly] == ['2025-03', '2025-04']
+        assert products['ramen']['total_qty'] == 3  # 取消の明細は除外
+
+    def test_settlement_edit_marks_day_and_rollup_follows(self, pos, app, sales_store):
+        self._compare(pos, app)
+        assert self._marks(pos) == []
+
+        # 会計後の訂正：4/10 の伝票に明細を追加し、人数も記録する
+        with app.test_request_context('/'):
+            flask.g.tenant_id = 6
+            s = pos.SessionLocal()
+            try:
+                s.add(pos.OrderItem(id=632, tenant_id=6, store_id=SALES_STORE, order_id=63, menu_id=62,
+                                    qty=2, unit_price=500, tax_rate=0.08, status='提供済',
+                                    added_at=datetime(2025, 4, 10, 20)))
+                s.add(pos.T_お客様詳細(order_id=63, store_id=SALES_STORE, 大人男性=2, 大人女性=2))
+                s.commit()
+            finally:
+                s.close()
+                pos.SessionLocal.remove()
+        assert self._marks(pos) == ['2025-04-10']
+
+        daily, monthly, products = self._compare(pos, app)
+        assert daily[-1] == {'date': '2025-04-10', 'order_count': 1, 'subtotal': 2000, 'tax_amount': 180,
+                             'total_sales': 2180, 'guests': 4, 'avg_sales_per_guest': 545}
+        assert products['gyoza']['total_qty'] == 6
+        assert self._marks(pos) == []
+
+    def test_failed_mark_write_does_not_abort_checkout(self, pos, app, sales_store, monkeypatch):
+        def broken(s):
+            s.execute(pos.text('SELECT * FROM "T_存在しない"'))
+
+        monkeypatch.setattr(pos, '_ensure_sales_rollup_tables', broken)
+        with app.test_request_context('/'):
+            flask.g.tenant_id = 6
+            s = pos.SessionLocal()
+            try:
+                s.get(pos.OrderHeader, 64).note = 'edited'
+                s.add(pos.OrderItem(id=642, tenant_id=6, store_id=SALES_STORE, order_id=64, menu_id=61,
+                                    qty=1, unit_price=1000, tax_rate=0.10, status='新規',
+                                    added_at=datetime(2025, 4, 11)))
+                s.commit()
+            finally:
+                s.close()
+                pos.SessionLocal.remove()
+        with pos.engine.connect() as conn:
+            assert conn.execute(pos.text('SELECT COUNT(*) FROM "T_注文明細" WHERE id = 642')).scalar() == 1
+
+    def test_rollup_refresh_leaves_request_session_uncommitted(self, pos, app, sales_store):
+        ctx = self._request(app)
+        try:
+            s = pos.SessionLocal()
+            try:
+                s.get(pos.OrderHeader, 64).note = 'pending'
+                s.flush()
+                pos._sales_rollup_refresh(s, [SALES_STORE], '2025-04-01', '2025-04-30')
+                s.rollback()
+                assert s.get(pos.OrderHeader, 64).note != 'pending'
+            finally:
+                s.close()
+                pos.SessionLocal.remove()
+        finally:
+            ctx.pop()
+
+
+class TestKdsDelta:
+    def _get(self, pos, app, since):
+        with app.test_request_context('/', query_string={'since': since}):
+            flask.g.tenant_id = 4
+            flask.session.update(role='staff', tenant_id=4, store_id=401)
+            return pos.kds_api_get_items().get_json()
+
+    def _settled_cursor(self, pos, app):
+        """フル応答で進捗行が作られた分を読み切り、変化のない状態のカーソルを返す"""
+        cursor = self._get(pos, app, 0)['cursor']
+        cursor = self._get(pos, app, cursor)['cursor']
+        assert self._get(pos, app, cursor)['orders'] == []
+        return cursor
+
+    def _touch(self, pos, app, memo):
+        with app.test_request_context('/'):
+            flask.g.tenant_id = 4
+            s = pos.SessionLocal()
+            try:
+                s.get(pos.OrderItem, 442).memo = memo
+                s.commit()
+            finally:
+                s.close()
+                pos.SessionLocal.remove()
+
+    @pytest.fixture(autouse=True)
+    def _delta_env(self, pos, monkeypatch):
+        pos.migrate_progress_table_fix()
+        # 直近分の含め直しを切り、カーソルより後のログだけを差分にする
+        monkeypatch.setattr(pos, 'KDS_DELTA_OVERLAP_SEC', -3600)
+        monkeypatch.setattr(pos.random, 'random', lambda: 1.0)
+
+    def test_cursor_advances_with_changes(self, pos, app, kds_store):
+        assert self._get(pos, app, 0)['mode'] == 'full'
+        cursor = self._settled_cursor(pos, app)
+
+        self._touch(pos, app, 'no onion')
+        delta = self._get(pos, app, cursor)
+        assert delta['mode'] == 'delta'
+        assert delta['orders'] == [41] and delta['cursor'] > cursor
+        assert {it['id'] for it in delta['items']} >= {441, 442, 443, 444}
+
+        idle = self._get(pos, app, delta['cursor'])
+        assert idle == {'ok': True, 'mode': 'delta', 'cursor': delta['cursor'],
+                        'items': [], 'orders': [], 'removed': []}
+
+    def test_full_response_after_prune(self, pos, app, kds_store, monkeypatch):
+        cursor = self._settled_cursor(pos, app)
+        self._touch(pos, app, 'a')
+        self._touch(pos, app, 'b')
+
+        monkeypatch.setattr(pos, 'KDS_CHANGELOG_RETENTION_HOURS', -1)
+        with app.test_request_context('/'):
+            s = pos.SessionLocal()
+            try:
+                pos._kds_prune_changelog(s)
+            finally:
+                s.close()
+                pos.SessionLocal.remove()
+        # 全件削除済みでも、削除後に記録が増えていても差分では追えない
+        assert self._get(pos, app, cursor)['mode'] == 'full'
+        self._touch(pos, app, 'c')
+        resp = self._get(pos, app, cursor)
+        assert resp['mode'] == 'full' and resp['cursor'] > cursor
+
+    def test_full_response_when_delta_too_large(self, pos, app, kds_store, monkeypatch):
+        cursor = self._settled_cursor(pos, app)
+        self._touch(pos, app, 'd')
+        monkeypatch.setattr(pos, 'KDS_DELTA_MAX_ORDERS', 0)
+        assert self._get(pos, app, cursor)['mode'] == 'full'
+
+    def test_progress_write_appears_in_next_delta(self, pos, app, kds_store):
+        cursor = self._settled_cursor(pos, app)
+        with app.test_request_context('/'):
+            flask.g.tenant_id = 4
+            s = pos.SessionLocal()
+            try:
+                pos.progress_set(s, 443, n=0, c=1)
+                s.commit()
+            finally:
+                s.close()
+                pos.SessionLocal.remove()
+        delta = self._get(pos, app, cursor)
+        assert delta['mode'] == 'delta' and delta['orders'] == [41]
+
+    def test_failed_changelog_write_keeps_the_update(self, pos, app, kds_store, monkeypatch):
+        def broken(s):
+            s.execute(pos.text('SELECT * FROM "T_存在しない"'))
+
+        monkeypatch.setattr(pos, '_ensure_kds_changelog', broken)
+        self._touch(pos, app, 'kept')
+        with pos.engine.connect() as conn:
+            assert conn.execute(pos.text('SELECT "メモ" FROM "T_注文明細" WHERE id = 442')).scalar() == 'kept'
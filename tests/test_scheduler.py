@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+scheduler.py（ジョブのリース）の結合テスト
+
+一時ディレクトリの SQLite に T_スケジューラジョブ などを作り、app.db を差し替えて
+scheduler.py を直接ロードする。リースの取り合い・期限切れの取り直し・
+実行中の延長と延長スレッドの停止・get_state の集計を検証する。
+"""
+import sys
+import os
+import time
+import types
+import threading
+import importlib.util
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker, declarative_base  # noqa: E402
+
+_APP = os.path.join(os.path.dirname(__file__), '..', 'app')
+
+
+def _load(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='module')
+def sched(tmp_path_factory):
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('sched') / 'sched.db'}",
+                           connect_args={'check_same_thread': False}, future=True)
+    fake_db = types.ModuleType('app.db')
+    fake_db.Base = declarative_base()
+    fake_db.SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+    with pytest.MonkeyPatch.context() as mp:
+        if 'app' not in sys.modules:
+            mp.setitem(sys.modules, 'app', MagicMock())
+        mp.setitem(sys.modules, 'app.db', fake_db)
+        models = _load('app.models_integrations', os.path.join(_APP, 'models_integrations.py'))
+        mp.setitem(sys.modules, 'app.models_integrations', models)
+        module = _load('scheduler_under_test', os.path.join(_APP, 'services', 'scheduler.py'))
+        fake_db.Base.metadata.create_all(engine, tables=[
+            models.TSchedulerJob.__table__, models.TSchedulerConfig.__table__,
+            models.TSchedulerState.__table__,
+        ])
+        yield module
+    engine.dispose()
+
+
+@pytest.fixture
+def job(sched):
+    """gmail:1 のジョブ 1 件（実行期限到来・リースなし）"""
+    db = sched.SessionLocal()
+    try:
+        db.query(sched.TSchedulerJob).delete()
+        row = sched.TSchedulerJob(job_key='gmail:1', kind='gmail', tenant_id=1)
+        db.add(row)
+        db.commit()
+        return row.id
+    finally:
+        db.close()
+
+
+def _row(sched, job_id):
+    db = sched.SessionLocal()
+    try:
+        return db.get(sched.TSchedulerJob, job_id)
+    finally:
+        db.close()
+
+
+def _claim(sched, owner, **kw):
+    db = sched.SessionLocal()
+    try:
+        return sched._claim_job(db, owner, ('gmail',), **kw)
+    finally:
+        db.close()
+
+
+class TestClaim:
+    def test_only_one_owner_wins(self, sched, job):
+        barrier = threading.Barrier(6)
+        results = {}
+
+        def claim(n):
+            barrier.wait()
+            results[n] = _claim(sched, f'w{n}')
+
+        threads = [threading.Thread(target=claim, args=(n,)) for n in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(results) == 6
+        winners = [n for n, r in results.items() if r]
+        assert len(winners) == 1
+        assert results[winners[0]] == (job, 'gmail', 1)
+        assert _row(sched, job).lease_owner == f'w{winners[0]}'
+
+    def test_held_lease_is_not_claimed(self, sched, job):
+        assert _claim(sched, 'a') is not None
+        assert _claim(sched, 'b') is None
+        assert _claim(sched, 'b', force=True) is None  # force でもリース中は取らない
+
+    def test_expired_lease_is_reclaimed(self, sched, job):
+        db = sched.SessionLocal()
+        try:
+            row = db.get(sched.TSchedulerJob, job)
+            row.lease_owner = 'dead-worker'
+            row.lease_until = datetime.utcnow() - timedelta(seconds=1)
+            db.commit()
+        finally:
+            db.close()
+        assert _claim(sched, 'b') == (job, 'gmail', 1)
+        row = _row(sched, job)
+        assert row.lease_owner == 'b' and row.lease_until > datetime.utcnow()
+        # 取り直された後は、元の持ち主は延長できない
+        assert sched._renew_lease(job, 'dead-worker') is False
+
+    def test_not_due_job_is_skipped_unless_forced(self, sched, job):
+        db = sched.SessionLocal()
+        try:
+            db.get(sched.TSchedulerJob, job).next_run_at = datetime.utcnow() + timedelta(minutes=5)
+            db.commit()
+        finally:
+            db.close()
+        assert _claim(sched, 'a') is None
+        assert _claim(sched, 'a', force=True) == (job, 'gmail', 1)
+
+
+class TestRunJobs:
+    def test_lease_renewed_while_running_and_renewal_stops(self, sched, job, monkeypatch):
+        monkeypatch.setattr(sched, 'JOB_LEASE_RENEW_SEC', 0.05)
+        monkeypatch.setattr(sched, '_job_targets', lambda db, kinds: {'gmail': {1}})
+        renewals = []
+        renew = sched._renew_lease
+        monkeypatch.setattr(sched, '_renew_lease',
+                            lambda job_id, owner: renewals.append(owner) or renew(job_id, owner))
+        seen = []
+
+        def run(kind, tenant_id):
+            for _ in range(3):
+                seen.append(_row(sched, job).lease_until)
+                time.sleep(0.12)
+            return {'saved': 2, 'skipped': 1, 'errors': []}
+
+        monkeypatch.setattr(sched, '_run_job', run)
+        summary = sched.run_jobs(kinds=('gmail',), threads=1)
+
+        assert summary['jobs'] == 1 and summary['saved'] == 2
+        assert len(renewals) >= 2 and seen[-1] > seen[0]
+        row = _row(sched, job)
+        assert row.lease_owner is None and row.lease_until is None
+        assert row.run_count == 1 and row.last_status == 'ok'
+        assert row.next_run_at > row.last_started_at
+
+        count = len(renewals)
+        time.sleep(0.2)
+        assert len(renewals) == count
+        assert not any(t.name == f'scheduler-lease-{job}' for t in threading.enumerate())
+
+    def test_renewal_stops_when_lease_is_lost(self, sched, job, monkeypatch):
+        monkeypatch.setattr(sched, 'JOB_LEASE_RENEW_SEC', 0.01)
+        assert _claim(sched, 'a') is not None
+        db = sched.SessionLocal()
+        try:
+            db.get(sched.TSchedulerJob, job).lease_owner = 'b'
+            db.commit()
+        finally:
+            db.close()
+        stop = threading.Event()
+        t = threading.Thread(target=sched._keep_lease, args=(job, 'a', stop))
+        t.start()
+        t.join(1)
+        assert not t.is_alive()
+        stop.set()
+
+
+class TestGetState:
+    def test_metrics_per_kind_and_tenant(self, sched, job):
+        now = datetime.utcnow()
+        db = sched.SessionLocal()
+        try:
+            row = db.get(sched.TSchedulerJob, job)
+            row.run_count, row.total_duration_ms, row.max_duration_ms = 4, 1000, 400
+            row.last_status, row.last_finished_at = 'ok', now - timedelta(minutes=3)
+            db.add_all([
+                sched.TSchedulerJob(job_key='gmail:2', kind='gmail', tenant_id=2, run_count=1,
+                                    total_duration_ms=900, max_duration_ms=900, last_status='error',
+                                    last_finished_at=now - timedelta(minutes=1),
+                                    lease_owner='x', lease_until=now + timedelta(minutes=5)),
+                sched.TSchedulerJob(job_key='mail:1', kind='mail', tenant_id=1),
+            ])
+            db.commit()
+        finally:
+            db.close()
+
+        state = sched.get_state()
+        gmail = state['jobs']['gmail']
+        assert (gmail['jobs'], gmail['running'], gmail['errors'], gmail['runs']) == (2, 1, 1, 5)
+        assert gmail['avg_duration_ms'] == 380 and gmail['max_duration_ms'] == 900
+        assert state['jobs']['mail'] == {'jobs': 1, 'running': 0, 'errors': 0, 'runs': 0,
+                                         'last_finished_at': None, 'avg_duration_ms': None,
+                                         'max_duration_ms': None}
+        assert state['last_status'] == 'error'
+
+        mine = sched.get_state(tenant_id=1)
+        assert mine['jobs']['gmail']['jobs'] == 1 and mine['jobs']['gmail']['avg_duration_ms'] == 250
+        assert mine['last_status'] == 'ok'
+        assert mine['last_finished_at'] == now - timedelta(minutes=3)
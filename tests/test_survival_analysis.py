@@ -15,6 +15,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app', 'service
 from survival_analysis import (
     make_survival_record,
     kaplan_meier_estimate,
+    kaplan_meier_by_strata,
     greenwood_confidence_interval,
     calculate_disease_incidence,
     analyze_weight_trend,
@@ -147,6 +148,63 @@ def test_km_censored_before_event():
     assert abs(curve[1]['survival_rate'] - 0.0) < 1e-6
 
 
+def test_km_tied_death_and_censor():
+    """
+    同一時点の死亡と打ち切り: 死亡を先に処理し、打ち切りは次の時点から外れる
+    n=4, t=50 で 1 死亡 + 1 打ち切り, t=80 で 1 死亡, t=90 で 1 打ち切り
+    S(50) = 1 - 1/4 = 0.75
+    S(80) = 0.75 * (1 - 1/2) = 0.375
+    """
+    records = [
+        make_survival_record(1, 50, True),
+        make_survival_record(2, 50, False),
+        make_survival_record(3, 80, True),
+        make_survival_record(4, 90, False),
+        make_survival_record(5, None, True),  # 除外
+    ]
+    result = kaplan_meier_estimate(records)
+    curve = result['survival_curve']
+    assert [p['n_at_risk'] for p in curve] == [4, 2]
+    assert curve[0]['n_censored'] == 1
+    assert abs(curve[0]['survival_rate'] - 0.75) < 1e-6
+    assert abs(curve[1]['survival_rate'] - 0.375) < 1e-6
+    assert result['median_lifespan_months'] == 80
+    assert (result['n_total'], result['n_events'], result['n_censored']) == (4, 2, 2)
+
+
+def test_km_by_strata_matches_per_stratum():
+    """層別一括推定の結果は層ごとに kaplan_meier_estimate を呼んだ結果と一致する"""
+    import random
+    rng = random.Random(7)
+    records = []
+    for i in range(300):
+        rec = make_survival_record(i, rng.randint(1, 60), rng.random() < 0.6)
+        rec['breed'] = ['トイプードル', 'チワワ', 'ダックス'][i % 3]
+        records.append(rec)
+    records.append({**make_survival_record(999, 10, True), 'breed': None})  # 層なしは除外
+
+    result = kaplan_meier_by_strata(records, 'breed')
+    assert set(result) == {'トイプードル', 'チワワ', 'ダックス'}
+    for breed, km in result.items():
+        expected = kaplan_meier_estimate([r for r in records if r['breed'] == breed])
+        assert km == expected
+
+
+def test_km_by_strata_callable_with_ci():
+    """層キーに関数を渡せ、with_ci=True で信頼区間が付く"""
+    records = [
+        make_survival_record(1, 50, True),
+        make_survival_record(2, 100, True),
+        make_survival_record(3, 120, False),
+        make_survival_record(11, 30, True),
+    ]
+    result = kaplan_meier_by_strata(records, lambda r: 'A' if r['dog_id'] < 10 else 'B', with_ci=True)
+    assert result['A']['n_total'] == 3
+    assert result['B']['median_lifespan_months'] == 30
+    expected = greenwood_confidence_interval(kaplan_meier_estimate(records[:3])['survival_curve'])
+    assert result['A']['survival_curve'] == expected
+
+
 # ─────────────────────────────────────────────
 # 3. greenwood_confidence_interval
 # ─────────────────────────────────────────────
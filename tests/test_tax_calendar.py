@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+tax_calendar.py の営業日カレンダーのユニットテスト
+
+ビット列から展開した翌営業日・営業日数が、1日ずつ祝日判定する
+従来の方法と一致すること、保存ファイルを共有できることを検証する。
+"""
+import sys
+import os
+from datetime import date, timedelta
+
+# パスを追加してモジュールを直接インポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+import tax_calendar  # noqa: E402
+
+
+def _legacy_is_holiday(d, cache={}):
+    if d.weekday() >= 5:
+        return True
+    if d.year not in cache:
+        cache[d.year] = tax_calendar._get_jp_holidays(d.year)
+    return d in cache[d.year]
+
+
+def _legacy_next_business_day(d):
+    while _legacy_is_holiday(d):
+        d += timedelta(days=1)
+    return d
+
+
+def _days(start, end):
+    d = start
+    while d <= end:
+        yield d
+        d += timedelta(days=1)
+
+
+class TestBusinessCalendar:
+    def setup_method(self):
+        self.cal = tax_calendar.BusinessCalendar(
+            {y: tax_calendar._year_bitmap(y) for y in range(2024, 2027)})
+
+    def test_matches_legacy_including_years_outside_span(self):
+        for d in _days(date(2023, 12, 1), date(2027, 2, 1)):
+            assert self.cal.is_business_day(d) == (not _legacy_is_holiday(d)), d
+            assert self.cal.next_business_day(d) == _legacy_next_business_day(d), d
+
+    def test_next_business_day_across_year_end(self):
+        # 2026/12/31(木) は営業日、2027/1/1 は元日 → 翌営業日は 1/4(月)
+        assert self.cal.next_business_day(date(2027, 1, 1)) == date(2027, 1, 4)
+        assert self.cal.next_business_day(date(2025, 12, 31)) == date(2025, 12, 31)
+
+    def test_count_business_days(self):
+        start, end = date(2024, 11, 15), date(2026, 3, 10)
+        expected = sum(1 for d in _days(start, end) if not _legacy_is_holiday(d))
+        assert self.cal.count_business_days(start, end) == expected
+        assert self.cal.count_business_days(end, start) == 0
+
+    def test_version_follows_bitmaps(self):
+        same = tax_calendar.BusinessCalendar(
+            {y: tax_calendar._year_bitmap(y) for y in range(2024, 2027)})
+        assert same.version == self.cal.version
+        bitmaps = {y: tax_calendar._year_bitmap(y) for y in range(2024, 2027)}
+        bitmaps[2025] = bytes([bitmaps[2025][0] ^ 1]) + bitmaps[2025][1:]
+        assert tax_calendar.BusinessCalendar(bitmaps).version != self.cal.version
+
+
+class TestCalendarFile:
+    def test_round_trip_and_reuse(self, tmp_path):
+        path = str(tmp_path / 'cal.bin')
+        cal = tax_calendar.load_business_calendar(path, 2025, 2026)
+        assert os.path.getsize(path) == tax_calendar._CAL_HEADER.size + 2 * tax_calendar._CAL_YEAR_BYTES
+        assert tax_calendar._read_calendar_file(path, 2025, 2026) is not None
+        # 保存範囲より広い範囲を要求されたら作り直す
+        assert tax_calendar._read_calendar_file(path, 2024, 2026) is None
+        loaded = tax_calendar.load_business_calendar(path, 2025, 2026)
+        assert loaded.next_business_day(date(2025, 5, 3)) == cal.next_business_day(date(2025, 5, 3))
+
+    def test_default_path_does_not_depend_on_cwd(self, tmp_path, monkeypatch):
+        saved = []
+        monkeypatch.delenv('TAX_CALENDAR_CACHE_PATH', raising=False)
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(tax_calendar, '_read_calendar_file', lambda path, y0, y1: saved.append(path))
+        monkeypatch.setattr(tax_calendar, '_write_calendar_file', lambda path, y0, y1, b: None)
+        monkeypatch.setattr(tax_calendar, '_business_calendar', None)
+        tax_calendar.load_business_calendar(None, 2025, 2025)
+        assert os.path.isabs(saved[0])
+        assert os.path.dirname(saved[0]) == os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(tax_calendar.__file__))), 'database')
+
+    def test_corrupt_file_is_rebuilt(self, tmp_path):
+        path = tmp_path / 'cal.bin'
+        path.write_bytes(b'garbage')
+        cal = tax_calendar.load_business_calendar(str(path), 2025, 2025)
+        assert cal.next_business_day(date(2025, 1, 1)) == date(2025, 1, 2)
+        assert tax_calendar._read_calendar_file(str(path), 2025, 2025) is not None
+
+
+class TestClientDeadlineMemo:
+    def _client(self, cid, name):
+        from types import SimpleNamespace
+        return SimpleNamespace(
+            id=cid, name=name, type='法人', fiscal_year_end_month=3, fiscal_year_end=None,
+            corp_tax_extension=1, consumption_tax_extension=0,
+            prefectural_tax_extension=0, municipal_tax_extension=0,
+            salary_office_notification=1, withholding_tax_special=0,
+            has_fixed_asset_tax=0, has_depreciable_asset_tax=0,
+        )
+
+    def test_same_settings_share_template_but_not_dicts(self):
+        a = tax_calendar.get_all_deadlines_for_client(self._client(1, 'A'), 2026)
+        a[0]['note'] = '呼び出し側で書き換え'
+        b = tax_calendar.get_all_deadlines_for_client(self._client(2, 'B'), 2026)
+        assert len(a) == len(b) and len(a) > 0
+        assert b[0]['note'] != '呼び出し側で書き換え'
+        assert {d['client_id'] for d in b} == {2}
+        assert all(d['client_type'] == '法人' for d in b)
+        assert [d['date'] for d in a] == [d['date'] for d in b]
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+tax_office_lookup.py / prefecture_tax_office_map.py のユニットテスト
+
+郵便番号インデックスの書き出し・読み込み、照会結果キャッシュからの応答
+（ネットワーク無し）、欠けた遠隔照会結果を保存しないこと、都道府県税事務所の
+トライ検索が従来の走査と同じ結果を返すことを検証する。
+"""
+import sys
+import os
+import types
+
+import pytest
+
+# パスを追加してモジュールを直接インポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+import tax_office_lookup  # noqa: E402
+import prefecture_tax_office_map as ptm  # noqa: E402
+
+
+@pytest.fixture
+def lookup_env(tmp_path, monkeypatch):
+    monkeypatch.setenv('TAX_OFFICE_INDEX_PATH', str(tmp_path / 'zip.bin'))
+    monkeypatch.setenv('TAX_OFFICE_CACHE_PATH', str(tmp_path / 'cache.db'))
+    monkeypatch.setattr(tax_office_lookup, '_index', {'loaded': False, 'data': None})
+    monkeypatch.setattr(tax_office_lookup, '_memo', {})
+    # build_result は app.prefecture_tax_office_map を遅延インポートする（Flask 無しで読めるよう差し替え）
+    app_pkg = types.ModuleType('app')
+    app_pkg.prefecture_tax_office_map = ptm
+    monkeypatch.setitem(sys.modules, 'app', app_pkg)
+    monkeypatch.setitem(sys.modules, 'app.prefecture_tax_office_map', ptm)
+
+    def _no_network(*args, **kwargs):
+        raise AssertionError('ネットワークに照会してはいけない')
+    monkeypatch.setattr(tax_office_lookup, 'fetch_nta_tax_office', _no_network)
+    monkeypatch.setattr(tax_office_lookup, 'fetch_zipcloud_address', _no_network)
+    return tmp_path
+
+
+class TestLookup:
+    def test_normalize(self):
+        assert tax_office_lookup.normalize_zipcode('700-0901') == '7000901'
+        assert tax_office_lookup.normalize_zipcode('７００') is None
+        assert tax_office_lookup.normalize_zipcode(None) is None
+
+    def test_index_hit(self, lookup_env):
+        tax_office_lookup.write_index(str(lookup_env / 'zip.bin'), {
+            '1600023': ('東京都', '新宿区', '新宿税務署', '東京都新宿都税事務所'),
+            '7000901': ('岡山県', '岡山市', '岡山東税務署', '備前県民局'),
+            '0600000': ('北海道', '札幌市', None, None),
+        })
+        r = tax_office_lookup.lookup_zipcode('160-0023')
+        assert r['source'] == 'index'
+        assert r['tax_office_name'] == '新宿税務署'
+        assert r['pref_tax_office_name'] == '東京都新宿都税事務所'
+        assert r['is_tokyo_23ku'] is True
+        assert 'municipality_office_name' not in r
+        r = tax_office_lookup.lookup_zipcode('7000901')
+        assert r['municipality_office_name'] == '岡山市役所'
+        # インデックスに税務署が無く、キャッシュにも無ければ遠隔照会しない限り None
+        assert tax_office_lookup.lookup_zipcode('0600000', allow_remote=False) is None
+        assert tax_office_lookup.lookup_zipcode('9999999', allow_remote=False) is None
+
+    def test_cache_hit(self, lookup_env):
+        tax_office_lookup.cache_put('3300001', {
+            'prefecture': '埼玉県', 'city': '伊奈町', 'tax_office_name': '上尾税務署'})
+        r = tax_office_lookup.lookup_zipcode('330-0001', allow_remote=False)
+        assert r['source'] == 'cache'
+        assert r['tax_office_name'] == '上尾税務署'
+        assert r['municipality_office_name'] == '伊奈町役場'
+        assert [z for z, _ in tax_office_lookup.iter_cache()] == ['3300001']
+
+    def test_incomplete_remote_answer_not_cached(self, lookup_env, monkeypatch):
+        monkeypatch.setattr(tax_office_lookup, 'fetch_nta_tax_office', lambda z: '上尾税務署')
+        monkeypatch.setattr(tax_office_lookup, 'fetch_zipcloud_address', lambda z: (None, None))
+        r = tax_office_lookup.lookup_zipcode('3300001')
+        assert r['source'] == 'remote' and r['tax_office_name'] == '上尾税務署'
+        assert tax_office_lookup.iter_cache() == []
+        assert tax_office_lookup._memo == {}
+
+        monkeypatch.setattr(tax_office_lookup, 'fetch_zipcloud_address', lambda z: ('埼玉県', '伊奈町'))
+        r = tax_office_lookup.lookup_zipcode('3300001')
+        assert r['municipality_office_name'] == '伊奈町役場'
+        assert [z for z, _ in tax_office_lookup.iter_cache()] == ['3300001']
+
+    def test_schema_created_once(self, lookup_env, monkeypatch):
+        statements = []
+        connect = tax_office_lookup.sqlite3.connect
+
+        class _Conn:
+            def __init__(self, conn):
+                self._conn = conn
+
+            def execute(self, sql, *args):
+                statements.append(sql)
+                return self._conn.execute(sql, *args)
+
+            def __getattr__(self, name):
+                return getattr(self._conn, name)
+
+            def __enter__(self):
+                return self._conn.__enter__()
+
+            def __exit__(self, *exc):
+                return self._conn.__exit__(*exc)
+
+        monkeypatch.setattr(tax_office_lookup.sqlite3, 'connect', lambda *a, **k: _Conn(connect(*a, **k)))
+        for _ in range(3):
+            tax_office_lookup.cache_get('3300001')
+        assert sum(1 for sql in statements if sql.startswith('CREATE')) == 1
+
+    def test_default_paths_do_not_depend_on_cwd(self, monkeypatch, tmp_path):
+        monkeypatch.delenv('TAX_OFFICE_CACHE_PATH', raising=False)
+        monkeypatch.delenv('TAX_OFFICE_INDEX_PATH', raising=False)
+        monkeypatch.chdir(tmp_path)
+        assert os.path.isabs(tax_office_lookup._cache_path())
+        assert os.path.isabs(tax_office_lookup._index_path())
+
+
+class TestPrefTaxOfficeIndex:
+    def _scan(self, prefecture, city):
+        """従来の3段階の線形走査"""
+        offices = ptm.PREF_TAX_OFFICE_MAP.get(prefecture, [])
+        for cond in (lambda m: m == city,
+                     lambda m: city.startswith(m) or m.startswith(city),
+                     lambda m: city in m or m in city):
+            for office in offices:
+                if any(cond(m) for m in office['municipalities']):
+                    return office['name']
+        return None
+
+    def test_matches_linear_scan(self):
+        for prefecture, offices in ptm.PREF_TAX_OFFICE_MAP.items():
+            for office in offices:
+                for m in office['municipalities']:
+                    for city in (m, m[:-1], m + '中央区', m[1:], ''):
+                        assert ptm.get_pref_tax_office_name(prefecture, city) == self._scan(prefecture, city)
+
+    def test_unknown_prefecture(self):
+        assert ptm.get_pref_tax_office_name('存在しない県', '市') is None
+        assert ptm.get_pref_tax_office_candidates('存在しない県', '市') == []
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+tenant_storage_adapter.py（保存先キャッシュ / 主＋ミラーへの保存）のユニットテスト
+
+app.db と change_bus を差し替えて tenant_storage_adapter.py を直接ロードする。
+キャッシュの使い回しと無効化（自プロセス・change_bus の版数更新）、
+主の失敗は例外になること、ミラーの失敗は記録のみで保存は成立すること、
+ミラーごとに別のストリームが渡ることを検証する。
+"""
+import sys
+import os
+import types
+import logging
+import importlib.util
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip('werkzeug')
+pytest.importorskip('sqlalchemy')
+
+_APP = os.path.join(os.path.dirname(__file__), '..', 'app')
+
+
+class FakeBus:
+    def __init__(self):
+        self.versions = {}
+        self.published = []
+
+    def version(self, channel):
+        return self.versions.get(channel, 0)
+
+    def publish(self, channel):
+        self.published.append(channel)
+        self.versions[channel] = self.version(channel) + 1
+
+
+class FakeAdapter:
+    def __init__(self, name, fail=False, close_stream=False):
+        self.name = name
+        self.fail = fail
+        self.close_stream = close_stream
+        self.streams = []
+        self.received = []
+
+    def upload(self, file_stream, original_name, **kwargs):
+        self.streams.append(file_stream)
+        self.received.append(file_stream.read())
+        if self.close_stream:
+            file_stream.close()
+        if self.fail:
+            raise RuntimeError(f'{self.name} down')
+        return f'https://{self.name}/{original_name}'
+
+
+@pytest.fixture(scope='module')
+def storage():
+    fake_db = types.ModuleType('app.db')
+    fake_db.SessionLocal = MagicMock()
+    with pytest.MonkeyPatch.context() as mp:
+        if 'app' not in sys.modules:
+            mp.setitem(sys.modules, 'app', MagicMock())
+        mp.setitem(sys.modules, 'app.db', fake_db)
+        spec = importlib.util.spec_from_file_location(
+            'tenant_storage_adapter_under_test', os.path.join(_APP, 'utils', 'tenant_storage_adapter.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def bus(monkeypatch):
+    bus = FakeBus()
+    change_bus = types.ModuleType('app.services.change_bus')
+    change_bus.get_change_bus = lambda: bus
+    if 'app' not in sys.modules:
+        monkeypatch.setitem(sys.modules, 'app', MagicMock())
+    monkeypatch.setitem(sys.modules, 'app.services', types.ModuleType('app.services'))
+    monkeypatch.setitem(sys.modules, 'app.services.change_bus', change_bus)
+    return bus
+
+
+@pytest.fixture
+def loads(storage, bus, monkeypatch):
+    """DB からの解決を数える（テナントごとに 主＋ミラー1件）"""
+    calls = []
+
+    def _load(tenant_id, store_id, staff_id, staff_type):
+        calls.append(tenant_id)
+        return [f'primary-{tenant_id}', f'mirror-{tenant_id}']
+
+    monkeypatch.setattr(storage, '_storage_cache', {})
+    monkeypatch.setattr(storage, '_load_tenant_storage_configs', _load)
+    monkeypatch.setattr(storage, '_build_adapter', lambda config, tenant_id: FakeAdapter(config))
+    return calls
+
+
+class TestAdapterCache:
+    def test_adapters_are_reused(self, storage, loads):
+        first = storage.get_storage_adapters(7, store_id=1)
+        again = storage.get_storage_adapters(7, store_id=1)
+        assert [a.name for a in first] == ['primary-7', 'mirror-7']
+        assert all(a is b for a, b in zip(first, again))
+        assert loads == [7]
+
+    def test_local_invalidation_reloads(self, storage, bus, loads):
+        first = storage.get_storage_adapters(7, store_id=1)
+        storage.get_storage_adapters(8)
+        storage.invalidate_storage_cache(7)
+        assert bus.published == ['storage:7']
+        reloaded = storage.get_storage_adapters(7, store_id=1)
+        assert reloaded[0] is not first[0]
+        storage.get_storage_adapters(8)
+        assert loads == [7, 8, 7]  # 他テナントのキャッシュは残る
+
+    def test_version_bump_from_other_worker_reloads(self, storage, bus, loads):
+        first = storage.get_storage_adapters(7)
+        bus.versions['storage:7'] = 3  # 他ワーカーが invalidate_storage_cache(7) を呼んだ
+        reloaded = storage.get_storage_adapters(7)
+        assert reloaded[0] is not first[0] and loads == [7, 7]
+        assert storage.get_storage_adapters(7)[0] is reloaded[0]
+        assert loads == [7, 7]
+
+    def test_expired_entry_reloads(self, storage, loads, monkeypatch):
+        storage.get_storage_adapters(7)
+        monkeypatch.setattr(storage, '_CACHE_TTL_SEC', -1)
+        storage.invalidate_storage_cache()
+        storage.get_storage_adapters(7)
+        storage.get_storage_adapters(7)
+        assert loads == [7, 7, 7]
+
+
+class TestUploadToAdapters:
+    def test_primary_failure_raises(self, storage):
+        primary, mirror = FakeAdapter('primary', fail=True), FakeAdapter('mirror')
+        with pytest.raises(RuntimeError, match='primary down'):
+            storage.upload_to_adapters([primary, mirror], b'data', 'a.pdf', client_id=1)
+        assert mirror.received == []  # 主が失敗したらミラーへは保存しない
+
+    def test_mirror_failure_is_logged_not_raised(self, storage, caplog):
+        primary = FakeAdapter('primary')
+        broken, ok = FakeAdapter('broken', fail=True), FakeAdapter('ok')
+        with caplog.at_level(logging.WARNING, logger=storage.logger.name):
+            url = storage.upload_to_adapters([primary, broken, ok], b'data', 'a.pdf', client_id=1)
+        assert url == 'https://primary/a.pdf'
+        assert ok.received == [b'data']
+        assert any('FakeAdapter' in r.getMessage() and 'a.pdf' in r.getMessage() for r in caplog.records)
+
+    def test_mirrors_get_independent_streams(self, storage):
+        primary = FakeAdapter('primary', close_stream=True)
+        mirrors = [FakeAdapter(f'm{n}', close_stream=True) for n in range(3)]
+        storage.upload_to_adapters([primary] + mirrors, b'payload', 'a.pdf', client_id=1)
+        streams = [ad.streams[0] for ad in [primary] + mirrors]
+        assert len({id(s) for s in streams}) == 4
+        assert all(ad.received == [b'payload'] for ad in mirrors)
+
+    def test_stream_upload_mirrors_read_full_content(self, storage):
+        from io import BytesIO
+        primary = FakeAdapter('primary')
+        mirrors = [FakeAdapter('m1'), FakeAdapter('m2')]
+        stream = BytesIO(b'payload')
+        stream.read(3)  # 途中まで読まれたストリームでも先頭から保存する
+        url = storage.upload_stream_to_adapters([primary] + mirrors, stream, 'a.pdf', client_id=1)
+        assert url == 'https://primary/a.pdf'
+        assert primary.streams[0] is stream and primary.received == [b'payload']
+        assert all(ad.received == [b'payload'] and ad.streams[0] is not stream for ad in mirrors)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+ocr.py のページ並列処理（_map_pages）のユニットテスト
+
+並列に処理しても結果がページ順に並ぶこと・進捗が全件分通知されることを検証する。
+"""
+import sys
+import os
+import time
+
+# パスを追加してモジュールを直接インポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app', 'utils', 'voucher'))
+import ocr  # noqa: E402
+
+
+class TestMapPages:
+    def test_results_keep_page_order(self):
+        # 先頭ページほど遅く終わるようにして、完了順と入力順をずらす
+        def _slow(i):
+            time.sleep(0.01 * (5 - i))
+            return i * 10
+
+        assert ocr._map_pages(_slow, list(range(5))) == [0, 10, 20, 30, 40]
+
+    def test_progress_reported_for_every_page(self):
+        calls = []
+        ocr._map_pages(lambda i: i, [1, 2, 3], progress=lambda d, t: calls.append((d, t)))
+        assert calls[0] == (0, 3)
+        assert calls[-1] == (3, 3)
+        assert len(calls) == 4
+
+    def test_exception_propagates(self):
+        def _fail(i):
+            if i == 2:
+                raise ValueError('page 2')
+            return i
+
+        try:
+            ocr._map_pages(_fail, [1, 2, 3])
+        except ValueError as e:
+            assert 'page 2' in str(e)
+        else:
+            raise AssertionError('例外が送出されていません')
+
+
+class TestIncompleteResults:
+    def test_failed_google_vision_page_is_reported(self, tmp_path, monkeypatch):
+        pages = []
+        for i in range(3):
+            p = tmp_path / f'p{i}.jpg'
+            p.write_bytes(b'x')
+            pages.append(str(p))
+        monkeypatch.setattr(ocr, '_pdf_to_images', lambda path, dpi=200: list(pages))
+
+        def _vision(path, api_key):
+            if path == pages[1]:
+                raise RuntimeError('timeout')
+            return os.path.basename(path)
+
+        monkeypatch.setattr(ocr, '_call_google_vision_single', _vision)
+        failed = []
+        text = ocr.extract_text_with_google_vision_api_key('a.pdf', 'key', failed_pages=failed)
+        assert text == 'p0.jpg\np2.jpg'
+        assert failed == [2]
+
+    def test_incomplete_result_is_not_cacheable(self):
+        assert ocr._ocr_cacheable({'transactions': [{}]})
+        assert not ocr._ocr_cacheable({'transactions': [], '_error': 'x'})
+        assert not ocr._ocr_cacheable({'transactions': [{}], '_incomplete': 'ページ2'})
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+通帳画像前処理（傾き補正）のベンチマーク
+
+目的:
+  縮小画像での粗→精探索＋配列演算による現実装（_detect_skew_angle）と、
+  2400px の二値画像を 0.5 度刻みで 41 回回転して Python ループで評価していた
+  旧実装の処理時間・推定角度を比較する。
+
+前提:
+  Pillow が必要（numpy があれば投影・Otsu は numpy で計算される）。Flask / DB 不要。
+  画像ディレクトリを指定しない場合は、既知の角度で傾けた疑似通帳画像を生成して使う。
+
+使い方:
+  python tools/bench_image_preprocess.py [スキャン画像のディレクトリ] [繰り返し回数（既定 1）]
+  → 画像ごとの 旧実装 / 現実装 の時間（ms）と推定角度、全体の速度比を表示
+"""
+
+import os
+import random
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageOps
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app', 'utils', 'voucher'))
+
+import image_preprocess  # noqa: E402
+from image_preprocess import _detect_skew_angle  # noqa: E402
+
+_EXTS = ('.jpg', '.jpeg', '.png')
+
+
+def _legacy_otsu_threshold(img):
+    histogram = img.histogram()
+    total = sum(histogram)
+    if total == 0:
+        return 128
+    sum_total = sum(i * histogram[i] for i in range(256))
+    sum_bg = 0
+    weight_bg = 0
+    max_variance = 0
+    threshold = 128
+    for i in range(256):
+        weight_bg += histogram[i]
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += i * histogram[i]
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_total - sum_bg) / weight_fg
+        variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if variance > max_variance:
+            max_variance = variance
+            threshold = i
+    return threshold
+
+
+def _legacy_projection_score(binary_img):
+    width, height = binary_img.size
+    pixels = binary_img.load()
+    row_sums = [sum(1 for x in range(width) if pixels[x, y] == 0) for y in range(height)]
+    if not row_sums:
+        return 0
+    mean = sum(row_sums) / len(row_sums)
+    return sum((s - mean) ** 2 for s in row_sums) / len(row_sums)
+
+
+def _legacy_detect_skew_angle(img):
+    """変更前の _deskew の角度推定部分をそのまま再現"""
+    threshold = _legacy_otsu_threshold(img)
+    binary = img.point(lambda p: 255 if p > threshold else 0)
+    best_angle = 0
+    best_score = -1
+    for angle_tenth in range(-100, 101, 5):
+        angle = angle_tenth / 10.0
+        score = _legacy_projection_score(binary.rotate(angle, expand=False, fillcolor=255))
+        if score > best_score:
+            best_score = score
+            best_angle = angle
+    return best_angle
+
+
+def _synthetic_scans(count=6, seed=1):
+    """罫線と文字列風の黒帯を並べた通帳風画像を既知の角度で傾けて生成する"""
+    rng = random.Random(seed)
+    scans = []
+    for n in range(count):
+        img = Image.new('L', (1800, 2400), 235)
+        draw = ImageDraw.Draw(img)
+        for y in range(160, 2300, 64):
+            draw.line([(80, y + 44), (1720, y + 44)], fill=150, width=2)
+            x = 100
+            while x < 1650:
+                w = rng.randint(20, 140)
+                draw.rectangle([x, y + 8, x + w, y + 34], fill=rng.randint(10, 60))
+                x += w + rng.randint(12, 40)
+        angle = rng.choice([-7.5, -4.0, -1.5, 0.0, 2.5, 6.0])
+        skewed = img.rotate(angle, expand=False, fillcolor=235, resample=Image.BICUBIC)
+        scans.append((f'synthetic-{n + 1}', skewed, -angle))
+    return scans
+
+
+def _load_scans(directory):
+    scans = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(_EXTS):
+            continue
+        img = ImageOps.exif_transpose(Image.open(os.path.join(directory, name))).convert('L')
+        w, h = img.size
+        if max(w, h) < 2400:  # preprocess_bank_image と同じ解像度正規化
+            scale = 2400 / max(w, h)
+            img = img.resize((int(w * scale), int(h * scale)), Image.LANCZOS)
+        scans.append((name, img, None))
+    return scans
+
+
+def _time(fn, img, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(img)
+        elapsed = (time.perf_counter() - t0) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 and os.path.isdir(sys.argv[1]) else None
+    repeat = int(sys.argv[-1]) if len(sys.argv) > 1 and sys.argv[-1].isdigit() else 1
+    scans = _load_scans(directory) if directory else _synthetic_scans()
+    if not scans:
+        print('画像が見つかりません')
+        return
+
+    print(f'numpy: {"あり" if image_preprocess.np is not None else "なし（Pillowのみ）"}  画像数: {len(scans)}  繰り返し: {repeat}')
+    print(f'{"画像":<24}{"期待角度":>8}{"旧角度":>8}{"新角度":>8}{"旧(ms)":>10}{"新(ms)":>10}')
+    legacy_total = new_total = 0.0
+    mismatches = 0
+    for name, img, expected in scans:
+        legacy_angle, legacy_ms = _time(_legacy_detect_skew_angle, img, repeat)
+        new_angle, new_ms = _time(_detect_skew_angle, img, repeat)
+        legacy_total += legacy_ms
+        new_total += new_ms
+        if abs(legacy_angle - new_angle) > 0.5:
+            mismatches += 1
+        exp = f'{expected:.1f}' if expected is not None else '-'
+        print(f'{name[:23]:<24}{exp:>8}{legacy_angle:>8.1f}{new_angle:>8.1f}{legacy_ms:>10.1f}{new_ms:>10.1f}')
+
+    print(f'合計: 旧 {legacy_total:.0f}ms / 新 {new_total:.0f}ms（{legacy_total / max(new_total, 1e-9):.1f}倍）')
+    print(f'角度の差が0.5度を超えた画像: {mismatches}件')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+POS テナント自動フィルタ（_apply_tenant_filter）のマイクロベンチマーク
+
+目的:
+  do_orm_execute フックが 1 クエリあたりに上乗せするオーバーヘッドを、
+  旧実装（毎回 Base.registry.mappers を走査してクラスごとに lambda を生成）と
+  現実装（TenantScoped レジストリ + テナントごとに 1 つのキャッシュ済みオプション）で比較する。
+  対象は KDS（/api/kds/items）とフロア（/floor）で実際に発行しているクエリ。
+
+前提:
+  requirements.txt の Flask / SQLAlchemy がインストール済みであること。
+  DB はインメモリ SQLite を使う（本番 DB には接続しない）。
+
+使い方:
+  python tools/bench_pos_tenant_filter.py [反復回数（既定 2000）]
+  → フックなし / 旧実装 / 現実装 の 1 クエリ平均時間（µs）と、フックなしとの差分を表示
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, g  # noqa: E402
+from sqlalchemy import event, func  # noqa: E402
+from sqlalchemy.orm import Session, with_loader_criteria  # noqa: E402
+
+from app.blueprints import pos_app as pos  # noqa: E402
+
+TENANT_ID = 1
+STORE_ID = 1
+
+
+def _legacy_apply_tenant_filter(execute_state):
+    """変更前の実装（比較用にそのまま再現）"""
+    if not execute_state.is_select:
+        return
+    tenant_id = pos._current_tenant_id()
+    if tenant_id is None:
+        return
+    for mapper in list(pos.Base.registry.mappers):
+        cls = mapper.class_
+        try:
+            if issubclass(cls, pos.TenantScoped):
+                execute_state.statement = execute_state.statement.options(
+                    with_loader_criteria(
+                        cls,
+                        lambda ent: ent.tenant_id == tenant_id,
+                        include_aliases=True
+                    )
+                )
+        except TypeError:
+            pass
+
+
+def _seed(s):
+    s.add(pos.Store(id=STORE_ID, tenant_id=TENANT_ID, code="bench", name="bench"))
+    for n in range(1, 21):
+        s.add(pos.TableSeat(id=n, tenant_id=TENANT_ID, store_id=STORE_ID, table_no=str(n), status="空席"))
+        s.add(pos.Menu(id=n, tenant_id=TENANT_ID, store_id=STORE_ID, name=f"menu{n}", price=500))
+        s.add(pos.OrderHeader(id=n, tenant_id=TENANT_ID, store_id=STORE_ID, table_id=n, status="新規"))
+        for k in range(3):
+            s.add(pos.OrderItem(tenant_id=TENANT_ID, store_id=STORE_ID, order_id=n, menu_id=n,
+                                qty=1, unit_price=500, tax_rate=0.10, status="新規",
+                                added_at=datetime.now(timezone.utc)))
+    s.commit()
+
+
+def _kds_query(s):
+    return (
+        s.query(
+            pos.OrderItem.id, pos.OrderItem.order_id, pos.TableSeat.table_no,
+            pos.Menu.name, pos.OrderItem.qty, pos.OrderItem.status,
+        )
+        .join(pos.OrderHeader, pos.OrderHeader.id == pos.OrderItem.order_id)
+        .join(pos.TableSeat, pos.TableSeat.id == pos.OrderHeader.table_id)
+        .join(pos.Menu, pos.Menu.id == pos.OrderItem.menu_id)
+        .filter(pos.OrderHeader.store_id == STORE_ID)
+        .filter(pos.OrderHeader.status != "会計済")
+        .filter(pos.OrderItem.qty > 0)
+        .order_by(pos.OrderItem.id.asc())
+        .all()
+    )
+
+
+def _floor_query(s):
+    tables = (
+        s.query(pos.TableSeat)
+         .filter(pos.TableSeat.store_id == STORE_ID)
+         .order_by(pos.TableSeat.table_no.asc())
+         .all()
+    )
+    latest = (
+        s.query(pos.OrderHeader.table_id, func.max(pos.OrderHeader.id))
+         .join(pos.TableSeat, pos.TableSeat.id == pos.OrderHeader.table_id)
+         .filter(pos.OrderHeader.store_id == STORE_ID, pos.TableSeat.store_id == STORE_ID)
+         .group_by(pos.OrderHeader.table_id)
+         .all()
+    )
+    return tables, latest
+
+
+def _time(fn, s, n):
+    for _ in range(50):
+        fn(s)
+    started = time.perf_counter()
+    for _ in range(n):
+        fn(s)
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def _run(label, hook, n, results):
+    if hook is not None:
+        event.listen(Session, "do_orm_execute", hook)
+    try:
+        s = pos.SessionLocal()
+        try:
+            results[label] = {name: _time(fn, s, n) for name, fn in (("kds", _kds_query), ("floor", _floor_query))}
+        finally:
+            s.close()
+            pos.SessionLocal.remove()
+    finally:
+        if hook is not None:
+            event.remove(Session, "do_orm_execute", hook)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    pos.Base.metadata.create_all(pos.engine)
+
+    # 本番フックは一旦外し、比較対象ごとに付け替える
+    event.remove(Session, "do_orm_execute", pos._apply_tenant_filter)
+
+    app = Flask(__name__)
+    with app.test_request_context("/"):
+        g.tenant_id = TENANT_ID
+        s = pos.SessionLocal()
+        _seed(s)
+        s.close()
+        pos.SessionLocal.remove()
+
+        results = {}
+        _run("no_hook", None, n, results)
+        _run("legacy", _legacy_apply_tenant_filter, n, results)
+        _run("current", pos._apply_tenant_filter, n, results)
+
+    print(f"TenantScoped mappers: {len(pos.tenant_scoped_mappers())} / all mappers: {len(pos.Base.registry.mappers)}")
+    print(f"{'':10}{'kds (µs)':>14}{'Δ':>10}{'floor (µs)':>14}{'Δ':>10}")
+    base = results["no_hook"]
+    for label in ("no_hook", "legacy", "current"):
+        r = results[label]
+        print(f"{label:10}{r['kds']:>14.1f}{r['kds'] - base['kds']:>10.1f}"
+              f"{r['floor']:>14.1f}{r['floor'] - base['floor']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+生存分析（kaplan_meier_estimate）のマイクロベンチマーク
+
+目的:
+  時点集計による 1 パス実装（現実装）と、ユニーク死亡時点ごとに
+  レコード全体を再走査していた旧実装の処理時間を比較する。
+  あわせて、犬種ごとに kaplan_meier_estimate を呼ぶ場合と
+  kaplan_meier_by_strata で一括推定する場合を比較する。
+
+前提:
+  標準ライブラリのみで動く（Flask / DB 不要）。データは乱数で生成する。
+
+使い方:
+  python tools/bench_survival_analysis.py [頭数（既定 5000）] [犬種数（既定 20）]
+  → 旧実装 / 現実装 / 層別一括 の平均時間（ms）と、旧実装との結果一致を表示
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app', 'services'))
+
+from survival_analysis import (  # noqa: E402
+    kaplan_meier_by_strata,
+    kaplan_meier_estimate,
+    make_survival_record,
+)
+
+
+def _legacy_kaplan_meier_estimate(records):
+    """変更前の実装（比較用に生存曲線部分をそのまま再現）"""
+    valid = [r for r in records if r.get('time_months') is not None]
+    n_total = len(valid)
+    if n_total == 0:
+        return {'survival_curve': [], 'median_lifespan_months': None}
+
+    sorted_records = sorted(valid, key=lambda r: (r['time_months'], -r['event']))
+    death_times = sorted(set(r['time_months'] for r in sorted_records if r['event'] == 1))
+
+    survival_rate = 1.0
+    n_at_risk = n_total
+    cursor = 0
+    curve = []
+    for t in death_times:
+        while cursor < len(sorted_records) and sorted_records[cursor]['time_months'] < t:
+            n_at_risk -= 1
+            cursor += 1
+        d = sum(1 for r in sorted_records if r['time_months'] == t and r['event'] == 1)
+        c = sum(1 for r in sorted_records if r['time_months'] == t and r['event'] == 0)
+        if n_at_risk > 0:
+            survival_rate = survival_rate * (1.0 - d / n_at_risk)
+        curve.append({
+            'age_months': t,
+            'survival_rate': round(survival_rate, 6),
+            'n_at_risk': n_at_risk,
+            'n_events': d,
+            'n_censored': c,
+        })
+        n_at_risk -= (d + c)
+        cursor += (d + c)
+
+    median_lifespan = None
+    for point in curve:
+        if point['survival_rate'] <= 0.5:
+            median_lifespan = point['age_months']
+            break
+    return {'survival_curve': curve, 'median_lifespan_months': median_lifespan}
+
+
+def _make_records(n_dogs, n_breeds, seed=42):
+    rng = random.Random(seed)
+    records = []
+    for i in range(n_dogs):
+        rec = make_survival_record(
+            dog_id=i,
+            age_months=rng.randint(1, 200),
+            is_deceased=rng.random() < 0.6,
+        )
+        rec['breed'] = f'breed{i % n_breeds}'
+        records.append(rec)
+    return records
+
+
+def _bench(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    n_dogs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    n_breeds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    records = _make_records(n_dogs, n_breeds)
+    by_breed = {}
+    for r in records:
+        by_breed.setdefault(r['breed'], []).append(r)
+
+    legacy = _legacy_kaplan_meier_estimate(records)
+    current = kaplan_meier_estimate(records)
+    same = (legacy['survival_curve'] == current['survival_curve']
+            and legacy['median_lifespan_months'] == current['median_lifespan_months'])
+
+    repeat = 5
+    t_legacy = _bench(lambda: _legacy_kaplan_meier_estimate(records), repeat)
+    t_current = _bench(lambda: kaplan_meier_estimate(records), repeat)
+    t_legacy_breeds = _bench(
+        lambda: [_legacy_kaplan_meier_estimate(v) for v in by_breed.values()], repeat)
+    t_current_breeds = _bench(
+        lambda: [kaplan_meier_estimate(v) for v in by_breed.values()], repeat)
+    t_strata = _bench(lambda: kaplan_meier_by_strata(records, 'breed'), repeat)
+
+    print(f'頭数={n_dogs} 犬種数={n_breeds} 結果一致={same}')
+    print(f'全体   旧実装: {t_legacy:9.2f} ms   現実装: {t_current:9.2f} ms'
+          f'   ({t_legacy / t_current:.1f}x)')
+    print(f'犬種別 旧実装: {t_legacy_breeds:9.2f} ms   現実装: {t_current_breeds:9.2f} ms'
+          f'   層別一括: {t_strata:9.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
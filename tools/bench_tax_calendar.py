@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+税務カレンダー（get_all_deadlines_for_client）のマイクロベンチマーク
+
+目的:
+  全顧問先の年間カレンダー生成（顧問先数ぶん get_all_deadlines_for_client を呼ぶ）
+  について、現実装（営業日カレンダー＋税務設定ごとの期限一覧の使い回し）と、
+  顧問先ごとに全期限を組み立て直し、1日ずつ is_holiday を呼んで翌営業日を
+  探していた旧実装の処理時間を比較する。
+
+前提:
+  標準ライブラリのみで動く（Flask / DB 不要）。顧問先は乱数で生成する。
+  営業日カレンダーは一時ディレクトリに保存し、既存のファイルには触れない。
+
+使い方:
+  python tools/bench_tax_calendar.py [顧問先数（既定 5000）] [年（既定 今年）]
+  → カレンダー読み込み / 旧実装 / 現実装 の時間（ms）と、旧実装との結果一致を表示
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+import tax_calendar  # noqa: E402
+
+
+def _make_legacy_next_business_day():
+    """変更前の実装（年ごとの祝日 set を使い、1日ずつ進める）"""
+    holiday_cache = {}
+
+    def is_holiday(d):
+        if d.weekday() >= 5:
+            return True
+        if d.year not in holiday_cache:
+            holiday_cache[d.year] = tax_calendar._get_jp_holidays(d.year)
+        return d in holiday_cache[d.year]
+
+    def next_business_day(d):
+        while is_holiday(d):
+            d += timedelta(days=1)
+        return d
+
+    return next_business_day
+
+
+def _make_clients(n, seed=42):
+    rng = random.Random(seed)
+    clients = []
+    for i in range(n):
+        corp = rng.random() < 0.6
+        clients.append(SimpleNamespace(
+            id=i + 1,
+            name=f'顧問先{i + 1}',
+            type='法人' if corp else '個人',
+            fiscal_year_end_month=rng.randint(1, 12) if corp else None,
+            fiscal_year_end=None,
+            corp_tax_extension=rng.randint(0, 1),
+            consumption_tax_extension=rng.randint(0, 1),
+            prefectural_tax_extension=rng.randint(0, 1),
+            municipal_tax_extension=rng.randint(0, 1),
+            salary_office_notification=rng.randint(0, 1),
+            withholding_tax_special=rng.randint(0, 1),
+            has_fixed_asset_tax=rng.randint(0, 1),
+            has_depreciable_asset_tax=rng.randint(0, 1),
+        ))
+    return clients
+
+
+def _build_legacy(clients, year):
+    """変更前と同じく、顧問先ごとに全期限を組み立て直す"""
+    out = []
+    for c in clients:
+        for d in tax_calendar._client_deadline_template(c, year):
+            d['client_id'] = c.id
+            d['client_name'] = c.name
+            out.append(d)
+    return out
+
+
+def _build(clients, year):
+    out = []
+    for c in clients:
+        out.extend(tax_calendar.get_all_deadlines_for_client(c, year))
+    return out
+
+
+def main():
+    n_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    year = int(sys.argv[2]) if len(sys.argv) > 2 else date.today().year
+    clients = _make_clients(n_clients)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'business_calendar.bin')
+        t0 = time.perf_counter()
+        tax_calendar.load_business_calendar(path)
+        t_build = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        tax_calendar.load_business_calendar(path)
+        t_load = time.perf_counter() - t0
+
+    current = tax_calendar.next_business_day
+    tax_calendar.next_business_day = _make_legacy_next_business_day()
+    try:
+        t0 = time.perf_counter()
+        legacy = _build_legacy(clients, year)
+        t_legacy = time.perf_counter() - t0
+    finally:
+        tax_calendar.next_business_day = current
+
+    tax_calendar._template_memo.clear()
+    t0 = time.perf_counter()
+    result = _build(clients, year)
+    t_new = time.perf_counter() - t0
+
+    print(f'顧問先数: {n_clients}  年: {year}  期限数: {len(result)}')
+    print(f'営業日カレンダー 計算+保存: {t_build * 1000:8.1f} ms   読み込み: {t_load * 1000:8.1f} ms')
+    print(f'旧実装（顧問先ごとに組み立て・1日ずつ判定）: {t_legacy * 1000:8.1f} ms')
+    print(f'現実装（営業日カレンダー・設定ごとに使い回し）: {t_new * 1000:8.1f} ms   ({t_legacy / t_new:.2f}x)')
+    print(f'結果一致: {legacy == result}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+郵便番号インデックス（app/data/zip_tax_office.bin）の作成
+
+目的:
+  tax_office_lookup がネットワーク無しで引けるよう、郵便番号 →
+  (都道府県, 市区町村, 税務署, 都道府県税事務所) のインデックスを作る。
+
+入力:
+  --ken-all      日本郵便の郵便番号データ（KEN_ALL.CSV / utf_ken_all.csv）
+                 3列目=郵便番号, 7列目=都道府県, 8列目=市区町村 を使う
+  --encoding     KEN_ALL の文字コード（既定 cp932。utf_ken_all.csv は utf-8）
+  --tax-offices  任意。「都道府県,市区町村,税務署名」の CSV（市区町村単位の管轄表）
+  --from-cache   任意。遠隔照会キャッシュ（TAX_OFFICE_CACHE_PATH）の答えも取り込む
+                 （郵便番号単位の答えなので、管轄表より優先する）
+  都道府県税事務所は prefecture_tax_office_map から求める。
+
+使い方:
+  python tools/build_tax_office_index.py --ken-all KEN_ALL.CSV [--tax-offices offices.csv]
+      [--from-cache] [--out app/data/zip_tax_office.bin]
+  → 件数・税務署の判明率・ファイルサイズ・1件あたりの検索時間を表示
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+import tax_office_lookup  # noqa: E402
+from prefecture_tax_office_map import get_pref_tax_office_name  # noqa: E402
+
+
+def _read_tax_offices(path):
+    offices = {}
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) >= 3 and row[0] and row[1] and row[2]:
+                offices.setdefault((row[0].strip(), row[1].strip()), row[2].strip())
+    return offices
+
+
+def main():
+    parser = argparse.ArgumentParser(description='郵便番号インデックスを作成する')
+    parser.add_argument('--ken-all', required=True)
+    parser.add_argument('--encoding', default='cp932')
+    parser.add_argument('--tax-offices')
+    parser.add_argument('--from-cache', action='store_true')
+    parser.add_argument('--out', default=os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app', 'data', 'zip_tax_office.bin'))
+    args = parser.parse_args()
+
+    offices = _read_tax_offices(args.tax_offices) if args.tax_offices else {}
+    pref_office_memo = {}
+    records = {}
+    with open(args.ken_all, encoding=args.encoding, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 8:
+                continue
+            zip7 = tax_office_lookup.normalize_zipcode(row[2])
+            if zip7 is None or zip7 in records:
+                continue   # 同じ郵便番号の2行目以降（町域違い）は市区町村が同じなので省く
+            prefecture, city = row[6], row[7]
+            key = (prefecture, city)
+            if key not in pref_office_memo:
+                pref_office_memo[key] = get_pref_tax_office_name(prefecture, city)
+            records[zip7] = (prefecture, city, offices.get(key), pref_office_memo[key])
+
+    if args.from_cache:
+        for zip7, payload in tax_office_lookup.iter_cache():
+            if not payload.get('tax_office_name'):
+                continue
+            prefecture, city, _, pref_office = records.get(zip7, (payload.get('prefecture'), payload.get('city'), None, None))
+            if pref_office is None and prefecture and city:
+                pref_office = get_pref_tax_office_name(prefecture, city)
+            records[zip7] = (prefecture, city, payload['tax_office_name'], pref_office)
+
+    tax_office_lookup.write_index(args.out, records)
+
+    os.environ['TAX_OFFICE_INDEX_PATH'] = args.out
+    sample = sorted(records)[::max(1, len(records) // 1000)]
+    if sample:
+        tax_office_lookup.lookup_index(sample[0])   # 読み込みは計測に含めない
+    t0 = time.perf_counter()
+    for z in sample:
+        tax_office_lookup.lookup_index(z)
+    per_lookup = (time.perf_counter() - t0) / max(1, len(sample))
+
+    with_office = sum(1 for r in records.values() if r[2])
+    print(f'郵便番号: {len(records)}件  税務署判明: {with_office}件  出力: {args.out} '
+          f'({os.path.getsize(args.out) / 1024:.0f} KB)')
+    print(f'検索時間（インデックス読み込み後）: {per_lookup * 1e6:.1f} µs/件')
+
+
+if __name__ == '__main__':
+    main()